@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Benchmarks of preprocess16S on synthetic reads (see 'benchmarks/synthetic_reads.py').
+#
+# Usage (from the root directory of the repository):
+#   python3 -m benchmarks.bench_16S [-n <num_pairs>] [-t 1,2,4] [--json results.json]
+#
+# Each benchmark reports reads (or calls) per second and peak memory
+#   allocated by Python during the benchmark (measured with tracemalloc in a separate run).
+# Parallel quality stage is run on read files in the shared pool of workers for each number of threads.
+# End-to-end benchmark runs 'preprocess16S.py -m' for each number of threads
+#   and reports wall time, reads per second and peak RSS of the whole process tree.
+
+import io
+import os
+import sys
+import json
+import shutil
+import getopt
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+import subprocess
+from time import perf_counter
+
+# Benchmarks are run from the root directory of the repository
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _REPO_DIR)
+
+from benchmarks.synthetic_reads import SyntheticAmplicons, rc
+from src.filesystem import OPEN_FUNCS, FORMATTING_FUNCS, get_archv_fmt_indx, open_files, close_files
+from src.fastq import read_fastq_pair
+from src.crosstalks import find_primer
+from src.smith_waterman import SW_align
+from src import executor
+import read_merging_16S
+
+
+def measure(name, func, n_items, unit="reads", memory=True):
+    """
+    Function runs 'func()' and measures it's throughput and (in a separate run) peak memory.
+
+    :param name: name of the benchmark;
+    :type name: str;
+    :param func: function without arguments that processes 'n_items' items;
+    :param n_items: number of items 'func' processes;
+    :type n_items: int;
+    :param unit: name of items;
+    :type unit: str;
+    :param memory: measure peak memory with tracemalloc;
+    :type memory: bool;
+
+    Returns dict with results of the benchmark.
+    """
+    start = perf_counter()
+    func()
+    wall_time = perf_counter() - start
+
+    peak_kb = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    # end if
+
+    result = {
+        "name": name,
+        "items": n_items,
+        "unit": unit,
+        "wall_time": round(wall_time, 4),
+        "per_sec": round(n_items / wall_time, 1) if wall_time > 0 else None,
+        "peak_python_kb": peak_kb
+    }
+    print("{:<28} {:>10} {:<6} {:>9.3f} s {:>12} {}/s {:>10} KB".format(name, n_items, unit,
+        wall_time, result["per_sec"], unit, peak_kb if not peak_kb is None else '-'))
+    return result
+# end def measure
+
+
+def bench_read_fastq_pair(R1_path, R2_path, n_pairs):
+
+    def run():
+        fmt_indx = get_archv_fmt_indx(R1_path)
+        read_files = open_files({"R1": R1_path, "R2": R2_path}, OPEN_FUNCS[fmt_indx])
+        while not read_fastq_pair(read_files, FORMATTING_FUNCS[fmt_indx]) is None:
+            pass
+        # end while
+        close_files(read_files)
+    # end def run
+
+    name = "read_fastq_pair" + (" (gz)" if R1_path.endswith(".gz") else "")
+    return measure(name, run, n_pairs)
+# end def bench_read_fastq_pair
+
+
+def bench_find_primer(pairs, primers):
+
+    def run():
+        for pair in pairs:
+            # find_primer trims primers in place -- keep_primers=True leaves records untouched
+            if find_primer(primers[0], pair["R1"], True):
+                find_primer(primers[1], pair["R2"], True)
+            # end if
+        # end for
+    # end def run
+
+    return measure("find_primer", run, len(pairs))
+# end def bench_find_primer
+
+
+def bench_merge_by_overlap(pairs, phred_offset=33):
+
+    # Forward read and reverse-complement reverse read overlap by 'overl' nucleotides
+    prepared = list()
+    for pair in pairs:
+        fseq, fqual = pair["R1"]["seq"], pair["R1"]["qual_str"]
+        rseq, rqual = rc(pair["R2"]["seq"]), pair["R2"]["qual_str"][::-1]
+        overl = min(len(fseq), len(rseq)) // 2
+        prepared.append( (len(fseq) - overl, overl, fseq, fqual, rseq, rqual) )
+    # end for
+
+    def run():
+        for loffset, overl, fseq, fqual, rseq, rqual in prepared:
+            read_merging_16S._merge_by_overlap(loffset, overl, fseq, fqual, rseq, rqual, phred_offset)
+        # end for
+    # end def run
+
+    return measure("_merge_by_overlap", run, len(prepared))
+# end def bench_merge_by_overlap
+
+
+def bench_SW_align(pairs, templates, n_calls):
+
+    def run():
+        for i in range(n_calls):
+            pair = pairs[i % len(pairs)]
+            SW_align(rc(pair["R2"]["seq"]), templates[i % len(templates)], "synth")
+        # end for
+    # end def run
+
+    return measure("SW_align", run, n_calls, unit="calls", memory=False)
+# end def bench_SW_align
+
+
+def bench_quality(pairs, R1_path, R2_path, n_thr_list, phred_offset=33):
+    """
+    Benchmarks of 'calc_qual_disrib', 'single_qual_calcer' and of the parallel quality stage
+      ('parallel_qual' on read files) for each number of threads.
+    They require numpy and matplotlib -- benchmarks are skipped if these packages are not installed.
+    """
+    try:
+        import numpy
+        import matplotlib
+    except ImportError:
+        print("{:<28} skipped: numpy and matplotlib are required".format("quality"))
+        return list()
+    # end try
+
+    from src import quality_plot
+    from src import parallel_quality_plot
+
+    def substr_phred_offs(q_symb):
+        return ord(q_symb) - phred_offset
+    # end def substr_phred_offs
+
+    def run_calc_qual_disrib():
+        for pair in pairs:
+            quality_plot.calc_qual_disrib(pair, substr_phred_offs=substr_phred_offs)
+        # end for
+    # end def run_calc_qual_disrib
+
+    def run_single_qual_calcer():
+        parallel_quality_plot.single_qual_calcer(pairs, len(pairs), phred_offset)
+    # end def run_single_qual_calcer
+
+    results = [
+        measure("calc_qual_disrib", run_calc_qual_disrib, len(pairs)),
+        measure("single_qual_calcer", run_single_qual_calcer, len(pairs))
+    ]
+
+    def run_parallel_qual(n_thr):
+        # Progress of the stage is not printed among results
+        with contextlib.redirect_stdout(io.StringIO()):
+            parallel_quality_plot.parallel_qual({"R1": R1_path, "R2": R2_path}, n_thr, phred_offset)
+        # end with
+    # end def run_parallel_qual
+
+    try:
+        for n_thr in n_thr_list:
+            # Workers are started by the first call, so they are not counted in time of the stage
+            run_parallel_qual(n_thr)
+            result = measure("parallel_qual -t {}".format(n_thr), lambda: run_parallel_qual(n_thr),
+                len(pairs), memory=False)
+            result["n_threads"] = n_thr
+            results.append(result)
+        # end for
+    finally:
+        executor.shutdown()
+    # end try
+
+    return results
+# end def bench_quality
+
+
+def _drain(fd):
+    # Read output of the child process until it closes the terminal
+    try:
+        while os.read(fd, 65536):
+            pass
+        # end while
+    except OSError:
+        pass
+    # end try
+# end def _drain
+
+
+def run_driver(args, cwd):
+    """
+    Function runs 'preprocess16S.py' with arguments 'args'.
+    The driver prints progress bar, which requires a terminal, so it is run in a pseudo-terminal.
+
+    Returns tuple (<exit code>, <wall time>, <peak RSS of the process tree, KB>).
+    """
+    master_fd, slave_fd = os.openpty()
+    cmd = [sys.executable, os.path.join(_REPO_DIR, "preprocess16S.py")] + args
+
+    start = perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.PIPE, stdout=slave_fd, stderr=slave_fd)
+    os.close(slave_fd)
+    drainer = threading.Thread(target=_drain, args=(master_fd,), daemon=True)
+    drainer.start()
+    # Answer 'continue' if the driver asks about number of threads
+    proc.stdin.write(b"c\n")
+    proc.stdin.close()
+
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    wall_time = perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    drainer.join(timeout=1)
+    os.close(master_fd)
+
+    # ru_maxrss of 'wait4' is the peak RSS of the largest descendant
+    return (proc.returncode, wall_time, rusage.ru_maxrss)
+# end def run_driver
+
+
+def bench_end_to_end(R1_path, R2_path, n_pairs, n_thr_list, workdir):
+
+    results = list()
+    for n_thr in n_thr_list:
+        outdir = os.path.join(workdir, "e2e_{}thr".format(n_thr))
+        exit_code, wall_time, peak_rss = run_driver(["-1", R1_path, "-2", R2_path,
+            "-o", outdir, "-m", "-t", str(n_thr)], workdir)
+        if exit_code != 0:
+            print("{:<28} failed with exit code {}".format("preprocess16S -m -t {}".format(n_thr), exit_code))
+            continue
+        # end if
+
+        result = {
+            "name": "preprocess16S -m",
+            "n_threads": n_thr,
+            "items": n_pairs,
+            "unit": "reads",
+            "wall_time": round(wall_time, 3),
+            "per_sec": round(n_pairs / wall_time, 1),
+            "peak_rss_kb": peak_rss
+        }
+        print("{:<28} {:>10} {:<6} {:>9.3f} s {:>12} reads/s {:>10} KB (RSS)".format(
+            "preprocess16S -m -t {}".format(n_thr), n_pairs, "reads", wall_time, result["per_sec"], peak_rss))
+        results.append(result)
+    # end for
+
+    return results
+# end def bench_end_to_end
+
+
+def run_benchmarks(n_pairs=20000, n_thr_list=(1,), sw_calls=20, seed=16, end_to_end=True):
+    """
+    Function generates synthetic data and runs all benchmarks.
+
+    Returns list of results (dictionaries).
+    """
+    workdir = tempfile.mkdtemp(prefix="bench_16S_")
+    results = list()
+
+    try:
+        generator = SyntheticAmplicons(seed=seed)
+        R1_path = os.path.join(workdir, "synthetic_R1.fastq")
+        R2_path = os.path.join(workdir, "synthetic_R2.fastq")
+        generator.write_fastq(R1_path, R2_path, n_pairs)
+        generator.write_fastq(R1_path + ".gz", R2_path + ".gz", n_pairs)
+        pairs = list(generator.pairs(n_pairs))
+
+        print("\n{:<28} {:>17} {:>11} {:>20} {:>13}".format("benchmark", "items", "time", "throughput", "peak memory"))
+        print('-' * 95)
+
+        results.append(bench_read_fastq_pair(R1_path, R2_path, n_pairs))
+        results.append(bench_read_fastq_pair(R1_path + ".gz", R2_path + ".gz", n_pairs))
+        results.append(bench_find_primer(pairs, generator.primers))
+        results.append(bench_merge_by_overlap(pairs))
+        results.append(bench_SW_align(pairs, generator.templates, sw_calls))
+        results.extend(bench_quality(pairs, R1_path, R2_path, n_thr_list))
+
+        if end_to_end:
+            results.extend(bench_end_to_end(R1_path, R2_path, n_pairs, n_thr_list, workdir))
+        # end if
+    finally:
+        shutil.rmtree(workdir)
+    # end try
+
+    return results
+# end def run_benchmarks
+
+
+if __name__ == "__main__":
+
+    usage_msg = """
+Benchmarks of preprocess16S on synthetic 16S amplicon reads.
+
+Usage:
+    python3 -m benchmarks.bench_16S [-n <num_pairs>] [-t 1,2,4] [--json results.json]
+Options:
+    -n (--num-pairs) <int> --- number of synthetic read pairs (default 20000);
+    -t (--threads) <int,int,...> --- numbers of threads for parallel quality and end-to-end benchmarks (default 1);
+    -s (--seed) <int> --- seed of the generator of reads (default 16);
+    --sw-calls <int> --- number of Smith-Waterman alignments (default 20);
+    --no-end-to-end --- do not run end-to-end benchmark;
+    --json <path> --- write results to a JSON file;
+"""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:t:s:",
+            ["help", "num-pairs=", "threads=", "seed=", "sw-calls=", "no-end-to-end", "json="])
+    except getopt.GetoptError as opt_err:
+        print(str(opt_err))
+        print(usage_msg)
+        sys.exit(2)
+    # end try
+
+    params = dict()
+    json_path = None
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage_msg)
+            sys.exit(0)
+        elif opt in ("-n", "--num-pairs"):
+            params["n_pairs"] = int(arg)
+        elif opt in ("-t", "--threads"):
+            params["n_thr_list"] = [int(n_thr) for n_thr in arg.split(',')]
+        elif opt in ("-s", "--seed"):
+            params["seed"] = int(arg)
+        elif opt == "--sw-calls":
+            params["sw_calls"] = int(arg)
+        elif opt == "--no-end-to-end":
+            params["end_to_end"] = False
+        elif opt == "--json":
+            json_path = arg
+        # end if
+    # end for
+
+    results = run_benchmarks(**params)
+
+    if not json_path is None:
+        with open(json_path, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+        # end with
+        print("\nResults are written to '{}'".format(json_path))
+    # end if
+# end if
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Benchmark and validation of the alignment server (see 'src/alignment_server.py') on localhost:
+#   concurrent clients (processes, as concurrent runs of preprocess16S on a node) align their reads
+#   by themselves and then with the server, and best hits of every read are compared.
+#
+# Usage (from the root directory of the repository):
+#   python3 -m benchmarks.bench_align_server [-n <num_pairs>] [-c <num_clients>] [-a <aligner>] [-l <latency>]
+#
+# Reference sequences and reads are synthetic, and blastn stand-in is used
+#   (see 'benchmarks/standins/standin_tools.py'); index of minimizers is built for them too.
+#   Each client aligns forward reads and reverse-complement reverse reads of it's own read pairs.
+# The server is started in a child process and is stopped by SIGTERM, as it is on a node.
+# Hits of a read are "same" if all fields of all best hits are equal (see 'src.hit_cache.hit_fields').
+#   Reference sequences of all hits are retrieved from the server and compared too.
+
+import os
+import sys
+import json
+import shutil
+import signal
+import getopt
+import tempfile
+import threading
+import multiprocessing as mp
+from time import perf_counter, sleep
+
+# Benchmarks are run from the root directory of the repository
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _REPO_DIR)
+
+from benchmarks.synthetic_reads import SyntheticAmplicons
+from benchmarks.bench_gap_filling import use_standins, _GAP_INSERT_LEN_RATIO
+from src.alignment_server import AlignmentClient
+from src.hit_cache import hit_fields
+from src import minimizer_index
+import read_merging_16S
+
+# Seconds to wait for the server to start listening
+_START_TIMEOUT = 60
+
+
+def _serve(socket_path, aligner):
+    # Target of the process of the server
+    server = read_merging_16S.make_align_server(socket_path, aligner)
+    # 'shutdown' waits for 'serve_forever' to return, so it is called from another thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.serve_forever()
+# end def _serve
+
+
+def _client_align(seqs, aligner, align_server):
+    # Function aligns reads in a client process and returns (<fields of best hits of each read>, <time>)
+    read_merging_16S._aligner = aligner
+    read_merging_16S._align_server_path = align_server
+    start = perf_counter()
+    align_reports = read_merging_16S._align_reads(seqs)
+    return ({seq: hit_fields(align_reports[seq]) for seq in seqs}, perf_counter() - start)
+# end def _client_align
+
+
+def _run_clients(client_seqs, aligner, align_server=None):
+    # Function runs one process per client. Returns (<results of '_client_align'>, <wall time>)
+    start = perf_counter()
+    with mp.get_context("fork").Pool(len(client_seqs)) as pool:
+        results = pool.starmap(_client_align, [(seqs, aligner, align_server) for seqs in client_seqs])
+    # end with
+    return (results, perf_counter() - start)
+# end def _run_clients
+
+
+def _wait_for_server(socket_path, server_process):
+    # Function returns client of the server as soon as the server listens to the socket
+    start = perf_counter()
+    while True:
+        try:
+            return AlignmentClient(socket_path)
+        except OSError:
+            if not server_process.is_alive() or perf_counter() - start > _START_TIMEOUT:
+                raise
+            # end if
+            sleep(0.05)
+        # end try
+    # end while
+# end def _wait_for_server
+
+
+def bench_align_server(client_pairs, aligner, workdir):
+    """
+    Function aligns reads of clients by clients themselves and with the server, and compares hits.
+
+    :param client_pairs: read pairs of each client;
+    :type client_pairs: list< list< dict<str: dict<str: str>> > >;
+    :param aligner: aligner (see 'read_merging_16S.ALIGNERS');
+    :type aligner: str;
+
+    Returns dictionary of results.
+    """
+    client_seqs = [list(dict.fromkeys([pair["R1"]["seq"] for pair in pairs]
+        + [read_merging_16S._rc(pair["R2"]["seq"]) for pair in pairs])) for pairs in client_pairs]
+
+    local_results, local_time = _run_clients(client_seqs, aligner)
+
+    socket_path = os.path.join(workdir, "align_server.sock")
+    server_process = mp.get_context("fork").Process(target=_serve, args=(socket_path, aligner))
+    server_process.start()
+    try:
+        client = _wait_for_server(socket_path, server_process)
+        server_results, server_time = _run_clients(client_seqs, aligner, socket_path)
+
+        # Reference sequences hit by reads
+        accs = sorted({hit[5] for hits, run_time in local_results for fields in hits.values()
+            for hit in (fields or ())})
+        same_references = client.references(accs) == read_merging_16S._fetch_references(accs)
+        counts = client.info()["counts"]
+        client.close()
+    finally:
+        server_process.terminate()
+        server_process.join()
+    # end try
+
+    n_same, n_reads = 0, 0
+    for (local_hits, local_run_time), (server_hits, server_run_time) in zip(local_results, server_results):
+        n_reads += len(local_hits)
+        n_same += sum(1 for seq, fields in local_hits.items() if server_hits[seq] == fields)
+    # end for
+
+    result = {
+        "aligner": aligner,
+        "clients": len(client_seqs),
+        "reads": n_reads,
+        "same_hits": n_same,
+        "different_hits": n_reads - n_same,
+        "same_references": same_references,
+        "local_time": round(local_time, 3),
+        "server_time": round(server_time, 3),
+        "server_batches": counts.get("batches", 0),
+        "server_aligned": counts.get("aligned", 0)
+    }
+
+    print("\n{}: {} clients, {} reads".format(aligner, len(client_seqs), n_reads))
+    print("  hits are the same for {} reads, different for {}; reference sequences are {}".format(n_same,
+        n_reads - n_same, "the same" if same_references else "DIFFERENT"))
+    print("  clients align by themselves: {:.3f} s; with the server: {:.3f} s ({} batches, {} unique reads aligned)"
+        .format(local_time, server_time, result["server_batches"], result["server_aligned"]))
+    return result
+# end def bench_align_server
+
+
+def run_benchmark(n_pairs=200, n_clients=4, aligners=read_merging_16S.ALIGNERS, latency=0.0, seed=16,
+    n_templates=50):
+    """
+    Function prepares reference sequences and reads (see the header of this module) and runs benchmark
+      for each aligner.
+
+    Returns list of dictionaries of results.
+    """
+    workdir = tempfile.mkdtemp(prefix="bench_align_server_")
+    os.environ["STANDIN_LATENCY"] = str(latency)
+    try:
+        generator = SyntheticAmplicons(seed=seed, n_templates=n_templates,
+            insert_len_ratio=_GAP_INSERT_LEN_RATIO, crosstalk_frac=0.02)
+        db_path = os.path.join(workdir, "synthetic_references.fasta")
+        generator.write_templates(db_path)
+        use_standins(db_path)
+        minimizer_index.build_index(db_path)
+
+        client_pairs = [list(generator.pairs(n_pairs)) for i in range(n_clients)]
+        return [bench_align_server(client_pairs, aligner, workdir) for aligner in aligners]
+    finally:
+        shutil.rmtree(workdir)
+    # end try
+# end def run_benchmark
+
+
+if __name__ == "__main__":
+
+    usage_msg = """
+Benchmark and validation of the alignment server.
+
+Usage:
+    python3 -m benchmarks.bench_align_server [-n <num_pairs>] [-c <num_clients>] [-a <aligner>] [-l <latency>]
+Options:
+    -n (--num-pairs) <int> --- number of read pairs of each client (default 200);
+    -c (--clients) <int> --- number of concurrent clients (default 4);
+    -a (--aligner) <str> --- aligner: blastn or minimizer (both by default);
+    -l (--latency) <float> --- emulated latency of blastn stand-in, seconds (default 0);
+    -s (--seed) <int> --- seed of the generator of reads (default 16);
+    --templates <int> --- number of synthetic reference sequences (default 50);
+    --json <path> --- write results to a JSON file;
+"""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:c:a:l:s:",
+            ["help", "num-pairs=", "clients=", "aligner=", "latency=", "seed=", "templates=", "json="])
+    except getopt.GetoptError as opt_err:
+        print(str(opt_err))
+        print(usage_msg)
+        sys.exit(2)
+    # end try
+
+    params = dict()
+    json_path = None
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage_msg)
+            sys.exit(0)
+        elif opt in ("-n", "--num-pairs"):
+            params["n_pairs"] = int(arg)
+        elif opt in ("-c", "--clients"):
+            params["n_clients"] = int(arg)
+        elif opt in ("-a", "--aligner"):
+            params["aligners"] = (arg,)
+        elif opt in ("-l", "--latency"):
+            params["latency"] = float(arg)
+        elif opt in ("-s", "--seed"):
+            params["seed"] = int(arg)
+        elif opt == "--templates":
+            params["n_templates"] = int(arg)
+        elif opt == "--json":
+            json_path = arg
+        # end if
+    # end for
+
+    results = run_benchmark(**params)
+
+    if not json_path is None:
+        with open(json_path, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+        # end with
+        print("\nResults are written to '{}'".format(json_path))
+    # end if
+# end if
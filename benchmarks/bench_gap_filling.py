@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Benchmark of gap-filling read merging with stand-ins of blastn and blastdbcmd
+#   (see 'benchmarks/standins/standin_tools.py') -- it runs without BLAST+ and Silva database.
+#
+# Usage (from the root directory of the repository):
+#   python3 -m benchmarks.bench_gap_filling [-n <num_pairs>] [-l 0,0.05,0.2] [--json results.json]
+#
+# Gap-filling merging ('_merge_chunk') spawns blastn twice per chunk of read pairs
+#   and blastdbcmd for every reference sequence that is not cached.
+# For each emulated latency of external programs the benchmark reports:
+#   - total time and reads per second;
+#   - time spent waiting for external programs (as seen by the Python process);
+#   - time external programs actually worked (reported by stand-ins themselves);
+#   - emulated latency;
+#   - orchestration overhead: waiting time minus work time minus latency,
+#     i.e. cost of spawning processes, starting them and transferring data through pipes;
+#   - time of the Python part (Smith-Waterman aligning and merging itself).
+# Costs of bare process spawning and of start-up of Python interpreter (stand-ins are Python scripts,
+#   unlike real BLAST+ programs) are measured separately, so that they can be taken into account.
+
+import os
+import sys
+import json
+import shutil
+import getopt
+import tempfile
+from time import perf_counter
+from subprocess import Popen as sp_Popen
+
+# Benchmarks are run from the root directory of the repository
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _REPO_DIR)
+
+from benchmarks.synthetic_reads import SyntheticAmplicons
+from src import run_report
+import read_merging_16S
+
+STANDINS_DIR = os.path.join(_REPO_DIR, "benchmarks", "standins")
+
+# Amplicons slightly longer than two reads: pairs do not overlap
+#   and therefore are passed to gap-filling merging (gap is about 20 nt).
+_GAP_INSERT_LEN_RATIO = 0.95
+
+
+def use_standins(db_fasta_path):
+    """
+    Function makes 'read_merging_16S' use stand-ins of blastn and blastdbcmd
+      with FASTA file 'db_fasta_path' as a database.
+    """
+    if not os.environ["PATH"].startswith(STANDINS_DIR + os.pathsep):
+        os.environ["PATH"] = STANDINS_DIR + os.pathsep + os.environ["PATH"]
+    # end if
+    read_merging_16S._cmd_for_blastn = read_merging_16S._cmd_for_blastn.replace(
+        read_merging_16S._blast_fmt_db, db_fasta_path)
+    read_merging_16S._blast_fmt_db = db_fasta_path
+    # 'merge_reads' checks presence of this file of formatted database
+    open(db_fasta_path + ".nhr", 'a').close()
+# end def use_standins
+
+
+def _spawn_cost(cmd, n_calls):
+    # Returns mean wall time of running command 'cmd' through shell
+    start = perf_counter()
+    for i in range(n_calls):
+        sp_Popen(cmd, shell=True).wait()
+    # end for
+    return (perf_counter() - start) / n_calls
+# end def _spawn_cost
+
+
+def _read_timing_log(log_path):
+    # Returns dict<str: [work_time, latency, calls]> -- summary of stand-ins' timing log
+    summary = dict()
+    if os.path.exists(log_path):
+        with open(log_path, 'r') as log_file:
+            for line in log_file:
+                tool, work_time, latency = line.split('\t')
+                tool_summary = summary.setdefault(tool, [0.0, 0.0, 0])
+                tool_summary[0] += float(work_time)
+                tool_summary[1] += float(latency)
+                tool_summary[2] += 1
+            # end for
+        # end with
+    # end if
+    return summary
+# end def _read_timing_log
+
+
+def bench_gap_filling(pairs, latency, workdir, phred_offset=33, num_N=35, min_overlap=20, mismatch_frac=0.1):
+
+    log_path = os.path.join(workdir, "timing_{}.log".format(latency))
+    os.environ["STANDIN_LATENCY"] = str(latency)
+    os.environ["STANDIN_TIMING_LOG"] = log_path
+    run_report.pop_substage_timers() # reset timers
+
+    outcomes = dict()
+    start = perf_counter()
+    chunk_size = read_merging_16S._BLAST_CHUNK_SIZE
+    # Placements of pairs made with previous latencies are not reused
+    run_placements = read_merging_16S._RunPlacements()
+    for i in range(0, len(pairs), chunk_size):
+        for merging_result in read_merging_16S._merge_chunk_dereplicated(read_merging_16S._gap_filling_merging,
+                pairs[i : i + chunk_size], run_placements, phred_offset, num_N, min_overlap, mismatch_frac):
+            outcomes[merging_result[0]] = outcomes.get(merging_result[0], 0) + 1
+        # end for
+    # end for
+    total_time = perf_counter() - start
+
+    timers = run_report.pop_substage_timers()
+    tools = _read_timing_log(log_path)
+
+    wait_time = sum(timers.get(name, (0.0, 0))[0] for name in ("blast", "blastdbcmd"))
+    n_calls = sum(timers.get(name, (0.0, 0))[1] for name in ("blast", "blastdbcmd"))
+    work_time = sum(tool[0] for tool in tools.values())
+    latency_time = sum(tool[1] for tool in tools.values())
+    overhead = wait_time - work_time - latency_time
+
+    result = {
+        "name": "gap_filling",
+        "latency": latency,
+        "items": len(pairs),
+        "unit": "reads",
+        "merged": outcomes.get(0, 0),
+        "wall_time": round(total_time, 3),
+        "per_sec": round(len(pairs) / total_time, 1),
+        "external_calls": n_calls,
+        "external_wait_time": round(wait_time, 3),
+        "external_work_time": round(work_time, 3),
+        "latency_time": round(latency_time, 3),
+        "orchestration_time": round(overhead, 3),
+        "orchestration_share": round(overhead / total_time, 3),
+        "python_time": round(total_time - wait_time, 3),
+        "substages": run_report.merge_substage_timers([timers])
+    }
+    print("{:>8.3f} {:>8} {:>8} {:>9.3f} {:>9.1f} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} ({:.0%}) {:>9.3f}".format(
+        latency, len(pairs), result["merged"], total_time, result["per_sec"], n_calls, wait_time,
+        work_time, latency_time, overhead, result["orchestration_share"], result["python_time"]))
+    return result
+# end def bench_gap_filling
+
+
+def run_benchmarks(n_pairs=200, latencies=(0.0, 0.05), seed=16, n_templates=50):
+    """
+    Function generates synthetic non-overlapping read pairs and reference sequences,
+      and runs gap-filling benchmark for each latency.
+
+    Returns list of results (dictionaries).
+    """
+    workdir = tempfile.mkdtemp(prefix="bench_gap_filling_")
+    results = list()
+
+    try:
+        generator = SyntheticAmplicons(seed=seed, n_templates=n_templates,
+            insert_len_ratio=_GAP_INSERT_LEN_RATIO, crosstalk_frac=0)
+        db_path = os.path.join(workdir, "synthetic_references.fasta")
+        generator.write_templates(db_path)
+        use_standins(db_path)
+        pairs = list(generator.pairs(n_pairs))
+
+        n_calls = 20
+        spawn_ms = _spawn_cost("true", n_calls) * 1000
+        python_ms = _spawn_cost("{} -c pass".format(sys.executable), n_calls) * 1000
+        print("\nMean cost of spawning a process through shell: {:.1f} ms".format(spawn_ms))
+        print("Mean cost of starting Python interpreter (stand-ins are Python scripts): {:.1f} ms".format(python_ms))
+        results.append({"name": "spawn_cost", "shell_spawn_ms": round(spawn_ms, 2),
+            "python_startup_ms": round(python_ms, 2)})
+
+        print("\n{:>8} {:>8} {:>8} {:>9} {:>9} {:>7} {:>9} {:>9} {:>9} {:>16} {:>9}".format("latency", "pairs",
+            "merged", "time, s", "reads/s", "calls", "wait, s", "work, s", "lat., s", "orchestr., s", "python, s"))
+        print('-' * 113)
+
+        for latency in latencies:
+            results.append(bench_gap_filling(pairs, latency, workdir))
+        # end for
+    finally:
+        shutil.rmtree(workdir)
+    # end try
+
+    return results
+# end def run_benchmarks
+
+
+if __name__ == "__main__":
+
+    usage_msg = """
+Benchmark of gap-filling read merging with stand-ins of blastn and blastdbcmd.
+
+Usage:
+    python3 -m benchmarks.bench_gap_filling [-n <num_pairs>] [-l 0,0.05,0.2] [--json results.json]
+Options:
+    -n (--num-pairs) <int> --- number of synthetic non-overlapping read pairs (default 200);
+    -l (--latencies) <float,float,...> --- emulated latencies of external programs, seconds (default 0,0.05);
+    -s (--seed) <int> --- seed of the generator of reads (default 16);
+    --templates <int> --- number of reference sequences (default 50);
+    --json <path> --- write results to a JSON file;
+"""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:l:s:",
+            ["help", "num-pairs=", "latencies=", "seed=", "templates=", "json="])
+    except getopt.GetoptError as opt_err:
+        print(str(opt_err))
+        print(usage_msg)
+        sys.exit(2)
+    # end try
+
+    params = dict()
+    json_path = None
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage_msg)
+            sys.exit(0)
+        elif opt in ("-n", "--num-pairs"):
+            params["n_pairs"] = int(arg)
+        elif opt in ("-l", "--latencies"):
+            params["latencies"] = [float(latency) for latency in arg.split(',')]
+        elif opt in ("-s", "--seed"):
+            params["seed"] = int(arg)
+        elif opt == "--templates":
+            params["n_templates"] = int(arg)
+        elif opt == "--json":
+            json_path = arg
+        # end if
+    # end for
+
+    results = run_benchmarks(**params)
+
+    if not json_path is None:
+        with open(json_path, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+        # end with
+        print("\nResults are written to '{}'".format(json_path))
+    # end if
+# end if
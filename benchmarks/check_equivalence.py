@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Output-equivalence regression harness for alternative implementations ("engines")
+#   of the core functions of preprocess16S.
+#
+# Usage (from the root directory of the repository):
+#   python3 -m benchmarks.check_equivalence -e <engine_module> [-n <num_pairs>] [-1 R1.fastq -2 R2.fastq]
+#
+# An engine is a Python module that defines any subset of the following functions
+#   with the same signatures as the reference ones:
+#     find_primer        (src/crosstalks.py),
+#     SW_align           (src/smith_waterman.py),
+#     _merge_by_overlap  (read_merging_16S.py),
+#     read_fastq_pair    (src/fastq.py),
+#     write_fastq_record (src/fastq.py).
+#   Functions an engine does not define are taken from the reference implementation.
+# While checks run with the engine, it's functions replace the reference ones in all modules
+#   of the repository, so that the code calling them (e.g. 'find_primer_organizer',
+#   '_gap_filling_merging') runs unchanged.
+#
+# The harness runs the reference implementation and the engine on the same inputs
+#   (synthetic reads and, optionally, real samples), checks that record streams,
+#   primer statistics ('primer_stats') and gap-filling statistics (outcomes, gap lengths) are identical,
+#   and reports the speed ratio (reference time / engine time).
+# Exit code is 0 if all outputs are identical and 1 otherwise.
+
+import io
+import os
+import sys
+import copy
+import json
+import shutil
+import getopt
+import tempfile
+import importlib
+from time import perf_counter
+from contextlib import contextmanager
+
+# Benchmarks are run from the root directory of the repository
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _REPO_DIR)
+
+from benchmarks.synthetic_reads import SyntheticAmplicons, rc
+from benchmarks.bench_gap_filling import use_standins
+from src.filesystem import OPEN_FUNCS, FORMATTING_FUNCS, get_archv_fmt_indx, open_files, close_files
+from src import fastq
+from src import crosstalks
+from src import smith_waterman
+import read_merging_16S
+
+# Functions that engines can replace -> their reference implementations.
+REFERENCE = {
+    "find_primer": crosstalks.find_primer,
+    "SW_align": smith_waterman.SW_align,
+    "_merge_by_overlap": read_merging_16S._merge_by_overlap,
+    "read_fastq_pair": fastq.read_fastq_pair,
+    "write_fastq_record": fastq.write_fastq_record
+}
+
+
+@contextmanager
+def engine_installed(engine):
+    """
+    Context manager replaces reference functions with functions of 'engine'
+      in all loaded modules of the repository and restores them on exit.
+
+    :param engine: module of the engine. None means reference implementation;
+    :type engine: module;
+    """
+    replaced = list()
+    if not engine is None:
+        repo_modules = [module for name, module in list(sys.modules.items())
+            if (name.startswith("src.") or name == "read_merging_16S") and not module is None]
+        for func_name, ref_func in REFERENCE.items():
+            alt_func = getattr(engine, func_name, None)
+            if alt_func is None:
+                continue
+            # end if
+            for module in repo_modules:
+                for attr, value in list(vars(module).items()):
+                    if value is ref_func:
+                        setattr(module, attr, alt_func)
+                        replaced.append( (module, attr, ref_func) )
+                    # end if
+                # end for
+            # end for
+        # end for
+    # end if
+    try:
+        yield
+    finally:
+        for module, attr, ref_func in replaced:
+            setattr(module, attr, ref_func)
+        # end for
+    # end try
+# end def engine_installed
+
+
+# |==== Checks ====|
+# Each check runs 'func' and returns tuple (<output>, <wall_time>).
+# Output must be comparable with '=='.
+
+
+def _timed(func, *args):
+    start = perf_counter()
+    output = func(*args)
+    return (output, perf_counter() - start)
+# end def _timed
+
+
+def check_fastq_io(read_paths):
+    """
+    Reads all pairs from 'read_paths' and writes them back to in-memory files.
+
+    Returns tuple (<list of pairs>, <text of R1 file>, <text of R2 file>).
+    """
+    fmt_indx = get_archv_fmt_indx(read_paths["R1"])
+    read_files = open_files(read_paths, OPEN_FUNCS[fmt_indx])
+    out_files = {"R1": io.StringIO(), "R2": io.StringIO()}
+
+    pairs = list()
+    while True:
+        # Functions are looked up in module, so that engine's functions are called
+        fastq_recs = fastq.read_fastq_pair(read_files, FORMATTING_FUNCS[fmt_indx])
+        if fastq_recs is None:
+            break
+        # end if
+        pairs.append(fastq_recs)
+        fastq.write_fastq_record(out_files["R1"], fastq_recs["R1"])
+        fastq.write_fastq_record(out_files["R2"], fastq_recs["R2"])
+    # end while
+    close_files(read_files)
+
+    return (pairs, out_files["R1"].getvalue(), out_files["R2"].getvalue())
+# end def check_fastq_io
+
+
+def check_crosstalks(pairs, primers, keep_primers=False):
+    """
+    Runs cross-talk detection ('find_primer_organizer') on copies of 'pairs'.
+
+    Returns tuple (<primer_stats>, <dict of texts of result files>).
+    """
+    pairs = copy.deepcopy(pairs) # 'find_primer' trims primers in place
+    result_files = {key: io.StringIO() for key in ("mR1", "mR2", "trR1", "trR2")}
+    primer_stats = {"match": 0, "trash": 0}
+
+    for fastq_recs in pairs:
+        crosstalks.find_primer_organizer(fastq_recs, result_files,
+            stats=primer_stats, primers=primers, keep_primers=keep_primers)
+    # end for
+
+    return (primer_stats, {key: outfile.getvalue() for key, outfile in result_files.items()})
+# end def check_crosstalks
+
+
+def check_SW_align(pairs, templates, n_calls):
+    """
+    Aligns reverse-complement reverse reads against templates with 'SW_align'.
+
+    Returns list of dictionaries of fields of alignment results.
+    """
+    results = list()
+    for i in range(n_calls):
+        pair = pairs[i % len(pairs)]
+        align_result = smith_waterman.SW_align(rc(pair["R2"]["seq"]), templates[i % len(templates)], "synth")
+        results.append(vars(align_result))
+    # end for
+    return results
+# end def check_SW_align
+
+
+def check_merge_by_overlap(pairs, phred_offset=33):
+    """
+    Merges reads with '_merge_by_overlap' assuming overlap of half of read length.
+
+    Returns list of tuples (<merged_seq>, <merged_qual>).
+    """
+    results = list()
+    for pair in pairs:
+        fseq, fqual = pair["R1"]["seq"], pair["R1"]["qual_str"]
+        rseq, rqual = rc(pair["R2"]["seq"]), pair["R2"]["qual_str"][::-1]
+        overl = min(len(fseq), len(rseq)) // 2
+        results.append(read_merging_16S._merge_by_overlap(len(fseq) - overl, overl,
+            fseq, fqual, rseq, rqual, phred_offset))
+    # end for
+    return results
+# end def check_merge_by_overlap
+
+
+def check_gap_filling(pairs, phred_offset=33, num_N=35, min_overlap=20, mismatch_frac=0.1):
+    """
+    Runs gap-filling merging (with stand-ins of blastn and blastdbcmd) and handles it's results
+      as 'read_merging_16S' does.
+
+    Returns tuple (<statistics of gap-filling merging (see 'read_merging_16S.pop_gap_filling_stats')>,
+      <dict of texts of result files>).
+    """
+    result_files = {key: io.StringIO() for key in ("merg", "umR1", "umR2")}
+    read_merging_16S.pop_gap_filling_stats()
+    # Pairs are merged one by one outside of chunks, so identical pairs share placements kept
+    #   in '_chunk_placements'. Placements made by the previous check are not reused: the engine must place pairs itself
+    read_merging_16S._chunk_placements.clear()
+
+    for fastq_recs in pairs:
+        merging_result, merged_strs = read_merging_16S._gap_filling_merging(fastq_recs,
+            phred_offset, num_N, min_overlap, mismatch_frac)
+        read_merging_16S._handle_merge_pair_result(merging_result, fastq_recs, result_files,
+            merged_strs)
+    # end for
+
+    stats = read_merging_16S.pop_gap_filling_stats()
+    return ({key: dict(counter) for key, counter in stats.items()},
+        {key: outfile.getvalue() for key, outfile in result_files.items()})
+# end def check_gap_filling
+
+
+def _first_difference(ref_output, alt_output, path="output"):
+    """
+    Function finds the first difference between two outputs.
+
+    Returns description of the difference (str) or None if outputs are identical.
+    """
+    if type(ref_output) != type(alt_output):
+        return "{}: types differ ({} != {})".format(path, type(ref_output).__name__, type(alt_output).__name__)
+    # end if
+
+    if isinstance(ref_output, dict):
+        for key in sorted(set(ref_output) | set(alt_output), key=str):
+            if not key in ref_output or not key in alt_output:
+                return "{}[{!r}]: key is missing in one of outputs".format(path, key)
+            # end if
+            diff = _first_difference(ref_output[key], alt_output[key], "{}[{!r}]".format(path, key))
+            if not diff is None:
+                return diff
+            # end if
+        # end for
+        return None
+
+    elif isinstance(ref_output, (list, tuple)):
+        for i, (ref_item, alt_item) in enumerate(zip(ref_output, alt_output)):
+            diff = _first_difference(ref_item, alt_item, "{}[{}]".format(path, i))
+            if not diff is None:
+                return diff
+            # end if
+        # end for
+        if len(ref_output) != len(alt_output):
+            return "{}: lengths differ ({} != {})".format(path, len(ref_output), len(alt_output))
+        # end if
+        return None
+
+    elif isinstance(ref_output, str) and ref_output != alt_output:
+        # Report the first differing line of a text
+        ref_lines, alt_lines = ref_output.splitlines(), alt_output.splitlines()
+        for i, (ref_line, alt_line) in enumerate(zip(ref_lines, alt_lines)):
+            if ref_line != alt_line:
+                return "{}, line {}: {!r} != {!r}".format(path, i + 1, ref_line, alt_line)
+            # end if
+        # end for
+        return "{}: numbers of lines differ ({} != {})".format(path, len(ref_lines), len(alt_lines))
+
+    elif ref_output != alt_output:
+        return "{}: {!r} != {!r}".format(path, ref_output, alt_output)
+    # end if
+
+    return None
+# end def _first_difference
+
+
+def compare(name, engine, func, *args):
+    """
+    Function runs check 'func(*args)' with the reference implementation and with 'engine',
+      and compares outputs.
+
+    Returns dict with results of the comparison.
+    """
+    ref_output, ref_time = _timed(func, *args)
+    with engine_installed(engine):
+        alt_output, alt_time = _timed(func, *args)
+    # end with
+
+    diff = _first_difference(ref_output, alt_output)
+    result = {
+        "name": name,
+        "identical": diff is None,
+        "difference": diff,
+        "reference_time": round(ref_time, 4),
+        "engine_time": round(alt_time, 4),
+        "speed_ratio": round(ref_time / alt_time, 2) if alt_time > 0 else None
+    }
+    print("{:<32} {:<10} {:>12.3f} s {:>12.3f} s {:>9}x".format(name,
+        "identical" if diff is None else "DIFFERENT", ref_time, alt_time, result["speed_ratio"]))
+    if not diff is None:
+        print("  first difference -- {}".format(diff))
+    # end if
+    return result
+# end def compare
+
+
+def check_sample(label, engine, read_paths, primers, templates=None, sw_calls=20, gap_filling=False):
+    """
+    Function runs all checks on one sample.
+
+    :param label: name of the sample;
+    :type label: str;
+    :param read_paths: paths to R1 and R2 files;
+    :type read_paths: dict<str: str>;
+    :param templates: reference sequences for 'SW_align' check. It is skipped if templates are None;
+    :type templates: list<str>;
+    :param gap_filling: run gap-filling check (stand-ins must be installed with 'use_standins');
+    :type gap_filling: bool;
+
+    Returns list of results of comparisons.
+    """
+    results = [compare("{}: FASTQ I/O".format(label), engine, check_fastq_io, read_paths)]
+
+    # Inputs of other checks are read with the reference implementation
+    pairs = check_fastq_io(read_paths)[0]
+
+    results.append(compare("{}: cross-talks".format(label), engine, check_crosstalks, pairs, primers))
+    results.append(compare("{}: _merge_by_overlap".format(label), engine, check_merge_by_overlap, pairs))
+    if not templates is None:
+        results.append(compare("{}: SW_align".format(label), engine, check_SW_align, pairs, templates, sw_calls))
+    # end if
+    if gap_filling:
+        results.append(compare("{}: gap-filling".format(label), engine, check_gap_filling, pairs))
+    # end if
+
+    for result in results:
+        result["sample"] = label
+    # end for
+    return results
+# end def check_sample
+
+
+def load_engine(engine_name):
+    """
+    Function imports engine module and checks that it provides at least one known function.
+    """
+    engine = importlib.import_module(engine_name)
+    provided = [func_name for func_name in REFERENCE if hasattr(engine, func_name)]
+    if len(provided) == 0:
+        raise ValueError("Engine '{}' does not define any of functions: {}".format(engine_name,
+            ", ".join(REFERENCE)))
+    # end if
+    print("Engine '{}' provides: {}".format(engine_name, ", ".join(provided)))
+    return engine
+# end def load_engine
+
+
+def run_checks(engine_name, n_pairs=2000, seed=16, sw_calls=20, gap_pairs=50, real_samples=()):
+    """
+    Function runs checks on synthetic reads and on real samples.
+
+    :param engine_name: name of engine module;
+    :type engine_name: str;
+    :param gap_pairs: number of non-overlapping synthetic pairs for gap-filling check (0 -- skip it);
+    :type gap_pairs: int;
+    :param real_samples: pairs of paths to R1 and R2 files of real samples;
+    :type real_samples: list< tuple<str, str> >;
+
+    Returns list of results of comparisons.
+    """
+    engine = load_engine(engine_name)
+    workdir = tempfile.mkdtemp(prefix="check_equivalence_")
+    results = list()
+
+    try:
+        print("\n{:<32} {:<10} {:>14} {:>14} {:>10}".format("check", "outputs", "reference", "engine", "ratio"))
+        print('-' * 84)
+
+        generator = SyntheticAmplicons(seed=seed)
+        synth_paths = {"R1": os.path.join(workdir, "synthetic_R1.fastq.gz"),
+            "R2": os.path.join(workdir, "synthetic_R2.fastq.gz")}
+        generator.write_fastq(synth_paths["R1"], synth_paths["R2"], n_pairs)
+        results.extend(check_sample("synthetic", engine, synth_paths, list(generator.primers),
+            templates=generator.templates, sw_calls=sw_calls))
+
+        if gap_pairs > 0:
+            gap_generator = SyntheticAmplicons(seed=seed, insert_len_ratio=0.95, crosstalk_frac=0)
+            db_path = os.path.join(workdir, "synthetic_references.fasta")
+            gap_generator.write_templates(db_path)
+            use_standins(db_path)
+            gap_paths = {"R1": os.path.join(workdir, "gap_R1.fastq"), "R2": os.path.join(workdir, "gap_R2.fastq")}
+            gap_generator.write_fastq(gap_paths["R1"], gap_paths["R2"], gap_pairs)
+            pairs = check_fastq_io(gap_paths)[0]
+            results.append(compare("synthetic-gap: gap-filling", engine, check_gap_filling, pairs))
+            results[-1]["sample"] = "synthetic-gap"
+        # end if
+
+        for R1_path, R2_path in real_samples:
+            label = os.path.basename(R1_path)
+            results.extend(check_sample(label, engine, {"R1": R1_path, "R2": R2_path},
+                list(SyntheticAmplicons().primers)))
+        # end for
+    finally:
+        shutil.rmtree(workdir)
+    # end try
+
+    n_different = sum(1 for result in results if not result["identical"])
+    if n_different == 0:
+        print("\nAll outputs are identical.")
+    else:
+        print("\n{} of {} checks produced different outputs!".format(n_different, len(results)))
+    # end if
+
+    return results
+# end def run_checks
+
+
+if __name__ == "__main__":
+
+    usage_msg = """
+Output-equivalence regression harness for alternative implementations of core functions.
+
+Usage:
+    python3 -m benchmarks.check_equivalence -e <engine_module> [-n <num_pairs>] [-1 R1.fastq -2 R2.fastq]
+Options:
+    -e (--engine) <module> --- importable module of an alternative engine (e.g. 'mypackage.fast16S');
+    -n (--num-pairs) <int> --- number of synthetic read pairs (default 2000);
+    -s (--seed) <int> --- seed of the generator of reads (default 16);
+    -1 (--R1) <path> --- R1 file of a real sample (can be specified multiple times, with -2);
+    -2 (--R2) <path> --- R2 file of a real sample;
+    --sw-calls <int> --- number of Smith-Waterman alignments (default 20);
+    --gap-pairs <int> --- number of read pairs for gap-filling check with stand-ins of BLAST
+        (default 50, 0 -- skip the check);
+    --json <path> --- write results to a JSON file;
+"""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "he:n:s:1:2:",
+            ["help", "engine=", "num-pairs=", "seed=", "R1=", "R2=", "sw-calls=", "gap-pairs=", "json="])
+    except getopt.GetoptError as opt_err:
+        print(str(opt_err))
+        print(usage_msg)
+        sys.exit(2)
+    # end try
+
+    params = dict()
+    engine_name = None
+    R1_paths, R2_paths = list(), list()
+    json_path = None
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage_msg)
+            sys.exit(0)
+        elif opt in ("-e", "--engine"):
+            engine_name = arg
+        elif opt in ("-n", "--num-pairs"):
+            params["n_pairs"] = int(arg)
+        elif opt in ("-s", "--seed"):
+            params["seed"] = int(arg)
+        elif opt in ("-1", "--R1"):
+            R1_paths.append(os.path.abspath(arg))
+        elif opt in ("-2", "--R2"):
+            R2_paths.append(os.path.abspath(arg))
+        elif opt == "--sw-calls":
+            params["sw_calls"] = int(arg)
+        elif opt == "--gap-pairs":
+            params["gap_pairs"] = int(arg)
+        elif opt == "--json":
+            json_path = arg
+        # end if
+    # end for
+
+    if engine_name is None:
+        print("Engine module is not specified (-e option)")
+        print(usage_msg)
+        sys.exit(2)
+    # end if
+    if len(R1_paths) != len(R2_paths):
+        print("Numbers of R1 and R2 files of real samples are not equal")
+        sys.exit(2)
+    # end if
+    params["real_samples"] = list(zip(R1_paths, R2_paths))
+
+    results = run_checks(engine_name, **params)
+
+    if not json_path is None:
+        with open(json_path, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+        # end with
+        print("\nResults are written to '{}'".format(json_path))
+    # end if
+
+    sys.exit(0 if all(result["identical"] for result in results) else 1)
+# end if
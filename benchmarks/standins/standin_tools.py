@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+# Stand-in implementations of blastn, blastdbcmd and NGmerge.
+#
+# They accept the same command lines the scripts of this repository use
+#   and produce output of the same format, so that the whole pipeline
+#   (including gap-filling read merging) can be run and benchmarked offline,
+#   without BLAST+, NGmerge and Silva database installed.
+# The "database" is a plain FASTA file (e.g. written by 'SyntheticAmplicons.write_templates'),
+#   which is passed to stand-ins via '-db' option instead of a formatted BLAST database.
+#
+# Stand-ins are NOT aligners of production quality: blastn stand-in performs
+#   k-mer seeded ungapped alignment, NGmerge stand-in performs anchor-based overlap search.
+#
+# Environment variables:
+#   STANDIN_LATENCY -- extra latency (seconds) of every call of every stand-in.
+#     It emulates start-up cost of real programs (loading database indices, etc.);
+#   STANDIN_<TOOL>_LATENCY (e.g. STANDIN_BLASTN_LATENCY) -- latency of a particular stand-in.
+#     It overrides STANDIN_LATENCY;
+#   STANDIN_TIMING_LOG -- path to a file, to which every call appends a line
+#     '<tool>\t<work_time>\t<latency>' (seconds). Work time does not include
+#     interpreter start-up and latency, so that orchestration overhead
+#     can be estimated by the caller.
+
+import os
+import sys
+import gzip
+from math import log
+from time import perf_counter, sleep
+
+
+# Length of k-mers used as seeds by blastn stand-in.
+K = 11
+
+# Parameters of bit score calculation for ungapped alignment with reward 2 and penalty -1
+#   (Karlin-Altschul statistics).
+_LAMBDA = 0.549
+_K_PARAM = 0.334
+
+_RC_DICT = {
+    'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G',
+    'R': 'Y', 'Y': 'R', 'S': 'S', 'W': 'W',
+    'K': 'M', 'M': 'K', 'B': 'V', 'D': 'H',
+    'H': 'D', 'V': 'B', 'U': 'A', 'N': 'N'
+}
+
+# blastn output fields that stand-in is able to produce
+_OUTFMT_FIELDS = ("qseqid", "qstart", "qend", "sstart", "send", "sacc", "sseqid", "qlen", "slen",
+    "length", "gaps", "mismatch", "pident", "sstrand", "bitscore", "evalue")
+
+
+def rc(seq):
+    return "".join(_RC_DICT.get(nucl, 'N') for nucl in reversed(seq))
+# end def rc
+
+
+def _latency(tool):
+    return float(os.environ.get("STANDIN_{}_LATENCY".format(tool.upper()),
+        os.environ.get("STANDIN_LATENCY", 0)))
+# end def _latency
+
+
+def run_tool(tool, main, argv):
+    """
+    Function emulates latency of a tool, runs it's 'main' function and logs timing.
+
+    :param tool: name of the tool;
+    :type tool: str;
+    :param main: function that does the job of the tool. It returns exit code;
+    :param argv: command line arguments;
+    :type argv: list<str>;
+    """
+    latency = _latency(tool)
+    if latency > 0:
+        sleep(latency)
+    # end if
+
+    start = perf_counter()
+    exit_code = main(argv)
+    work_time = perf_counter() - start
+
+    log_path = os.environ.get("STANDIN_TIMING_LOG")
+    if not log_path is None:
+        # Lines are short, so appending is atomic even if calls run in parallel
+        with open(log_path, 'a') as log_file:
+            log_file.write("{}\t{:.6f}\t{:.6f}\n".format(tool, work_time, latency))
+        # end with
+    # end if
+
+    sys.exit(exit_code)
+# end def run_tool
+
+
+def _parse_args(argv, flags=()):
+    """
+    Function parses BLAST-style arguments: '-name value' pairs and value-less 'flags'.
+
+    Returns dict<str: str>.
+    """
+    args = dict()
+    i = 0
+    while i < len(argv):
+        name = argv[i].lstrip('-')
+        if name in flags:
+            args[name] = True
+            i += 1
+        else:
+            args[name] = argv[i+1] if i + 1 < len(argv) else ""
+            i += 2
+        # end if
+    # end while
+    return args
+# end def _parse_args
+
+
+def read_fasta(fasta_file):
+    """
+    Generator yields tuples (<header_without_'>'>, <sequence>) from an open FASTA file.
+    """
+    header, seq_lines = None, list()
+    for line in fasta_file:
+        line = line.strip()
+        if line.startswith('>'):
+            if not header is None:
+                yield (header, "".join(seq_lines).upper())
+            # end if
+            header, seq_lines = line[1:], list()
+        elif line != "":
+            seq_lines.append(line)
+        # end if
+    # end for
+    if not header is None:
+        yield (header, "".join(seq_lines).upper())
+    # end if
+# end def read_fasta
+
+
+def _read_db(db_path):
+    with open(db_path, 'r') as db_file:
+        return list(read_fasta(db_file))
+    # end with
+# end def _read_db
+
+
+# |==== blastn ====|
+
+
+def _kmer_index(subjects):
+    """
+    Function builds index of k-mers of subject sequences (plus strand).
+
+    Returns dict<str: list< tuple<int, int> >> -- k-mer to list of (<subject_index>, <position>).
+    """
+    index = dict()
+    for subj_i, (header, seq) in enumerate(subjects):
+        for pos in range(len(seq) - K + 1):
+            index.setdefault(seq[pos:pos+K], list()).append( (subj_i, pos) )
+        # end for
+    # end for
+    return index
+# end def _kmer_index
+
+
+def _best_diagonals(query, index):
+    """
+    Function counts seed hits of 'query' on each diagonal of each subject.
+
+    Returns dict<int: int> -- subject index to it's best diagonal (subject position minus query position).
+    """
+    diag_counts = dict()
+    for qpos in range(len(query) - K + 1):
+        for subj_i, spos in index.get(query[qpos:qpos+K], ()):
+            key = (subj_i, spos - qpos)
+            diag_counts[key] = diag_counts.get(key, 0) + 1
+        # end for
+    # end for
+
+    best = dict()
+    for (subj_i, diag), n_seeds in diag_counts.items():
+        if not subj_i in best or n_seeds > best[subj_i][0]:
+            best[subj_i] = (n_seeds, diag)
+        # end if
+    # end for
+    return {subj_i: diag for subj_i, (n_seeds, diag) in best.items()}
+# end def _best_diagonals
+
+
+def _ungapped_extend(query, sseq, diag, reward, penalty):
+    """
+    Function finds maximal scoring segment of ungapped alignment of 'query'
+      and 'sseq' along diagonal 'diag'.
+
+    Returns tuple (<score>, <qstart>, <qend>, <mismatches>) (0-based, end exclusive).
+    """
+    qfrom = max(0, -diag)
+    qto = min(len(query), len(sseq) - diag)
+
+    best = (0, 0, 0)
+    score, seg_start = 0, qfrom
+    for qpos in range(qfrom, qto):
+        score += reward if query[qpos] == sseq[qpos + diag] else penalty
+        if score <= 0:
+            score, seg_start = 0, qpos + 1
+        elif score > best[0]:
+            best = (score, seg_start, qpos + 1)
+        # end if
+    # end for
+
+    score, qstart, qend = best
+    mismatches = sum(1 for qpos in range(qstart, qend) if query[qpos] != sseq[qpos + diag])
+    return (score, qstart, qend, mismatches)
+# end def _ungapped_extend
+
+
+def _format_bitscore(bitscore):
+    return "{:.0f}".format(bitscore) if bitscore >= 100 else "{:.1f}".format(bitscore)
+# end def _format_bitscore
+
+
+def _format_evalue(evalue):
+    if evalue < 1e-180:
+        return "0.0"
+    # end if
+    return "{:.2e}".format(evalue) if evalue < 0.001 else "{:.3f}".format(evalue)
+# end def _format_evalue
+
+
+def _align_query(qseqid, query, subjects, index, db_len, reward, penalty):
+    """
+    Function aligns query against subjects on both strands.
+
+    Returns list of dictionaries of output fields (see '_OUTFMT_FIELDS') sorted by bitscore.
+    """
+    hits = list()
+    qlen = len(query)
+
+    for strand, strand_query in (("plus", query), ("minus", rc(query))):
+        for subj_i, diag in _best_diagonals(strand_query, index).items():
+            header, sseq = subjects[subj_i]
+            score, qstart, qend, mismatches = _ungapped_extend(strand_query, sseq, diag, reward, penalty)
+            if score == 0:
+                continue
+            # end if
+
+            length = qend - qstart
+            # 1-based subject coordinates
+            sstart, send = qstart + diag + 1, qend + diag
+            if strand == "plus":
+                qstart, qend = qstart + 1, qend
+            else:
+                # Coordinates of reverse-complement query are converted to coordinates
+                #   of the query itself, subject coordinates go in descending order
+                qstart, qend = qlen - qend + 1, qlen - qstart
+                sstart, send = send, sstart
+            # end if
+
+            bitscore = (_LAMBDA * score - log(_K_PARAM)) / log(2)
+            hits.append({
+                "qseqid": qseqid,
+                "qstart": qstart,
+                "qend": qend,
+                "sstart": sstart,
+                "send": send,
+                "sacc": header.partition(' ')[0],
+                "sseqid": header.partition(' ')[0],
+                "qlen": qlen,
+                "slen": len(sseq),
+                "length": length,
+                "gaps": 0,
+                "mismatch": mismatches,
+                "pident": "{:.3f}".format(100 * (length - mismatches) / length),
+                "sstrand": strand,
+                "bitscore": bitscore,
+                "evalue": qlen * db_len * 2 ** (-bitscore),
+                "subj_i": subj_i
+            })
+        # end for
+    # end for
+
+    hits.sort(key=lambda hit: (-hit["bitscore"], hit["subj_i"]))
+    return hits
+# end def _align_query
+
+
+def blastn_main(argv):
+    """
+    blastn stand-in. Reads FASTA query (or multiple queries) from stdin or '-query' file
+      and writes tabular output ('-outfmt "6 <fields>"') to stdout or '-out' file.
+    Supported options: -db, -query, -out, -outfmt, -reward, -penalty, -evalue,
+      -max_target_seqs, -ungapped, -task, -num_threads (the last three are accepted and ignored).
+    """
+    args = _parse_args(argv, flags=("ungapped",))
+
+    if not "db" in args or not os.path.exists(args["db"]):
+        sys.stderr.write("BLAST Database error: No alias or index file found for nucleotide database [{}]\n"
+            .format(args.get("db")))
+        return 2
+    # end if
+
+    outfmt = args.get("outfmt", "6").split()
+    if outfmt[0] != "6":
+        sys.stderr.write("blastn stand-in supports only tabular output format (-outfmt 6)\n")
+        return 1
+    # end if
+    fields = outfmt[1:] if len(outfmt) > 1 else ["qseqid", "sseqid", "pident", "length", "mismatch",
+        "gaps", "qstart", "qend", "sstart", "send", "evalue", "bitscore"]
+    for field in fields:
+        if not field in _OUTFMT_FIELDS:
+            sys.stderr.write("blastn stand-in does not support output field '{}'\n".format(field))
+            return 1
+        # end if
+    # end for
+
+    reward = int(args.get("reward", 2))
+    penalty = int(args.get("penalty", -3))
+    max_evalue = float(args.get("evalue", 10))
+    max_target_seqs = int(args.get("max_target_seqs", 500))
+
+    subjects = _read_db(args["db"])
+    index = _kmer_index(subjects)
+    db_len = sum(len(seq) for header, seq in subjects)
+
+    query_file = open(args["query"], 'r') if "query" in args else sys.stdin
+    outfile = open(args["out"], 'w') if "out" in args else sys.stdout
+
+    for header, query in read_fasta(query_file):
+        qseqid = header.partition(' ')[0]
+        hits = [hit for hit in _align_query(qseqid, query, subjects, index, db_len, reward, penalty)
+            if hit["evalue"] <= max_evalue][:max_target_seqs]
+
+        for hit in hits:
+            hit["bitscore"] = _format_bitscore(hit["bitscore"])
+            hit["evalue"] = _format_evalue(hit["evalue"])
+            outfile.write("\t".join(str(hit[field]) for field in fields) + '\n')
+        # end for
+    # end for
+
+    if not query_file is sys.stdin:
+        query_file.close()
+    # end if
+    if not outfile is sys.stdout:
+        outfile.close()
+    # end if
+    return 0
+# end def blastn_main
+
+
+# |==== blastdbcmd ====|
+
+
+def blastdbcmd_main(argv):
+    """
+    blastdbcmd stand-in. Prints sequences requested with '-entry <acc>[,<acc>...]'
+      or '-entry_batch <file>' (one accession per line, '-' for stdin) in FASTA format.
+    """
+    args = _parse_args(argv)
+
+    if not "db" in args or not os.path.exists(args["db"]):
+        sys.stderr.write("BLAST Database error: No alias or index file found for nucleotide database [{}]\n"
+            .format(args.get("db")))
+        return 2
+    # end if
+
+    if "entry" in args:
+        accs = args["entry"].split(',')
+    elif "entry_batch" in args:
+        batch_file = sys.stdin if args["entry_batch"] == '-' else open(args["entry_batch"], 'r')
+        accs = [line.strip() for line in batch_file if line.strip() != ""]
+        batch_file.close()
+    else:
+        sys.stderr.write("Error: [blastdbcmd] Either -entry or -entry_batch must be specified\n")
+        return 1
+    # end if
+
+    records = {header.partition(' ')[0]: (header, seq) for header, seq in _read_db(args["db"])}
+
+    exit_code = 0
+    for acc in accs:
+        if not acc in records:
+            sys.stderr.write("Error: [blastdbcmd] Entry not found in BLAST database\n")
+            exit_code = 1
+            continue
+        # end if
+        header, seq = records[acc]
+        sys.stdout.write('>' + header + '\n')
+        for i in range(0, len(seq), 80):
+            sys.stdout.write(seq[i:i+80] + '\n')
+        # end for
+    # end for
+    return exit_code
+# end def blastdbcmd_main
+
+
+# |==== NGmerge ====|
+
+
+# Length of anchors and their positions in reverse-complement reverse read
+#   used by NGmerge stand-in for finding overlap.
+_ANCHOR_LEN = 12
+_ANCHOR_POSITIONS = (0, 20, 40, 60)
+
+
+def _read_fastq(fastq_file):
+    while True:
+        lines = [fastq_file.readline().strip() for i in range(4)]
+        if lines[0] == "":
+            return
+        # end if
+        yield lines
+    # end while
+# end def _read_fastq
+
+
+def _open_fastq(path):
+    return gzip.open(path, 'rt') if path.endswith(".gz") else open(path, 'r')
+# end def _open_fastq
+
+
+def _find_overlap(fseq, rseq, min_overlap, mismatch_frac):
+    """
+    Function finds overlap of forward read and reverse-complement reverse read.
+    Dovetailed alignments are not reported.
+
+    Returns offset of reverse read relative to forward read or None.
+    """
+    for anchor_pos in _ANCHOR_POSITIONS:
+        anchor = rseq[anchor_pos : anchor_pos + _ANCHOR_LEN]
+        if len(anchor) < _ANCHOR_LEN:
+            break
+        # end if
+        fpos = fseq.find(anchor)
+        while fpos != -1:
+            offset = fpos - anchor_pos
+            overlap = len(fseq) - offset
+            if offset >= 0 and min_overlap <= overlap <= len(rseq):
+                mismatches = sum(1 for i in range(overlap) if fseq[offset+i] != rseq[i])
+                if mismatches <= mismatch_frac * overlap:
+                    return offset
+                # end if
+            # end if
+            fpos = fseq.find(anchor, fpos + 1)
+        # end while
+    # end for
+    return None
+# end def _find_overlap
+
+
+def _stitch(offset, fseq, fqual, rseq, rqual):
+    # Nucleotide with higher quality wins in the overlapping region
+    overlap = len(fseq) - offset
+    seq, qual = [fseq[:offset]], [fqual[:offset]]
+    for i in range(overlap):
+        if fqual[offset+i] >= rqual[i]:
+            seq.append(fseq[offset+i])
+            qual.append(fqual[offset+i])
+        else:
+            seq.append(rseq[i])
+            qual.append(rqual[i])
+        # end if
+    # end for
+    seq.append(rseq[overlap:])
+    qual.append(rqual[overlap:])
+    return ("".join(seq), "".join(qual))
+# end def _stitch
+
+
+def ngmerge_main(argv):
+    """
+    NGmerge stand-in. Supports the command line used by 'read_merging_16S.py':
+        NGmerge -1 <R1> -2 <R2> -o <merged> -f <unmerged_prefix> -n <threads> -v -m <min_overlap> -p <mismatch_frac>
+    Merged reads are written to '-o' file, unmerged reads -- to '<prefix>_1.fastq'
+      and '<prefix>_2.fastq' in the working directory. With '-v' it prints statistics
+      to stderr in the same format as NGmerge does.
+    """
+    args = _parse_args(argv, flags=("v",))
+    for opt in ("1", "2", "o"):
+        if not opt in args:
+            sys.stderr.write("Error! Missing required argument: -{}\n".format(opt))
+            return 1
+        # end if
+    # end for
+
+    min_overlap = int(args.get("m", 20))
+    mismatch_frac = float(args.get("p", 0.1))
+
+    analyzed, stitched = 0, 0
+    unmerged_files = None
+    if "f" in args:
+        unmerged_files = (open(args["f"] + "_1.fastq", 'w'), open(args["f"] + "_2.fastq", 'w'))
+    # end if
+
+    with _open_fastq(args["1"]) as R1_file, _open_fastq(args["2"]) as R2_file, open(args["o"], 'w') as merged_file:
+        for rec1, rec2 in zip(_read_fastq(R1_file), _read_fastq(R2_file)):
+            analyzed += 1
+            rseq, rqual = rc(rec2[1]), rec2[3][::-1]
+            offset = _find_overlap(rec1[1], rseq, min_overlap, mismatch_frac)
+
+            if offset is None:
+                if not unmerged_files is None:
+                    unmerged_files[0].write("\n".join(rec1) + '\n')
+                    unmerged_files[1].write("\n".join(rec2) + '\n')
+                # end if
+            else:
+                stitched += 1
+                seq, qual = _stitch(offset, rec1[1], rec1[3], rseq, rqual)
+                merged_file.write("{}\n{}\n+\n{}\n".format(rec1[0].partition(' ')[0], seq, qual))
+            # end if
+        # end for
+    # end with
+
+    if not unmerged_files is None:
+        unmerged_files[0].close()
+        unmerged_files[1].close()
+    # end if
+
+    if "v" in args:
+        sys.stderr.write("Processing files: {},{}\n".format(args["1"], args["2"]))
+        sys.stderr.write("  Fragments (pairs of reads) analyzed: {}\n".format(analyzed))
+        sys.stderr.write("  Successfully stitched: {}\n".format(stitched))
+    # end if
+    return 0
+# end def ngmerge_main
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Deterministic generator of synthetic paired-end reads of 16S rDNA amplicons.
+#
+# Reads are simulated from a set of random "template" sequences (one template -- one taxon)
+#   with skewed abundances. Each amplicon is
+#     <forward primer><insert><reverse-complement of reverse primer>,
+#   forward read is read from it's 5'-end and reverse read -- from 5'-end of reverse-complement strand.
+# Generator is deterministic: the same parameters and seed result in the same reads.
+#
+# Can be used as a script:
+#   python3 -m benchmarks.synthetic_reads -n 100000 -o synthetic_dir
+
+import os
+import sys
+import random
+import getopt
+from gzip import open as open_as_gzip
+
+# Benchmarks are run from the root directory of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.crosstalks import MAX_SHIFT
+
+# According to
+#  https://support.illumina.com/documents/documentation/chemistry_documentation/16s/16s-metagenomic-library-prep-guide-15044223-b.pdf
+_INSERT_LEN = 550 # the same as in read_merging_16S
+
+DEFAULT_PRIMERS = ("CCTACGGGNGGCWGCAG", "GACTACHVGGGTATCTAATCC")
+
+# Nucleotides that a degenerate primer symbol can be resolved to
+_DEGENERATE = {
+    'A': "A", 'C': "C", 'G': "G", 'T': "T",
+    'R': "AG", 'Y': "CT", 'S': "CG", 'W': "AT",
+    'K': "GT", 'M': "AC", 'B': "CGT", 'D': "AGT",
+    'H': "ACT", 'V': "ACG", 'N': "ACGT"
+}
+
+_RC_TABLE = str.maketrans("ACGTN", "TGCAN")
+
+# Shift of primer sequence in a read -> it's probability.
+# Positive shift -- there are extra nucleotides before the primer;
+# negative shift -- first nucleotides of the primer are missing.
+DEFAULT_SHIFTS = {0: 0.90, 1: 0.04, -1: 0.03, 2: 0.02, -2: 0.01}
+
+# Quality profiles: (Q at 5'-end, Q at 3'-end, standard deviation of noise)
+QUALITY_PROFILES = {
+    "high": (38, 34, 1.5),
+    "miseq": (37, 22, 4.0),
+    "low": (30, 12, 5.0)
+}
+
+
+def rc(seq):
+    """Returns reverse-complement sequence (of non-degenerate sequence)."""
+    return seq.translate(_RC_TABLE)[::-1]
+# end def rc
+
+
+class SyntheticAmplicons:
+    """
+    Class SyntheticAmplicons is dedicated to generate paired-end reads of 16S rDNA amplicons.
+
+    :field templates: list of template sequences (inserts between primers);
+    :type templates: list<str>;
+    :field abundances: relative abundances of templates;
+    :type abundances: list<float>;
+
+    :method pairs: yields pairs of FASTQ-records;
+    :method write_fastq: writes reads to a pair of FASTQ files;
+    :method write_templates: writes full amplicon sequences of templates to a FASTA file;
+    """
+
+    def __init__(self, seed=16, primers=DEFAULT_PRIMERS, n_templates=50, insert_len_ratio=0.8,
+        insert_len_sd=10, read_len=250, shifts=DEFAULT_SHIFTS, crosstalk_frac=0.05,
+        quality_profile="miseq", abundance_skew=1.0):
+        """
+        :param seed: seed of the random generator;
+        :type seed: int;
+        :param primers: forward and reverse primers (may be degenerate);
+        :type primers: tuple<str>;
+        :param n_templates: number of templates;
+        :type n_templates: int;
+        :param insert_len_ratio: mean length of amplicon relative to '_INSERT_LEN';
+        :type insert_len_ratio: float;
+        :param insert_len_sd: standard deviation of lengths of templates;
+        :type insert_len_sd: int;
+        :param read_len: length of reads;
+        :type read_len: int;
+        :param shifts: shift of primer -> it's probability (see 'DEFAULT_SHIFTS');
+        :type shifts: dict<int: float>;
+        :param crosstalk_frac: fraction of read pairs without primer sequences;
+        :type crosstalk_frac: float;
+        :param quality_profile: key of 'QUALITY_PROFILES';
+        :type quality_profile: str;
+        :param abundance_skew: exponent of Zipf-like distribution of abundances of templates.
+            0 -- all templates are equally abundant;
+        :type abundance_skew: float;
+        """
+
+        for shift in shifts:
+            if abs(shift) > MAX_SHIFT:
+                raise ValueError("Absolute value of shift must not be greater than {}".format(MAX_SHIFT))
+            # end if
+        # end for
+
+        self._seed = seed
+        self.primers = primers
+        self.read_len = read_len
+        self.crosstalk_frac = crosstalk_frac
+        self.q_start, self.q_end, self.q_sd = QUALITY_PROFILES[quality_profile]
+        self.shift_values = list(shifts.keys())
+        self.shift_weights = list(shifts.values())
+
+        rand = random.Random(seed)
+
+        amplicon_len = int(_INSERT_LEN * insert_len_ratio)
+        insert_mean = amplicon_len - len(primers[0]) - len(primers[1])
+
+        self.templates = list()
+        for i in range(n_templates):
+            insert_len = max(1, int(rand.gauss(insert_mean, insert_len_sd)))
+            self.templates.append("".join(rand.choice("ACGT") for j in range(insert_len)))
+        # end for
+
+        self.abundances = [1 / (i + 1) ** abundance_skew for i in range(n_templates)]
+    # end def __init__
+
+    def _resolve_primer(self, rand, primer):
+        return "".join(rand.choice(_DEGENERATE[nucl]) for nucl in primer)
+    # end def _resolve_primer
+
+    def _shifted(self, rand, primer_seq, shift):
+        if shift > 0:
+            return "".join(rand.choice("ACGT") for i in range(shift)) + primer_seq
+        else:
+            return primer_seq[-shift :]
+        # end if
+    # end def _shifted
+
+    def _qualities(self, rand, length):
+        quals = list()
+        for i in range(length):
+            mean = self.q_start + (self.q_end - self.q_start) * i / length
+            quals.append(min(40, max(2, int(round(rand.gauss(mean, self.q_sd))))))
+        # end for
+        return quals
+    # end def _qualities
+
+    def _sequence_read(self, rand, seq, phred_offset):
+        """
+        Function simulates sequencing of first 'read_len' nucleotides of 'seq'
+          with substitution errors according to quality values.
+        Returns tuple (<sequence>, <quality string>).
+        """
+        seq = seq[: self.read_len]
+        quals = self._qualities(rand, len(seq))
+        read = list(seq)
+        for i, q in enumerate(quals):
+            if rand.random() < 10 ** (-q / 10):
+                read[i] = rand.choice("ACGT".replace(read[i], "") if read[i] in "ACGT" else "ACGT")
+            # end if
+        # end for
+        return ("".join(read), "".join(chr(q + phred_offset) for q in quals))
+    # end def _sequence_read
+
+    def pairs(self, n_pairs, phred_offset=33):
+        """
+        Function-generator yields pairs of FASTQ-records of the following structure
+          (the same structure 'src.fastq.read_fastq_pair' returns):
+        {
+            "R1": {"seq_id": ..., "seq": ..., "opt_id": ..., "qual_str": ...},
+            "R2": {"seq_id": ..., "seq": ..., "opt_id": ..., "qual_str": ...}
+        }
+
+        :param n_pairs: number of pairs to generate;
+        :type n_pairs: int;
+        """
+        rand = random.Random(self._seed + 1)
+
+        for i in range(n_pairs):
+
+            if rand.random() < self.crosstalk_frac:
+                # Cross-talk: reads from an unknown (random) sequence
+                amplicon = "".join(rand.choice("ACGT") for j in range(self.read_len * 2))
+            else:
+                template = rand.choices(self.templates, weights=self.abundances)[0]
+                forw_primer = self._resolve_primer(rand, self.primers[0])
+                rev_primer = self._resolve_primer(rand, self.primers[1])
+                shift_1, shift_2 = rand.choices(self.shift_values, weights=self.shift_weights, k=2)
+                amplicon = self._shifted(rand, forw_primer, shift_1) + template \
+                    + rc(self._shifted(rand, rev_primer, shift_2))
+            # end if
+
+            fseq, fqual = self._sequence_read(rand, amplicon, phred_offset)
+            rseq, rqual = self._sequence_read(rand, rc(amplicon), phred_offset)
+
+            seq_id = "@SYNTH:1:FC:1:1:{}:{}".format(i // 1000 + 1, i % 1000 + 1)
+            yield {
+                "R1": {"seq_id": seq_id + " 1:N:0:1", "seq": fseq, "opt_id": '+', "qual_str": fqual},
+                "R2": {"seq_id": seq_id + " 2:N:0:1", "seq": rseq, "opt_id": '+', "qual_str": rqual}
+            }
+        # end for
+    # end def pairs
+
+    def write_fastq(self, R1_path, R2_path, n_pairs, phred_offset=33):
+        """
+        Function writes 'n_pairs' read pairs to files 'R1_path' and 'R2_path'.
+        Files are gzipped if their names end with '.gz'.
+        """
+        how_to_open = open_as_gzip if R1_path.endswith(".gz") else open
+        with how_to_open(R1_path, "wt") as R1_file, how_to_open(R2_path, "wt") as R2_file:
+            for pair in self.pairs(n_pairs, phred_offset):
+                for rec, outfile in ((pair["R1"], R1_file), (pair["R2"], R2_file)):
+                    outfile.write("{}\n{}\n{}\n{}\n".format(rec["seq_id"], rec["seq"],
+                        rec["opt_id"], rec["qual_str"]))
+                # end for
+            # end for
+        # end with
+    # end def write_fastq
+
+    def write_templates(self, fasta_path):
+        """
+        Function writes templates (with primers, as they are in amplicons)
+          to a FASTA file. Templates are named 'synth_<n>'.
+        """
+        rand = random.Random(self._seed + 2)
+        with open(fasta_path, 'w') as fasta_file:
+            for i, template in enumerate(self.templates):
+                fasta_file.write(">synth_{} synthetic 16S template {}\n".format(i, i))
+                fasta_file.write(self._resolve_primer(rand, self.primers[0]) + template
+                    + rc(self._resolve_primer(rand, self.primers[1])) + '\n')
+            # end for
+        # end with
+    # end def write_templates
+# end class SyntheticAmplicons
+
+
+if __name__ == "__main__":
+
+    usage_msg = """
+Generator of synthetic paired-end reads of 16S rDNA amplicons.
+
+Usage:
+    python3 -m benchmarks.synthetic_reads -n <num_pairs> -o <outdir>
+Options:
+    -n (--num-pairs) <int> --- number of read pairs (default 10000);
+    -o (--outdir) --- output directory (default current directory);
+    -s (--seed) <int> --- seed of the random generator (default 16);
+    --templates <int> --- number of templates (default 50);
+    --insert-ratio <float> --- mean amplicon length relative to 550 bp (default 0.8);
+    --read-len <int> --- read length (default 250);
+    --crosstalks <float> --- fraction of cross-talks (default 0.05);
+    --quality [high, miseq, low] --- quality profile (default miseq);
+    --gzip --- gzip FASTQ files;
+"""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:o:s:",
+            ["help", "num-pairs=", "outdir=", "seed=", "templates=", "insert-ratio=",
+            "read-len=", "crosstalks=", "quality=", "gzip"])
+    except getopt.GetoptError as opt_err:
+        print(str(opt_err))
+        print(usage_msg)
+        sys.exit(2)
+    # end try
+
+    n_pairs = 10000
+    outdir = os.getcwd()
+    gzip_files = False
+    params = dict()
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage_msg)
+            sys.exit(0)
+        elif opt in ("-n", "--num-pairs"):
+            n_pairs = int(arg)
+        elif opt in ("-o", "--outdir"):
+            outdir = arg
+        elif opt in ("-s", "--seed"):
+            params["seed"] = int(arg)
+        elif opt == "--templates":
+            params["n_templates"] = int(arg)
+        elif opt == "--insert-ratio":
+            params["insert_len_ratio"] = float(arg)
+        elif opt == "--read-len":
+            params["read_len"] = int(arg)
+        elif opt == "--crosstalks":
+            params["crosstalk_frac"] = float(arg)
+        elif opt == "--quality":
+            params["quality_profile"] = arg
+        elif opt == "--gzip":
+            gzip_files = True
+        # end if
+    # end for
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    # end if
+
+    ext = ".fastq.gz" if gzip_files else ".fastq"
+    generator = SyntheticAmplicons(**params)
+    generator.write_fastq(os.path.join(outdir, "synthetic_R1" + ext),
+        os.path.join(outdir, "synthetic_R2" + ext), n_pairs)
+    generator.write_templates(os.path.join(outdir, "synthetic_templates.fasta"))
+    print("{} read pairs are written to '{}'".format(n_pairs, os.path.abspath(outdir)))
+# end if
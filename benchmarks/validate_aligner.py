@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Validation of the index of minimizers (see 'src/minimizer_index.py') against blastn:
+#   reads are placed on reference sequences by both aligners (see 'read_merging_16S.ALIGNERS'),
+#   and their best placements are compared.
+#
+# Usage (from the root directory of the repository):
+#   python3 -m benchmarks.validate_aligner [-n <num_pairs>] [-1 R1.fastq -2 R2.fastq] [-d <database_fasta>]
+#
+# By default reference sequences and reads are synthetic, and blastn stand-in is used
+#   (see 'benchmarks/standins/standin_tools.py'). If database is specified, it is used with real blastn:
+#   it must be formatted with makeblastdb and indexed with 'python3 -m src.minimizer_index <fasta>'.
+# Placement of a hit is (<accession>, <strand>, <diagonal>). A read is counted as:
+#   "same" -- sets of best placements are equal;
+#   "overlapping" -- sets of best placements intersect (e.g. blastn reports less ties);
+#   "different" -- both aligners have hits, but placements are different;
+#   "blastn_only", "minimizer_only" -- only one of the aligners has a significant hit;
+#   "no_hit" -- neither of aligners has a significant hit.
+# Forward reads and reverse-complement reverse reads are aligned, as gap-filling merging does.
+
+import os
+import sys
+import json
+import shutil
+import getopt
+import tempfile
+from time import perf_counter
+from collections import Counter
+
+# Benchmarks are run from the root directory of the repository
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _REPO_DIR)
+
+from benchmarks.synthetic_reads import SyntheticAmplicons
+from benchmarks.bench_gap_filling import use_standins, _GAP_INSERT_LEN_RATIO
+from src.filesystem import OPEN_FUNCS, FORMATTING_FUNCS, get_archv_fmt_indx, open_files, close_files
+from src.fastq import read_fastq_pair
+from src import minimizer_index
+from src import executor
+import read_merging_16S
+
+CATEGORIES = ("same", "overlapping", "different", "blastn_only", "minimizer_only", "no_hit")
+
+
+def _placements(align_report):
+    # Returns set of placements of best hits of a read
+    if align_report is None:
+        return set()
+    # end if
+    return {(hit.sacc, hit.sstrand, hit.s_start - hit.q_start if hit.sstrand else hit.s_start + hit.q_start)
+        for hit in align_report}
+# end def _placements
+
+
+def _category(blastn_report, minimizer_report):
+    blastn_placements, minimizer_placements = _placements(blastn_report), _placements(minimizer_report)
+    if len(blastn_placements) == 0:
+        return "no_hit" if len(minimizer_placements) == 0 else "minimizer_only"
+    elif len(minimizer_placements) == 0:
+        return "blastn_only"
+    elif blastn_placements == minimizer_placements:
+        return "same"
+    elif len(blastn_placements & minimizer_placements) != 0:
+        return "overlapping"
+    # end if
+    return "different"
+# end def _category
+
+
+def _align_with(aligner, seqs):
+    # Returns (<best hits of each sequence>, <wall time>)
+    read_merging_16S._aligner = aligner
+    start = perf_counter()
+    align_reports = read_merging_16S._align_reads(seqs)
+    return (align_reports, perf_counter() - start)
+# end def _align_with
+
+
+def validate(pairs):
+    """
+    Function places reads of 'pairs' on reference sequences with both aligners and compares placements.
+
+    Returns dictionary of results.
+    """
+    seqs = list(dict.fromkeys([pair["R1"]["seq"] for pair in pairs]
+        + [read_merging_16S._rc(pair["R2"]["seq"]) for pair in pairs]))
+
+    # The index is opened before timing, as a worker of the shared pool opens it once per run
+    executor.warm_state(("minimizer_index", read_merging_16S._blast_fmt_db),
+        lambda: minimizer_index.MinimizerIndex(read_merging_16S._blast_fmt_db))
+    blastn_reports, blastn_time = _align_with("blastn", seqs)
+    minimizer_reports, minimizer_time = _align_with("minimizer", seqs)
+    read_merging_16S._aligner = "blastn"
+
+    categories = Counter(_category(blastn_reports[seq], minimizer_reports[seq]) for seq in seqs)
+    result = {
+        "reads": len(seqs),
+        "categories": {category: categories[category] for category in CATEGORIES},
+        "blastn_time": round(blastn_time, 3),
+        "minimizer_time": round(minimizer_time, 3),
+        "speed_ratio": round(blastn_time / minimizer_time, 2) if minimizer_time > 0 else None
+    }
+
+    print("\n{} reads are placed on reference sequences".format(len(seqs)))
+    for category in CATEGORIES:
+        print("  {:<15} {:>8} ({:.1%})".format(category, categories[category], categories[category] / max(1, len(seqs))))
+    # end for
+    print("blastn: {:.3f} s; index of minimizers: {:.3f} s".format(blastn_time, minimizer_time))
+    return result
+# end def validate
+
+
+def _read_pairs(read_paths, n_pairs):
+    how_to_open = OPEN_FUNCS[get_archv_fmt_indx(read_paths["R1"])]
+    actual_format_func = FORMATTING_FUNCS[get_archv_fmt_indx(read_paths["R1"])]
+    read_files = open_files(read_paths, how_to_open)
+    pairs = list()
+    try:
+        while len(pairs) < n_pairs:
+            fastq_recs = read_fastq_pair(read_files, actual_format_func)
+            if fastq_recs is None:
+                break
+            # end if
+            pairs.append(fastq_recs)
+        # end while
+    finally:
+        close_files(read_files)
+    # end try
+    return pairs
+# end def _read_pairs
+
+
+def run_validation(n_pairs=500, seed=16, n_templates=50, read_paths=None, db_path=None):
+    """
+    Function prepares reference sequences and reads (see the header of this module) and runs validation.
+
+    Returns dictionary of results.
+    """
+    workdir = tempfile.mkdtemp(prefix="validate_aligner_")
+    try:
+        generator = SyntheticAmplicons(seed=seed, n_templates=n_templates,
+            insert_len_ratio=_GAP_INSERT_LEN_RATIO, crosstalk_frac=0.02)
+        if db_path is None:
+            db_path = os.path.join(workdir, "synthetic_references.fasta")
+            generator.write_templates(db_path)
+            use_standins(db_path)
+            minimizer_index.build_index(db_path)
+        else:
+            read_merging_16S._cmd_for_blastn = read_merging_16S._cmd_for_blastn.replace(
+                read_merging_16S._blast_fmt_db, db_path)
+            read_merging_16S._blast_fmt_db = db_path
+        # end if
+
+        if read_paths is None:
+            pairs = list(generator.pairs(n_pairs))
+        else:
+            pairs = _read_pairs(read_paths, n_pairs)
+        # end if
+
+        return validate(pairs)
+    finally:
+        shutil.rmtree(workdir)
+    # end try
+# end def run_validation
+
+
+if __name__ == "__main__":
+
+    usage_msg = """
+Validation of the index of minimizers against blastn.
+
+Usage:
+    python3 -m benchmarks.validate_aligner [-n <num_pairs>] [-1 R1.fastq -2 R2.fastq] [-d <database_fasta>]
+Options:
+    -n (--num-pairs) <int> --- number of read pairs (default 500);
+    -1 (--R1), -2 (--R2) <path> --- files of reads (synthetic reads are generated by default);
+    -d (--db) <path> --- FASTA file of BLAST database indexed with 'src.minimizer_index'
+        (synthetic reference sequences and blastn stand-in are used by default);
+    -s (--seed) <int> --- seed of the generator of reads (default 16);
+    --templates <int> --- number of synthetic reference sequences (default 50);
+    --json <path> --- write results to a JSON file;
+"""
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:1:2:d:s:",
+            ["help", "num-pairs=", "R1=", "R2=", "db=", "seed=", "templates=", "json="])
+    except getopt.GetoptError as opt_err:
+        print(str(opt_err))
+        print(usage_msg)
+        sys.exit(2)
+    # end try
+
+    params = dict()
+    read_paths = dict()
+    json_path = None
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage_msg)
+            sys.exit(0)
+        elif opt in ("-n", "--num-pairs"):
+            params["n_pairs"] = int(arg)
+        elif opt in ("-1", "--R1"):
+            read_paths["R1"] = arg
+        elif opt in ("-2", "--R2"):
+            read_paths["R2"] = arg
+        elif opt in ("-d", "--db"):
+            params["db_path"] = os.path.abspath(arg)
+        elif opt in ("-s", "--seed"):
+            params["seed"] = int(arg)
+        elif opt == "--templates":
+            params["n_templates"] = int(arg)
+        elif opt == "--json":
+            json_path = arg
+        # end if
+    # end for
+
+    if len(read_paths) == 1:
+        print("Both files of reads (-1 and -2) must be specified.")
+        sys.exit(2)
+    elif len(read_paths) == 2:
+        params["read_paths"] = read_paths
+    # end if
+
+    results = run_validation(**params)
+
+    if not json_path is None:
+        with open(json_path, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+        # end with
+        print("\nResults are written to '{}'".format(json_path))
+    # end if
+# end if
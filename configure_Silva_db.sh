@@ -43,13 +43,25 @@ set -e
 # === Select a place for database ===
 
 db_dir=Silva_SSU_138_Nr99
+build_minimizer_index=false
+amplicon_db=false
+primer_path=""
 
-while getopts "o:" opt
+while getopts "o:map:" opt
 do
     case ${opt} in
     o)
         db_dir=${OPTARG}
     ;;
+    m)
+        build_minimizer_index=true
+    ;;
+    a)
+        amplicon_db=true
+    ;;
+    p)
+        primer_path=`realpath ${OPTARG}`
+    ;;
     ?)
         echo "Option not recognized."
         echo "Please, see README.md for help."
@@ -101,11 +113,70 @@ if [[ -z `find -regextype sed -regex "\./.*${db_name}.*" 2>&1 | grep -v "Permiss
 
     echo -e "Silva database is successfully configured."
 
+    # === Make packed reference store ===
+
+    # Sequences packed 4 bits per nucleotide and an index of them:
+    #   read merging retrieves reference sequences from them without calling blastdbcmd
+    echo -e "\nMaking packed reference store..."
+    PYTHONPATH=${startdir} python3 -m src.packed_references ${db_name}
+
     rm -v ${db_name}
 
 else
     echo -e "Silva database is alredy located in '`realpath ${db_dir}`' directory"
     echo 'Downloading and making BLAST DB is omitted.'
+
+    if [[ ! -f "${db_name}.pidx" ]]; then
+        if [[ -f "${db_name}" ]]; then
+            echo -e "\nMaking packed reference store..."
+            PYTHONPATH=${startdir} python3 -m src.packed_references ${db_name}
+        else
+            echo "Packed reference store is not built, because '${db_name}' is removed."
+            echo "Reference sequences will be retrieved with blastdbcmd."
+        fi
+    fi
+fi
+
+# === Make amplicon database (optional) ===
+
+# In-silico PCR extracts amplicons of primers (Illumina V3-V4 ones or ones from file specified with '-p')
+#   from Silva sequences and dereplicates them (see 'src/insilico_pcr.py').
+#   Gap-filling merging will use the amplicon database instead of full-length sequences.
+if [[ ${amplicon_db} == true ]]; then
+    amplicon_name=${db_name%.fasta}_amplicon.fasta
+    if [[ -f "${db_name}" || -f "${db_name}.pidx" ]]; then
+        echo -e "\nExtracting amplicons from Silva sequences (in-silico PCR)..."
+        PYTHONPATH=${startdir} python3 -m src.insilico_pcr ${db_name} ${amplicon_name} ${primer_path}
+
+        echo "Making BLAST database of amplicons..."
+        cmd="makeblastdb -in ${amplicon_name} -parse_seqids -dbtype nucl"
+        echo ${cmd}
+        ${cmd}
+        PYTHONPATH=${startdir} python3 -m src.packed_references ${amplicon_name}
+        # Index of minimizers of previous amplicons is not valid anymore
+        rm -f ${amplicon_name}.midx
+
+        db_name=${amplicon_name}
+        db_abspath=`realpath ${db_name}`
+    else
+        echo "Amplicon database cannot be made, because neither '${db_name}' nor it's packed store exists."
+        exit 1
+    fi
+fi
+
+# === Make index of minimizers (optional) ===
+
+# It is an alternative to blastn for gap-filling merging (see 'src/minimizer_index.py').
+#   The index is built from packed reference store.
+if [[ ${build_minimizer_index} == true ]]; then
+    if [[ -f "${db_name}.midx" ]]; then
+        echo -e "\nIndex of minimizers is already built."
+    elif [[ -f "${db_name}.pidx" ]]; then
+        echo -e "\nMaking index of minimizers (it will take a while)..."
+        PYTHONPATH=${startdir} python3 -m src.minimizer_index ${db_name}
+    else
+        echo "Index of minimizers cannot be built, because packed reference store is not built."
+    fi
 fi
 
 # === Configure module 'read_merging_16S' by specifying locations of files needed for it's work ===
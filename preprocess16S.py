@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-__version__ = "4.0.d"
+__version__ = "4.1.a"
 # Year, month, day
-__last_update_date__ = "2020-12-16"
+__last_update_date__ = "2026-10-18"
 
 # |===== Check python interpreter version. =====|
 
@@ -30,13 +30,15 @@ import os
 import re
 import getopt
 from src.printing import *
+from src.executor import parse_memory_size
 
 try:
     opts, args = getopt.getopt(sys.argv[1:], "hvkmqr:1:2:o:t:f:N:m:p:",
         ["help", "version", "keep-primers", "merge-reads", "quality-plot",
         "primers=", "R1=", "R2=", "outdir=", "threads=", "phred-offset",
         "ngmerge-path=", "num-N=", "min-overlap=", "mismatch-frac=",
-        "no-ovlp-merge"])
+        "no-ovlp-merge", "profile", "sample-profile", "tmpdir=",
+        "sample=", "fraction=", "seed=", "max-memory=", "aligner=", "hit-cache=", "blast-jobs=", "align-server="])
 except getopt.GetoptError as opt_err:
     print( str(opt_err) )
     print("See help ('-h' option)")
@@ -90,6 +92,32 @@ if "-h" in sys.argv[1:] or "--help" in sys.argv[1:]:
 
     print("-f (--phred-offset) [33, 64] --- Phred quality offset (default -- 33);\n")
 
+    print("""--tmpdir <path> --- directory for intermediate (uncompressed) files, e.g. node-local SSD
+  or '/dev/shm'. A temporary directory is created in it and removed after the run;
+  only gzipped result files, quality plot, log file and run report are written to output directory.
+  By default intermediate files are placed in output directory.\n""")
+
+    print("""--sample <int> --- subsampled QC run: process only given number of randomly sampled read pairs.
+  Time of the full run is estimated and written to log file and run report;\n""")
+
+    print("""--fraction <float> --- subsampled QC run: process only given fraction (from 0 to 1)
+  of randomly sampled read pairs (see '--sample');\n""")
+
+    print("""--seed <int> --- seed of random number generator for '--sample' and '--fraction'
+  (random by default).\n""")
+
+    print("""--max-memory <size> --- memory budget for reads in flight between reading process
+  and worker processes, e.g. '4G' or '512M' (suffixes K, M, G, T). Reading is paused
+  until there is room in the budget. Unlimited by default: two packets of reads per worker.\n""")
+
+    print("""--profile --- Flag option. If specified, the parent process and all worker processes
+  will be profiled with cProfile. One pstats file per stage will be placed in
+  directory 'profiles' in the output directory. Profiling slows the program down.\n""")
+
+    print("""--sample-profile --- Flag option. If specified, low-overhead sampling profiler
+  will be run in the parent process and all worker processes. Collapsed stack counts
+  (flame graph format) will be placed in directory 'profiles' in the output directory.\n""")
+
     print("\n  Read merging options:\n")
 
     print("-m (--merge-reads) --- Flag option. If specified, reads will be merged together;\n")
@@ -112,6 +140,24 @@ if "-h" in sys.argv[1:] or "--help" in sys.argv[1:]:
         of read merging will be applied after NGmerge.
         Disabled by default.\n""")
 
+    print("""--aligner -- aligner that places reads on reference sequences for gap-filling merging:
+  'blastn' (BLAST+ and Silva BLAST database) or 'minimizer' (in-process index of minimizers
+  built with `configure_Silva_db.sh -m`).
+  Default value: blastn.\n""")
+
+    print("""--hit-cache -- SQLite file of persistent cache of hits of reads for gap-filling merging.
+  Reads found in it are not aligned again, hits of other reads are stored in it.
+  The file is created if it does not exist. Disabled by default.\n""")
+
+    print("""--blast-jobs -- number of blastn processes run at once by the main process for gap-filling
+  merging. Reads are aligned ahead of merging, and worker processes only merge them.
+  By default each worker runs it's own blastn calls. Only for blastn aligner.\n""")
+
+    print("""--align-server -- socket of local alignment server started with
+  `python3 -m src.alignment_server`. Reads for gap-filling merging are aligned by the server,
+  and reference sequences are retrieved from it. The server must run the same aligner (--aligner).
+  Disabled by default.\n""")
+
     if "--help" in sys.argv[1:]:
         print("----------------------------------------------------------\n")
         print("""  EXAMPLES:\n
@@ -149,6 +195,17 @@ num_N = 35
 min_overlap = 20 # as default in NGmerge
 mismatch_frac = 0.1 # as default in NGmerge
 no_ovlp_merge = False
+aligner = "blastn"
+hit_cache = None
+blast_jobs = None
+align_server = None
+profile = False
+sample_profile = False
+tmpdir = None
+sample_size = None
+sample_fraction = None
+seed = None
+max_memory = None
 
 for opt, arg in opts:
 
@@ -290,9 +347,94 @@ for opt, arg in opts:
 
     elif opt == "--no-ovlp-merge":
         no_ovlp_merge = True
+
+    elif opt == "--aligner":
+        aligner = arg
+
+    elif opt == "--hit-cache":
+        if not os.path.isdir(os.path.dirname(os.path.abspath(arg))):
+            print_error("Directory of cache of hits (--hit-cache option) does not exist: '{}'".format(arg))
+            sys.exit(1)
+        # end if
+        hit_cache = os.path.abspath(arg)
+
+    elif opt == "--blast-jobs":
+        try:
+            blast_jobs = int(arg)
+            if blast_jobs < 1:
+                raise ValueError
+            # end if
+        except ValueError:
+            print_error("invalid number of blastn processes (--blast-jobs option): '{}'".format(arg))
+            print("It must be integer number > 0.")
+            sys.exit(1)
+        # end try
+
+    elif opt == "--align-server":
+        align_server = os.path.abspath(arg)
+
+    elif opt == "--profile":
+        profile = True
+
+    elif opt == "--sample-profile":
+        sample_profile = True
+
+    elif opt == "--tmpdir":
+        if not os.path.isdir(arg):
+            print_error("Directory '{}' does not exist!".format(arg))
+            sys.exit(1)
+        # end if
+        tmpdir = os.path.abspath(arg)
+
+    elif opt == "--sample":
+        try:
+            sample_size = int(arg)
+            if sample_size < 1:
+                raise ValueError
+            # end if
+        except ValueError:
+            print("Invalid number of read pairs to sample (--sample option): '{}'".format(arg))
+            print("It must be integer number > 0.")
+            sys.exit(1)
+        # end try
+
+    elif opt == "--fraction":
+        try:
+            sample_fraction = float(arg)
+            if sample_fraction <= 0 or sample_fraction > 1:
+                raise ValueError
+            # end if
+        except ValueError:
+            print("Invalid fraction of read pairs to sample (--fraction option): '{}'".format(arg))
+            print("It must be number from 0 to 1.")
+            sys.exit(1)
+        # end try
+
+    elif opt == "--max-memory":
+        try:
+            max_memory = parse_memory_size(arg)
+        except ValueError as err:
+            print("Invalid memory budget (--max-memory option): {}".format(err))
+            print("It must be positive number optionally followed by K, M, G or T, e.g. '4G'.")
+            sys.exit(1)
+        # end try
+
+    elif opt == "--seed":
+        try:
+            seed = int(arg)
+        except ValueError:
+            print("Invalid seed (--seed option): '{}'".format(arg))
+            print("It must be integer number.")
+            sys.exit(1)
+        # end try
     # end if
 # end for
 
+if not sample_size is None and not sample_fraction is None:
+    print_error("options '--sample' and '--fraction' cannot be used together!")
+    sys.exit(1)
+# end if
+
 
 # Some checks
 if merge_reads:
@@ -312,7 +454,13 @@ if merge_reads:
         exit(1)
     # end try
 
-    if no_ovlp_merge:
+    if not aligner in read_merging_16S.ALIGNERS:
+        print_error("invalid aligner (--aligner option): '{}'".format(aligner))
+        print("Available aligners: {}.".format(", ".join(read_merging_16S.ALIGNERS)))
+        sys.exit(1)
+    # end if
+
+    if no_ovlp_merge and aligner == "blastn":
         # Check blastn and blastdbcmd
 
         pathdirs = os.environ["PATH"].split(os.pathsep)
@@ -345,7 +493,8 @@ else:
     #   specified without `-m` option.
     for opt in ("--ngmerge-path", "-N", "--num-N",
                       "-m", "--min-overlap", "-p",
-                "--mismatch-frac", "--no-ovlp-merge"):
+                "--mismatch-frac", "--no-ovlp-merge", "--aligner", "--hit-cache", "--blast-jobs",
+                "--align-server"):
         if opt in sys.argv[1:]:
             print("\nOption `{}` does not make any sense".format(opt))
             print("  since you do not merge reads (`-m` option is not specified).")
@@ -378,88 +527,21 @@ if quality_plot:
 
 print( '\n'+get_work_time() + " ({}) ".format(strftime("%d.%m.%Y %H:%M:%S", localtime(start_time))) + "- Start working\n")
 
-
-import math
-from src.fastq import *
-from src.filesystem import *
-from src.crosstalks import *
-
-
-# This is a decorator.
-# All functions that process reads do some same operations: they open read files, open result files,
-#   they count how many reads are already processed.
-# So we will use one interface during multiple procedures.
-
-def progress_counter(process_func, read_paths, result_paths=None, **kwargs):
-
-    def organizer():
-
-        # Collect some info
-        file_type = get_archv_fmt_indx(read_paths["R1"])
-        how_to_open = OPEN_FUNCS[file_type]
-        actual_format_func = FORMATTING_FUNCS[file_type]
-        readfile_length = sum(1 for line in how_to_open(read_paths["R1"]))  # lengths of read files are equal
-        read_pairs_num = int(readfile_length / 4)            # divizion by 4, since there are 4 lines per one fastq-record
-
-        # Open files
-        read_files = open_files(read_paths, how_to_open)
-        if not result_paths is None:
-            result_files = open_files(result_paths, open, 'w')
-        # end if
-
-        # Proceed
-        inc_percentage = 0.01
-        reads_processed = 0
-        # Progress bar shoud not be larger than terminal
-        readnum_digits = math.ceil(math.log(read_pairs_num, 10)) # number of digits in number of read pairs
-        # Number of spaces-equals to print. 11 is number of some 'technical' characters in progress bar, such as '['.
-        width = min(50, os.get_terminal_size().columns - (11+2*readnum_digits))
-        width_ratio = 100 / width
-        spaces = width
-        next_done_percentage = inc_percentage
-        printn("[" + " "*width + "]" + " 0%")
-
-        while reads_processed < read_pairs_num:
-
-            fastq_recs = read_fastq_pair(read_files, actual_format_func)
-
-            # Do what you need with these reads
-            if result_paths is not None:
-                process_func(fastq_recs, result_files, **kwargs)
-            else:
-                process_func(fastq_recs, **kwargs)    # result_files is None while calulating data for plotting
-            # end if
-
-            reads_processed += 1
-            if reads_processed / read_pairs_num >= next_done_percentage:
-                width = min(50, os.get_terminal_size().columns - (11+2*readnum_digits))
-                perc_done = round(next_done_percentage * 100)
-                spaces = width - int(perc_done / width_ratio)
-
-                printn("\r[{}>{}] {}% ({}/{})".format("="*int(perc_done / width_ratio), " "*spaces,
-                    perc_done, reads_processed, read_pairs_num))
-                next_done_percentage += inc_percentage
-            # end if
-        # end while
-
-        print("\r[" + "="*width + "]" + " 100% ({}/{})\n\n"
-            .format(reads_processed, read_pairs_num))
-
-        close_files(read_files)
-        if not result_paths is None:
-            close_files(result_files)
-        # end if
-    # end def organizer
-
-    return organizer
-# end def progress_counter
+from src.crosstalks import get_primers
+from src.errors import Preprocess16SError
+from src import api
 
 
 # |======================= Proceed =======================|
 
 # === Retrieve primers sequences from file ===
 
-primers, primer_ids = get_primers(sys.argv[1:], primer_path)
+try:
+    primers, primer_ids = get_primers(sys.argv[1:], primer_path)
+except Preprocess16SError as err:
+    print_error(str(err))
+    sys.exit(1)
+# end try
 
 
 # === Select read files if they are not specified ===
@@ -467,7 +549,7 @@ primers, primer_ids = get_primers(sys.argv[1:], primer_path)
 # If read files are not specified by CL arguments
 if len(read_paths) == 0:
     # Search for read files in current directory.
-    looks_like_forw_reads = lambda f: False if re.match(r".*R1.*\.f(ast)?q(\.gz)?$", smth) is None else True
+    looks_like_forw_reads = lambda f: False if re.match(r".*R1.*\.f(ast)?q(\.gz)?$", f) is None else True
     forw_reads = ( list(filter(looks_like_forw_reads, os.listdir('.'))) )[0]
     rev_reads = forw_reads.replace("R1", "R2")
     if not os.path.exists(rev_reads):
@@ -479,14 +561,6 @@ if len(read_paths) == 0:
 # end if
 
 
-# I need to keep names of read files in memory in order to name result files properly.
-names = dict()
-for key, path in read_paths.items():
-    file_name_itself = os.path.basename(read_paths[key])
-    names[key] = re.search(r"(.*)\.f(ast)?q", file_name_itself).group(1)
-# end for
-
-
 # === Create output directory. ===
 if not os.path.exists(outdir_path):
     try:
@@ -494,7 +568,6 @@ if not os.path.exists(outdir_path):
     except OSError as oserror:
         print_error("Error while creating result directory")
         print( str(oserror) )
-        close_files(read_files)
         exit(1)
     # end try
 # end if
@@ -538,228 +611,18 @@ Remove old content or quite? [R/q] """)
     # end while
 # end if
 
-artif_dir = os.path.join(outdir_path, "putative_artifacts")
-
-# === Create directory for trash. ===
-if not os.path.exists(artif_dir):
-    try:
-        os.makedirs( artif_dir )
-    except OSError as oserror:
-        print_error("Error while creating result directory")
-        print( str(oserror) )
-        close_files(read_files)
-        exit(1)
-    # end try
-# end if
-
-
-# === Create and open result files. ===
-
-files_to_gzip = list()
-result_files = dict()
-# Keys description:
-# 'm' -- matched (i.e. sequence with primer in it);
-# 'tr' -- trash (i.e. sequence without primer in it);
-# I need to keep these paths in memory in order to gzip corresponding files afterwards.
-result_paths = {
-    # We need trash anyway (trash without primers and, therefore, without 16S data):
-    "mR1": "{}{}{}.16S.fastq".format( outdir_path, os.sep, names["R1"]),
-    "mR2": "{}{}{}.16S.fastq".format( outdir_path, os.sep, names["R2"]),
-    "trR1": "{}{}{}.trash.fastq".format( artif_dir, os.sep, names["R1"]),
-    "trR2": "{}{}{}.trash.fastq".format( artif_dir, os.sep, names["R2"])
-}
-
-files_to_gzip.extend(result_paths.values())
-
-primer_stats = {
-    "match": 0,           # number of read pairs with primers
-    "trash": 0            # number of cross-talks
-}
-
-print("\nFollowing files will be processed:")
-for i, path in enumerate(read_paths.values()):
-    print("  {}. '{}'".format(i+1, os.path.abspath(path)))
-# end for
-
-print("Number of threads: {};".format(n_thr))
-print("Phred offset: {};".format(phred_offset))
-if keep_primers:
-    print("Primer sequences will not be trimmed.")
-# end if
-if merge_reads:
-    print("Reads will be merged together.")
-# end if
-if quality_plot:
-    print("Quality plot will be created.")
-# end if
-print('-'*20+'\n')
-
-
-# |===== Start the process of searching for cross-talks =====|
-
-print("{} - Searching for cross-talks started".format(get_work_time()))
-print("Proceeding...\n")
-
-primer_task = progress_counter(find_primer_organizer, read_paths, result_paths,
-    primers=primers, stats=primer_stats, keep_primers=keep_primers)
-primer_task()
-del primer_task
-
-print("{} - Searching for cross-talks is completed".format(get_work_time()))
-print("""{} read pairs have been processed.
-{} read pairs with primer sequences have been detected.
-{} cross-talk read pairs have been detected.""".format(primer_stats["match"] + primer_stats["trash"],
-    primer_stats["match"], primer_stats["trash"]))
-
-cr_talk_rate = round(100 * primer_stats["trash"] / (primer_stats["match"] + primer_stats["trash"]), 3)
-print("I.e. cross-talk rate is {}%".format(cr_talk_rate))
-print('\n' + '~' * 50)
-
-# |===== The process of searching for cross-talks is completed =====|
-
-
-# |===== Start merging reads =====|
-
-if merge_reads:
-
-    merge_result_files = read_merging_16S.merge_reads(result_paths["mR1"], result_paths["mR2"],
-        ngmerge=ngmerge, outdir_path=outdir_path, n_thr=n_thr, phred_offset=phred_offset,
-        num_N=num_N, min_overlap=min_overlap, mismatch_frac=mismatch_frac, no_ovlp_merge=no_ovlp_merge)
-    merging_stats = read_merging_16S.get_merging_stats()
-
-    files_to_gzip.extend(merge_result_files.values())
-# end if
-
-
-# |===== The process of merging reads is completed =====|
-
-
-# |===== Create a quality plot =====|
-
-if quality_plot:
-
-    # Function for getting Q value from Phred-encoded character:
-    def substr_phred_offs(q_symb):
-        return ord(q_symb) - phred_offset
-    # end def substr_phred_offs
-
-    if merge_reads:
-        data_plotting_paths = {
-            "R1": merge_result_files["merg"]
-        }
-    else:
-        data_plotting_paths = {
-            "R1": result_paths["mR1"],
-            "R2": result_paths["mR2"]
-        }
-    # end if
-
-    print("\n{} - Calculations for plotting started".format(get_work_time()))
-    print("Proceeding...\n")
-
-    if n_thr == 1:
-        plotting_task = progress_counter(calc_qual_disrib, data_plotting_paths,
-            substr_phred_offs=substr_phred_offs)
-        plotting_task()
-        del plotting_task
-        image_path = create_plot(outdir_path, phred_offset)
-    else:
-        Y = parallel_qual(data_plotting_paths, n_thr, substr_phred_offs)
-        image_path = create_plot(Y, outdir_path, phred_offset)
-    # end if
-
-    print("{} - Calculations for plotting are completed".format(get_work_time()))
-    print('\n' + '~' * 50)
-# end if
-
-
-# |===== The process of plotting is completed =====|
-
-
-# Remove empty files
-for file in files_to_gzip:
-    if os.stat(file).st_size == 0:
-        os.remove(file)
-        print("'{}' is removed since it is empty".format(file))
-    # end if
-# end for
-
-# Gzip result files
-gzip_util = "gzip"
-util_found = False
-for directory in os.environ["PATH"].split(os.pathsep):
-    if os.path.isdir(directory) and gzip_util in os.listdir(directory):
-        util_found = True
-        break
-    # end if
-# end for
-
-print("\n{} - Gzipping result files...".format(get_work_time()))
-for file in files_to_gzip:
-    if os.path.exists(file):
-        if util_found:
-            os.system("{} {}".format(gzip_util, file))
-        else:
-            with open(file, 'r') as plain_file, open_as_gzip(file+".gz", 'wb') as gz_file:
-                for line in plain_file:
-                    gz_file.write(bytes(line, "utf-8"))
-                # end for
-            # end with
-            os.unlink(file)
-        # end if
-        print("\'{}\' is gzipped".format(file))
-    # end if
-# end for
-
-print("{} - Gzipping is completed\n".format(get_work_time()))
-print("Result files are placed in the following directory:\n  '{}'\n".format(os.path.abspath(outdir_path)))
-
-# Create log file
-start_time_fmt = strftime("%d_%m_%Y_%H_%M_%S", localtime(start_time))
-with open("{}{}preprocess16S_{}.log".format(outdir_path, os.sep, start_time_fmt).replace(" ", "_"), 'w') as logfile:
-
-    logfile.write("Script 'preprocess_16S.py' was run at {}\n".format(start_time_fmt))
-    end_time = strftime("%d_%m_%Y_%H_%M_%S", localtime(time()))
-    logfile.write("Script completed it's job at {}\n".format(end_time))
-
-    logfile.write("Phred offset: {}.\n\n".format(phred_offset))
-    logfile.write("Number of threads used: {}.\n".format(n_thr))
-
-    logfile.write("Primer sequences:\n\n")
-
-    for i in range(len(primers)):
-        logfile.write("{}\n".format(primer_ids[i]))
-        logfile.write("{}\n".format(primers[i]))
-    # end for
-
-    logfile.write("\nFollowing files have been processed:\n")
-    logfile.write("  '{}'\n  '{}'\n\n".format(os.path.abspath(read_paths["R1"]), os.path.abspath(read_paths["R2"])))
-
-    logfile.write("""{} read pairs have been processed.
-{} read pairs with primer sequences have been detected.
-{} cross-talk read pairs have been detected.\n""".format(primer_stats["match"] + primer_stats["trash"],
-    primer_stats["match"], primer_stats["trash"]))
-
-    logfile.write("I.e. cross-talk rate is {}%\n\n".format(cr_talk_rate))
-
-    if keep_primers:
-        logfile.write("Primer sequences were not trimmed.\n")
-    # end if
-
-    if merge_reads:
-        logfile.write("\n\tReads were merged\n\n")
-        logfile.write("{} read pairs have been merged.\n".format(merging_stats[0]))
-        logfile.write("{} read pairs haven't been merged.\n".format(merging_stats[1]))
-    # end if
-
-    logfile.write("\nResults are in the following directory:\n  '{}'\n".format(outdir_path))
-
-    if quality_plot:
-        logfile.write("\nQuality plot was created. Here it is: \n  '{}'\n".format(image_path))
-    # end if
-
-    logfile.flush()
-# end with
+# All the work is done by 'preprocess' function of library interface ('src/api.py')
+try:
+    api.preprocess(read_paths, outdir_path, primers=primers, primer_ids=primer_ids,
+        keep_primers=keep_primers, merge_reads=merge_reads, quality_plot=quality_plot,
+        n_thr=n_thr, phred_offset=phred_offset, ngmerge=ngmerge, num_N=num_N,
+        min_overlap=min_overlap, mismatch_frac=mismatch_frac, no_ovlp_merge=no_ovlp_merge,
+        aligner=aligner, hit_cache=hit_cache, blast_jobs=blast_jobs, align_server=align_server, profile=profile, sample_profile=sample_profile, version=__version__, tmpdir=tmpdir,
+        sample_size=sample_size, sample_fraction=sample_fraction, seed=seed, max_memory=max_memory)
+except (Preprocess16SError, OSError) as err:
+    print_error(str(err))
+    sys.exit(1)
+# end try
 
 print(get_work_time() + " ({}) ".format(strftime("%d.%m.%Y %H:%M:%S", localtime(time()))) + "- Job is successfully completed!\n")
 sys.exit(0)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Batch mode of preprocess16S: preprocessing of many samples listed in a sample sheet.
+# Samples are processed concurrently, total number of cores ('-t' option) is split between them
+#   (see 'src/batch.py'). Statistics of all samples are written to one table 'batch_stats.tsv'.
+
+__version__ = "4.1.a"
+# Year, month, day
+__last_update_date__ = "2026-10-18"
+
+import sys
+
+if sys.version_info.major < 3:
+    print( "\nYour python interpreter version is " + "%d.%d" % (sys.version_info.major,
+        sys.version_info.minor) )
+    print("   Please, use Python 3.\a")
+    sys.exit(1)
+# end if
+
+import os
+import getopt
+
+from src.printing import *
+from src.errors import Preprocess16SError
+from src.crosstalks import get_primers
+from src import batch
+from src import api
+from src import executor
+
+
+usage_msg = """
+preprocess16S_batch.py -- batch mode of preprocess16S.py; version {}.
+
+Usage:
+    ./preprocess16S_batch.py -s <sample_sheet> -o <outdir> [-t <cores>] [OPTIONS]
+
+Sample sheet is a text file with one sample per line. Fields are separated with tabs or commas:
+    <sample_name> <R1_path> <R2_path>
+  or
+    <R1_path> <R2_path>
+  (the name is derived from name of R1 file). Lines starting with '#' are ignored.
+  Relative paths are relative to directory of the sample sheet.
+
+Results of each sample are placed in directory '<outdir>/<sample_name>'.
+Table of statistics of all samples is written to '<outdir>/batch_stats.tsv'.
+
+Options:
+    -h (--help) --- show help message;
+    -v (--version) --- show version;
+    -s (--sample-sheet) <path> --- sample sheet (required);
+    -o (--outdir) <path> --- output directory. It must not exist or be empty (required);
+    -t (--threads) <int> --- total number of cores to use (default: all available cores);
+    -j (--max-concurrent) <int> --- maximum number of samples processed at the same time
+        (default: number of cores);
+    -r (--primers) <path> --- multi-FASTA file with primer sequences
+        (Illumina V3-V4 primers are used by default);
+    -k (--keep-primers) --- do not trim primer sequences;
+    -q (--quality-plot) --- plot distribution of read quality for each sample;
+    -f (--phred-offset) [33, 64] --- Phred quality offset (default 33);
+    -m (--merge-reads) --- merge reads;
+    --ngmerge-path <path> --- path to NGmerge executable;
+    -N (--num-N) <int> --- maximum length of a gap that can be filled with Ns (default 35);
+    --min-overlap <int> --- minimum overlap of reads to be merged with NGmerge (default 20);
+    --mismatch-frac <float> --- fraction of mismatches to allow in the overlapped region (default 0.1);
+    --no-ovlp-merge --- apply gap-filling merging after NGmerge (requires BLAST+ and Silva database);
+    --tmpdir <path> --- directory for intermediate files of samples, e.g. node-local SSD or '/dev/shm'
+        (default: output directory of a sample). Temporary directories are removed after samples are processed;
+    --max-memory <size> --- memory budget of the batch for reads in flight, e.g. '16G' (suffixes K, M, G, T).
+        It is split between samples in proportion to their cores (default: unlimited);
+
+Cores are split between samples running at the same time. Inside a sample, NGmerge, Python worker
+  processes and gzip can use all cores of the sample, since they run one after another.
+  Samples with small input files are processed without Python worker processes.
+""".format(__version__)
+
+
+if __name__ == "__main__":
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hvs:o:t:j:r:kqf:mN:",
+            ["help", "version", "sample-sheet=", "outdir=", "threads=", "max-concurrent=", "primers=",
+            "keep-primers", "quality-plot", "phred-offset=", "merge-reads", "ngmerge-path=",
+            "num-N=", "min-overlap=", "mismatch-frac=", "no-ovlp-merge", "tmpdir=", "max-memory="])
+    except getopt.GetoptError as opt_err:
+        print(str(opt_err))
+        print(usage_msg)
+        sys.exit(2)
+    # end try
+
+    sheet_path = None
+    outdir_path = None
+    n_cores = len(os.sched_getaffinity(0))
+    max_concurrent = None
+    primer_path = None
+    params = {
+        "keep_primers": False,
+        "quality_plot": False,
+        "phred_offset": 33,
+        "merge_reads": False,
+        "ngmerge": api.DEFAULT_NGMERGE,
+        "num_N": 35,
+        "min_overlap": 20,
+        "mismatch_frac": 0.1,
+        "no_ovlp_merge": False,
+        "tmpdir": None,
+        "max_memory": None,
+        "version": __version__
+    }
+
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print(usage_msg)
+                sys.exit(0)
+            elif opt in ("-v", "--version"):
+                print(__version__)
+                sys.exit(0)
+            elif opt in ("-s", "--sample-sheet"):
+                sheet_path = arg
+            elif opt in ("-o", "--outdir"):
+                outdir_path = os.path.abspath(arg)
+            elif opt in ("-t", "--threads"):
+                n_cores = int(arg)
+                if n_cores < 1:
+                    raise ValueError("number of cores must be positive integer number: '{}'".format(arg))
+                # end if
+            elif opt in ("-j", "--max-concurrent"):
+                max_concurrent = int(arg)
+                if max_concurrent < 1:
+                    raise ValueError("number of concurrent samples must be positive integer number: '{}'"
+                        .format(arg))
+                # end if
+            elif opt in ("-r", "--primers"):
+                primer_path = arg
+            elif opt in ("-k", "--keep-primers"):
+                params["keep_primers"] = True
+            elif opt in ("-q", "--quality-plot"):
+                params["quality_plot"] = True
+            elif opt in ("-f", "--phred-offset"):
+                params["phred_offset"] = int(arg)
+                if params["phred_offset"] not in (33, 64):
+                    raise ValueError("invalid Phred offset: '{}'. Available values: 33, 64".format(arg))
+                # end if
+            elif opt in ("-m", "--merge-reads"):
+                params["merge_reads"] = True
+            elif opt == "--ngmerge-path":
+                # Samples run NGmerge from their output directories, so the path is made absolute
+                if not os.path.isfile(arg):
+                    raise ValueError("file '{}' does not exist".format(arg))
+                # end if
+                params["ngmerge"] = os.path.abspath(arg)
+            elif opt in ("-N", "--num-N"):
+                params["num_N"] = int(arg)
+            elif opt == "--min-overlap":
+                params["min_overlap"] = int(arg)
+            elif opt == "--mismatch-frac":
+                params["mismatch_frac"] = float(arg)
+                if not 0 <= params["mismatch_frac"] <= 1:
+                    raise ValueError("fraction of mismatches must be from 0.0 to 1.0: '{}'".format(arg))
+                # end if
+            elif opt == "--no-ovlp-merge":
+                params["no_ovlp_merge"] = True
+            elif opt == "--tmpdir":
+                if not os.path.isdir(arg):
+                    raise ValueError("directory '{}' does not exist".format(arg))
+                # end if
+                params["tmpdir"] = os.path.abspath(arg)
+            elif opt == "--max-memory":
+                params["max_memory"] = executor.parse_memory_size(arg)
+            # end if
+        # end for
+    except ValueError as err:
+        print_error(str(err))
+        sys.exit(1)
+    # end try
+
+    if sheet_path is None or outdir_path is None:
+        print_error("sample sheet (-s) and output directory (-o) must be specified!")
+        print(usage_msg)
+        sys.exit(1)
+    # end if
+
+    if os.path.exists(outdir_path) and len(os.listdir(outdir_path)) != 0:
+        print_error("output directory '{}' is not empty!".format(outdir_path))
+        sys.exit(1)
+    # end if
+
+    if params["merge_reads"] and not os.access(params["ngmerge"], os.X_OK):
+        print_error("NGmerge file is not executable: '{}'".format(params["ngmerge"]))
+        print("Please, make it executable. You can do it in this way:")
+        print(" chmod +x {}".format(params["ngmerge"]))
+        sys.exit(1)
+    # end if
+
+    try:
+        params["primers"], params["primer_ids"] = get_primers(None, primer_path)
+        samples = batch.read_sample_sheet(sheet_path)
+        if params["merge_reads"] and params["no_ovlp_merge"]:
+            import read_merging_16S
+            read_merging_16S.check_silva_db()
+        # end if
+        if not os.path.exists(outdir_path):
+            os.makedirs(outdir_path)
+        # end if
+    except (Preprocess16SError, OSError) as err:
+        print_error(str(err))
+        sys.exit(1)
+    # end try
+
+    print("\n |=== preprocess16S_batch.py (version {}) ===|\n".format(__version__))
+    print("{} samples; {} cores{}.\n".format(len(samples), n_cores,
+        "" if max_concurrent is None else "; at most {} samples at the same time".format(max_concurrent)))
+
+    results = batch.run_batch(samples, outdir_path, n_cores, max_concurrent, **params)
+
+    table_path = os.path.join(outdir_path, "batch_stats.tsv")
+    batch.write_stats_table(table_path, results)
+
+    n_failed = sum(1 for result in results if result["status"] != "ok")
+    print("\n{} - Batch is completed: {} samples processed, {} failed".format(get_work_time(),
+        len(results) - n_failed, n_failed))
+    print("Statistics of samples is here:\n  '{}'\n".format(table_path))
+
+    sys.exit(0 if n_failed == 0 else 1)
+# end if
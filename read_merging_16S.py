@@ -1,36 +1,51 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-__version__ = "4.0.c"
+__version__ = "4.1.a"
 # Year, month, day
-__last_update_date__ = "2020-12-16"
+__last_update_date__ = "2026-10-18"
 
 import os
 import re
 import sys
-import math
 import shutil
+import atexit
+import tempfile
+import sqlite3
+import asyncio
 
-from gzip import open as open_as_gzip
 from bz2 import open as open_as_bz2
+from glob import glob
 
 from subprocess import Popen as sp_Popen, PIPE as sp_PIPE
-import multiprocessing as mp
+from collections import deque, Counter, OrderedDict
 
 from src.printing import *
 from src.fastq import *
 from src.filesystem import *
+from src.errors import Preprocess16SError, FastqError, MergingError
 
 from src.NGmerge_quality_profile import *
+from src import run_report
+from src import profiling
+from src import executor
+from src import progress
 
 from src.smith_waterman import SW_align, AlignResult
+from src.reference_store import ReferenceStore, hit_rate
+from src.packed_references import PackedReferences
+from src.minimizer_index import MinimizerIndex, index_path as minimizer_index_path
+from src import minimizer_index
+from src.hit_cache import HitCache, hit_rate as hit_cache_rate
+from src.orchestrator import SubprocessOrchestrator
+from src.alignment_server import AlignmentServer, AlignmentClient
 
 _blast_fmt_db = "/home/deynonih/cager/preprocess-refine/classif/local_database/SILVA_138_SSURef_NR99_tax_silva_trunc.fasta"
 
-QSTART, QEND, SSTART, SEND, SACC, QLEN, LENGTH, GAPS, SSTRAND, BITSCORE, EVALUE = range(11)
+QSEQID, QSTART, QEND, SSTART, SEND, SACC, QLEN, LENGTH, GAPS, SSTRAND, BITSCORE, EVALUE = range(12)
 
 _cmd_for_blastn = """blastn -db {} -penalty -1 -reward 2 -ungapped \
--outfmt "6 qstart qend sstart send sacc qlen length gaps sstrand bitscore evalue" \
+-outfmt "6 qseqid qstart qend sstart send sacc qlen length gaps sstrand bitscore evalue" \
 -task megablast -max_target_seqs 10""".format(_blast_fmt_db)
 
 _RC_DICT = {
@@ -48,6 +63,58 @@ _rc = lambda seq: "".join(map(_single_nucl_rc, seq[::-1]))
 _MAX_ALIGN_OFFSET = 5
 # --------------------------------------------
 
+# Maximum number of reference sequences (both strands are counted) kept in cache of a process
+#   (see '_reference_store'). Cache lives in warm state of the process (see 'src.executor.warm_state'),
+#   so workers of the shared pool retrieve each reference sequence from BLAST database once
+#   as long as it is in use.
+_REF_CACHE_SIZE = 4000
+
+# Maximum number of distinct read pairs, placements of which on reference sequences are kept by the main
+#   process of a merging run (see '_RunPlacements'). Amplicon libraries consist mostly of copies of few
+#   sequences, so a pair identical to one seen before in the same merging run is neither aligned nor
+#   placed again: only the merged sequence and qualities are made for it (see '_place_pair_cached').
+_PLACEMENT_CACHE_SIZE = 20000
+
+# Number of read pairs, reads of which are aligned against the reference database with one blastn call
+#   (see '_blast_chunk'). Loading of the database is the most expensive part of a blastn call.
+_BLAST_CHUNK_SIZE = 500
+
+# Number of chunks of reads being aligned by blastn processes run by the orchestrator
+#   (see '_prealigned_chunks'), per process in flight. Forward and reverse reads of a chunk
+#   are aligned one after another, so there should be more chunks than processes.
+_PREALIGN_CHUNKS_PER_JOB = 2
+
+# Maximum number of distinct reads, best hits of which are kept by the process that aligns reads
+#   in advance (see '_prealigned_chunks'): a read aligned before in the same merging run
+#   is not sent to blastn again (forward and reverse reads of each placed pair are counted).
+_PREALIGNED_HITS_SIZE = 2 * _PLACEMENT_CACHE_SIZE
+
+# Aligners that place reads on reference sequences for gap-filling merging:
+#   "blastn" -- blastn against BLAST database;
+#   "minimizer" -- index of minimizers built next to BLAST database (see 'src.minimizer_index').
+#     It runs in the process that merges reads and requires neither BLAST+ nor BLAST database.
+ALIGNERS = ("blastn", "minimizer")
+# Aligner of the current process: it is set for each chunk of reads (see '_merge_chunk')
+_aligner = "blastn"
+
+# Path to persistent cache of hits of reads of the current process (see 'src.hit_cache';
+#   None if the cache is not used). It is set for each chunk of reads (see '_merge_chunk')
+_hit_cache_path = None
+
+# Path to socket of the alignment server that aligns reads and keeps reference sequences
+#   for the current process (see 'src.alignment_server'; None if reads are aligned by the process itself).
+#   It is set for each chunk of reads (see '_merge_chunk')
+_align_server_path = None
+
+# Best hits of reads of the current chunk aligned in advance (see '_blast_chunk'):
+#   dict<str: list<AlignResult>>, keys are sequences of reads. Reads without hits are mapped to None.
+_chunk_hits = dict()
+
+# Placements of read pairs of the current chunk (see '_place_pair_cached'): passed by the main process
+#   for pairs placed before in the merging run, and made for other pairs of the chunk.
+#   Keys are sequences of both reads (see '_pair_key').
+_chunk_placements = dict()
+
 # According to
 #  https://support.illumina.com/documents/documentation/chemistry_documentation/16s/16s-metagenomic-library-prep-guide-15044223-b.pdf
 _INSERT_LEN = 550
@@ -57,6 +124,33 @@ _INSERT_LEN = 550
 # Keys in this dictionary are in consistency with return codes of the function "_merge_pair"
 _merging_stats = None    # it in None in the beginning, because there is no statistics before merging
 
+# Outcomes of gap-filling merging of a read pair:
+#   "merged_gap" -- reads are merged, gap between them is filled with Ns;
+#   "merged_short_overlap" -- reads are merged by overlap that is shorter than minimum overlap of NGmerge;
+#   "no_hit" -- a read has no hit in the reference database;
+#   "long_overlap" -- reads overlap long enough, but NGmerge has not merged them;
+#   "dovetailed" -- read pair is dovetailed;
+#   "gap_too_long" -- gap between reads is longer than maximum number of Ns;
+#   "unforeseen" -- unforseen case (see '_handle_unforseen_case').
+GAP_FILLING_OUTCOMES = ("merged_gap", "merged_short_overlap", "no_hit", "long_overlap",
+    "dovetailed", "gap_too_long", "unforeseen")
+
+# Statistics of gap-filling merging collected by the current process (a worker or the main process):
+#   "outcomes" -- number of read pairs per outcome (see 'GAP_FILLING_OUTCOMES');
+#   "gap_lengths" -- histogram of lengths of gaps between reads (length: number of read pairs),
+#     both filled with Ns and too long ones;
+#   "reference_cache" -- counts of the store of reference sequences (see 'src.reference_store');
+#   "dereplication" -- numbers of read "pairs" passed to gap-filling merging and of pairs actually
+#     placed on reference sequences ("placed_pairs", see '_place_pair_cached');
+#   "hit_cache" -- counts of persistent cache of hits of reads (see 'src.hit_cache').
+# These are plain counters: nothing is shared between processes. Workers return them with results
+#   of each packet (see 'pop_gap_filling_stats'), and the main process sums them ('add_gap_filling_stats').
+_gap_filling_stats = {"outcomes": Counter(), "gap_lengths": Counter(), "reference_cache": Counter(),
+    "dereplication": Counter(), "hit_cache": Counter()}
+
+# Statistics of gap-filling merging of the last 'merge_reads' call (None if gap-filling merging was not run)
+_gap_filling_result = None
+
 
 # ===============================  Internal functions  ===============================
 
@@ -124,39 +218,33 @@ class NoRefAlignError(Exception):
 # end class NoRefAlignError
 
 
-def _blast_read(fseq, f_id):
-
-    # Align read. Find the best hit.
-    pipe = sp_Popen(_cmd_for_blastn, shell=True, stdout=sp_PIPE, stderr=sp_PIPE, stdin=sp_PIPE)
+def _parse_blast_hits(lines):
+    """
+    Function selects best hits of a query from tabular output of blastn (see '_best_hits').
 
-    # blastn will read query from stdin
-    pipe.stdin.write( bytes(f_id.replace('@', '>') + '\n', "utf-8") )
-    pipe.stdin.write( bytes(fseq + '\n', "utf-8") )
-    pipe.stdin.close()
+    :param lines: lines of output of blastn for one query;
+    :type lines: list<str>;
 
-    exit_code = pipe.wait() # launch blastn
-    if exit_code != 0:
-        print_error("error while aligning a sequence against local database")
-        print(pipe.stderr.read().decode("utf-8"))
-        print("ID if erroneous read:\n  '{}'".format(f_id))
-        sys.exit(exit_code)
-    # end if
+    Returns list of AlignResult or None if there is no significant similarity.
+    """
+    return _best_hits([line.split('\t') for line in lines])
+# end def _parse_blast_hits
 
-    lines = pipe.stdout.read().decode("utf-8").strip()
 
-    # If there is no significant similarity
-    if lines == '':
-        raise NoRefAlignError()
-    # end if
+def _best_hits(hits):
+    """
+    Function selects best hits of a query: all hits with the best bitscore.
+    Hits of a query are sorted by bitscore (descending) by blastn and by the index of minimizers.
 
-    lines = lines.splitlines()
+    :param hits: fields of hits in order of '_cmd_for_blastn' output format (bitscores are strings printed by blastn);
+    :type hits: list< sequence<object> >;
 
+    Returns list of AlignResult or None if there is no significant similarity.
+    """
     align_report = list()
-    best_bitscore = lines[0].split('\t')[BITSCORE]
-
-    for line in lines:
+    best_bitscore = hits[0][BITSCORE]
 
-        hit = line.split('\t')
+    for hit in hits:
 
         if hit[BITSCORE] != best_bitscore:
             break
@@ -171,6 +259,469 @@ def _blast_read(fseq, f_id):
     # end for
 
     if align_report[0].evalue > 1e-2:
+        return None
+    # end if
+
+    return align_report
+# end def _best_hits
+
+
+def _blast_reads(seqs, num_threads=1):
+    """
+    Function aligns reads against the reference database with one blastn call:
+      reads are passed to blastn as one multi-FASTA query, so that the database is loaded once.
+    Queries are named by their indices, since IDs of forward and reverse reads of a pair are the same.
+
+    :param seqs: sequences of reads;
+    :type seqs: iterable<str>;
+    :param num_threads: number of threads of blastn;
+    :type num_threads: int;
+
+    Returns dict<str: list<AlignResult>> -- best hits of each sequence (see '_parse_blast_hits').
+      Sequences without significant similarity are mapped to None.
+    """
+    seqs = list(dict.fromkeys(seqs)) # identical reads are aligned once
+    if len(seqs) == 0:
+        return dict()
+    # end if
+
+    blast_start = perf_counter()
+    # blastn will read query from stdin
+    pipe = sp_Popen(_blastn_command(num_threads), shell=True,
+        stdout=sp_PIPE, stderr=sp_PIPE, stdin=sp_PIPE)
+    stdout, stderr = pipe.communicate(_blastn_query(seqs)) # launch blastn
+    run_report.add_substage_time("blast", perf_counter() - blast_start, child=True)
+
+    return _parse_blastn_output(seqs, pipe.returncode, stdout, stderr)
+# end def _blast_reads
+
+
+def _blastn_command(num_threads=1):
+    # Returns command line of blastn that reads query from stdin
+    return "{} -num_threads {}".format(_cmd_for_blastn, num_threads)
+# end def _blastn_command
+
+
+def _blastn_query(seqs):
+    # Returns multi-FASTA query of blastn: queries are named by their indices in 'seqs'
+    return bytes("".join(">{}\n{}\n".format(i, seq) for i, seq in enumerate(seqs)), "utf-8")
+# end def _blastn_query
+
+
+def _parse_blastn_output(seqs, returncode, stdout, stderr):
+    """
+    Function parses output of blastn called for query made by '_blastn_query'.
+
+    :param seqs: sequences of reads (unique ones) in order of the query;
+    :type seqs: list<str>;
+    :param returncode: exit code of blastn;
+    :type returncode: int;
+    :param stdout: output of blastn;
+    :type stdout: bytes;
+    :param stderr: error output of blastn;
+    :type stderr: bytes;
+
+    Returns dict<str: list<AlignResult>> (see '_blast_reads').
+    Raises MergingError if blastn has failed.
+    """
+    if returncode != 0:
+        raise MergingError("error while aligning sequences against local database (exit code {}).\n{}"
+            .format(returncode, stderr.decode("utf-8")))
+    # end if
+
+    # Group lines by query
+    query_lines = [list() for seq in seqs]
+    for line in stdout.decode("utf-8").splitlines():
+        if line != '':
+            query_lines[int(line.partition('\t')[0])].append(line)
+        # end if
+    # end for
+
+    return {seq: (_parse_blast_hits(lines) if len(lines) != 0 else None)
+        for seq, lines in zip(seqs, query_lines)}
+# end def _parse_blastn_output
+
+
+def _index_reads(seqs):
+    """
+    Function aligns reads against reference sequences with the index of minimizers (see 'src.minimizer_index').
+    The index is opened once per process and is kept in it's warm state (see 'src.executor.warm_state').
+
+    :param seqs: sequences of reads;
+    :type seqs: iterable<str>;
+
+    Returns dict<str: list<AlignResult>> -- best hits of each sequence (see '_best_hits').
+      Sequences without significant similarity are mapped to None.
+    """
+    index = executor.warm_state(("minimizer_index", _blast_fmt_db), lambda: MinimizerIndex(_blast_fmt_db))
+    seqs = list(dict.fromkeys(seqs)) # identical reads are aligned once
+
+    index_start = perf_counter()
+    align_reports = dict()
+    for i, seq in enumerate(seqs):
+        hits = index.align(i, seq)
+        align_reports[seq] = _best_hits(hits) if len(hits) != 0 else None
+    # end for
+    run_report.add_substage_time("minimizer_index", perf_counter() - index_start, calls=len(seqs))
+
+    return align_reports
+# end def _index_reads
+
+
+def _align_reads(seqs, num_threads=1):
+    """
+    Function aligns reads against reference sequences with the aligner of the current process
+      (see 'ALIGNERS'): with one blastn call or with the index of minimizers.
+    If persistent cache of hits is used (see '_hit_cache'), only reads missing from it are aligned,
+      and their hits are stored in the cache.
+
+    :param seqs: sequences of reads;
+    :type seqs: iterable<str>;
+    :param num_threads: number of threads of blastn;
+    :type num_threads: int;
+
+    Returns dict<str: list<AlignResult>> -- best hits of each sequence.
+      Sequences without significant similarity are mapped to None.
+    """
+    hit_cache = _hit_cache()
+    if hit_cache is None:
+        return _run_aligner(seqs, num_threads)
+    # end if
+
+    seqs = list(dict.fromkeys(seqs))
+    cache_start = perf_counter()
+    align_reports = hit_cache.get_many(seqs)
+    run_report.add_substage_time("hit_cache", perf_counter() - cache_start)
+
+    missing = [seq for seq in seqs if not seq in align_reports]
+    if len(missing) != 0:
+        aligned = _run_aligner(missing, num_threads)
+        cache_start = perf_counter()
+        hit_cache.put_many(aligned)
+        run_report.add_substage_time("hit_cache", perf_counter() - cache_start)
+        align_reports.update(aligned)
+    # end if
+    return align_reports
+# end def _align_reads
+
+
+def _run_aligner(seqs, num_threads=1):
+    # Function aligns reads with the aligner of the current process (see '_align_reads')
+    if not _align_server_path is None:
+        return _server_reads(seqs)
+    elif _aligner == "minimizer":
+        return _index_reads(seqs)
+    # end if
+    return _blast_reads(seqs, num_threads)
+# end def _run_aligner
+
+
+def _align_server():
+    # Returns client of the alignment server of the current process (see 'src.alignment_server').
+    #   Each process has it's own connection to the server.
+    return executor.warm_state(("align_server", _align_server_path), lambda: AlignmentClient(_align_server_path))
+# end def _align_server
+
+
+def _server_reads(seqs):
+    """
+    Function aligns reads with the alignment server (see 'src.alignment_server'). The server aligns them
+      with the same aligner and selects best hits in the same way (see 'make_align_server').
+
+    :param seqs: sequences of reads;
+    :type seqs: iterable<str>;
+
+    Returns dict<str: list<AlignResult>> -- best hits of each sequence (see '_best_hits').
+    Raises MergingError if the server fails.
+    """
+    seqs = list(dict.fromkeys(seqs)) # identical reads are aligned once
+    if len(seqs) == 0:
+        return dict()
+    # end if
+
+    server_start = perf_counter()
+    try:
+        align_reports = _align_server().align(seqs)
+    except (OSError, RuntimeError) as err:
+        raise MergingError("error while aligning sequences with alignment server '{}'.\n{}"
+            .format(_align_server_path, str(err)))
+    # end try
+    run_report.add_substage_time("align_server", perf_counter() - server_start, child=True)
+
+    return align_reports
+# end def _server_reads
+
+
+def _hit_cache_fingerprint():
+    """
+    Function returns fingerprint of the aligner of the current process for persistent cache of hits
+      (see 'src.hit_cache'): names, sizes and modification times of files of the database
+      and parameters of the aligner.
+    """
+    if _aligner == "minimizer":
+        db_files = [minimizer_index_path(_blast_fmt_db)]
+        params = "minimizer K={} W={} max_occurrences={} max_candidates={}".format(minimizer_index.K,
+            minimizer_index.W, minimizer_index.MAX_OCCURRENCES, minimizer_index.MAX_CANDIDATES)
+    else:
+        # Files of BLAST database: '<db>.nhr', '<db>.nsq', ... and '<db>.00.nhr', ... for multi-volume ones
+        db_files = sorted(glob(_blast_fmt_db + ".n*") + glob(_blast_fmt_db + ".[0-9]*.n*"))
+        params = _cmd_for_blastn
+    # end if
+    files = ";".join("{}:{}:{}".format(os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns)
+        for path in db_files if os.path.exists(path))
+    return "{}\n{}".format(params, files)
+# end def _hit_cache_fingerprint
+
+
+def _hit_cache():
+    # Returns persistent cache of hits of the current process (see 'src.hit_cache'),
+    #   or None if it is not used. Each process has it's own connection to the cache.
+    if _hit_cache_path is None:
+        return None
+    # end if
+    return executor.warm_state(("hit_cache", _hit_cache_path, _blast_fmt_db, _aligner),
+        lambda: HitCache(_hit_cache_path, _hit_cache_fingerprint()))
+# end def _hit_cache
+
+
+def _blast_chunk(packet, num_threads=1, chunk_hits=None):
+    """
+    Function aligns reads of a chunk of read pairs in advance (see '_chunk_hits'), so that
+      gap-filling merging of the chunk runs two blastn calls instead of one or two calls per pair
+      (with the index of minimizers reads are aligned in this process, see '_align_reads').
+    Forward reads are aligned first. Reverse reads are aligned only if their forward reads
+      have multiple best hits: '_gap_filling_merging' does not need other ones.
+    Reference sequences hit by forward reads are retrieved with one blastdbcmd call
+      (see 'src.reference_store.ReferenceStore.prefetch').
+    Pairs placed before in the merging run (see '_place_pair_cached') are skipped.
+
+    :param packet: list of read pairs (see '_gap_filling_merging');
+    :type packet: list< dict<str: dict<str: str>> >;
+    :param num_threads: number of threads of blastn;
+    :type num_threads: int;
+    :param chunk_hits: best hits of reads of the chunk aligned by the calling process
+      (see '_prealigned_chunks'). If specified, reads are not aligned again;
+    :type chunk_hits: dict<str: list<AlignResult>>;
+    """
+    # Pairs placed before are not aligned again
+    packet = [fastq_recs for fastq_recs in packet if not _pair_key(fastq_recs) in _chunk_placements]
+
+    _chunk_hits.clear()
+    if chunk_hits is None:
+        _chunk_hits.update(_align_reads((fastq_recs["R1"]["seq"] for fastq_recs in packet), num_threads))
+        _chunk_hits.update(_align_reads((_rc(fastq_recs["R2"]["seq"]) for fastq_recs in _ambiguous_pairs(packet,
+            _chunk_hits)), num_threads))
+    else:
+        _chunk_hits.update(chunk_hits)
+    # end if
+
+    # References are retrieved only for hits of forward reads
+    _reference_store().prefetch(hit.sacc for fastq_recs in packet
+        for hit in (_chunk_hits[fastq_recs["R1"]["seq"]] or ()))
+# end def _blast_chunk
+
+
+def _ambiguous_pairs(packet, chunk_hits):
+    # Returns read pairs, forward reads of which have multiple best hits: their reverse reads are aligned too
+    return [fastq_recs for fastq_recs in packet
+        if not chunk_hits[fastq_recs["R1"]["seq"]] is None and len(chunk_hits[fastq_recs["R1"]["seq"]]) > 1]
+# end def _ambiguous_pairs
+
+
+async def _align_reads_async(seqs, orchestrator):
+    """
+    Coroutine aligns reads against the reference database with blastn run by the orchestrator
+      (see 'src.orchestrator'). It is the counterpart of '_align_reads' for the event loop
+      of the orchestrator: persistent cache of hits is used in the same way.
+
+    :param seqs: sequences of reads;
+    :type seqs: iterable<str>;
+    :param orchestrator: orchestrator that runs blastn;
+    :type orchestrator: SubprocessOrchestrator;
+
+    Returns dict<str: list<AlignResult>> (see '_align_reads').
+    """
+    seqs = list(dict.fromkeys(seqs))
+    hit_cache = _hit_cache()
+    align_reports = dict() if hit_cache is None else hit_cache.get_many(seqs)
+
+    missing = [seq for seq in seqs if not seq in align_reports]
+    if len(missing) != 0:
+        returncode, stdout, stderr, run_time = await orchestrator.run(_blastn_command(), _blastn_query(missing))
+        aligned = _parse_blastn_output(missing, returncode, stdout, stderr)
+        if not hit_cache is None:
+            hit_cache.put_many(aligned)
+        # end if
+        align_reports.update(aligned)
+    # end if
+    return align_reports
+# end def _align_reads_async
+
+
+async def _align_reads_once(seqs, orchestrator, run_hits, in_flight):
+    """
+    Coroutine returns best hits of reads (see '_align_reads_async'). Only reads that are neither aligned
+      before in the merging run nor being aligned for another chunk are sent to blastn.
+
+    :param seqs: sequences of reads;
+    :type seqs: iterable<str>;
+    :param orchestrator: orchestrator that runs blastn;
+    :type orchestrator: SubprocessOrchestrator;
+    :param run_hits: best hits of reads aligned before in the run (bounded LRU cache,
+      see '_PREALIGNED_HITS_SIZE'). Hits of reads aligned now are added to it;
+    :type run_hits: collections.OrderedDict<str: list<AlignResult>>;
+    :param in_flight: tasks aligning reads at the moment, by sequences of reads;
+    :type in_flight: dict<str: asyncio.Task>;
+
+    Returns dict<str: list<AlignResult>>.
+    """
+    seqs = list(dict.fromkeys(seqs))
+    hits = dict()
+    missing = list()
+    batches = set() # tasks of other chunks aligning some of the reads
+    for seq in seqs:
+        if seq in run_hits:
+            hits[seq] = run_hits[seq]
+            run_hits.move_to_end(seq)
+        elif seq in in_flight:
+            batches.add(in_flight[seq])
+        else:
+            missing.append(seq)
+        # end if
+    # end for
+
+    if len(missing) != 0:
+        batch = asyncio.get_running_loop().create_task(_align_reads_async(missing, orchestrator))
+        for seq in missing:
+            in_flight[seq] = batch
+        # end for
+
+        def store_hits(batch):
+            for seq in missing:
+                del in_flight[seq]
+            # end for
+            if not batch.cancelled() and batch.exception() is None:
+                run_hits.update(batch.result())
+                while len(run_hits) > _PREALIGNED_HITS_SIZE:
+                    run_hits.popitem(last=False) # forget the least recently used read
+                # end while
+            # end if
+        # end def store_hits
+
+        batch.add_done_callback(store_hits)
+        batches.add(batch)
+    # end if
+
+    for batch in batches:
+        aligned = await batch
+        hits.update((seq, aligned[seq]) for seq in seqs if seq in aligned)
+    # end for
+    return hits
+# end def _align_reads_once
+
+
+async def _prealign_chunk(packet, orchestrator, run_hits, in_flight):
+    # Coroutine aligns reads of a chunk as '_blast_chunk' does and returns their best hits
+    #   (see '_align_reads_once' for 'run_hits' and 'in_flight')
+    chunk_hits = await _align_reads_once((fastq_recs["R1"]["seq"] for fastq_recs in packet), orchestrator,
+        run_hits, in_flight)
+    chunk_hits.update(await _align_reads_once((_rc(fastq_recs["R2"]["seq"])
+        for fastq_recs in _ambiguous_pairs(packet, chunk_hits)), orchestrator, run_hits, in_flight))
+    return chunk_hits
+# end def _prealign_chunk
+
+
+def _prealigned_chunks(chunks, blast_jobs, hit_cache=None, max_chunks=None):
+    """
+    Function-generator aligns reads of chunks against the reference database with blastn processes run
+      by the orchestrator in this process (see 'src.orchestrator'): up to 'blast_jobs' processes run at once,
+      and alignment of next chunks goes on while this process (or workers) merge reads of previous ones.
+    Chunks are yielded in their order together with best hits of their reads, which are passed
+      to '_merge_chunk' so that it does not call blastn.
+    Best hits are kept for the whole run (see '_PREALIGNED_HITS_SIZE'), so each distinct read is sent
+      to blastn once, even if it is in many chunks.
+
+    :param chunks: chunks of read pairs (see '_merge_chunk');
+    :type chunks: iterable< list< dict<str: dict<str: str>> > >;
+    :param blast_jobs: maximum number of blastn processes running at once;
+    :type blast_jobs: int;
+    :param hit_cache: path to persistent cache of hits of reads (see 'src.hit_cache'; None -- no cache);
+    :type hit_cache: str;
+    :param max_chunks: maximum number of chunks being aligned (_PREALIGN_CHUNKS_PER_JOB per process if None);
+    :type max_chunks: int;
+
+    Yields tuples (<chunk>, <best hits of reads of the chunk: dict<str: list<AlignResult>> >).
+    Raises MergingError if blastn fails.
+    """
+    globals()["_aligner"] = "blastn"
+    globals()["_hit_cache_path"] = hit_cache
+    if max_chunks is None:
+        max_chunks = _PREALIGN_CHUNKS_PER_JOB * blast_jobs
+    # end if
+
+    orchestrator = SubprocessOrchestrator(blast_jobs)
+    aligning = deque() # (<chunk>, <future of it's hits>)
+    # Both are used by coroutines in the event loop of the orchestrator only (see '_align_reads_once')
+    run_hits = OrderedDict()
+    in_flight = dict()
+    try:
+        for chunk in chunks:
+            aligning.append((chunk, orchestrator.submit(_prealign_chunk(chunk, orchestrator, run_hits, in_flight))))
+            while len(aligning) >= max(1, max_chunks):
+                chunk, future = aligning.popleft()
+                yield (chunk, _wait_for_hits(future))
+            # end while
+        # end for
+        while len(aligning) != 0:
+            chunk, future = aligning.popleft()
+            yield (chunk, _wait_for_hits(future))
+        # end while
+    finally:
+        orchestrator.close()
+        # Run time of blastn processes is summed: they run at once, while the process waits for them
+        #   only when alignment falls behind (see '_wait_for_hits')
+        run_report.add_substage_time("blast", orchestrator.counts["wall_time"], calls=orchestrator.counts["commands"])
+        if not hit_cache is None:
+            _gap_filling_stats["hit_cache"].update(_hit_cache().pop_counts())
+        # end if
+    # end try
+# end def _prealigned_chunks
+
+
+def _wait_for_hits(future):
+    # Returns result of alignment of a chunk (see '_prealigned_chunks') and counts time spent waiting for it
+    wait_start = perf_counter()
+    chunk_hits = future.result()
+    run_report.add_wait_time("child_wait", perf_counter() - wait_start)
+    return chunk_hits
+# end def _wait_for_hits
+
+
+def _blast_read(fseq, f_id):
+    """
+    Function returns best hits of a read: aligned in advance with the chunk (see '_blast_chunk')
+      or aligned now with a blastn call of it's own (or with the index of minimizers).
+
+    :param fseq: sequence of the read;
+    :type fseq: str;
+    :param f_id: ID of the read;
+    :type f_id: str;
+
+    Returns list of AlignResult.
+    Raises NoRefAlignError if there is no significant similarity.
+    """
+    try:
+        align_report = _chunk_hits[fseq]
+    except KeyError:
+        try:
+            align_report = _align_reads((fseq,))[fseq]
+        except MergingError as err:
+            raise MergingError("{}\nID if erroneous read:\n  '{}'".format(str(err), f_id))
+        # end try
+    # end try
+
+    # If there is no significant similarity
+    if align_report is None:
         raise NoRefAlignError()
     # end if
 
@@ -178,35 +729,222 @@ def _blast_read(fseq, f_id):
 # end def _blast_read
 
 
+def _pair_key(fastq_recs):
+    # Returns key of a read pair in caches of placements: sequences of both reads as they are in FASTQ files
+    return (fastq_recs["R1"]["seq"], fastq_recs["R2"]["seq"])
+# end def _pair_key
+
+
+class _RunPlacements:
+    """
+    Class _RunPlacements is dedicated to dereplicate read pairs of a merging run in the process
+      that reads them (the main process), so that each distinct pair (equal sequences of both reads)
+      is placed on a reference sequence once per run, whatever the number of workers is.
+      Placement of a pair is passed to '_merge_chunk' together with it's later copies (see '_place_pair_cached').
+    Placements are kept in bounded LRU cache of up to _PLACEMENT_CACHE_SIZE pairs.
+
+    :method split: returns placements of pairs of a chunk placed before and copies waiting for placement;
+    :method done: stores placements made for a chunk;
+    """
+
+    def __init__(self):
+        self._placements = OrderedDict()
+        self._pending = set() # keys of pairs being placed with chunks which are not merged yet
+    # end def __init__
+
+    def split(self, chunk):
+        """
+        Function is called for each chunk of the run in turn before the chunk is merged.
+        Pairs that are neither placed before nor being placed are marked as being placed with the chunk.
+
+        :param chunk: list of read pairs;
+        :type chunk: list< dict<str: dict<str: str>> >;
+
+        Returns tuple (<placements of pairs of the chunk placed before: dict<tuple<str, str>: object>>,
+          <indices of pairs being placed with an earlier chunk: set<int>>,
+          <keys of pairs to be placed with the chunk: set<tuple<str, str>>>).
+        Pairs waiting for an earlier chunk should be merged after it (see '_parallel_merging').
+        """
+        known = dict()
+        waiting = set()
+        new_keys = set()
+        for i, fastq_recs in enumerate(chunk):
+            key = _pair_key(fastq_recs)
+            if key in self._placements:
+                known[key] = self._placements[key]
+                self._placements.move_to_end(key)
+            elif key in self._pending and not key in new_keys:
+                waiting.add(i)
+            else:
+                new_keys.add(key)
+            # end if
+        # end for
+        self._pending.update(new_keys)
+        return (known, waiting, new_keys)
+    # end def split
+
+    def done(self, new_keys, placed):
+        """
+        Function stores placements made for a chunk.
+
+        :param new_keys: keys of pairs to be placed with the chunk (see 'split');
+        :type new_keys: set<tuple<str, str>>;
+        :param placed: placements made for the chunk;
+        :type placed: dict<tuple<str, str>: object>;
+        """
+        self._pending.difference_update(new_keys)
+        self._placements.update(placed)
+        while len(self._placements) > _PLACEMENT_CACHE_SIZE:
+            self._placements.popitem(last=False) # forget the least recently used pair
+        # end while
+    # end def done
+# end class _RunPlacements
+
+
+def _merge_chunk_dereplicated(merging_function, chunk, run_placements, *args, **kwargs):
+    """
+    Function merges a chunk of read pairs in the calling process (see '_merge_chunk'): pairs placed
+      before in the merging run are not placed again, and placements made for the chunk are kept
+      for next chunks.
+
+    :param run_placements: placements of the merging run;
+    :type run_placements: _RunPlacements;
+    Other arguments are passed to '_merge_chunk'.
+
+    Returns list of values returned by 'merging_function' in order of 'chunk'.
+    """
+    placements, waiting, new_keys = run_placements.split(chunk)
+    try:
+        return _merge_chunk(merging_function, chunk, *args, placements=placements, **kwargs)
+    finally:
+        run_placements.done(new_keys, {key: placements[key] for key in new_keys if key in placements})
+    # end try
+# end def _merge_chunk_dereplicated
+
+
+def _reference_store():
+    # Returns store of reference sequences of the current process (see 'src.reference_store')
+    return executor.warm_state(("references", _blast_fmt_db),
+        lambda: ReferenceStore(_REF_CACHE_SIZE, _fetch_references, _rc))
+# end def _reference_store
+
+
 def _retrieve_reference(acc, sstrand=False):
 
-    # Retrieve reference sequence
-    cmd_for_blastbdcmd = "blastdbcmd -db {} -entry {}".format(_blast_fmt_db, acc)
-    # cmd_for_blastbdcmd = _draft_cmd_for_blastdbcmd.replace("REPLACE_ME", faref_report[SACC])
+    # Turn sequence around if forward read has aligned to minus-strand
+    # if faref_report[SSTRAND] == "minus":
+    return _reference_store().get(acc, bool(sstrand))
+
+# def _retrieve_reference
+
+
+def _open_packed_references():
+    # Returns packed store of reference sequences (see 'src.packed_references') or None if it is not built
+    try:
+        return PackedReferences(_blast_fmt_db)
+    except (OSError, ValueError):
+        return None
+    # end try
+# end def _open_packed_references
+
+
+def _fetch_references(accs):
+    """
+    Function retrieves reference sequences from packed store built by 'configure_Silva_db.sh'
+      (see 'src.packed_references'). Packed store is memory-mapped, so no process is spawned and
+      all workers share it through the page cache. Sequences that are not in packed store
+      (or all of them, if it is not built) are retrieved with blastdbcmd.
+    If the alignment server is used, sequences are retrieved from it.
+
+    :param accs: accessions;
+    :type accs: list<str>;
+
+    Returns dict<str: tuple<str, str>> -- accession to (<sequence ID>, <sequence>).
+    """
+    if not _align_server_path is None:
+        return _server_references(accs)
+    # end if
+    packed_references = executor.warm_state(("packed_references", _blast_fmt_db), _open_packed_references)
+    if packed_references is None:
+        return _blastdbcmd_entries(accs)
+    # end if
+
+    references = dict()
+    missing = list()
+    packed_start = perf_counter()
+    for acc in accs:
+        sbjct_seq = packed_references.get(acc)
+        if sbjct_seq is None:
+            missing.append(acc)
+        else:
+            references[acc] = (acc, sbjct_seq)
+        # end if
+    # end for
+    run_report.add_substage_time("packed_references", perf_counter() - packed_start, calls=len(accs))
+
+    if len(missing) != 0:
+        references.update(_blastdbcmd_entries(missing))
+    # end if
+    return references
+# end def _fetch_references
+
+
+def _server_references(accs):
+    # Function retrieves reference sequences kept by the alignment server (see '_fetch_references')
+    server_start = perf_counter()
+    try:
+        references = _align_server().references(accs)
+    except (OSError, RuntimeError) as err:
+        raise MergingError("error while retrieving reference sequences from alignment server '{}'.\n{}"
+            .format(_align_server_path, str(err)))
+    # end try
+    run_report.add_substage_time("align_server", perf_counter() - server_start, calls=len(accs), child=True)
+    return references
+# end def _server_references
+
+
+def _blastdbcmd_entries(accs):
+    """
+    Function retrieves reference sequences from BLAST database with one blastdbcmd call
+      (accessions are passed to '-entry_batch' through stdin).
+
+    :param accs: accessions;
+    :type accs: list<str>;
+
+    Returns dict<str: tuple<str, str>> -- accession to (<sequence ID>, <sequence>).
+    """
+
+    # Retrieve reference sequences
+    cmd_for_blastbdcmd = "blastdbcmd -db {} -entry_batch -".format(_blast_fmt_db)
+
+    blastdbcmd_start = perf_counter()
+    pipe = sp_Popen(cmd_for_blastbdcmd, shell=True, stdout=sp_PIPE, stderr=sp_PIPE, stdin=sp_PIPE)
+    stdout_stderr = pipe.communicate(bytes("\n".join(accs) + "\n", "utf-8"))
+    run_report.add_substage_time("blastdbcmd", perf_counter() - blastdbcmd_start, child=True)
 
-    pipe = sp_Popen(cmd_for_blastbdcmd, shell=True, stdout=sp_PIPE, stderr=sp_PIPE)
-    stdout_stderr = pipe.communicate()
-    
     exit_code = pipe.returncode
     if exit_code != 0:
-        print_error("error while retrieving reference sequence from blast database")
-        print(stdout_stderr[1].decode("utf-8"))
-        sys.exit(exit_code)
+        raise MergingError("error while retrieving reference sequence from blast database (exit code {}).\n{}"
+            .format(exit_code, stdout_stderr[1].decode("utf-8")))
     # end if
 
-    sbjct_fasta_lines = stdout_stderr[0].decode("utf-8").splitlines()
-    sbjct_seq_id = sbjct_fasta_lines[0].strip() # get seq id
-    sbjct_seq = "".join(sbjct_fasta_lines[1:]) # get sequence itself
-
-    # Turn sequence around if forward read has aligned to minus-strand
-    # if faref_report[SSTRAND] == "minus":
-    if not sstrand:
-        sbjct_seq = _rc(sbjct_seq)
+    # Records are printed in order of accessions
+    records = stdout_stderr[0].decode("utf-8").split('>')[1:]
+    if len(records) != len(accs):
+        raise MergingError("blastdbcmd has returned {} sequences instead of {}.\n{}"
+            .format(len(records), len(accs), stdout_stderr[1].decode("utf-8")))
     # end if
 
-    return (sbjct_seq_id.partition(' ')[0][1:], sbjct_seq)
+    references = dict()
+    for acc, record in zip(accs, records):
+        sbjct_fasta_lines = record.splitlines()
+        sbjct_seq_id = sbjct_fasta_lines[0].strip() # get seq id
+        sbjct_seq = "".join(sbjct_fasta_lines[1:]) # get sequence itself
+        references[acc] = (sbjct_seq_id.partition(' ')[0], sbjct_seq)
+    # end for
 
-# def _retrieve_reference
+    return references
+# end def _blastdbcmd_entries
 
 
 def _handle_unforseen_case(f_id, fseq, r_id, rseq):
@@ -276,6 +1014,41 @@ def get_first_element(x):
 # end def get_first_element
 
 
+def _count_outcome(outcome, gap_len=None):
+    # Function counts outcome of gap-filling merging of a read pair in statistics of the current process
+    _gap_filling_stats["outcomes"][outcome] += 1
+    if not gap_len is None:
+        _gap_filling_stats["gap_lengths"][gap_len] += 1
+    # end if
+# end def _count_outcome
+
+
+def pop_gap_filling_stats():
+    """
+    Function returns statistics of gap-filling merging collected by the current process
+      (see '_gap_filling_stats') and resets them.
+    It is meant to be called at the end of a task of a pool worker: the result should be passed
+      to the main process and then to 'add_gap_filling_stats' function.
+    """
+    stats = {key: Counter(counter) for key, counter in _gap_filling_stats.items()}
+    for counter in _gap_filling_stats.values():
+        counter.clear()
+    # end for
+    return stats
+# end def pop_gap_filling_stats
+
+
+def add_gap_filling_stats(stats):
+    """
+    Function adds statistics returned by 'pop_gap_filling_stats' (e.g. in a worker)
+      to statistics of the current process.
+    """
+    for key, counter in stats.items():
+        _gap_filling_stats[key].update(counter)
+    # end for
+# end def add_gap_filling_stats
+
+
 def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_frac):
     """
     The second of the "kernel" functions in this module. Performs gap-filling process of read merging.
@@ -306,10 +1079,8 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
     len_rseq = len(rseq)
 
     if len_fseq != len(fqual) or len_rseq != len(rqual):
-        print("\n\nInvalid FASTQ format!\a")
-        print("Lengths of the sequence and the quality line are unequal")
-        print("ID if this read: '{}'".format(f_id))
-        sys.exit(1)
+        raise FastqError("Invalid FASTQ format! Lengths of the sequence and the quality line are unequal.\nID if this read: '{}'"
+            .format(f_id))
     # end if
 
 
@@ -321,27 +1092,92 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
     # # end if
 
 
+    # === Place the pair on a reference sequence: once per unique pair ===
+    placement = _place_pair_cached(fseq, rseq, f_id, r_id, fastq_recs["R2"]["seq"])
+    if placement is None:
+        _count_outcome("no_hit")
+        return 1, None
+    # end if
+
+    # Merged sequence and qualities are made from qualities of this very pair
+    faref_hit, raref_hit = placement
+    return _try_merge(faref_hit, raref_hit, fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset)
+# end def _gap_filling_merging
+
+
+def _place_pair_cached(fseq, rseq, f_id, r_id, raw_rseq):
+    """
+    Function places a read pair on a reference sequence (see '_place_pair') unless the pair is placed
+      before: placements of pairs placed before in the merging run are passed with the chunk
+      (see '_RunPlacements'), and copies of a pair in the same chunk are placed once.
+    Placement depends on sequences only, so it is shared by all copies of a pair, while
+      qualities of each copy are used for merging (see '_try_merge').
+
+    :param fseq: sequence of the forward read;
+    :type fseq: str;
+    :param rseq: reverse-complement sequence of the reverse read;
+    :type rseq: str;
+    :param f_id: ID of the forward read;
+    :type f_id: str;
+    :param r_id: ID of the reverse read;
+    :type r_id: str;
+    :param raw_rseq: sequence of the reverse read as it is in FASTQ file;
+    :type raw_rseq: str;
+
+    Returns value returned by '_place_pair'.
+    """
+    key = (fseq, raw_rseq)
+    try:
+        return _chunk_placements[key]
+    except KeyError:
+        placement = _place_pair(fseq, rseq, f_id, r_id)
+        _chunk_placements[key] = placement
+        _gap_filling_stats["dereplication"]["placed_pairs"] += 1
+        return placement
+    # end try
+# end def _place_pair_cached
+
+
+def _place_pair(fseq, rseq, f_id, r_id):
+    """
+    Function places a read pair on a reference sequence: it finds hits of both reads
+      on the same reference, according to which the reads are merged.
+
+    :param fseq: sequence of the forward read;
+    :type fseq: str;
+    :param rseq: reverse-complement sequence of the reverse read;
+    :type rseq: str;
+    :param f_id: ID of the forward read;
+    :type f_id: str;
+    :param r_id: ID of the reverse read;
+    :type r_id: str;
+
+    Returns tuple (<hit of the forward read>, <hit of the reverse read>)
+      or None if a read has no hit in the reference database.
+    """
+
     # === Blast forward read, align reverse read against the reference ===
     # "faref" means Forward [read] Against REFerence [sequence]
     try:
         faref_report = _blast_read(fseq, f_id)
     except NoRefAlignError:
-        return 1, None
+        return None
     # end try
 
     if len(faref_report) == 1:
-        # If forward read has single best hit -- retrieve this reference and merge reads
+        # If forward read has single best hit -- retrieve this reference and place reads
 
         faref_report = faref_report[0]
 
         # Retrieve refernce
         sbjct_id, sbjct_seq = _retrieve_reference(faref_report.sacc, faref_report.sstrand)
         # Align reverse read against reference
+        sw_start = perf_counter()
         raref_report = SW_align(rseq, sbjct_seq, sbjct_id)
+        run_report.add_substage_time("sw_align", perf_counter() - sw_start)
 
-        # Merge
-        return _try_merge(faref_report, raref_report,
-            fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset)
+        # Place
+        return (faref_report, raref_report)
 
     else:
         # If there are multiple best hits for forward read -- blast reverse read
@@ -350,7 +1186,7 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
         try:
             raref_report = _blast_read(rseq, r_id)
         except NoRefAlignError:
-            return 1, None
+            return None
         # end try
 
         # Find common best hits for forward and reverse reads
@@ -370,7 +1206,9 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
             rafbhs_reports = list()
             for hit in faref_report:
                 sbjct_id, sbjct_seq = _retrieve_reference(hit.sacc, hit.sacc) # retrieve
+                sw_start = perf_counter()
                 rafbhs_reports.append( SW_align(rseq, sbjct_seq, sbjct_id) ) # align
+                run_report.add_substage_time("sw_align", perf_counter() - sw_start)
             # end for
 
             # Find the best alignment
@@ -385,8 +1223,7 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
                 # Find hit wit hthis score
                 best_faref_hit = next(filter( lambda x: x.sacc == best_rafbhs_sacc, faref_report ))
 
-                return _try_merge(best_faref_hit, best_rafbhs_hits[0],
-                    fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset)
+                return (best_faref_hit, best_rafbhs_hits[0])
             else:
                 # If there are nultiple best alignments -- find alignment with minimum number of gaps
                 min_gaps = min(map( get_gaps, best_rafbhs_hits )) # get min gap number
@@ -396,8 +1233,7 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
                 if len(min_gaps_rafbhs_hits) == 1:
                     # If there are single hit with min number of gaps -- use if and merge reads
                     min_gaps_faref_hit = next(filter( select_min_gaps, faref_report ))
-                    return _try_merge(faref_report, min_gaps_rafbhs_hits[0],
-                        fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset)
+                    return (faref_report, min_gaps_rafbhs_hits[0])
                 else:
                     # If there are multiple alignments with num number of gaps -- 
                     #   just select reference with lexicographically minimal accession number
@@ -411,9 +1247,8 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
                     lexgraph_min_faref_hit = next(filter(find_sacc, faref_report))
                     lexgraph_min_raref_hit = next(filter(find_sacc, min_gaps_rafbhs_hits))
 
-                    # Merge
-                    return _try_merge(lexgraph_min_faref_hit, lexgraph_min_raref_hit,
-                        fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset)
+                    # Place
+                    return (lexgraph_min_faref_hit, lexgraph_min_raref_hit)
                 # end if
             # end if
 
@@ -429,9 +1264,8 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
             common_hit_faref_report = next(filter( select_common, faref_report ))
             common_hit_raref_report = next(filter( select_common, raref_report ))
 
-            # Merge
-            return _try_merge(common_hit_faref_report, common_hit_raref_report,
-                fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset)
+            # Place
+            return (common_hit_faref_report, common_hit_raref_report)
 
         else:
             # If there are multiple common best hits for forward and reverse read --
@@ -468,9 +1302,8 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
                 min_gaps_faref_report = next(filter( select_min_gaps_report, common_hit_faref_report ))
                 min_gaps_raref_report = next(filter( select_min_gaps_report, common_hit_raref_report ))
 
-                # Merge
-                return _try_merge(min_gaps_faref_report, min_gaps_raref_report,
-                    fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset)
+                # Place
+                return (min_gaps_faref_report, min_gaps_raref_report)
 
             else:
                 # If there are nultiple alignments with num number of gaps -- 
@@ -485,13 +1318,12 @@ def _gap_filling_merging(fastq_recs, phred_offset, num_N, min_overlap, mismatch_
                 lexgraph_faref_min_hit = next(filter( find_sacc, common_hit_faref_report ))
                 lexgraph_raref_min_hit = next(filter( find_sacc, common_hit_raref_report ))
 
-                # Merge
-                return _try_merge(lexgraph_faref_min_hit, lexgraph_raref_min_hit,
-                    fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset)
+                # Place
+                return (lexgraph_faref_min_hit, lexgraph_raref_min_hit)
             # end if
         # end if
     # end if
-# end def _gap_filling_merging
+# end def _place_pair
 
 
 def _try_merge(faref_report, raref_report, fseq, rseq, fqual, rqual, min_overlap, num_N, phred_offset):
@@ -507,6 +1339,7 @@ def _try_merge(faref_report, raref_report, fseq, rseq, fqual, rqual, min_overlap
 
     if forw_end > rev_end:
         # Dovetailed read pair
+        _count_outcome("dovetailed")
         return 1, None
     # end if
 
@@ -514,6 +1347,7 @@ def _try_merge(faref_report, raref_report, fseq, rseq, fqual, rqual, min_overlap
 
     # Overlap region is long enough
     if not gap and forw_end - rev_start > min_overlap:
+        _count_outcome("long_overlap")
         return 1, None
 
     # Length of the overlapping region is short,
@@ -524,6 +1358,7 @@ def _try_merge(faref_report, raref_report, fseq, rseq, fqual, rqual, min_overlap
         overl = len(fseq) - loffset
         merged_seq, merged_qual = _merge_by_overlap(loffset, overl, fseq, fqual, rseq, rqual, phred_offset)
 
+        _count_outcome("merged_short_overlap")
         return 0, {"seq": merged_seq, "qual_str": merged_qual}
 
     # Here we have a gap.
@@ -532,6 +1367,7 @@ def _try_merge(faref_report, raref_report, fseq, rseq, fqual, rqual, min_overlap
         gap_len = rev_start - forw_end
         # If gap is too long -- discard this pair.
         if gap_len > num_N:
+            _count_outcome("gap_too_long", gap_len)
             return 1, None
         
         else:
@@ -539,17 +1375,19 @@ def _try_merge(faref_report, raref_report, fseq, rseq, fqual, rqual, min_overlap
             merged_seq = fseq + 'N' * gap_len + rseq
             merged_qual = fqual + chr(phred_offset+3) * gap_len + rqual
 
+            _count_outcome("merged_gap", gap_len)
             return 0, {"seq": merged_seq, "qual_str": merged_qual}
         # end if
     # end if
 
     # === Unforseen case. This code should not be ran. But if it does-- report about it. ===
     _handle_unforseen_case(f_id, fseq, r_id, rseq)
+    _count_outcome("unforeseen")
     return 3, None
 # end def _try_merge
 
 
-def _handle_merge_pair_result(merging_result, fastq_recs, result_files, merged_strs, second_step=False):
+def _handle_merge_pair_result(merging_result, fastq_recs, result_files, merged_strs):
     """
     This function handles the result of read merging and writes sequences in corresponding files.
 
@@ -564,8 +1402,7 @@ def _handle_merge_pair_result(merging_result, fastq_recs, result_files, merged_s
     if merging_result == 0:
 
         if merged_strs is None:
-            print("Fatal error 77. Please, contact the developer.")
-            sys.exit(77)
+            raise MergingError("Fatal error 77. Please, contact the developer.")
         # end if
 
         merged_rec = {
@@ -575,83 +1412,29 @@ def _handle_merge_pair_result(merging_result, fastq_recs, result_files, merged_s
             "qual_str": merged_strs["qual_str"]
         }
         write_fastq_record(result_files["merg"], merged_rec)
-        _merging_stats[merging_result] += 1
-        if second_step:
-            _merging_stats[1] -= 1
-        # end if
         return 0
     
     # can't merge reads
     elif merging_result == 1:
         write_fastq_record(result_files["umR1"], fastq_recs["R1"])
         write_fastq_record(result_files["umR2"], fastq_recs["R2"])
-        if not second_step:
-            _merging_stats[merging_result] += 1
-        # end if
-        
         return 1
     
     # if unforseen situation occured in 'read_merging_16S'
     elif merging_result == 3:
-        close_files(result_files)
-        input("Press ENTER to exit:")
-        sys.exit(1)
+        raise MergingError("Read merging crashed on an unforseen case. Please contact the developer.")
     
     # if 'read_merging_16S' returnes something unexpected and undesigned
     else:
-        print("ERROR!!!\n\tModule that was merging reads returned an unexpected and undesigned value.")
-        print("\tHere it is: {}".format(str(merging_result)))
-        
-        print("Please, contact the developer.")
-        close_files(read_files, result_files)
-        input("Press ENTER to exit:")
-        sys.exit(1)
+        raise MergingError("Module that was merging reads returned an unexpected and undesigned value: {}.\nPlease, contact the developer."
+            .format(str(merging_result)))
     # end if
 # end def _handle_merge_pair_result
 
 
-def _proc_init(print_lock_buff, counter_buff, count_lock_buff, write_lock_buff,
-    result_files_buff,_merging_stats_buff):
-    """
-    Function that initializes global variables that all processes shoud have access to.
-    This function is meant to be passed as 'initializer' argument to 'multiprocessing.Pool' function.
-
-    :param print_lock_buff: lock that synchronizes printing to the console;
-    :type print_lock_buff: multiprocessing.Lock;
-    :param counter_buff: integer number representing number of processed reads;
-    :type counter_buff: multiprocessing.Value;
-    :param count_lock_buff: lock that synchronizes incrementing 'counter' variable;
-    :type count_lock_buff: multiprocessing.Lock;
-    :param write_lock_buff: lock that synchronizes writing to result files;
-    :type write_lock_buff: multiprocessing.Lock;
-    :param result_paths_buff: dictionary of paths to result files;
-    :type result_paths_buff: dict<str: str>;
-    :param _merging_stats_buff: array of values in which merging result statistics will be stored;
-    :type _merging_stats_buff: multiprocessing.Array<int>;
-    """
-
-    global print_lock
-    print_lock = print_lock_buff
-
-    global counter
-    counter = counter_buff
-
-    global count_lock
-    count_lock = count_lock_buff
-
-    global write_lock
-    write_lock = write_lock_buff
-
-    global result_files
-    result_files = result_files_buff
-
-    global _merging_stats
-    _merging_stats = _merging_stats_buff
-# end def _proc_init
-
-
 def _one_thread_merging(merging_function, read_paths, wmode,
-    result_paths, second_step, num_N, min_overlap, mismatch_frac, delay=1, phred_offset=33):
+    result_paths, num_N, min_overlap, mismatch_frac, phred_offset=33, aligner="blastn", hit_cache=None,
+    blast_jobs=None, align_server=None):
     """
     Function launches one-thread merging.
     
@@ -662,11 +1445,21 @@ def _one_thread_merging(merging_function, read_paths, wmode,
     :type wmode: str;
     :param result_paths: dict of paths to read files;
     :type result_paths: dict<str: str>;
-    :param second_step: flag that is True if gap-filling merging is performing;
-    :type second_step: bool;
-    :param delay: number of reads that will be processed silently.
-        I.e. status bar will be updated every 'delay' reads;
-    :type delay: int;
+    :param aligner: aligner that places reads on reference sequences (see 'ALIGNERS');
+    :type aligner: str;
+    :param hit_cache: path to persistent cache of hits of reads (see 'src.hit_cache'; None -- no cache);
+    :type hit_cache: str;
+    :param blast_jobs: number of blastn processes that align reads of next chunks while this process
+      merges reads (see '_prealigned_chunks'; None -- one blastn call at a time, made by '_merge_chunk').
+      It is ignored if the aligner is not blastn or the alignment server is used;
+    :type blast_jobs: int;
+    :param align_server: path to socket of the alignment server (see 'src.alignment_server';
+      None -- reads are aligned by this process);
+    :type align_server: str;
+
+    Reads are processed in chunks of '_BLAST_CHUNK_SIZE' read pairs (see '_merge_chunk').
+    Statistics of merging are collected by the calling process (see 'pop_gap_filling_stats').
+    Each distinct read pair is placed on a reference sequence once (see '_RunPlacements').
     """
 
     # Collect some info
@@ -679,42 +1472,46 @@ def _one_thread_merging(merging_function, read_paths, wmode,
     read_files = open_files(read_paths, how_to_open)
     result_files = open_files(result_paths, how_to_open, wmode)
 
+    chunks = ([read_fastq_pair(read_files, actual_format_func) for j in range(min(_BLAST_CHUNK_SIZE, read_pairs_num - i))]
+        for i in range(0, read_pairs_num, _BLAST_CHUNK_SIZE))
+    if blast_jobs is None or aligner != "blastn" or not align_server is None:
+        chunks = ((chunk, None) for chunk in chunks)
+    else:
+        chunks = _prealigned_chunks(chunks, blast_jobs, hit_cache)
+    # end if
+    run_placements = _RunPlacements()
+
     # Proceed
-    reads_processed, i = 0, 0
     try:
-        readnum_digits = math.ceil(math.log(read_pairs_num, 10))
-    except ValueError: # catch log(1)
-        readnum_digits = 1
+        with progress.ProgressReporter(read_pairs_num):
+            for chunk, chunk_hits in chunks:
+
+                merge_res_list = _merge_chunk_dereplicated(merging_function, chunk, run_placements, phred_offset,
+                    num_N, min_overlap, mismatch_frac, aligner=aligner, hit_cache=hit_cache, chunk_hits=chunk_hits,
+                    align_server=align_server)
+                write_start = perf_counter()
+                for fastq_recs, (merging_result, merged_strs) in zip(chunk, merge_res_list):
+                    _handle_merge_pair_result(merging_result, fastq_recs, result_files, merged_strs)
+                # end for
+                run_report.add_substage_time("writing", perf_counter() - write_start)
+                executor.add_progress(len(chunk))
+            # end for
+        # end with
+    finally:
+        chunks.close()
+        close_files(read_files, result_files)
     # end try
-    bar_len = min(50, os.get_terminal_size().columns - (11+2*readnum_digits))
-    while reads_processed < read_pairs_num:
-
-        fastq_recs = read_fastq_pair(read_files, actual_format_func)
-
-        merging_result, merged_strs = merging_function(fastq_recs, phred_offset, num_N, min_overlap, mismatch_frac)
-        _handle_merge_pair_result(merging_result, fastq_recs, result_files, merged_strs, second_step=second_step)
-        reads_processed += 1
-        i += 1
-
-        if i == delay:
-            bar_len = min(50, os.get_terminal_size().columns - (11+2*readnum_digits))
-            eqs = int( bar_len*(reads_processed / read_pairs_num) ) # number of '=' characters
-            spaces = bar_len - eqs # number of ' ' characters
-            printn("\r[" + "="*eqs + '>' + ' '*spaces +"] {}% ({}/{})".format(int(reads_processed/read_pairs_num*100),
-                reads_processed, read_pairs_num))
-            i = 0
-        # end if
-    # end while
-    print("\r[" + "="*bar_len + "]" + "  100% ({}/{})\n\n"
-        .format(reads_processed, read_pairs_num))
-    close_files(read_files, result_files)
 # end def _one_thread_merging
 
 
 def _parallel_merging(merging_function, read_paths, result_paths, n_thr,
-    second_step, num_N, min_overlap, mismatch_frac, delay=5, max_unwr_size=10, phred_offset=33):
+    num_N, min_overlap, mismatch_frac, packet_size=_BLAST_CHUNK_SIZE, phred_offset=33, aligner="blastn",
+    hit_cache=None, blast_jobs=None, align_server=None):
     """
-    Function launches parallel read merging.
+    Function launches parallel read merging in the shared pool of processes (see 'src/executor.py').
+    Read pairs are sent to workers in packets tagged with sequence numbers. Workers only merge reads;
+      the calling process writes results in input order, so that result files are the same
+      as after one-thread merging.
 
     :param merging_function: function that will be applied to reads;
     :param read_paths: dict of paths to read files. it's structure is described in 'src.fastq.fastq_read_packets' function;
@@ -723,142 +1520,195 @@ def _parallel_merging(merging_function, read_paths, result_paths, n_thr,
     :type result_paths: dict<str: str>;
     :param n_thr: int;
     :type n_thr: int:
-    :param second_step: flag that is True if gap-filling merging is performing;
-    :type second_step: bool;
-    :param delay: number of reads that will be processed silently.
-        I.e. status bar will be updated every 'delay' reads;
-    :type delay: int;
-    :param max_unwr_size: procesed reads will be written to result files every time next 'max_unwr_size'
-        reads are processed;
-    :type max_unwr_size: int;
+    :param packet_size: number of read pairs in one task of a worker (and in one blastn call, see '_merge_chunk').
+        Packets are made smaller if there are too few reads to give every worker a packet;
+    :type packet_size: int;
+    :param aligner: aligner that places reads on reference sequences (see 'ALIGNERS');
+    :type aligner: str;
+    :param hit_cache: path to persistent cache of hits of reads (see 'src.hit_cache'; None -- no cache);
+    :type hit_cache: str;
+    :param blast_jobs: number of blastn processes run by this process (see '_prealigned_chunks'):
+      reads of packets are aligned before packets are sent to workers, and workers only merge reads.
+      If None, each worker aligns reads of it's packets itself. It is ignored if the aligner is not blastn
+      or the alignment server is used;
+    :type blast_jobs: int;
+    :param align_server: path to socket of the alignment server (see 'src.alignment_server';
+      None -- reads are aligned by workers). Each worker connects to the server;
+    :type align_server: str;
+
+    Returns list of sub-stage timers collected in worker processes (see 'src.run_report.pop_substage_timers').
+    Statistics of merging collected in worker processes are added to statistics of the calling process
+      (see 'add_gap_filling_stats').
+    Read pairs are dereplicated by the calling process (see '_RunPlacements'): each distinct pair is placed
+      by the worker that gets it's first copy, and it's placement is sent to workers together with later copies.
+      Copies read while the first one is being placed are merged by the calling process as soon as
+      the placement comes back.
     """
-    
-    print_lock = mp.Lock() # lock that synchronizes printing to the console;
-    write_lock = mp.Lock() # lock that synchronizes writing to result files;
-    counter = mp.Value('i', 0) # integer number representing number of processed reads;
-    count_lock = mp.Lock() # lock that synchronizes 'counter' variable incrementing;
-    sync_merg_stats = mp.Array('i', 3)
-    for i in range(len(_merging_stats.values())):
-        sync_merg_stats[i] = _merging_stats[i]
-    # end for
 
     how_to_open = OPEN_FUNCS[ get_archv_fmt_indx(read_paths["R1"]) ]
+    actual_format_func = FORMATTING_FUNCS[ get_archv_fmt_indx(read_paths["R1"]) ]
 
     reads_at_all = int( sum(1 for line in how_to_open(read_paths["R1"])) / 4 )
 
-    # Open result files
-    result_files = dict()
-    for key, path in result_paths.items():
-        result_files[key] = open(path, 'a')
-    # end for
-
-    pool = mp.Pool(n_thr, initializer=_proc_init,
-        initargs=(print_lock, counter, count_lock, write_lock, result_files, sync_merg_stats))
-    pool.starmap(_single_merger,
-        [(merging_function, data, reads_at_all, second_step, delay, max_unwr_size, phred_offset,
-            num_N, min_overlap, mismatch_frac)
-        for data in fastq_read_packets(read_paths, reads_at_all, n_thr)])
-
-    # Reaping zombies
-    pool.close()
-    pool.join()
+    # Packets are kept here until their results are written:
+    #   (<packet>, <pairs sent to a worker>, <indices of pairs waiting for placement>, <keys of pairs placed with it>)
+    sent_packets = deque()
+    packet_size = max(1, min(packet_size, -(-reads_at_all // n_thr)))
+    packet_size, max_pending = executor.packet_plan(packet_size, n_thr)
+    run_placements = _RunPlacements()
+
+    def packets(read_files):
+        while True:
+            packet = list()
+            for i in range(packet_size):
+                fastq_recs = read_fastq_pair(read_files, actual_format_func)
+                if fastq_recs is None:
+                    break
+                # end if
+                packet.append(fastq_recs)
+            # end for
+            if len(packet) == 0:
+                return
+            # end if
+            yield packet
+        # end while
+    # end def packets
 
-    close_files(result_files)
+    def tasks(read_files):
+        if blast_jobs is None or aligner != "blastn" or not align_server is None:
+            prealigned = ((packet, None) for packet in packets(read_files))
+        else:
+            # Packets being aligned are held in memory too: their number is limited by the memory budget
+            prealigned = _prealigned_chunks(packets(read_files), blast_jobs, hit_cache,
+                executor.packet_plan(packet_size, blast_jobs)[1])
+        # end if
+        try:
+            for packet, chunk_hits in prealigned:
+                placements, waiting, new_keys = run_placements.split(packet)
+                sent = [fastq_recs for i, fastq_recs in enumerate(packet) if not i in waiting]
+                sent_packets.append((packet, sent, waiting, new_keys))
+                yield (merging_function, sent, phred_offset, num_N, min_overlap, mismatch_frac, aligner, hit_cache,
+                    chunk_hits, align_server, placements)
+            # end for
+        finally:
+            prealigned.close()
+        # end try
+    # end def tasks
 
-    globals()["_merging_stats"] = {
-        0: sync_merg_stats[0],
-        1: sync_merg_stats[1]
-    }
+    substage_timers = list()
+    read_files = open_files(read_paths, how_to_open)
+    result_files = open_files(result_paths, open, 'a')
+    try:
+        with progress.ProgressReporter(reads_at_all):
+            for merge_res_list, timers, stats, placed in executor.imap("gap_filling", _merge_packet,
+                    tasks(read_files), n_thr, max_pending):
+                packet, sent, waiting, new_keys = sent_packets.popleft()
+                run_placements.done(new_keys, {_pair_key(sent[i]): placement for i, placement in placed.items()})
+                if len(waiting) != 0:
+                    # Pairs placed with earlier packets are merged here: their placements have come back
+                    waiting_res_list = iter(_merge_chunk_dereplicated(merging_function,
+                        [packet[i] for i in sorted(waiting)], run_placements, phred_offset, num_N, min_overlap,
+                        mismatch_frac, aligner=aligner, hit_cache=hit_cache, align_server=align_server))
+                    sent_res_list = iter(merge_res_list)
+                    merge_res_list = [next(waiting_res_list) if i in waiting else next(sent_res_list)
+                        for i in range(len(packet))]
+                # end if
+                write_start = perf_counter()
+                for fastq_recs, (merging_result, merged_strs) in zip(packet, merge_res_list):
+                    _handle_merge_pair_result(merging_result, fastq_recs, result_files, merged_strs)
+                # end for
+                run_report.add_substage_time("writing", perf_counter() - write_start)
+                substage_timers.append(timers)
+                add_gap_filling_stats(stats)
+                executor.add_progress(len(packet))
+            # end for
+        # end with
+    finally:
+        close_files(read_files, result_files)
+    # end try
 
-    print("\r["+"="*50+"] 100% ({}/{})\n".format(reads_at_all, reads_at_all))
+    return substage_timers
 # end def _parallel_merging
 
 
-
-def _single_merger(merging_function, data, reads_at_all, second_step,
-    delay, max_unwr_size, phred_offset,
-    num_N, min_overlap, mismatch_frac):
+def _merge_chunk(merging_function, chunk, phred_offset, num_N, min_overlap, mismatch_frac, num_threads=1,
+    aligner="blastn", hit_cache=None, chunk_hits=None, align_server=None, placements=None):
     """
-    Function that performs task meant to be done by one process while parallel gap-filling read merging.
-
-    :param data: list of FASTQ-records
-        (structure of these records is described in 'write_fastq_record' function);
-    :type data: list< dict<str: str> >;
-    :param reads_at_all: total number of read pairs in input files;
-    :type reads_at_all: int;
-    :param second_step: flag that is True if gap-filling merging is performing;
-    :type second_step: bool;
-    :param delay: number of reads that will be processed silently.
-        I.e. status bar will be updated every 'delay' reads;
-    :type delay: int;
-    :param max_unwr_size: procesed reads will be written to result files every time next 'max_unwr_size'
-        reads are processed;
-    :type max_unwr_size: int;
+    Function merges a chunk of read pairs. Reads of the chunk are aligned against the reference database
+      in advance with two blastn calls (see '_blast_chunk'), then 'merging_function' is applied to each pair.
+
+    :param chunk: list of read pairs
+        (structure of FASTQ-records is described in 'write_fastq_record' function);
+    :type chunk: list< dict<str: dict<str: str>> >;
+    :param num_threads: number of threads of blastn;
+    :type num_threads: int;
+    :param aligner: aligner that places reads on reference sequences (see 'ALIGNERS');
+    :type aligner: str;
+    :param hit_cache: path to persistent cache of hits of reads (see 'src.hit_cache'; None -- no cache);
+    :type hit_cache: str;
+    :param chunk_hits: best hits of reads of the chunk if they have been aligned in advance
+      (see '_prealigned_chunks');
+    :type chunk_hits: dict<str: list<AlignResult>>;
+    :param align_server: path to socket of the alignment server (see 'src.alignment_server';
+      None -- reads are aligned by this process);
+    :type align_server: str;
+    :param placements: placements of pairs of the chunk placed before in the merging run
+      (see '_RunPlacements'). Placements made for other pairs of the chunk are added to it;
+    :type placements: dict<tuple<str, str>: object>;
+
+    Returns list of values returned by 'merging_function' in order of 'chunk'.
     """
-
-    # Processes will print number of processed reads every 'delay' reads.
-    i =  0
+    globals()["_chunk_placements"] = dict() if placements is None else placements
+    globals()["_aligner"] = aligner
+    globals()["_hit_cache_path"] = hit_cache
+    globals()["_align_server_path"] = align_server
+    _gap_filling_stats["dereplication"]["pairs"] += len(chunk)
     try:
-        readnum_digits = math.ceil(math.log(len(data), 10))
-    except ValueError: # catch log(1)
-        readnum_digits = 1
+        _blast_chunk(chunk, num_threads, chunk_hits)
+        return [merging_function(fastq_recs, phred_offset, num_N, min_overlap, mismatch_frac)
+            for fastq_recs in chunk]
+    finally:
+        globals()["_chunk_placements"] = dict()
+        _chunk_hits.clear()
+        _gap_filling_stats["reference_cache"].update(_reference_store().pop_counts())
+        if not hit_cache is None:
+            _gap_filling_stats["hit_cache"].update(_hit_cache().pop_counts())
+        # end if
     # end try
-    bar_len = min(50, os.get_terminal_size().columns - (11+2*readnum_digits)) # length of status bar
+# end def _merge_chunk
 
-    # Processes will write processed reads every 'max_unwr_size' reads.
-    j = 0
-    tmp_fq_recs = list()
-    tmp_merge_res_list = list()
-
-    EXT_CODE, SEQS = range(2)
-    
-    for fastq_recs in data:
 
-        tmp_merge_res_list.append(merging_function(fastq_recs, phred_offset, num_N, min_overlap, mismatch_frac))
-        tmp_fq_recs.append(fastq_recs)
-        j += 1
-
-        if j == max_unwr_size:
-
-            with write_lock:
-                for k in range(max_unwr_size):
-                    _handle_merge_pair_result(tmp_merge_res_list[k][EXT_CODE], tmp_fq_recs[k],
-                        result_files, tmp_merge_res_list[k][SEQS], second_step=second_step)
-                # end for
-            # end with
-
-            j = 0
-            tmp_fq_recs.clear()
-            tmp_merge_res_list.clear()
-        # end if
-
-        if i == delay:
-            # synchronized incrementing
-            with count_lock:
-                counter.value += i
-            # end with
-            
-            i = 0
-
-            bar_len = min(50, os.get_terminal_size().columns - (11+2*readnum_digits)) # length of status bar
-            eqs = int( bar_len*(counter.value / reads_at_all) ) # number of '=' characters
-            spaces = bar_len - eqs # number of ' ' characters
-            with print_lock:
-                printn("\r[" + "="*eqs + '>' + ' '*spaces +"] {}% ({}/{})".format(int(counter.value/reads_at_all*100),
-                    counter.value, reads_at_all))
-            # end with
+def _merge_packet(merging_function, packet, phred_offset, num_N, min_overlap, mismatch_frac, aligner="blastn",
+    hit_cache=None, chunk_hits=None, align_server=None, placements=None):
+    """
+    Function that performs task meant to be done by one process while parallel read merging.
+
+    :param packet: list of read pairs
+        (structure of FASTQ-records is described in 'write_fastq_record' function);
+    :type packet: list< dict<str: dict<str: str>> >;
+    :param placements: placements of pairs of the packet placed before in the merging run (see '_merge_chunk');
+    :type placements: dict<tuple<str, str>: object>;
+
+    Returns tuple (<list of values returned by 'merging_function' in order of 'packet'>,
+      <sub-stage timers of the process (see 'src.run_report.pop_substage_timers')>,
+      <statistics of merging of the packet (see 'pop_gap_filling_stats')>,
+      <placements made for the packet: dict<int: object>, keys are indices of first copies of pairs in 'packet'>).
+    """
+    placements = dict() if placements is None else placements
+    known_keys = set(placements)
+    merge_res_list = _merge_chunk(merging_function, packet, phred_offset, num_N, min_overlap, mismatch_frac,
+        aligner=aligner, hit_cache=hit_cache, chunk_hits=chunk_hits, align_server=align_server, placements=placements)
+
+    # Placements are returned by indices of pairs, not by their sequences: the calling process holds them
+    placed = dict()
+    for i, fastq_recs in enumerate(packet):
+        key = _pair_key(fastq_recs)
+        if not key in known_keys and key in placements:
+            placed[i] = placements.pop(key)
         # end if
-        i += 1
     # end for
-
-    # A little 'tail' of reads often will remain -- we do not want to lose them:
-    with write_lock:
-        for k in range(len(tmp_merge_res_list)):
-            _handle_merge_pair_result(tmp_merge_res_list[k][EXT_CODE], tmp_fq_recs[k],
-                result_files, tmp_merge_res_list[k][SEQS], second_step=second_step)
-        # end for
-    # end with
-# end def _single_merger
+    return (merge_res_list, run_report.pop_substage_timers(), pop_gap_filling_stats(), placed)
+# end def _merge_packet
 
 
 # ===============================  "Public" stuff  ===============================
@@ -888,9 +1738,182 @@ def get_merging_stats():
 # end def get_merging_stats
 
 
+def get_gap_filling_stats():
+    """
+    Function returns statistics of gap-filling merging of the last 'merge_reads' call:
+    {
+        "outcomes": dict<str: int> -- number of read pairs per outcome (see 'GAP_FILLING_OUTCOMES'),
+        "gap_lengths": dict<int: int> -- histogram of lengths of gaps between reads,
+        "reference_cache": dict<str: object> -- number of "lookups" of reference sequences,
+          number of "fetched" ones, number of retrievals from the database ("batches") and "hit_rate"
+          (see 'src.reference_store'),
+        "dereplication": dict<str: object> -- number of read "pairs", number of pairs actually placed
+          on reference sequences ("placed_pairs", see '_RunPlacements') and their "ratio" (see 'dereplication_ratio'),
+        "hit_cache": dict<str: object> -- number of "lookups" of reads in persistent cache of hits, number of
+          "hits", of "stored" and of "evicted" entries, "hit_rate" and "miss_rate" (see 'src.hit_cache')
+    }
+    Function returns None if gap-filling merging has not been performed.
+    """
+    return _gap_filling_result
+# end def get_gap_filling_stats
+
+
+def dereplication_ratio(counts):
+    """
+    Function returns number of read pairs passed to gap-filling merging per pair actually placed
+      on a reference sequence (None if no pair has been placed).
+
+    :param counts: counts of dereplication (see '_gap_filling_stats');
+    :type counts: dict<str: int>;
+    """
+    placed_pairs = counts.get("placed_pairs", 0)
+    if placed_pairs == 0:
+        return None
+    # end if
+    return round(counts.get("pairs", 0) / placed_pairs, 2)
+# end def dereplication_ratio
+
+
+def check_silva_db(aligner="blastn"):
+    """
+    Function checks if Silva database, which is required for gap-filling merging, is installed.
+    Index of minimizers is required instead of BLAST database if it is the aligner (see 'ALIGNERS').
+    Raises MergingError if it is not.
+    """
+    if not aligner in ALIGNERS:
+        raise MergingError("Unknown aligner: '{}'. Available aligners: {}.".format(aligner, ", ".join(ALIGNERS)))
+    # end if
+    if aligner == "minimizer":
+        if not os.path.exists(minimizer_index_path(_blast_fmt_db)):
+            raise MergingError("Index of minimizers of Silva database is not built!\nPlease, run `configure_Silva_db.sh -m` before merging with `--aligner minimizer`.")
+        # end if
+    elif not os.path.exists(_blast_fmt_db + ".nhr"):
+        raise MergingError("Silva database is not installed!\nPlease, run `configure_Silva_db.sh` before merging with `--no-ovlp-merge` flag.")
+    # end if
+# end def check_silva_db
+
+
+def check_hit_cache(hit_cache):
+    """
+    Function checks if persistent cache of hits of reads (see 'src.hit_cache') can be opened:
+      it is created if it does not exist.
+    Raises MergingError if it cannot be opened.
+    """
+    try:
+        HitCache(hit_cache, "").close()
+    except sqlite3.Error as err:
+        raise MergingError("cannot open cache of hits '{}': {}".format(hit_cache, str(err)))
+    # end try
+# end def check_hit_cache
+
+
+def check_align_server(align_server, aligner="blastn"):
+    """
+    Function checks if the alignment server (see 'src.alignment_server') is available and aligns reads
+      as this process would: with the same aligner against the same database.
+    Raises MergingError if it does not.
+    """
+    try:
+        client = AlignmentClient(align_server)
+        try:
+            info = client.info()
+        finally:
+            client.close()
+        # end try
+    except (OSError, RuntimeError) as err:
+        raise MergingError("alignment server '{}' is not available: {}".format(align_server, str(err)))
+    # end try
+    if info["aligner"] != aligner or info["db"] != _blast_fmt_db:
+        raise MergingError("alignment server '{}' aligns reads with {} against '{}', but {} against '{}' is required"
+            .format(align_server, info["aligner"], info["db"], aligner, _blast_fmt_db))
+    # end if
+# end def check_align_server
+
+
+def make_align_server(socket_path, aligner="blastn", num_threads=1):
+    """
+    Function makes alignment server (see 'src.alignment_server') that aligns reads with an aligner
+      of this module (see 'ALIGNERS') and keeps reference sequences retrieved from the database.
+      The server runs in the calling process, which must be dedicated to it.
+
+    :param socket_path: path to socket of the server;
+    :type socket_path: str;
+    :param aligner: aligner (see 'ALIGNERS');
+    :type aligner: str;
+    :param num_threads: number of threads of blastn;
+    :type num_threads: int;
+
+    Returns AlignmentServer.
+    Raises OSError if the socket cannot be created.
+    """
+    globals()["_aligner"] = aligner
+    globals()["_align_server_path"] = None
+    if aligner == "minimizer":
+        # Index is opened now, so that the first request does not wait for it
+        executor.warm_state(("minimizer_index", _blast_fmt_db), lambda: MinimizerIndex(_blast_fmt_db))
+    # end if
+    return AlignmentServer(socket_path, lambda seqs: _run_aligner(seqs, num_threads), _fetch_references, _rc,
+        {"db": _blast_fmt_db, "aligner": aligner})
+# end def make_align_server
+
+
+def ngmerge_command(ngmerge, read_paths, merged_path, unmerged_prefix, n_thr, min_overlap, mismatch_frac):
+    """
+    Function returns command line for NGmerge.
+    NGmerge writes unmerged reads to files '<unmerged_prefix>_1.fastq' and '<unmerged_prefix>_2.fastq'.
+
+    :param ngmerge: path to NGmerge executable;
+    :type ngmerge: str;
+    :param read_paths: paths to files of forward ("R1") and reverse ("R2") reads;
+    :type read_paths: dict<str: str>;
+    :param merged_path: path to file for merged reads;
+    :type merged_path: str;
+    :param unmerged_prefix: prefix of files for unmerged reads;
+    :type unmerged_prefix: str;
+    """
+    return "{} -1 {} -2 {} -o {} -f {} -n {} -v -m {} -p {}".format(ngmerge, read_paths["R1"], read_paths["R2"],
+        merged_path, unmerged_prefix, n_thr, min_overlap, mismatch_frac)
+# end def ngmerge_command
+
+
+def run_ngmerge(ngmerge_cmd):
+    """
+    Function runs NGmerge and parses merging statistics from it's stderr.
+
+    :param ngmerge_cmd: command line returned by 'ngmerge_command' function;
+    :type ngmerge_cmd: str;
+
+    Returns tuple (<number of processed read pairs>, <number of merged read pairs>).
+    Raises MergingError if NGmerge fails.
+    """
+    ngmerge_start = perf_counter()
+    pipe = sp_Popen(ngmerge_cmd, shell = True, stderr=sp_PIPE)
+    stderr = pipe.communicate()[1].decode("utf-8") # run NGmerge
+    run_report.add_wait_time("child_wait", perf_counter() - ngmerge_start)
+
+    if pipe.returncode != 0:
+        raise MergingError("error running NGmerge (exit code {}).\n{}".format(pipe.returncode, stderr))
+    # end if
+
+    # Parse merging statistoct from NGmerge's stderr
+    stderr = stderr.splitlines()[1:]
+    reads_pattern = r"Fragments \(pairs of reads\) analyzed: ([0-9]+)"
+    merged_pattern = r"Successfully stitched: ([0-9]+)"
+    try:
+        reads_processed = int(re.search(reads_pattern, stderr[0]).group(1))
+        merged_reads = int(re.search(merged_pattern, stderr[1]).group(1))
+    except (AttributeError, IndexError):
+        raise MergingError("error 78: cannot parse output of NGmerge.\nPlease, contact the developer.")
+    # end try
+
+    return (reads_processed, merged_reads)
+# end def run_ngmerge
+
+
 def merge_reads(R1_path, R2_path, ngmerge,
     outdir_path="read_merging_result_{}".format(strftime("%d_%m_%Y_%H_%M_%S", localtime(start_time))).replace(' ', '_'),
-    n_thr=1, phred_offset=33, num_N=35, min_overlap=20, mismatch_frac=0.1, no_ovlp_merge=False):
+    n_thr=1, phred_offset=33, num_N=35, min_overlap=20, mismatch_frac=0.1, no_ovlp_merge=False,
+    ngmerge_thr=None, aligner="blastn", hit_cache=None, blast_jobs=None, align_server=None):
     """
     This is the function that you should actually call from the outer scope in order to merge reads
     (and 'get_merging_stats' after it, if you want).
@@ -903,6 +1926,19 @@ def merge_reads(R1_path, R2_path, ngmerge,
     :type outdir_path: str
     :param n_thr: number of execution threads;
     :type n_thr: int;
+    :param ngmerge_thr: number of threads of NGmerge ('n_thr' if None);
+    :type ngmerge_thr: int;
+    :param aligner: aligner that places reads on reference sequences for gap-filling merging (see 'ALIGNERS');
+    :type aligner: str;
+    :param hit_cache: path to persistent cache of hits of reads for gap-filling merging
+      (see 'src.hit_cache'; None -- no cache);
+    :type hit_cache: str;
+    :param blast_jobs: number of blastn processes run at once by this process for gap-filling merging
+      (see '_prealigned_chunks'; None -- each worker runs it's own blastn calls). Only for blastn aligner;
+    :type blast_jobs: int;
+    :param align_server: path to socket of the alignment server that aligns reads for gap-filling merging
+      (see 'src.alignment_server'; None -- reads are aligned by this run). 'blast_jobs' is ignored if it is used;
+    :type align_server: str;
 
     Function returns a dict<str: str> of the following format:
     {   
@@ -912,22 +1948,20 @@ def merge_reads(R1_path, R2_path, ngmerge,
     }
     """
 
-    if no_ovlp_merge and not os.path.exists(_blast_fmt_db + ".nhr"):
-        print_error("Silva database is not installed!")
-        print("Please, run `configure_Silva_db.sh` before merging with `--no-ovlp-merge` flag.")
-        sys.exit(1)
+    if no_ovlp_merge:
+        check_silva_db(aligner)
+        if not hit_cache is None:
+            check_hit_cache(hit_cache)
+        # end if
+        if not align_server is None:
+            check_align_server(align_server, aligner)
+        # end if
     # end if
 
     # Create a directory for putative artifacts
     artif_dir = "{}{}putative_artifacts".format(outdir_path, os.sep)
     if not os.path.exists(artif_dir):
-        try:
-            os.mkdir(artif_dir)
-        
-        except OSError as oserror:
-            print("Error while creating result directory\n", str(oserror))
-            sys.exit(1)
-        # end try
+        os.mkdir(artif_dir)
     # end if
 
     # The followig dictionary represents some statistics of merging.
@@ -936,6 +1970,7 @@ def merge_reads(R1_path, R2_path, ngmerge,
         0: 0,           # number of merged reads
         1: 0           # number of unmerged reads
     }
+    globals()["_gap_filling_result"] = None
 
     # |==== Run NGmerge ===|
 
@@ -971,38 +2006,26 @@ def merge_reads(R1_path, R2_path, ngmerge,
 
     unmerged_prefix = "{}.unmerged".format(more_common_name)
 
-    ngmerge_cmd = "{} -1 {} -2 {} -o {} -f {} -n {} -v -m {} -p {}".format(ngmerge, read_paths["R1"], read_paths["R2"],
-        result_paths["merg"], unmerged_prefix, n_thr, min_overlap, mismatch_frac)
+    if ngmerge_thr is None:
+        ngmerge_thr = n_thr
+    # end if
+    ngmerge_cmd = ngmerge_command(ngmerge, read_paths, result_paths["merg"], unmerged_prefix,
+        ngmerge_thr, min_overlap, mismatch_frac)
     print(ngmerge_cmd + '\n')
     print("NGmerge is doing it's job silently...")
-    pipe = sp_Popen(ngmerge_cmd, shell = True, stderr=sp_PIPE)
-    stderr = pipe.communicate()[1].decode("utf-8") # run NGmerge
-
-    if pipe.returncode != 0:
-        # error
-        print_error("error running NGmerge.")
-        print(stderr)
-        sys.exit(pipe.returncode)
-    else:
-        # Parse merging statistoct from NGmerge's stderr
-        stderr = stderr.splitlines()[1:]
-        reads_pattern = r"Fragments \(pairs of reads\) analyzed: ([0-9]+)"
-        merged_pattern = r"Successfully stitched: ([0-9]+)"
-        try:
-            reads_processed = int(re.search(reads_pattern, stderr[0]).group(1))
-            merged_reads = int(re.search(merged_pattern, stderr[1]).group(1))
-            globals()["_merging_stats"][0] = merged_reads
-            globals()["_merging_stats"][1] = reads_processed - merged_reads
-        except AttributeError:
-            print_error("error 78")
-            print("Please, contact the developer.")
-            sys.exit(78)
-        # end try
-    # end if
+    run_report.start_stage("ngmerge", n_workers=ngmerge_thr, bytes_in=run_report.files_size(read_paths))
+    try:
+        reads_processed, merged_reads = run_ngmerge(ngmerge_cmd)
+    finally:
+        os.chdir(old_dir) # returs to old dir
+    # end try
+    globals()["_merging_stats"][0] = merged_reads
+    globals()["_merging_stats"][1] = reads_processed - merged_reads
 
-    os.chdir(old_dir) # returs to old dir
     roughly_unmerged_1 = os.path.join(outdir_path, "{}_1.fastq".format(unmerged_prefix))
     roughly_unmerged_2 = os.path.join(outdir_path, "{}_2.fastq".format(unmerged_prefix))
+    run_report.end_stage("ngmerge", reads=reads_processed,
+        bytes_out=run_report.files_size([result_paths["merg"], roughly_unmerged_1, roughly_unmerged_2]))
 
     if no_ovlp_merge:
 
@@ -1026,20 +2049,59 @@ def merge_reads(R1_path, R2_path, ngmerge,
         # end with
         print("  It will take a while")
         print("\n{} - Proceeding...\n\n".format(get_work_time()))
-        printn("[" + " "*50 + "]" + "  0%")
+
+        run_report.start_stage("gap_filling", n_workers=n_thr, bytes_in=run_report.files_size(read_paths))
+        unmerged_before = _merging_stats[1]
+        size_before = run_report.files_size(result_paths)
+        pop_gap_filling_stats() # start from empty statistics
 
         if n_thr == 1:
             _one_thread_merging(_gap_filling_merging, read_paths, 'a', result_paths,
-                True, num_N, min_overlap, mismatch_frac, phred_offset=phred_offset)
+                num_N, min_overlap, mismatch_frac, phred_offset=phred_offset, aligner=aligner,
+                hit_cache=hit_cache, blast_jobs=blast_jobs, align_server=align_server)
+            substage_timers = None
         else:
-            _parallel_merging(_gap_filling_merging, read_paths, result_paths, n_thr,
-                True, num_N, min_overlap, mismatch_frac, delay=n_thr, phred_offset=phred_offset)
+            substage_timers = _parallel_merging(_gap_filling_merging, read_paths, result_paths, n_thr,
+                num_N, min_overlap, mismatch_frac, phred_offset=phred_offset, aligner=aligner,
+                hit_cache=hit_cache, blast_jobs=blast_jobs, align_server=align_server)
         # end if
 
+        # Reduce statistics: workers have already returned theirs to this process
+        stats = pop_gap_filling_stats()
+        gap_merged = stats["outcomes"]["merged_gap"] + stats["outcomes"]["merged_short_overlap"]
+        _merging_stats[0] += gap_merged
+        _merging_stats[1] -= gap_merged
+        cache_hit_rate = hit_cache_rate(stats["hit_cache"])
+        globals()["_gap_filling_result"] = {
+            "outcomes": {outcome: stats["outcomes"][outcome] for outcome in GAP_FILLING_OUTCOMES},
+            "gap_lengths": dict(sorted(stats["gap_lengths"].items())),
+            "reference_cache": dict({key: stats["reference_cache"][key] for key in ("lookups", "fetched", "batches")},
+                hit_rate=hit_rate(stats["reference_cache"])),
+            "dereplication": dict({key: stats["dereplication"][key] for key in ("pairs", "placed_pairs")},
+                ratio=dereplication_ratio(stats["dereplication"])),
+            "hit_cache": dict({key: stats["hit_cache"][key] for key in ("lookups", "hits", "stored", "evicted")},
+                hit_rate=cache_hit_rate, miss_rate=None if cache_hit_rate is None else round(1 - cache_hit_rate, 4))
+        }
+
+        run_report.end_stage("gap_filling", reads=unmerged_before,
+            bytes_out=run_report.files_size(result_paths) - size_before, substages=substage_timers)
+
         os.unlink(roughly_unmerged_1)
         os.unlink(roughly_unmerged_2)
 
         print("{} - Read merging is completed".format(get_work_time()))
+        print("\nGap-filling merging:")
+        for outcome, count in _gap_filling_result["outcomes"].items():
+            print("  {}: {}".format(outcome, count))
+        # end for
+        print("  reference sequences: {lookups} lookups, {fetched} retrieved in {batches} batches; hit rate {hit_rate}"
+            .format(**_gap_filling_result["reference_cache"]))
+        print("  read pairs: {pairs} pairs, {placed_pairs} placed on references; {ratio} pairs per placement"
+            .format(**_gap_filling_result["dereplication"]))
+        if not hit_cache is None:
+            print("  cache of hits: {lookups} lookups, {hits} hits, {stored} stored, {evicted} evicted; hit rate {hit_rate}"
+                .format(**_gap_filling_result["hit_cache"]))
+        # end if
         print("\nFinally,")
         print("  {} read pairs have been merged together".format(_merging_stats[0]))
         print("  {} read pairs haven't been merged together.""".format(_merging_stats[1]))
@@ -1101,12 +2163,15 @@ Options:
     -o (--outdir) --- directory, in which result files will be placed;\n
     -t (--threads) <int> --- number of threads to launch;
     -f (--phred-offset) [33, 64] --- Phred quality offset (default -- 33);
+    --tmpdir <path> --- directory for intermediate files (default -- output directory);
+    --max-memory <size> --- memory budget for reads in flight, e.g. '4G' (default -- unlimited);
 """
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], "hv1:2:o:t:f:",
             ["help", "version", "R1=", "R2=", "outdir=", "threads=", "phred_offset=",
-            "ngmerge-path=", "num-N=", "min-overlap=", "mismatch-frac=", "no-ovlp-merge"])
+            "ngmerge-path=", "num-N=", "min-overlap=", "mismatch-frac=", "no-ovlp-merge", "profile",
+            "sample-profile", "tmpdir=", "max-memory=", "aligner=", "hit-cache=", "blast-jobs=", "align-server="])
     except getopt.GetoptError as opt_err:
         print(str(opt_err) + '\a')
         print("See help ('-h' option)")
@@ -1148,6 +2213,15 @@ Options:
 
         print("-f (--phred-offset) [33, 64] --- Phred quality offset (default -- 33);\n")
 
+        print("""--tmpdir <path> --- directory for intermediate files (decompressed input files,
+      unmerged reads of NGmerge, uncompressed result files), e.g. node-local SSD or '/dev/shm'.
+      A temporary directory is created in it and removed after the run.
+      By default intermediate files are placed in output directory.\n""")
+
+        print("""--max-memory <size> --- memory budget for reads in flight between reading process
+      and worker processes of gap-filling merging, e.g. '4G' or '512M' (suffixes K, M, G, T).
+      Reading is paused until there is room in the budget. Unlimited by default.\n""")
+
         print("-m (--merge-reads) --- Flag option. If specified, reads will be merged together;\n")
 
         print("""--ngmerge-path -- path to NGmerge executable.
@@ -1168,6 +2242,32 @@ Options:
             of read merging will be applied after NGmerge.
             Disabled by default.\n""")
 
+        print("""--aligner -- aligner that places reads on reference sequences for gap-filling merging:
+      'blastn' (BLAST+ and Silva BLAST database) or 'minimizer' (in-process index of minimizers
+      built with `configure_Silva_db.sh -m`).
+      Default value: blastn.\n""")
+
+        print("""--hit-cache -- SQLite file of persistent cache of hits of reads for gap-filling merging.
+      Reads found in it are not aligned again, hits of other reads are stored in it.
+      The file is created if it does not exist. Disabled by default.\n""")
+
+        print("""--blast-jobs -- number of blastn processes run at once by the main process for gap-filling
+      merging. Reads are aligned ahead of merging, and worker processes only merge them.
+      By default each worker runs it's own blastn calls. Only for blastn aligner.\n""")
+
+        print("""--align-server -- socket of local alignment server started with
+      `python3 -m src.alignment_server`. Reads for gap-filling merging are aligned by the server,
+      and reference sequences are retrieved from it. The server must run the same aligner (--aligner).
+      Disabled by default.\n""")
+
+        print("""--profile --- Flag option. If specified, the parent process and all worker processes
+      will be profiled with cProfile. One pstats file per stage will be placed in
+      directory 'profiles' in the output directory.\n""")
+
+        print("""--sample-profile --- Flag option. If specified, low-overhead sampling profiler
+      will be run in the parent process and all worker processes. Collapsed stack counts
+      (flame graph format) will be placed in directory 'profiles' in the output directory.\n""")
+
         if "--help" in sys.argv[1:]:
             print("----------------------------------------------------------\n")
             print("""  EXAMPLES:\n
@@ -1196,6 +2296,14 @@ Options:
     min_overlap = 20 # as default in NGmerge
     mismatch_frac = 0.1 # as default in NGmerge
     no_ovlp_merge = False
+    aligner = "blastn"
+    hit_cache = None
+    blast_jobs = None
+    align_server = None
+    profile = False
+    sample_profile = False
+    tmpdir = None
+    max_memory = None
 
     # First search for information-providing options:
 
@@ -1330,6 +2438,57 @@ Options:
 
         elif opt == "--no-ovlp-merge":
             no_ovlp_merge = True
+
+        elif opt == "--aligner":
+            if not arg in ALIGNERS:
+                print_error("invalid aligner (--aligner option): '{}'".format(arg))
+                print("Available aligners: {}.".format(", ".join(ALIGNERS)))
+                sys.exit(1)
+            # end if
+            aligner = arg
+
+        elif opt == "--hit-cache":
+            if not os.path.isdir(os.path.dirname(os.path.abspath(arg))):
+                print_error("Directory of cache of hits (--hit-cache option) does not exist: '{}'".format(arg))
+                sys.exit(1)
+            # end if
+            hit_cache = os.path.abspath(arg)
+
+        elif opt == "--blast-jobs":
+            try:
+                blast_jobs = int(arg)
+                if blast_jobs < 1:
+                    raise ValueError
+                # end if
+            except ValueError:
+                print_error("invalid number of blastn processes (--blast-jobs option): '{}'".format(arg))
+                print("It must be integer number > 0.")
+                sys.exit(1)
+            # end try
+
+        elif opt == "--align-server":
+            align_server = os.path.abspath(arg)
+
+        elif opt == "--profile":
+            profile = True
+
+        elif opt == "--sample-profile":
+            sample_profile = True
+
+        elif opt == "--tmpdir":
+            if not os.path.isdir(arg):
+                print_error("Directory '{}' does not exist!".format(arg))
+                sys.exit(1)
+            # end if
+            tmpdir = os.path.abspath(arg)
+
+        elif opt == "--max-memory":
+            try:
+                max_memory = executor.parse_memory_size(arg)
+            except ValueError as err:
+                print_error("invalid memory budget (--max-memory option): {}".format(err))
+                sys.exit(1)
+            # end try
         # end if
     # end for
 
@@ -1345,6 +2504,16 @@ Options:
     #    and remove uncompressed files after merging.
     # If we need to remove files in read_paths after merging, this flagwill be True
     rm_src_files = False
+
+    # Intermediate files are placed in temporary directory 'workdir' if '--tmpdir' is specified.
+    #   It is removed at exit. Otherwise decompressed files are placed next to input files
+    #   and other intermediate files -- in output directory.
+    workdir = None
+    if not tmpdir is None:
+        workdir = tempfile.mkdtemp(prefix="read_merging_16S_", dir=tmpdir)
+        atexit.register(shutil.rmtree, workdir, True)
+    # end if
+    run_report.start_stage("decompression", bytes_in=run_report.files_size(read_paths))
     for key, fpath in read_paths.items():
         if fpath.endswith(".gz") or fpath.endswith(".bz2"):
 
@@ -1354,6 +2523,9 @@ Options:
             how_to_open = OPEN_FUNCS[file_type]
 
             new_fpath = fpath[: fpath.rfind('.')] # remove extention
+            if not workdir is None:
+                new_fpath = os.path.join(workdir, os.path.basename(new_fpath))
+            # end if
 
             # Uncompress
             with how_to_open(fpath) as src_file, open(new_fpath, 'wb') as new_file:
@@ -1364,8 +2536,9 @@ Options:
             read_paths[key] = new_fpath
         # end if
     # end for
+    run_report.end_stage("decompression", bytes_out=run_report.files_size(read_paths) if rm_src_files else 0)
 
-    if no_ovlp_merge:
+    if no_ovlp_merge and aligner == "blastn":
         # Check utilities for read merging
         pathdirs = os.environ["PATH"].split(os.pathsep)
         for utility in ("blastn", "blastdbcmd"):
@@ -1446,10 +2619,27 @@ Options:
         # end while
     # end if
 
+    if workdir is None:
+        workdir = outdir_path
+    # end if
+
+    if profile or sample_profile:
+        profiling.enable(os.path.join(outdir_path, "profiles"), cprofile=profile,
+            sample_interval=profiling.SAMPLE_INTERVAL if sample_profile else None)
+    # end if
+
+    executor.set_max_memory(max_memory)
+
     # == Proceed ==
-    result_files = merge_reads(read_paths["R1"], read_paths["R2"], ngmerge=ngmerge,
-        outdir_path=outdir_path, n_thr=n_thr, phred_offset=phred_offset,
-        num_N=num_N, min_overlap=min_overlap, mismatch_frac=mismatch_frac, no_ovlp_merge=no_ovlp_merge)
+    try:
+        result_files = merge_reads(read_paths["R1"], read_paths["R2"], ngmerge=ngmerge,
+            outdir_path=workdir, n_thr=n_thr, phred_offset=phred_offset,
+            num_N=num_N, min_overlap=min_overlap, mismatch_frac=mismatch_frac, no_ovlp_merge=no_ovlp_merge,
+            aligner=aligner, hit_cache=hit_cache, blast_jobs=blast_jobs, align_server=align_server)
+    except (Preprocess16SError, OSError) as err:
+        print_error(str(err))
+        sys.exit(1)
+    # end try
 
     print("{} read pairs have been processed.".format(_merging_stats[0]+_merging_stats[1]))
 
@@ -1459,7 +2649,7 @@ Options:
             for fpath in read_paths.values():
                 os.unlink(fpath)
             # end for
-        except OSerror as oserr:
+        except OSError as oserr:
             print_error( str(oserr) )
             sys.exit(1)
     # end if
@@ -1474,21 +2664,19 @@ Options:
 
     # Gzip result files
     print("\nGzipping result files...")
-    for file in result_files.values():
-        if os.path.exists(file):
-            with open(file, 'r') as plain_file, open_as_gzip(file+".gz", 'wb') as gz_file:
-                for line in plain_file:
-                    gz_file.write(bytes(line, "utf-8"))
-                # end for
-            # end with
-            os.unlink(file)
-            print("\'{}\' is gzipped".format(file))
-        # end if
-    # end for
-    
+    run_report.start_stage("gzip", bytes_in=run_report.files_size(result_files))
+    try:
+        gz_paths = gzip_files(result_files.values(), src_dir=workdir, dest_dir=outdir_path)
+    except OSError as oserr:
+        print_error( str(oserr) )
+        sys.exit(1)
+    # end try
+    run_report.end_stage("gzip", bytes_out=run_report.files_size(gz_paths))
     print("Gzipping is completed\n")
     print("Result files are placed in the following directory:\n\t'{}'\n".format(outdir_path))
 
+    profiling.finish()
+
     # Write log file
     with open("{}{}read_merging_16S_{}.log".format(outdir_path, os.sep,
             strftime("%d_%m_%Y_%H_%M_%S", localtime(start_time))).replace(" ", "_"), 'w') as logfile:
@@ -1503,7 +2691,39 @@ Options:
         logfile.write("Script completed it's job at {}\n\n".format(end_time))
         logfile.write("{} read pairs have been merged.\n".format(_merging_stats[0]))
         logfile.write("{} read pairs haven't been merged together.\n".format(_merging_stats[1]))
+
+        gap_filling_stats = get_gap_filling_stats()
+        if not gap_filling_stats is None:
+            logfile.write("\nOutcomes of gap-filling merging:\n")
+            for outcome, count in gap_filling_stats["outcomes"].items():
+                logfile.write("  {}: {}\n".format(outcome, count))
+            # end for
+            logfile.write("Reference sequences: {lookups} lookups, {fetched} retrieved in {batches} batches; hit rate {hit_rate}\n"
+                .format(**gap_filling_stats["reference_cache"]))
+            logfile.write("Read pairs: {pairs} pairs, {placed_pairs} placed on references; {ratio} pairs per placement\n"
+                .format(**gap_filling_stats["dereplication"]))
+            if not hit_cache is None:
+                logfile.write("Cache of hits: {lookups} lookups, {hits} hits, {stored} stored, {evicted} evicted; hit rate {hit_rate}\n"
+                    .format(**gap_filling_stats["hit_cache"]))
+            # end if
+        # end if
+
+        if profile:
+            logfile.write("\n\tProfiling summary\n")
+            for stage, stage_pstats, summary in profiling.get_summaries():
+                logfile.write("\nStage '{}'. Full profile: '{}'\n\n".format(stage, stage_pstats))
+                logfile.write(summary)
+            # end for
+        # end if
     # end with
 
+    # Write JSON run report
+    run_report.write_report("{}{}read_merging_16S_{}.report.json".format(outdir_path, os.sep,
+            strftime("%d_%m_%Y_%H_%M_%S", localtime(start_time))).replace(" ", "_"),
+        program="read_merging_16S", version=__version__, n_threads=n_thr,
+        input_files=list(read_paths.values()), outdir=outdir_path,
+        merging_stats=dict({"merged": _merging_stats[0], "unmerged": _merging_stats[1]},
+            **(get_gap_filling_stats() or dict())))
+
     print('\n'+get_work_time() + " ({}) ".format(strftime("%d.%m.%Y %H:%M:%S", localtime(time()))) + "- Job is successfully completed!\n")
 # end if
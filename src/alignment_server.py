@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+# Module provides local alignment server for gap-filling read merging, shared by concurrent runs on a node.
+# When many samples are processed at once, each blastn call loads the database on it's own, and each
+#   process opens index of minimizers and retrieves reference sequences for itself. The server is started
+#   once per node and lives until it is stopped. It holds the aligner (index of minimizers or BLAST database,
+#   see 'read_merging_16S.ALIGNERS') and store of reference sequences, and answers batched queries
+#   of any number of preprocess16S processes (see '--align-server' option) over a Unix socket.
+#
+# Requests of all clients are put into one queue. The aligning thread takes all requests waiting
+#   in the queue at once and aligns their reads together (up to MAX_BATCH_READS reads): so concurrent
+#   clients share one blastn call, and identical reads of different clients are aligned once.
+#   Best hits are selected by the same code as in the client (see 'read_merging_16S._run_aligner'),
+#   so that hits are the same as if reads were aligned by the client itself.
+#
+# Protocol: a message is a JSON object preceded by it's length (8-byte unsigned integer, little-endian).
+#   {"op": "align", "seqs": [<sequence>, ...]} -> {"hits": [<fields of best hits, see 'src.hit_cache.hit_fields'>, ...]};
+#   {"op": "references", "accs": [<accession>, ...]} -> {"references": [[<sequence ID>, <sequence>], ...]};
+#   {"op": "info"} -> {"db": <path to database>, "aligner": <aligner>, "counts": <counts of the server>}.
+#   Answer to a failed request is {"error": <message>}.
+#
+# Usage (from the root directory of the repository):
+#   python3 -m src.alignment_server [-a <aligner>] [-t <blastn threads>] <socket>
+# The server is stopped by SIGTERM or SIGINT.
+
+import os
+import sys
+import json
+import queue
+import socket
+import signal
+import struct
+import getopt
+import threading
+import socketserver
+from collections import Counter
+
+from src.hit_cache import hit_fields, hits_from_fields
+from src.reference_store import ReferenceStore
+
+
+# Maximum number of reads aligned together by the server (requests are not split)
+MAX_BATCH_READS = 20000
+# Maximum number of reference sequences kept in memory by the server (plus strand only)
+REF_CACHE_SIZE = 100000
+
+# Seconds a client waits for an answer of the server (aligning of a request may wait for other batches)
+CLIENT_TIMEOUT = 3600
+
+# Header of a message: length of it's body
+_HEADER = struct.Struct("<Q")
+
+
+def send_message(sock, message):
+    """
+    Function sends a message (see the header of this module) to a socket.
+
+    :param sock: connected socket;
+    :type sock: socket.socket;
+    :param message: message;
+    :type message: dict;
+    """
+    body = json.dumps(message).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(body)) + body)
+# end def send_message
+
+
+def _recv_exactly(sock, n_bytes):
+    # Returns 'n_bytes' bytes read from a socket, or None if the peer has closed connection before the first byte
+    chunks = list()
+    while n_bytes != 0:
+        chunk = sock.recv(min(n_bytes, 2**20))
+        if len(chunk) == 0:
+            if len(chunks) == 0:
+                return None
+            # end if
+            raise ConnectionError("connection is closed in the middle of a message")
+        # end if
+        chunks.append(chunk)
+        n_bytes -= len(chunk)
+    # end while
+    return b"".join(chunks)
+# end def _recv_exactly
+
+
+def recv_message(sock):
+    """
+    Function receives a message (see the header of this module) from a socket.
+
+    Returns dict or None if the peer has closed connection.
+    Raises ConnectionError if connection is closed in the middle of a message.
+    """
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    # end if
+    body = _recv_exactly(sock, _HEADER.unpack(header)[0])
+    if body is None:
+        raise ConnectionError("connection is closed in the middle of a message")
+    # end if
+    return json.loads(body.decode("utf-8"))
+# end def recv_message
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    # Handler of a connection of a client: it serves requests until the client closes connection
+
+    def handle(self):
+        owner = self.server.owner
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ConnectionError, ValueError):
+                return
+            # end try
+            if request is None:
+                return
+            # end if
+            try:
+                send_message(self.request, owner.answer(request))
+            except OSError:
+                return
+            # end try
+        # end while
+    # end def handle
+# end class _RequestHandler
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+# end class _ThreadingUnixServer
+
+
+class AlignmentServer:
+    """
+    Class AlignmentServer is dedicated to serve alignment of reads and reference sequences
+      to concurrent processes over a Unix socket (see the header of this module).
+
+    :field socket_path: path to the socket;
+    :type socket_path: str;
+    :field info: description of the server sent to clients: "db" and "aligner";
+    :type info: dict<str: str>;
+    :field counts: numbers of "requests", of aligning "batches", of "reads" in requests, of "aligned" reads
+      and of "references" sent to clients;
+    :type counts: collections.Counter;
+
+    :method answer: returns answer to a request;
+    :method serve_forever: serves requests until 'shutdown' is called;
+    :method shutdown: stops serving;
+    """
+
+    def __init__(self, socket_path, align_batch, fetch_references, revcomp, info):
+        """
+        :param socket_path: path to the socket. Socket file left by a stopped server is removed;
+        :type socket_path: str;
+        :param align_batch: function that aligns reads. It takes list of sequences (unique ones)
+          and returns dict<str: list<AlignResult>> -- best hits of each sequence (None if there is no hit);
+        :param fetch_references: function that retrieves reference sequences (see 'src.reference_store');
+        :param revcomp: function that returns reverse-complement sequence;
+        :param info: description of the server (see 'info' field);
+        :type info: dict<str: str>;
+
+        Raises OSError if another server listens to the socket or it cannot be created.
+        """
+        self.socket_path = socket_path
+        self.info = info
+        self.counts = Counter()
+        self._align_batch = align_batch
+        self._references = ReferenceStore(REF_CACHE_SIZE, fetch_references, revcomp)
+        self._references_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self._queue = queue.Queue()
+
+        _remove_stale_socket(socket_path)
+        self._server = _ThreadingUnixServer(socket_path, _RequestHandler)
+        self._server.owner = self
+        self._aligning_thread = threading.Thread(target=self._align_requests, name="alignment-server", daemon=True)
+        self._aligning_thread.start()
+    # end def __init__
+
+    def answer(self, request):
+        """
+        Function returns answer to a request of a client (see the header of this module).
+
+        :param request: request;
+        :type request: dict;
+        """
+        self._count("requests")
+        op = request.get("op")
+        if op == "align":
+            done = threading.Event()
+            task = {"seqs": request["seqs"], "done": done}
+            self._queue.put(task)
+            done.wait()
+            return task.get("answer", {"error": "reads have not been aligned"})
+        elif op == "references":
+            try:
+                with self._references_lock:
+                    self._references.prefetch(request["accs"])
+                    references = [self._references.get(acc) for acc in request["accs"]]
+                # end with
+            except Exception as err: # the error is passed to the client, the server keeps serving
+                return {"error": str(err)}
+            # end try
+            self._count("references", len(references))
+            return {"references": references}
+        elif op == "info":
+            with self._counts_lock:
+                return dict(self.info, counts=dict(self.counts))
+            # end with
+        # end if
+        return {"error": "unknown request: '{}'".format(op)}
+    # end def answer
+
+    def _count(self, key, n=1):
+        with self._counts_lock:
+            self.counts[key] += n
+        # end with
+    # end def _count
+
+    def _align_requests(self):
+        # Aligning thread: takes requests waiting in the queue and aligns their reads together
+        while True:
+            tasks = [self._queue.get()]
+            n_reads = len(tasks[0]["seqs"])
+            while n_reads < MAX_BATCH_READS:
+                try:
+                    tasks.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+                # end try
+                n_reads += len(tasks[-1]["seqs"])
+            # end while
+
+            # Clients are answered whatever happens here: otherwise they would wait for the answer forever
+            try:
+                seqs = list(dict.fromkeys(seq for task in tasks for seq in task["seqs"]))
+                align_reports = self._align_batch(seqs)
+                for task in tasks:
+                    task["answer"] = {"hits": [hit_fields(align_reports[seq]) for seq in task["seqs"]]}
+                # end for
+                with self._counts_lock:
+                    self.counts["batches"] += 1
+                    self.counts["reads"] += n_reads
+                    self.counts["aligned"] += len(seqs)
+                # end with
+            except Exception as err: # the error is passed to clients, the server keeps serving
+                for task in tasks:
+                    task["answer"] = {"error": "{}: {}".format(type(err).__name__, str(err))}
+                # end for
+            finally:
+                for task in tasks:
+                    task["done"].set()
+                # end for
+            # end try
+        # end while
+    # end def _align_requests
+
+    def serve_forever(self):
+        self._server.serve_forever()
+    # end def serve_forever
+
+    def shutdown(self):
+        """
+        Function stops serving (it must be called from a thread other than the one running 'serve_forever')
+          and removes the socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        # end if
+    # end def shutdown
+# end class AlignmentServer
+
+
+def _remove_stale_socket(socket_path):
+    # Function removes socket file left by a stopped server. Raises OSError if a server listens to it
+    if not os.path.exists(socket_path):
+        return
+    # end if
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(socket_path)
+        return
+    finally:
+        sock.close()
+    # end try
+    raise OSError("alignment server is already running at '{}'".format(socket_path))
+# end def _remove_stale_socket
+
+
+class AlignmentClient:
+    """
+    Class AlignmentClient is dedicated to send requests to the alignment server.
+    A client is used by one thread at a time. Connection is opened again once if it is broken
+      (e.g. the server has been restarted). A request that is not answered in 'timeout' seconds fails
+      and is not sent again.
+
+    :field socket_path: path to the socket of the server;
+    :type socket_path: str;
+    :field timeout: seconds to wait for an answer;
+    :type timeout: float;
+
+    :method align: returns best hits of reads;
+    :method references: returns reference sequences;
+    :method info: returns description of the server;
+    :method close: closes connection;
+    """
+
+    def __init__(self, socket_path, timeout=CLIENT_TIMEOUT):
+        """
+        :param socket_path: path to the socket of the server;
+        :type socket_path: str;
+        :param timeout: seconds to wait for an answer;
+        :type timeout: float;
+
+        Raises OSError if the server is not available.
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._connect()
+    # end def __init__
+
+    def _connect(self):
+        self.close()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(self.timeout)
+        try:
+            self._sock.connect(self.socket_path)
+        except OSError:
+            self.close()
+            raise
+        # end try
+    # end def _connect
+
+    def _request(self, request):
+        # Returns answer of the server to a request. Raises OSError if the server is not available
+        #   or has not answered in time, and RuntimeError if the server has failed to answer
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    self._connect()
+                # end if
+                send_message(self._sock, request)
+                answer = recv_message(self._sock)
+                if answer is None:
+                    raise ConnectionError("alignment server has closed connection")
+                # end if
+                break
+            except socket.timeout:
+                # The server is busy or stuck: the request is not sent again. Late answer must not be read
+                #   as the answer to the next request, so connection is closed
+                self.close()
+                raise socket.timeout("alignment server has not answered in {} s".format(self.timeout))
+            except OSError:
+                self.close()
+                if attempt != 0:
+                    raise
+                # end if
+            # end try
+        # end for
+        if "error" in answer:
+            raise RuntimeError(answer["error"])
+        # end if
+        return answer
+    # end def _request
+
+    def align(self, seqs):
+        """
+        Function returns best hits of reads found by the server.
+
+        :param seqs: sequences of reads;
+        :type seqs: list<str>;
+
+        Returns dict<str: list<AlignResult>> -- best hits of each sequence.
+          Sequences without significant similarity are mapped to None.
+        """
+        answer = self._request({"op": "align", "seqs": seqs})
+        return {seq: hits_from_fields(fields) for seq, fields in zip(seqs, answer["hits"])}
+    # end def align
+
+    def references(self, accs):
+        """
+        Function returns reference sequences kept by the server.
+
+        :param accs: accessions;
+        :type accs: list<str>;
+
+        Returns dict<str: tuple<str, str>> -- accession to (<sequence ID>, <sequence>).
+        """
+        answer = self._request({"op": "references", "accs": accs})
+        return {acc: tuple(reference) for acc, reference in zip(accs, answer["references"])}
+    # end def references
+
+    def info(self):
+        return self._request({"op": "info"})
+    # end def info
+
+    def close(self):
+        if not self._sock is None:
+            self._sock.close()
+            self._sock = None
+        # end if
+    # end def close
+# end class AlignmentClient
+
+
+if __name__ == "__main__":
+
+    usage_msg = "Usage: python3 -m src.alignment_server [-a <aligner>] [-t <blastn threads>] <socket>"
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ha:t:", ["help", "aligner=", "threads="])
+    except getopt.GetoptError as opt_err:
+        print(str(opt_err))
+        print(usage_msg)
+        sys.exit(2)
+    # end try
+    if len(args) != 1:
+        print(usage_msg)
+        sys.exit(2)
+    # end if
+
+    aligner, num_threads = "blastn", 1
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage_msg)
+            sys.exit(0)
+        elif opt in ("-a", "--aligner"):
+            aligner = arg
+        elif opt in ("-t", "--threads"):
+            num_threads = int(arg)
+        # end if
+    # end for
+
+    import read_merging_16S
+    from src.errors import MergingError
+
+    try:
+        read_merging_16S.check_silva_db(aligner)
+        server = read_merging_16S.make_align_server(os.path.abspath(args[0]), aligner, num_threads)
+    except (OSError, MergingError) as err:
+        print("Error: {}".format(str(err)))
+        sys.exit(1)
+    # end try
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+    # end def stop
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print("Alignment server ({}, database '{}') is listening at '{}'".format(aligner, server.info["db"],
+        server.socket_path))
+    sys.stdout.flush()
+    server.serve_forever()
+    print("Alignment server is stopped: {requests} requests, {reads} reads aligned in {batches} batches ({aligned} unique), {references} references sent"
+        .format_map(Counter(server.counts)))
+# end if
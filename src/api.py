@@ -0,0 +1,1020 @@
+# -*- coding: utf-8 -*-
+# Library interface of preprocess16S.
+#
+# It lets other Python programs (e.g. long-running services) run preprocessing in-process:
+#   - 'read_pairs' streams read pairs from FASTQ files;
+#   - 'CrosstalkFilter' classifies read pairs from any iterable as 16S reads or cross-talks;
+#   - 'ReadMerger' merges read pairs from any iterable;
+#   - 'preprocess' runs the whole file-based pipeline of 'preprocess16S.py'.
+# Errors are reported by raising exceptions (subclasses of 'Preprocess16SError' and OSError),
+#   the interpreter is never terminated.
+#
+# Example:
+#   from src import api
+#   crosstalk_filter = api.CrosstalkFilter()
+#   merger = api.ReadMerger()
+#   pairs_16S = (pair for is_16S, pair in crosstalk_filter.classify(api.read_pairs(R1_path, R2_path)) if is_16S)
+#   for is_merged, record in merger.merge(pairs_16S):
+#       ...
+#   print(crosstalk_filter.stats.as_dict(), merger.stats.as_dict())
+
+import os
+import re
+import shutil
+import tempfile
+
+from src.printing import *
+from src.fastq import *
+from src.filesystem import *
+from src.crosstalks import find_primer, find_primer_organizer, get_primers
+from src.crosstalks import DEFAULT_PRIMERS, DEFAULT_PRIMER_IDS
+from src.errors import FastqError, PrimerError, MergingError
+from src import run_report
+from src import profiling
+from src import executor
+from src import subsample
+from src import progress
+from src import reference_store
+from src import hit_cache
+
+import read_merging_16S
+
+
+# Number of read pairs in one task of parallel cross-talk detection.
+CROSSTALK_PACKET_SIZE = 5000
+
+# NGmerge bundled with preprocess16S
+DEFAULT_NGMERGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "binaries", "NGmerge")
+
+
+class CrosstalkStats:
+    """
+    Class CrosstalkStats is dedicated to perform statistics of cross-talk detection.
+
+    :field match: number of read pairs with primer sequences;
+    :type match: int;
+    :field trash: number of cross-talks;
+    :type trash: int;
+
+    :method total: returns number of processed read pairs;
+    :method crosstalk_rate: returns percentage of cross-talks;
+    :method as_dict: returns statistics as dict<str: int> ('primer_stats' of 'preprocess16S.py');
+    """
+
+    def __init__(self, match=0, trash=0):
+        self.match = match
+        self.trash = trash
+    # end def __init__
+
+    def total(self):
+        return self.match + self.trash
+    # end def total
+
+    def crosstalk_rate(self):
+        return round(100 * self.trash / self.total(), 3) if self.total() != 0 else 0.0
+    # end def crosstalk_rate
+
+    def as_dict(self):
+        return {"match": self.match, "trash": self.trash}
+    # end def as_dict
+# end class CrosstalkStats
+
+
+class MergingStats:
+    """
+    Class MergingStats is dedicated to perform statistics of read merging.
+
+    :field merged: number of merged read pairs;
+    :type merged: int;
+    :field unmerged: number of read pairs that have not been merged;
+    :type unmerged: int;
+    :field outcomes: number of read pairs per outcome of gap-filling merging
+      (see 'read_merging_16S.GAP_FILLING_OUTCOMES'; None if gap-filling merging has not been performed);
+    :type outcomes: dict<str: int>;
+    :field gap_lengths: histogram of lengths of gaps between reads (None if gap-filling merging has not been performed);
+    :type gap_lengths: dict<int: int>;
+    :field reference_cache: counts of stores of reference sequences (see 'src.reference_store';
+      None if gap-filling merging has not been performed);
+    :type reference_cache: dict<str: int>;
+    :field dereplication: numbers of read "pairs" passed to gap-filling merging and of pairs actually
+      placed on reference sequences ("placed_pairs", see 'read_merging_16S._RunPlacements';
+      None if gap-filling merging has not been performed);
+    :type dereplication: dict<str: int>;
+    :field hit_cache: counts of persistent caches of hits of reads (see 'src.hit_cache';
+      None if gap-filling merging has not been performed);
+    :type hit_cache: dict<str: int>;
+
+    :method total: returns number of processed read pairs;
+    :method add_gap_filling_stats: adds statistics of gap-filling merging
+      (see 'read_merging_16S.get_gap_filling_stats');
+    :method as_dict: returns statistics as dict;
+    """
+
+    def __init__(self, merged=0, unmerged=0, outcomes=None, gap_lengths=None, reference_cache=None,
+        dereplication=None, hit_cache=None):
+        self.merged = merged
+        self.unmerged = unmerged
+        self.outcomes = outcomes
+        self.gap_lengths = gap_lengths
+        self.reference_cache = reference_cache
+        self.dereplication = dereplication
+        self.hit_cache = hit_cache
+    # end def __init__
+
+    def total(self):
+        return self.merged + self.unmerged
+    # end def total
+
+    def add_gap_filling_stats(self, stats):
+        if self.outcomes is None:
+            self.outcomes = {outcome: 0 for outcome in read_merging_16S.GAP_FILLING_OUTCOMES}
+            self.gap_lengths = dict()
+            self.reference_cache = {"lookups": 0, "fetched": 0, "batches": 0}
+            self.dereplication = {"pairs": 0, "placed_pairs": 0}
+            self.hit_cache = {"lookups": 0, "hits": 0, "stored": 0, "evicted": 0}
+        # end if
+        for outcome, count in stats["outcomes"].items():
+            self.outcomes[outcome] += count
+        # end for
+        for gap_len, count in stats["gap_lengths"].items():
+            self.gap_lengths[gap_len] = self.gap_lengths.get(gap_len, 0) + count
+        # end for
+        for key in self.reference_cache:
+            self.reference_cache[key] += stats["reference_cache"].get(key, 0)
+        # end for
+        for key in self.dereplication:
+            self.dereplication[key] += stats["dereplication"].get(key, 0)
+        # end for
+        for key in self.hit_cache:
+            self.hit_cache[key] += stats["hit_cache"].get(key, 0)
+        # end for
+    # end def add_gap_filling_stats
+
+    def as_dict(self):
+        stats = {"merged": self.merged, "unmerged": self.unmerged}
+        if not self.outcomes is None:
+            stats["outcomes"] = dict(self.outcomes)
+            stats["gap_lengths"] = dict(sorted(self.gap_lengths.items()))
+            stats["reference_cache"] = dict(self.reference_cache,
+                hit_rate=reference_store.hit_rate(self.reference_cache))
+            stats["dereplication"] = dict(self.dereplication,
+                ratio=read_merging_16S.dereplication_ratio(self.dereplication))
+            cache_hit_rate = hit_cache.hit_rate(self.hit_cache)
+            stats["hit_cache"] = dict(self.hit_cache, hit_rate=cache_hit_rate,
+                miss_rate=None if cache_hit_rate is None else round(1 - cache_hit_rate, 4))
+        # end if
+        return stats
+    # end def as_dict
+# end class MergingStats
+
+
+def read_pairs(R1_path, R2_path):
+    """
+    Generator yields read pairs from two FASTQ files (plain, gzipped or bzipped).
+
+    :param R1_path: path to file with forward reads;
+    :type R1_path: str;
+    :param R2_path: path to file with reverse reads;
+    :type R2_path: str;
+
+    Yields dictionaries {"R1": <FASTQ-record>, "R2": <FASTQ-record>}
+      (structure of records is described in 'src.fastq.read_fastq_pair' function).
+    """
+    file_type = get_archv_fmt_indx(R1_path)
+    read_files = open_files({"R1": R1_path, "R2": R2_path}, OPEN_FUNCS[file_type])
+    try:
+        while True:
+            fastq_recs = read_fastq_pair(read_files, FORMATTING_FUNCS[file_type])
+            if fastq_recs is None:
+                return
+            # end if
+            yield fastq_recs
+        # end while
+    finally:
+        close_files(read_files)
+    # end try
+# end def read_pairs
+
+
+def write_pairs(pairs, R1_path, R2_path):
+    """
+    Function writes read pairs to two plain FASTQ files.
+
+    Returns number of written pairs.
+    """
+    n_pairs = 0
+    with open(R1_path, 'w') as R1_file, open(R2_path, 'w') as R2_file:
+        for fastq_recs in pairs:
+            write_fastq_record(R1_file, fastq_recs["R1"])
+            write_fastq_record(R2_file, fastq_recs["R2"])
+            n_pairs += 1
+        # end for
+    # end with
+    return n_pairs
+# end def write_pairs
+
+
+class CrosstalkFilter:
+    """
+    Class CrosstalkFilter is dedicated to detect cross-talks depending on presence
+      of primer sequences at 5'-ends of both reads of a pair. Primers are trimmed
+      unless 'keep_primers' is True.
+    One filter can process any number of iterables; statistics is accumulated.
+
+    :field primers: sequences of forward and reverse primers;
+    :type primers: list<str>;
+    :field keep_primers: do not trim primer sequences;
+    :type keep_primers: bool;
+    :field stats: statistics of cross-talk detection;
+    :type stats: CrosstalkStats;
+
+    :method classify: yields (<is_16S>, <read_pair>) tuples;
+    """
+
+    def __init__(self, primers=None, keep_primers=False, primer_path=None):
+        """
+        :param primers: sequences of forward and reverse primers.
+            Default Illumina V3-V4 primers are used if neither primers nor primer file are specified;
+        :type primers: list<str>;
+        :param keep_primers: do not trim primer sequences;
+        :type keep_primers: bool;
+        :param primer_path: path to multi-FASTA file with primers (see 'src.crosstalks.read_primers');
+        :type primer_path: str;
+        """
+        if primers is None:
+            primers = get_primers(None, primer_path)[0]
+        # end if
+        if len(primers) < 2:
+            raise PrimerError("Two primer sequences are required, {} specified".format(len(primers)))
+        # end if
+        self.primers = primers
+        self.keep_primers = keep_primers
+        self.stats = CrosstalkStats()
+    # end def __init__
+
+    def classify(self, pairs):
+        """
+        Generator classifies read pairs.
+        Primer sequences are trimmed in place (if 'keep_primers' is False) only in 16S read pairs.
+
+        :param pairs: iterable of read pairs (see 'read_pairs');
+
+        Yields tuples (<is_16S>, <read_pair>): 'is_16S' is True if primers are found in both reads
+          and False if the pair is a cross-talk.
+        """
+        for fastq_recs in pairs:
+            is_16S = find_primer(self.primers[0], fastq_recs["R1"], self.keep_primers) \
+                and find_primer(self.primers[1], fastq_recs["R2"], self.keep_primers)
+            if is_16S:
+                self.stats.match += 1
+            else:
+                self.stats.trash += 1
+            # end if
+            yield (is_16S, fastq_recs)
+        # end for
+    # end def classify
+# end class CrosstalkFilter
+
+
+class ReadMerger:
+    """
+    Class ReadMerger is dedicated to merge read pairs with NGmerge and, optionally,
+      with gap-filling merging (requires BLAST+ and Silva database, see 'configure_Silva_db.sh').
+    NGmerge works with files, so pairs are spilled to a temporary directory, which is removed afterwards.
+    One merger can process any number of iterables; statistics is accumulated.
+
+    :field stats: statistics of read merging;
+    :type stats: MergingStats;
+
+    :method merge: yields (<is_merged>, <record>) tuples;
+    """
+
+    def __init__(self, ngmerge=DEFAULT_NGMERGE, phred_offset=33, num_N=35, min_overlap=20,
+        mismatch_frac=0.1, gap_filling=False, n_thr=1, tmpdir=None, aligner="blastn", hit_cache=None,
+        blast_jobs=None, align_server=None):
+        """
+        :param ngmerge: path to NGmerge executable;
+        :type ngmerge: str;
+        :param phred_offset: Phred quality offset;
+        :type phred_offset: int;
+        :param num_N: maximum length of a gap that can be filled with Ns;
+        :type num_N: int;
+        :param min_overlap: minimum overlap of reads to be merged with NGmerge;
+        :type min_overlap: int;
+        :param mismatch_frac: fraction of mismatches to allow in the overlapped region;
+        :type mismatch_frac: float;
+        :param gap_filling: apply gap-filling merging to pairs NGmerge has not merged;
+        :type gap_filling: bool;
+        :param n_thr: number of threads of NGmerge and blastn;
+        :type n_thr: int;
+        :param tmpdir: directory for temporary files (system default if None);
+        :type tmpdir: str;
+        :param aligner: aligner that places reads on reference sequences for gap-filling merging
+            (see 'read_merging_16S.ALIGNERS');
+        :type aligner: str;
+        :param hit_cache: path to persistent cache of hits of reads for gap-filling merging
+            (see 'src.hit_cache'; None -- no cache);
+        :type hit_cache: str;
+        :param blast_jobs: number of blastn processes that align reads of next chunks while reads
+            are merged (see 'read_merging_16S._prealigned_chunks'; None -- one blastn call at a time);
+        :type blast_jobs: int;
+        :param align_server: path to socket of the alignment server that aligns reads for gap-filling merging
+            (see 'src.alignment_server'; None -- reads are aligned by this process);
+        :type align_server: str;
+        """
+        if not os.access(ngmerge, os.X_OK):
+            raise MergingError("NGmerge file is not executable: '{}'".format(ngmerge))
+        # end if
+        if gap_filling:
+            read_merging_16S.check_silva_db(aligner)
+            if not hit_cache is None:
+                read_merging_16S.check_hit_cache(hit_cache)
+            # end if
+            if not align_server is None:
+                read_merging_16S.check_align_server(align_server, aligner)
+            # end if
+        # end if
+        self.ngmerge = ngmerge
+        self.phred_offset = phred_offset
+        self.num_N = num_N
+        self.min_overlap = min_overlap
+        self.mismatch_frac = mismatch_frac
+        self.gap_filling = gap_filling
+        self.n_thr = n_thr
+        self.aligner = aligner
+        self.hit_cache = hit_cache
+        self.blast_jobs = blast_jobs
+        self.align_server = align_server
+        self.tmpdir = tmpdir
+        self.stats = MergingStats()
+    # end def __init__
+
+    def merge(self, pairs):
+        """
+        Generator merges read pairs.
+        Pairs merged by NGmerge are yielded first (in input order),
+          then pairs remaining after NGmerge (in input order).
+
+        :param pairs: iterable of read pairs (see 'read_pairs');
+
+        Yields tuples (<is_merged>, <record>): if 'is_merged' is True, 'record' is merged FASTQ-record,
+          otherwise 'record' is the unmerged read pair.
+        """
+        workdir = tempfile.mkdtemp(prefix="preprocess16S_merging_", dir=self.tmpdir)
+        try:
+            read_paths = {"R1": os.path.join(workdir, "reads_R1.fastq"),
+                "R2": os.path.join(workdir, "reads_R2.fastq")}
+            if write_pairs(pairs, read_paths["R1"], read_paths["R2"]) == 0:
+                return
+            # end if
+
+            merged_path = os.path.join(workdir, "merged.fastq")
+            unmerged_prefix = os.path.join(workdir, "unmerged")
+            reads_processed, merged_reads = read_merging_16S.run_ngmerge(
+                read_merging_16S.ngmerge_command(self.ngmerge, read_paths, merged_path, unmerged_prefix,
+                    self.n_thr, self.min_overlap, self.mismatch_frac))
+            self.stats.merged += merged_reads
+
+            with open(merged_path, 'r') as merged_file:
+                while True:
+                    merged = read_fastq_pair({"R1": merged_file}, FORMATTING_FUNCS[0])
+                    if merged is None:
+                        break
+                    # end if
+                    yield (True, merged["R1"])
+                # end while
+            # end with
+
+            unmerged_paths = {"R1": unmerged_prefix + "_1.fastq", "R2": unmerged_prefix + "_2.fastq"}
+            chunks = fastq_read_packets(unmerged_paths, read_merging_16S._BLAST_CHUNK_SIZE)
+            if (self.gap_filling and not self.blast_jobs is None and self.aligner == "blastn"
+                    and self.align_server is None):
+                chunks = read_merging_16S._prealigned_chunks(chunks, self.blast_jobs, self.hit_cache)
+            else:
+                chunks = ((chunk, None) for chunk in chunks)
+            # end if
+            # Each distinct read pair of the call is placed on a reference sequence once
+            run_placements = read_merging_16S._RunPlacements()
+            try:
+                for chunk, chunk_hits in chunks:
+                    if self.gap_filling:
+                        # Reads of a chunk are aligned against the database with one blastn call
+                        #   (or they have been aligned in advance by blastn processes run at once)
+                        merge_res_list = read_merging_16S._merge_chunk_dereplicated(
+                            read_merging_16S._gap_filling_merging, chunk, run_placements, self.phred_offset,
+                            self.num_N, self.min_overlap, self.mismatch_frac, num_threads=self.n_thr,
+                            aligner=self.aligner, hit_cache=self.hit_cache, chunk_hits=chunk_hits,
+                            align_server=self.align_server)
+                    else:
+                        merge_res_list = [(1, None)] * len(chunk)
+                    # end if
+                    for fastq_recs, (merging_result, merged_strs) in zip(chunk, merge_res_list):
+                        if merging_result == 0:
+                            self.stats.merged += 1
+                            yield (True, {
+                                "seq_id": fastq_recs["R1"]["seq_id"],
+                                "seq": merged_strs["seq"],
+                                "opt_id": fastq_recs["R1"]["opt_id"],
+                                "qual_str": merged_strs["qual_str"]
+                            })
+                            continue
+                        elif merging_result != 1:
+                            raise MergingError("Read merging crashed on read pair '{}'. Please contact the developer."
+                                .format(fastq_recs["R1"]["seq_id"]))
+                        # end if
+                        self.stats.unmerged += 1
+                        yield (False, fastq_recs)
+                    # end for
+                # end for
+            finally:
+                chunks.close()
+            # end try
+        finally:
+            if self.gap_filling:
+                self.stats.add_gap_filling_stats(read_merging_16S.pop_gap_filling_stats())
+            # end if
+            shutil.rmtree(workdir)
+        # end try
+    # end def merge
+# end class ReadMerger
+
+
+def _classify_packet(primers, keep_primers, packet):
+    """
+    Function that performs task meant to be done by one process while parallel cross-talk detection.
+    Filter is kept in warm state of the worker (see 'src.executor.warm_state').
+
+    Returns tuple (<list of tuples (<is_16S>, <read_pair>)>, <sub-stage timers of the process>).
+    """
+    crosstalk_filter = executor.warm_state(("crosstalk_filter", tuple(primers), keep_primers),
+        lambda: CrosstalkFilter(primers, keep_primers))
+    match_start = perf_counter()
+    classified = list(crosstalk_filter.classify(packet))
+    run_report.add_substage_time("primer_matching", perf_counter() - match_start)
+    return (classified, run_report.pop_substage_timers())
+# end def _classify_packet
+
+
+def parallel_crosstalks(read_paths, result_paths, primers, keep_primers, n_thr, stats):
+    """
+    Function launches parallel cross-talk detection in the shared pool of processes (see 'src/executor.py').
+    Packets of read pairs are classified by workers; the calling process writes them to result files
+      in input order.
+
+    :param read_paths: dict of paths to read files ("R1" and "R2");
+    :type read_paths: dict<str: str>;
+    :param result_paths: dict of paths to result files ("mR1", "mR2", "trR1", "trR2");
+    :type result_paths: dict<str: str>;
+    :param primers: sequences of forward and reverse primers;
+    :type primers: list<str>;
+    :param keep_primers: do not trim primer sequences;
+    :type keep_primers: bool;
+    :param n_thr: number of worker processes;
+    :type n_thr: int;
+    :param stats: 'primer_stats' dict that will be updated;
+    :type stats: dict<str: int>;
+
+    Returns list of sub-stage timers collected in worker processes (see 'src.run_report.pop_substage_timers').
+    """
+    count_start = perf_counter()
+    how_to_open = OPEN_FUNCS[ get_archv_fmt_indx(read_paths["R1"]) ]
+    reads_at_all = int( sum(1 for line in how_to_open(read_paths["R1"])) / 4 )
+    run_report.add_substage_time("counting", perf_counter() - count_start)
+
+    substage_timers = list()
+    result_files = open_files(result_paths, open, 'w')
+    try:
+        packet_size, max_pending = executor.packet_plan(CROSSTALK_PACKET_SIZE, n_thr)
+        tasks = ((primers, keep_primers, packet) for packet in fastq_read_packets(read_paths, packet_size))
+        with progress.ProgressReporter(reads_at_all):
+            for classified, timers in executor.imap("crosstalks", _classify_packet, tasks, n_thr, max_pending):
+                write_start = perf_counter()
+                for is_16S, fastq_recs in classified:
+                    if is_16S:
+                        write_fastq_record(result_files["mR1"], fastq_recs["R1"])
+                        write_fastq_record(result_files["mR2"], fastq_recs["R2"])
+                        stats["match"] += 1
+                    else:
+                        write_fastq_record(result_files["trR1"], fastq_recs["R1"])
+                        write_fastq_record(result_files["trR2"], fastq_recs["R2"])
+                        stats["trash"] += 1
+                    # end if
+                # end for
+                run_report.add_substage_time("writing", perf_counter() - write_start)
+                substage_timers.append(timers)
+                executor.add_progress(len(classified))
+            # end for
+        # end with
+    finally:
+        close_files(result_files)
+    # end try
+
+    return substage_timers
+# end def parallel_crosstalks
+
+
+# This is a decorator.
+# All functions that process reads do some same operations: they open read files, open result files,
+#   they count how many reads are already processed.
+# So we will use one interface during multiple procedures.
+
+def progress_counter(process_func, read_paths, result_paths=None, **kwargs):
+
+    def organizer():
+
+        # Collect some info
+        file_type = get_archv_fmt_indx(read_paths["R1"])
+        how_to_open = OPEN_FUNCS[file_type]
+        actual_format_func = FORMATTING_FUNCS[file_type]
+        count_start = perf_counter()
+        readfile_length = sum(1 for line in how_to_open(read_paths["R1"]))  # lengths of read files are equal
+        read_pairs_num = int(readfile_length / 4)            # divizion by 4, since there are 4 lines per one fastq-record
+        run_report.add_substage_time("counting", perf_counter() - count_start)
+
+        # Open files
+        read_files = open_files(read_paths, how_to_open)
+        if not result_paths is None:
+            result_files = open_files(result_paths, open, 'w')
+        # end if
+
+        # Proceed
+        with progress.ProgressReporter(read_pairs_num):
+            for i in range(read_pairs_num):
+
+                read_start = perf_counter()
+                fastq_recs = read_fastq_pair(read_files, actual_format_func)
+                run_report.add_substage_time("reading", perf_counter() - read_start)
+
+                # Do what you need with these reads
+                if result_paths is not None:
+                    process_func(fastq_recs, result_files, **kwargs)
+                else:
+                    process_func(fastq_recs, **kwargs)    # result_files is None while calulating data for plotting
+                # end if
+
+                executor.add_progress()
+            # end for
+        # end with
+
+        close_files(read_files)
+        if not result_paths is None:
+            close_files(result_files)
+        # end if
+    # end def organizer
+
+    return organizer
+# end def progress_counter
+
+
+def _fastq_name(path):
+    # Returns name of FASTQ file without extentions
+    match = re.search(r"(.*)\.f(ast)?q", os.path.basename(path))
+    if match is None:
+        raise FastqError("File '{}' does not look like FASTQ file (.fastq or .fq extention is expected)"
+            .format(path))
+    # end if
+    return match.group(1)
+# end def _fastq_name
+
+
+def preprocess(read_paths, outdir_path, primers=None, primer_ids=None, keep_primers=False,
+    merge_reads=False, quality_plot=False, n_thr=1, phred_offset=33, ngmerge=DEFAULT_NGMERGE,
+    num_N=35, min_overlap=20, mismatch_frac=0.1, no_ovlp_merge=False, aligner="blastn", hit_cache=None,
+    blast_jobs=None, align_server=None, profile=False, sample_profile=False, version=None, ngmerge_thr=None, gzip_thr=None, tmpdir=None,
+    sample_size=None, sample_fraction=None, seed=None, max_memory=None):
+    """
+    Function runs the whole pipeline of 'preprocess16S.py' on a pair of FASTQ files:
+      cross-talk detection, (optionally) read merging and quality plotting, gzipping of result files.
+    Log file and JSON run report are written to 'outdir_path'.
+
+    :param read_paths: paths to files with forward ("R1") and reverse ("R2") reads;
+    :type read_paths: dict<str: str>;
+    :param outdir_path: directory, in which result files will be placed. It should be empty;
+    :type outdir_path: str;
+    :param primers: sequences of forward and reverse primers (default Illumina V3-V4 primers if None);
+    :type primers: list<str>;
+    :param primer_ids: IDs of primers (for log file);
+    :type primer_ids: list<str>;
+    Other parameters correspond to options of 'preprocess16S.py'. 'version' is written to run report.
+    'n_thr' is number of worker processes of Python stages. NGmerge threads ('ngmerge_thr')
+      and simultaneously running gzip processes ('gzip_thr') default to 'n_thr'.
+    If 'tmpdir' is specified, intermediate (uncompressed) files are placed in a temporary directory
+      created in 'tmpdir' (e.g. node-local SSD or '/dev/shm'), which is removed afterwards;
+      only gzipped result files, quality plot, log file and run report are written to 'outdir_path'.
+    If 'sample_size' (number of read pairs) or 'sample_fraction' is specified, the pipeline is run
+      on a random subset of read pairs (see 'src/subsample.py'; 'seed' is seed of random number generator).
+      Time of stages of the full run is estimated and written to log file and run report.
+    'max_memory' is memory budget (in bytes) for reads in flight between the reading process
+      and workers of parallel stages (see 'src.executor.packet_plan'). No budget if None.
+
+    Returns dict of the following structure:
+    {
+        "result_files": list of paths to gzipped result files,
+        "primer_stats": CrosstalkStats,
+        "merging_stats": MergingStats or None if reads were not merged,
+        "image_path": path to quality plot or None,
+        "log_path": path to log file,
+        "report_path": path to JSON run report,
+        "subsample": statistics of subsampling and estimated time of the full run
+            (None if all read pairs are processed)
+    }
+    Raises Preprocess16SError (or it's subclasses) and OSError on errors.
+    """
+
+    if not os.path.exists(outdir_path):
+        os.makedirs(outdir_path)
+    # end if
+
+    if not sample_size is None and not sample_fraction is None:
+        raise ValueError("Only one of 'sample_size' and 'sample_fraction' can be specified")
+    # end if
+
+    executor.set_max_memory(max_memory)
+
+    # Directory for intermediate files
+    workdir = outdir_path if tmpdir is None else tempfile.mkdtemp(prefix="preprocess16S_", dir=tmpdir)
+
+    try:
+        return _preprocess(read_paths, outdir_path, workdir, primers=primers, primer_ids=primer_ids,
+            keep_primers=keep_primers, merge_reads=merge_reads, quality_plot=quality_plot, n_thr=n_thr,
+            phred_offset=phred_offset, ngmerge=ngmerge, num_N=num_N, min_overlap=min_overlap,
+            mismatch_frac=mismatch_frac, no_ovlp_merge=no_ovlp_merge, aligner=aligner, hit_cache=hit_cache,
+            blast_jobs=blast_jobs, align_server=align_server, profile=profile,
+            sample_profile=sample_profile, version=version, ngmerge_thr=ngmerge_thr, gzip_thr=gzip_thr,
+            sample_size=sample_size, sample_fraction=sample_fraction, seed=seed)
+    finally:
+        if workdir != outdir_path:
+            shutil.rmtree(workdir, ignore_errors=True)
+        # end if
+    # end try
+# end def preprocess
+
+
+def _preprocess(read_paths, outdir_path, workdir, primers, primer_ids, keep_primers, merge_reads,
+    quality_plot, n_thr, phred_offset, ngmerge, num_N, min_overlap, mismatch_frac, no_ovlp_merge, aligner,
+    hit_cache, blast_jobs, align_server, profile, sample_profile, version, ngmerge_thr, gzip_thr, sample_size, sample_fraction, seed):
+    # Function does the job of 'preprocess'. Intermediate files are placed in 'workdir'
+    #   and result files are gzipped from it to 'outdir_path' (they are the same directory if 'tmpdir' is None).
+
+    run_report.reset()
+    run_start = strftime("%d_%m_%Y_%H_%M_%S", localtime(time()))
+
+    if primers is None:
+        primers, primer_ids = list(DEFAULT_PRIMERS), list(DEFAULT_PRIMER_IDS)
+    # end if
+    if primer_ids is None:
+        primer_ids = [">primer_{}".format(i+1) for i in range(len(primers))]
+    # end if
+
+    if merge_reads:
+        if not os.access(ngmerge, os.X_OK):
+            raise MergingError("NGmerge file is not executable: '{}'".format(ngmerge))
+        # end if
+        if no_ovlp_merge:
+            read_merging_16S.check_silva_db(aligner)
+            if not hit_cache is None:
+                read_merging_16S.check_hit_cache(hit_cache)
+            # end if
+            if not align_server is None:
+                read_merging_16S.check_align_server(align_server, aligner)
+            # end if
+        # end if
+    # end if
+
+    # I need to keep names of read files in memory in order to name result files properly.
+    names = dict()
+    for key, path in read_paths.items():
+        names[key] = _fastq_name(path)
+    # end for
+
+    if profile or sample_profile:
+        profiling.enable(os.path.join(outdir_path, "profiles"), cprofile=profile,
+            sample_interval=profiling.SAMPLE_INTERVAL if sample_profile else None)
+    # end if
+
+    # === Take a random subset of read pairs for subsampled QC run. ===
+    # 'input_paths' are files that are actually processed.
+    input_paths = read_paths
+    sampling = None
+    if not sample_size is None or not sample_fraction is None:
+        print("\n{} - Sampling read pairs...".format(get_work_time()))
+        run_report.start_stage("subsampling", bytes_in=run_report.files_size(read_paths))
+        input_paths, n_sampled, n_total = subsample.subsample_reads(read_paths,
+            os.path.join(workdir, "subsample"), sample_size, sample_fraction, seed)
+        run_report.end_stage("subsampling", reads=n_total, bytes_out=run_report.files_size(input_paths))
+        sampling = {
+            "sampled_pairs": n_sampled,
+            "total_pairs": n_total,
+            "fraction": round(n_sampled / n_total, 6) if n_total != 0 else None,
+            "seed": seed
+        }
+        print("{} - {} of {} read pairs are sampled".format(get_work_time(), n_sampled, n_total))
+    # end if
+
+    # === Create directory for trash. ===
+    artif_dir = os.path.join(workdir, "putative_artifacts")
+    if not os.path.exists(artif_dir):
+        os.makedirs(artif_dir)
+    # end if
+
+
+    # === Create and open result files. ===
+
+    files_to_gzip = list()
+    # Keys description:
+    # 'm' -- matched (i.e. sequence with primer in it);
+    # 'tr' -- trash (i.e. sequence without primer in it);
+    # I need to keep these paths in memory in order to gzip corresponding files afterwards.
+    result_paths = {
+        # We need trash anyway (trash without primers and, therefore, without 16S data):
+        "mR1": "{}{}{}.16S.fastq".format( workdir, os.sep, names["R1"]),
+        "mR2": "{}{}{}.16S.fastq".format( workdir, os.sep, names["R2"]),
+        "trR1": "{}{}{}.trash.fastq".format( artif_dir, os.sep, names["R1"]),
+        "trR2": "{}{}{}.trash.fastq".format( artif_dir, os.sep, names["R2"])
+    }
+
+    files_to_gzip.extend(result_paths.values())
+
+    primer_stats = {
+        "match": 0,           # number of read pairs with primers
+        "trash": 0            # number of cross-talks
+    }
+
+    print("\nFollowing files will be processed:")
+    for i, path in enumerate(read_paths.values()):
+        print("  {}. '{}'".format(i+1, os.path.abspath(path)))
+    # end for
+    if not sampling is None:
+        print("Only {} sampled read pairs will be processed;".format(sampling["sampled_pairs"]))
+    # end if
+
+    if workdir != outdir_path:
+        print("Intermediate files will be placed in '{}';".format(workdir))
+    # end if
+    print("Number of threads: {};".format(n_thr))
+    print("Phred offset: {};".format(phred_offset))
+    if keep_primers:
+        print("Primer sequences will not be trimmed.")
+    # end if
+    if merge_reads:
+        print("Reads will be merged together.")
+    # end if
+    if quality_plot:
+        print("Quality plot will be created.")
+    # end if
+    print('-'*20+'\n')
+
+
+    # |===== Start the process of searching for cross-talks =====|
+
+    print("{} - Searching for cross-talks started".format(get_work_time()))
+    print("Proceeding...\n")
+
+    run_report.start_stage("crosstalks", n_workers=n_thr, bytes_in=run_report.files_size(input_paths))
+    substage_timers = None
+    if n_thr == 1:
+        primer_task = progress_counter(find_primer_organizer, input_paths, result_paths,
+            primers=primers, stats=primer_stats, keep_primers=keep_primers)
+        primer_task()
+        del primer_task
+    else:
+        substage_timers = parallel_crosstalks(input_paths, result_paths, primers, keep_primers,
+            n_thr, primer_stats)
+    # end if
+    run_report.end_stage("crosstalks", reads=primer_stats["match"] + primer_stats["trash"],
+        bytes_out=run_report.files_size(result_paths), substages=substage_timers)
+    crosstalk_stats = CrosstalkStats(primer_stats["match"], primer_stats["trash"])
+
+    print("{} - Searching for cross-talks is completed".format(get_work_time()))
+    print("""{} read pairs have been processed.
+{} read pairs with primer sequences have been detected.
+{} cross-talk read pairs have been detected.""".format(crosstalk_stats.total(),
+        crosstalk_stats.match, crosstalk_stats.trash))
+
+    cr_talk_rate = crosstalk_stats.crosstalk_rate()
+    print("I.e. cross-talk rate is {}%".format(cr_talk_rate))
+    print('\n' + '~' * 50)
+
+    # |===== The process of searching for cross-talks is completed =====|
+
+
+    # |===== Start merging reads =====|
+
+    merging_stats = None
+    if merge_reads:
+
+        merge_result_files = read_merging_16S.merge_reads(result_paths["mR1"], result_paths["mR2"],
+            ngmerge=ngmerge, outdir_path=workdir, n_thr=n_thr, phred_offset=phred_offset,
+            num_N=num_N, min_overlap=min_overlap, mismatch_frac=mismatch_frac, no_ovlp_merge=no_ovlp_merge,
+            ngmerge_thr=ngmerge_thr, aligner=aligner, hit_cache=hit_cache,
+            blast_jobs=blast_jobs, align_server=align_server)
+        merging_stats = MergingStats(*(read_merging_16S.get_merging_stats()[i] for i in (0, 1)))
+        if not read_merging_16S.get_gap_filling_stats() is None:
+            merging_stats.add_gap_filling_stats(read_merging_16S.get_gap_filling_stats())
+        # end if
+
+        files_to_gzip.extend(merge_result_files.values())
+    # end if
+
+    # |===== The process of merging reads is completed =====|
+
+
+    # |===== Create a quality plot =====|
+
+    image_path = None
+    if quality_plot:
+
+        # Function for getting Q value from Phred-encoded character:
+        def substr_phred_offs(q_symb):
+            return ord(q_symb) - phred_offset
+        # end def substr_phred_offs
+
+        if merge_reads:
+            data_plotting_paths = {
+                "R1": merge_result_files["merg"]
+            }
+        else:
+            data_plotting_paths = {
+                "R1": result_paths["mR1"],
+                "R2": result_paths["mR2"]
+            }
+        # end if
+
+        print("\n{} - Calculations for plotting started".format(get_work_time()))
+        print("Proceeding...\n")
+        run_report.start_stage("quality_plot", n_workers=n_thr,
+            bytes_in=run_report.files_size(data_plotting_paths))
+
+        if n_thr == 1:
+            from src import quality_plot as qual_plot_module
+            qual_plot_module.Y[:] = 0 # forget distribution of the previous run
+            plotting_task = progress_counter(qual_plot_module.calc_qual_disrib, data_plotting_paths,
+                substr_phred_offs=substr_phred_offs)
+            plotting_task()
+            del plotting_task
+            image_path = qual_plot_module.create_plot(outdir_path, phred_offset)
+        else:
+            from src import parallel_quality_plot
+            Y = parallel_quality_plot.parallel_qual(data_plotting_paths, n_thr, phred_offset)
+            image_path = parallel_quality_plot.create_plot(Y, outdir_path, phred_offset)
+        # end if
+        run_report.end_stage("quality_plot",
+            reads=crosstalk_stats.match if not merge_reads else merging_stats.merged,
+            bytes_out=run_report.files_size([image_path]))
+
+        print("{} - Calculations for plotting are completed".format(get_work_time()))
+        print('\n' + '~' * 50)
+    # end if
+
+    # |===== The process of plotting is completed =====|
+
+
+    # Remove empty files
+    for file in files_to_gzip:
+        if os.stat(file).st_size == 0:
+            os.remove(file)
+            print("'{}' is removed since it is empty".format(file))
+        # end if
+    # end for
+
+    # Subsampled read files are not needed anymore
+    if not sampling is None:
+        shutil.rmtree(os.path.dirname(input_paths["R1"]))
+    # end if
+
+    print("\n{} - Gzipping result files...".format(get_work_time()))
+    if gzip_thr is None:
+        gzip_thr = n_thr
+    # end if
+    run_report.start_stage("gzip", n_workers=gzip_thr, bytes_in=run_report.files_size(files_to_gzip))
+    result_files = gzip_files(files_to_gzip, gzip_thr, src_dir=workdir, dest_dir=outdir_path)
+    run_report.end_stage("gzip", bytes_out=run_report.files_size(result_files))
+    print("{} - Gzipping is completed\n".format(get_work_time()))
+    print("Result files are placed in the following directory:\n  '{}'\n".format(os.path.abspath(outdir_path)))
+
+    folded_path = profiling.finish()
+
+    if not sampling is None:
+        # Subsampling itself is not a part of the full run
+        sampling["estimated_full_run"] = subsample.extrapolate_stages(
+            [stage for stage in run_report.get_stages() if stage["name"] != "subsampling"],
+            sampling["sampled_pairs"], sampling["total_pairs"])
+        print("Estimated time of the full run: {} s (x{} of this run)\n".format(
+            sampling["estimated_full_run"]["wall_time"], sampling["estimated_full_run"]["scale"]))
+    # end if
+
+    # Create log file
+    log_path = "{}{}preprocess16S_{}.log".format(outdir_path, os.sep, run_start).replace(" ", "_")
+    report_path = "{}{}preprocess16S_{}.report.json".format(outdir_path, os.sep, run_start).replace(" ", "_")
+    with open(log_path, 'w') as logfile:
+
+        logfile.write("Script 'preprocess_16S.py' was run at {}\n".format(run_start))
+        end_time = strftime("%d_%m_%Y_%H_%M_%S", localtime(time()))
+        logfile.write("Script completed it's job at {}\n".format(end_time))
+
+        logfile.write("Phred offset: {}.\n\n".format(phred_offset))
+        logfile.write("Number of threads used: {}.\n".format(n_thr))
+
+        logfile.write("Primer sequences:\n\n")
+
+        for i in range(len(primers)):
+            logfile.write("{}\n".format(primer_ids[i]))
+            logfile.write("{}\n".format(primers[i]))
+        # end for
+
+        logfile.write("\nFollowing files have been processed:\n")
+        logfile.write("  '{}'\n  '{}'\n\n".format(os.path.abspath(read_paths["R1"]), os.path.abspath(read_paths["R2"])))
+
+        logfile.write("""{} read pairs have been processed.
+{} read pairs with primer sequences have been detected.
+{} cross-talk read pairs have been detected.\n""".format(crosstalk_stats.total(),
+            crosstalk_stats.match, crosstalk_stats.trash))
+
+        logfile.write("I.e. cross-talk rate is {}%\n\n".format(cr_talk_rate))
+
+        if keep_primers:
+            logfile.write("Primer sequences were not trimmed.\n")
+        # end if
+
+        if not sampling is None:
+            logfile.write("\n\tSubsampled QC run\n\n")
+            logfile.write("{} of {} read pairs were sampled and processed.\n".format(sampling["sampled_pairs"],
+                sampling["total_pairs"]))
+            logfile.write("Estimated time of stages of the full run:\n")
+            for name, estimate in sampling["estimated_full_run"]["stages"].items():
+                logfile.write("  {}: {} s\n".format(name, estimate["wall_time"]))
+            # end for
+            logfile.write("  total: {} s\n".format(sampling["estimated_full_run"]["wall_time"]))
+        # end if
+
+        if merge_reads:
+            logfile.write("\n\tReads were merged\n\n")
+            logfile.write("{} read pairs have been merged.\n".format(merging_stats.merged))
+            logfile.write("{} read pairs haven't been merged.\n".format(merging_stats.unmerged))
+            if not merging_stats.outcomes is None:
+                logfile.write("Outcomes of gap-filling merging:\n")
+                for outcome, count in merging_stats.outcomes.items():
+                    logfile.write("  {}: {}\n".format(outcome, count))
+                # end for
+                logfile.write("Reference sequences: {lookups} lookups, {fetched} retrieved in {batches} batches; hit rate {hit_rate}\n"
+                    .format(**merging_stats.as_dict()["reference_cache"]))
+                logfile.write("Read pairs: {pairs} pairs, {placed_pairs} placed on references; {ratio} pairs per placement\n"
+                    .format(**merging_stats.as_dict()["dereplication"]))
+                if merging_stats.hit_cache["lookups"] != 0:
+                    logfile.write("Cache of hits: {lookups} lookups, {hits} hits, {stored} stored, {evicted} evicted; hit rate {hit_rate}\n"
+                        .format(**merging_stats.as_dict()["hit_cache"]))
+                # end if
+            # end if
+        # end if
+
+        logfile.write("\nResults are in the following directory:\n  '{}'\n".format(outdir_path))
+
+        if quality_plot:
+            logfile.write("\nQuality plot was created. Here it is: \n  '{}'\n".format(image_path))
+        # end if
+
+        logfile.write("\nRun report (timing and throughput of stages):\n  '{}'\n".format(report_path))
+
+        if profile:
+            logfile.write("\n\tProfiling summary\n")
+            for stage, stage_pstats, summary in profiling.get_summaries():
+                logfile.write("\nStage '{}'. Full profile: '{}'\n\n".format(stage, stage_pstats))
+                logfile.write(summary)
+            # end for
+        # end if
+
+        if sample_profile:
+            logfile.write("\nSampled stacks (flame graph format) are in the following directory:\n  '{}'\n"
+                .format(os.path.dirname(folded_path)))
+        # end if
+
+        logfile.flush()
+    # end with
+
+    # Create JSON run report
+    run_info = {
+        "program": "preprocess16S",
+        "version": version,
+        "n_threads": n_thr,
+        "input_files": [os.path.abspath(read_paths["R1"]), os.path.abspath(read_paths["R2"])],
+        "outdir": outdir_path,
+        "primer_stats": crosstalk_stats.as_dict()
+    }
+    if merge_reads:
+        run_info["merging_stats"] = merging_stats.as_dict()
+    # end if
+    if not sampling is None:
+        run_info["subsample"] = sampling
+    # end if
+    run_report.write_report(report_path, **run_info)
+
+    return {
+        "result_files": result_files,
+        "primer_stats": crosstalk_stats,
+        "merging_stats": merging_stats,
+        "image_path": image_path,
+        "log_path": log_path,
+        "report_path": report_path,
+        "subsample": sampling
+    }
+# end def _preprocess
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+# Module runs preprocessing (see 'src.api.preprocess') of many samples listed in a sample sheet.
+#
+# Samples are processed concurrently, each one in a separate process with it's own output directory
+#   '<outdir>/<sample_name>' (console output of a sample goes to file 'console.log' in this directory).
+# Total budget of cores is split between samples running at the same time and, inside a sample,
+#   between Python worker processes, threads of NGmerge and gzip processes (see 'sample_threads').
+# Statistics of all samples are gathered into one table (see 'write_stats_table').
+
+import os
+import re
+import sys
+import traceback
+import multiprocessing as mp
+from multiprocessing.connection import wait as mp_wait
+
+from src.printing import *
+from src.errors import Preprocess16SError, SampleSheetError
+from src import executor
+from src import api
+
+
+# Samples with input files smaller than this (in bytes) are processed by Python stages in the main
+#   process of the sample: starting worker processes and transferring reads to them costs more than it saves.
+SMALL_SAMPLE_SIZE = 50 * 2**20
+
+# Columns of the table of statistics
+STATS_COLUMNS = ("sample", "status", "read_pairs", "primer_pairs", "crosstalks", "crosstalk_rate",
+    "merged", "unmerged", "threads", "wall_time", "outdir")
+
+
+class Sample:
+    """
+    Class Sample is dedicated to perform a sample of a sample sheet.
+
+    :field name: name of the sample (name of it's output directory);
+    :type name: str;
+    :field R1: path to file with forward reads;
+    :type R1: str;
+    :field R2: path to file with reverse reads;
+    :type R2: str;
+
+    :method size: returns total size of read files in bytes;
+    """
+
+    def __init__(self, name, R1, R2):
+        self.name = name
+        self.R1 = R1
+        self.R2 = R2
+    # end def __init__
+
+    def size(self):
+        return os.path.getsize(self.R1) + os.path.getsize(self.R2)
+    # end def size
+# end class Sample
+
+
+def _sample_name(R1_path):
+    # Name of a sample is the name of file of forward reads without "R1" and extension
+    #   (the same name is given to file of merged reads in 'read_merging_16S.merge_reads').
+    name = api._fastq_name(R1_path)
+    if "R1" in name:
+        name = name[: name.rfind("R1")]
+    # end if
+    return name.strip("_.-")
+# end def _sample_name
+
+
+def read_sample_sheet(sheet_path):
+    """
+    Function reads a sample sheet. It is a text file with one sample per line.
+    Fields are separated with tabs or commas:
+        <sample_name> <R1_path> <R2_path>
+      or
+        <R1_path> <R2_path>
+      (the name is derived from name of R1 file in the last case).
+    Empty lines and lines starting with '#' are ignored, as well as a header line
+      ("sample,R1,R2" or "R1,R2"). Relative paths are relative to directory of the sample sheet.
+
+    :param sheet_path: path to sample sheet;
+    :type sheet_path: str;
+
+    Returns list<Sample> in order of the sample sheet.
+    Raises SampleSheetError if sample sheet cannot be read or is invalid.
+    """
+    sheet_dir = os.path.dirname(os.path.abspath(sheet_path))
+    samples = list()
+
+    try:
+        with open(sheet_path, 'r') as sheet_file:
+            lines = sheet_file.readlines()
+        # end with
+    except OSError as oserror:
+        raise SampleSheetError("Error while reading sample sheet: {}".format(oserror)) from oserror
+    # end try
+
+    for line_num, line in enumerate(lines, 1):
+        line = line.strip()
+        if line == "" or line.startswith('#'):
+            continue
+        # end if
+
+        fields = [field.strip() for field in re.split(r"[\t,]", line)]
+        if [field.upper() for field in fields[-2:]] == ["R1", "R2"]:
+            continue # header
+        # end if
+
+        if len(fields) == 3:
+            name, R1_path, R2_path = fields
+        elif len(fields) == 2:
+            R1_path, R2_path = fields
+            name = _sample_name(R1_path)
+        else:
+            raise SampleSheetError("Line {} of sample sheet '{}': 2 or 3 fields expected, {} found"
+                .format(line_num, sheet_path, len(fields)))
+        # end if
+
+        if name == "" or os.sep in name or name in (".", ".."):
+            raise SampleSheetError("Line {} of sample sheet '{}': invalid sample name '{}'"
+                .format(line_num, sheet_path, name))
+        # end if
+
+        read_paths = list()
+        for path in (R1_path, R2_path):
+            path = os.path.join(sheet_dir, os.path.expanduser(path))
+            if not os.path.isfile(path):
+                raise SampleSheetError("Line {} of sample sheet '{}': file '{}' does not exist"
+                    .format(line_num, sheet_path, path))
+            # end if
+            read_paths.append(path)
+        # end for
+
+        samples.append(Sample(name, *read_paths))
+    # end for
+
+    if len(samples) == 0:
+        raise SampleSheetError("Sample sheet '{}' contains no samples".format(sheet_path))
+    # end if
+
+    names = [sample.name for sample in samples]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if len(duplicates) != 0:
+        raise SampleSheetError("Sample names are not unique: {}".format(", ".join(duplicates)))
+    # end if
+
+    return samples
+# end def read_sample_sheet
+
+
+def sample_threads(free_cores, n_slots, sample_size):
+    """
+    Function splits cores for a sample that is being started.
+    Free cores are divided evenly between samples that can be started now ('n_slots'),
+      at least one core per sample. Samples are started from the largest one, so the remainder of
+      the division goes to the samples started first (division is rounded up). Stages of a sample run one after another, so each of
+      NGmerge, Python worker processes and gzip can use all cores of the sample.
+      Small samples (see 'SMALL_SAMPLE_SIZE') are processed by Python stages without worker processes.
+
+    :param free_cores: number of cores not used by running samples;
+    :type free_cores: int;
+    :param n_slots: number of samples that can be started now (including this one);
+    :type n_slots: int;
+    :param sample_size: total size of read files of the sample in bytes;
+    :type sample_size: int;
+
+    Returns dict<str: int> of the following structure:
+    {
+        "cores": number of cores given to the sample,
+        "n_thr": number of Python worker processes,
+        "ngmerge_thr": number of threads of NGmerge,
+        "gzip_thr": number of simultaneously running gzip processes
+    }
+    """
+    cores = max(1, -(-free_cores // max(1, n_slots)))
+    return {
+        "cores": cores,
+        "n_thr": 1 if sample_size < SMALL_SAMPLE_SIZE else cores,
+        "ngmerge_thr": cores,
+        "gzip_thr": cores
+    }
+# end def sample_threads
+
+
+def _run_sample(sample, outdir_path, threads, params, conn):
+    # Function processes one sample in a child process and sends it's row of the table of statistics
+    #   through connection 'conn'.
+
+    sample_outdir = os.path.join(outdir_path, sample.name)
+    os.makedirs(sample_outdir)
+    console = open(os.path.join(sample_outdir, "console.log"), 'w')
+    sys.stdout = sys.stderr = console
+
+    result = {
+        "sample": sample.name,
+        "status": "ok",
+        "threads": threads["cores"],
+        "outdir": sample_outdir
+    }
+    start = perf_counter()
+    try:
+        preprocess_result = api.preprocess({"R1": sample.R1, "R2": sample.R2}, sample_outdir,
+            n_thr=threads["n_thr"], ngmerge_thr=threads["ngmerge_thr"], gzip_thr=threads["gzip_thr"], **params)
+        primer_stats = preprocess_result["primer_stats"]
+        result["read_pairs"] = primer_stats.total()
+        result["primer_pairs"] = primer_stats.match
+        result["crosstalks"] = primer_stats.trash
+        result["crosstalk_rate"] = primer_stats.crosstalk_rate()
+        if not preprocess_result["merging_stats"] is None:
+            result["merged"] = preprocess_result["merging_stats"].merged
+            result["unmerged"] = preprocess_result["merging_stats"].unmerged
+        # end if
+    except (Preprocess16SError, OSError) as err:
+        print_error(str(err))
+        result["status"] = "error: {}".format(str(err).splitlines()[0] if str(err) else type(err).__name__)
+    except Exception as err:
+        traceback.print_exc()
+        result["status"] = "error: unexpected {}: {}".format(type(err).__name__, err)
+    finally:
+        executor.shutdown()
+        result["wall_time"] = round(perf_counter() - start, 3)
+        console.close()
+        conn.send(result)
+        conn.close()
+    # end try
+# end def _run_sample
+
+
+def run_batch(samples, outdir_path, n_cores, max_concurrent=None, **params):
+    """
+    Function preprocesses samples concurrently. Output of each sample is placed in directory
+      '<outdir_path>/<sample_name>', which must not exist.
+    Larger samples are started first. Cores of a finished sample are given to samples started after it.
+
+    :param samples: samples to process;
+    :type samples: list<Sample>;
+    :param outdir_path: output directory of the batch;
+    :type outdir_path: str;
+    :param n_cores: total number of cores the batch can use;
+    :type n_cores: int;
+    :param max_concurrent: maximum number of samples processed at the same time ('n_cores' if None);
+    :type max_concurrent: int;
+    Other keyword arguments are passed to 'src.api.preprocess' (except 'n_thr', 'ngmerge_thr' and 'gzip_thr').
+      'max_memory' is the budget of the whole batch: each sample gets a share proportional to it's cores.
+
+    Returns list of rows of the table of statistics (dict<str: object>, see 'STATS_COLUMNS')
+      in order of 'samples'. Failed samples have "status" "error: <message>".
+    """
+    if max_concurrent is None:
+        max_concurrent = n_cores
+    # end if
+
+    waiting = sorted(samples, key=lambda sample: sample.size(), reverse=True)
+    running = dict() # connection: (process, sample, threads)
+    results = dict()
+    free_cores = n_cores
+
+    while len(waiting) != 0 or len(running) != 0:
+
+        # Start as many samples as cores and 'max_concurrent' allow
+        while len(waiting) != 0 and free_cores > 0 and len(running) < max_concurrent:
+            n_slots = min(max_concurrent - len(running), len(waiting))
+            sample = waiting.pop(0)
+            threads = sample_threads(free_cores, n_slots, sample.size())
+            sample_params = params
+            if not params.get("max_memory") is None:
+                # Memory budget of the batch is split between samples as cores are
+                sample_params = dict(params, max_memory=params["max_memory"] * threads["cores"] // n_cores)
+            # end if
+            parent_conn, child_conn = mp.Pipe(duplex=False)
+            proc = mp.Process(target=_run_sample, args=(sample, outdir_path, threads, sample_params, child_conn))
+            proc.start()
+            child_conn.close()
+            running[parent_conn] = (proc, sample, threads)
+            free_cores -= threads["cores"]
+            print("{} - Sample '{}' is started ({} cores)".format(get_work_time(), sample.name, threads["cores"]))
+        # end while
+
+        # Wait for samples to finish
+        for conn in mp_wait(list(running.keys())):
+            proc, sample, threads = running.pop(conn)
+            try:
+                result = conn.recv()
+            except EOFError:
+                result = {"sample": sample.name, "threads": threads["cores"],
+                    "outdir": os.path.join(outdir_path, sample.name)}
+            # end try
+            conn.close()
+            proc.join()
+            if not "status" in result:
+                result["status"] = "error: process exited with code {}".format(proc.exitcode)
+            # end if
+            results[sample.name] = result
+            free_cores += threads["cores"]
+            print("{} - Sample '{}' is completed: {}".format(get_work_time(), sample.name, result["status"]))
+        # end for
+    # end while
+
+    return [results[sample.name] for sample in samples]
+# end def run_batch
+
+
+def total_row(results):
+    """
+    Function sums statistics of successfully processed samples.
+
+    Returns row of the table of statistics (dict<str: object>) with sample name "TOTAL".
+    """
+    completed = [result for result in results if result["status"] == "ok"]
+    total = {"sample": "TOTAL", "status": "{}/{} ok".format(len(completed), len(results))}
+    for column in ("read_pairs", "primer_pairs", "crosstalks", "merged", "unmerged"):
+        values = [result[column] for result in completed if column in result]
+        if len(values) != 0:
+            total[column] = sum(values)
+        # end if
+    # end for
+    if total.get("read_pairs", 0) != 0:
+        total["crosstalk_rate"] = round(100 * total["crosstalks"] / total["read_pairs"], 3)
+    # end if
+    total["wall_time"] = round(max((result.get("wall_time", 0) for result in results), default=0), 3)
+    return total
+# end def total_row
+
+
+def write_stats_table(table_path, results):
+    """
+    Function writes table of statistics of samples (tab-separated, one sample per line)
+      followed by the "TOTAL" row (see 'total_row'). Missing values are written as "NA".
+
+    :param table_path: path to the table;
+    :type table_path: str;
+    :param results: rows returned by 'run_batch';
+    :type results: list< dict<str: object> >;
+    """
+    with open(table_path, 'w') as table_file:
+        table_file.write('\t'.join(STATS_COLUMNS) + '\n')
+        for row in results + [total_row(results)]:
+            table_file.write('\t'.join(str(row.get(column, "NA")) for column in STATS_COLUMNS) + '\n')
+        # end for
+    # end with
+# end def write_stats_table
@@ -3,6 +3,8 @@
 # __last_update_date__ = "2020-08-07"
 
 from src.fastq import *
+from src.errors import PrimerError
+from src.run_report import add_substage_time
 import re
 
 
@@ -39,72 +41,89 @@ MATCH_DICT = {
 #    corresponding position in primer sequence, this A-nucleotide will be considered as matching.
 # 'N'-nucleotide in read sequence can not match anything.
 
+# Compiled primer matchers (see 'compile_primer' function): dict<str: tuple<frozenset<str>>>.
+# They are compiled once per process, so worker processes of the shared pool (see 'src/executor.py')
+#   keep them between tasks.
+_primer_matchers = dict()
+
+
+# Illumina V3-V4 primers -- they are used if primers are not specified.
+DEFAULT_PRIMERS = ["CCTACGGGNGGCWGCAG", "GACTACHVGGGTATCTAATCC"]
+DEFAULT_PRIMER_IDS = [">16S Amplicon PCR Forward Primer", ">16S Amplicon PCR Reverse Primer"]
+
 
 def get_primers(argv, primer_path):
     """
     Function returns primers sequeces and IDs. It returns default Illumina 16S amplicon primers
-      if no primers were specified with '-p' option. Otherwise it parses primers from '-p' file.
+      if no primer file is specified. Otherwise it parses primers from the file.
 
-    :param argv: command-line arguments [1:];
+    :param argv: command-line arguments [1:]. Not used, kept for compatibility;
     :type argv: same type as sys.argv;
-    :param primer_path: path to multi-fasta file with primers;
+    :param primer_path: path to multi-fasta file with primers or None;
     :type primer_path: str;
 
     Returns tuple of two lists:
     ([<primer_1_seq>, <primer_2_seq>], [<primer_1_ID>, <primer_2_ID>])
+    Raises PrimerError if primer file cannot be read or contains invalid primers.
     """
 
     # Use Illumina V3-V4 primers if they are not specified
-    if not "-p" in argv and not "--primers" in argv:
-        primers = ["CCTACGGGNGGCWGCAG", "GACTACHVGGGTATCTAATCC"]     # list of required primer sequences
-        primer_ids = [">16S Amplicon PCR Forward Primer", ">16S Amplicon PCR Reverse Primer"]  # list of their names
-    else:
-        # Variable named 'file_type' below will be 0(zero) if primers are in plain FASTA file
-        #   and 1(one) if they are in fasta.gz file
-        # If primers are in .gz file, it will be opened as .gz file and as standard text file otherwise.
-        file_type = get_archv_fmt_indx(primer_path)
-        how_to_open = OPEN_FUNCS[file_type]
-        actual_format_func = FORMATTING_FUNCS[file_type]
-
-        primers = list()
-        primer_ids = list()
-        # Assuming that each primer sequence is written in one line
-        primer_file = None
-        try:
-            primer_file = how_to_open(primer_path, 'r')
-            for i, line in enumerate(primer_file):
-                if i % 2 == 0:                                            # if line is sequense id
-                    primer_ids.append(actual_format_func(line))
-                
-                else:                                                     # if line is a sequence
-                    line = actual_format_func(line).upper()
-                    err_set = set(fre.indall(r"[^ATGCRYSWKMBDHVN]", line))     # primer validation
-                    if len(err_set) != 0:
-                        print_error("There are some inappropriate symbols in your primers!")
-                        print("Here they are:")
-                        for err_symb in err_set:
-                            print(" " + err_symb)
-                        # end for
-                        
-                        print("See you later with correct data")
-                        input("Press enter to exit:")
-                        exit(1)
-                    # end if
-                    
-                    primers.append(line)
-                # end if
-            # end for
-        except OSError as oserror:
-            print("Error while reading primer file.\n", str(oserror))
-            input("Press enter to exit:")
-            exit(1)
-        finally:
-            if primer_file is not None:
-                primer_file.close()
-            # end if
-        # end try
+    if primer_path is None:
+        return ( list(DEFAULT_PRIMERS), list(DEFAULT_PRIMER_IDS) )
     # end if
 
+    return read_primers(primer_path)
+# end def get_primers
+
+
+def read_primers(primer_path):
+    """
+    Function parses primer sequences and IDs from multi-FASTA file (one line per sequence).
+    File can be gzipped.
+
+    :param primer_path: path to multi-fasta file with primers;
+    :type primer_path: str;
+
+    Returns tuple of two lists:
+    ([<primer_1_seq>, <primer_2_seq>], [<primer_1_ID>, <primer_2_ID>])
+    Raises PrimerError if primer file cannot be read or contains invalid primers.
+    """
+
+    # Variable named 'file_type' below will be 0(zero) if primers are in plain FASTA file
+    #   and 1(one) if they are in fasta.gz file
+    # If primers are in .gz file, it will be opened as .gz file and as standard text file otherwise.
+    file_type = get_archv_fmt_indx(primer_path)
+    how_to_open = OPEN_FUNCS[file_type]
+    actual_format_func = FORMATTING_FUNCS[file_type]
+
+    primers = list()
+    primer_ids = list()
+    # Assuming that each primer sequence is written in one line
+    primer_file = None
+    try:
+        primer_file = how_to_open(primer_path, 'r')
+        for i, line in enumerate(primer_file):
+            if i % 2 == 0:                                            # if line is sequense id
+                primer_ids.append(actual_format_func(line))
+
+            else:                                                     # if line is a sequence
+                line = actual_format_func(line).upper()
+                err_set = set(re.findall(r"[^ATGCRYSWKMBDHVN]", line))     # primer validation
+                if len(err_set) != 0:
+                    raise PrimerError("There are some inappropriate symbols in your primers: {}"
+                        .format(", ".join(sorted(err_set))))
+                # end if
+
+                primers.append(line)
+            # end if
+        # end for
+    except OSError as oserror:
+        raise PrimerError("Error while reading primer file: {}".format(oserror)) from oserror
+    finally:
+        if primer_file is not None:
+            primer_file.close()
+        # end if
+    # end try
 
     # The last line in fasta file can be a blank line.
     # We do not need it.
@@ -115,8 +134,23 @@ def get_primers(argv, primer_path):
     # end try
 
     return ( primers, primer_ids )
+# end def read_primers
 
-# end def get_primers
+
+def compile_primer(primer):
+    """
+    Function "compiles" a primer sequence: for each position of the primer it computes set
+      of read nucleotides that match the symbol at this position (according to MATCH_DICT).
+    Thus matching of a read nucleotide is a single set lookup.
+
+    :param primer: primer sequence;
+    :type primer: str;
+
+    Returns tuple<frozenset<str>>.
+    """
+    return tuple( frozenset(nucl for nucl, symbols in MATCH_DICT.items() if symb in symbols)
+        for symb in primer )
+# end def compile_primer
 
 
 def find_primer(primer, fastq_rec, keep_primers):
@@ -140,12 +174,17 @@ def find_primer(primer, fastq_rec, keep_primers):
     read = fastq_rec["seq"]
     primer_len = len(primer)
 
+    matcher = _primer_matchers.get(primer)
+    if matcher is None:
+        matcher = _primer_matchers[primer] = compile_primer(primer)
+    # end if
+
     for shift in range(0, MAX_SHIFT + 1):
         score_1, score_2 = 0, 0
 
         for pos in range(0, primer_len - shift):
             # if match, 1(one) will be added to score, 0(zero) otherwise
-            score_1 += primer[pos+shift] in MATCH_DICT[read[pos]]
+            score_1 += read[pos] in matcher[pos+shift]
         # end for
         
         if score_1 / (primer_len-shift) >= RECOGN_PERCENTAGE:
@@ -165,7 +204,7 @@ def find_primer(primer, fastq_rec, keep_primers):
         shift += 1
 
         for pos in range(0, primer_len - shift):
-            score_2 += primer[pos] in MATCH_DICT[read[pos + shift]]
+            score_2 += read[pos + shift] in matcher[pos]
         # end for
         
         if score_2 / (primer_len) >= RECOGN_PERCENTAGE:
@@ -194,19 +233,20 @@ def find_primer_organizer(fastq_recs, result_files, **kwargs):
     primers = kwargs["primers"]
     keep_primers = kwargs["keep_primers"]
 
+    match_start = perf_counter()
     primer_in_R1 = find_primer(primers[0], fastq_recs["R1"], keep_primers)
-    if primer_in_R1:
-
-        primer_in_R2 = find_primer(primers[1], fastq_recs["R2"], keep_primers)
-
-        if primer_in_R2:
-            write_fastq_record(result_files["mR1"], fastq_recs["R1"])
-            write_fastq_record(result_files["mR2"], fastq_recs["R2"])
-            stats["match"] += 1
-            return
-        # end if
+    primer_in_R2 = primer_in_R1 and find_primer(primers[1], fastq_recs["R2"], keep_primers)
+    write_start = perf_counter()
+    add_substage_time("primer_matching", write_start - match_start)
+
+    if primer_in_R2:
+        write_fastq_record(result_files["mR1"], fastq_recs["R1"])
+        write_fastq_record(result_files["mR2"], fastq_recs["R2"])
+        stats["match"] += 1
+    else:
+        write_fastq_record(result_files["trR1"], fastq_recs["R1"])
+        write_fastq_record(result_files["trR2"], fastq_recs["R2"])
+        stats["trash"] += 1
     # end if
-    write_fastq_record(result_files["trR1"], fastq_recs["R1"])
-    write_fastq_record(result_files["trR2"], fastq_recs["R2"])
-    stats["trash"] += 1
+    add_substage_time("writing", perf_counter() - write_start)
 # end def find_primer_organizer
\ No newline at end of file
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Exceptions raised by modules of preprocess16S instead of terminating the interpreter.
+# Scripts catch them, print error message and exit; programs that import these modules
+#   (see 'src/api.py') can handle them as they need.
+
+
+class Preprocess16SError(Exception):
+    """
+    Base class of all errors of preprocess16S.
+    Is subclass of Exception.
+    """
+    pass
+# end class Preprocess16SError
+
+
+class FastqError(Preprocess16SError):
+    """
+    An exception meant to be raised when FASTQ data cannot be read or written.
+    """
+    pass
+# end class FastqError
+
+
+class PrimerError(Preprocess16SError):
+    """
+    An exception meant to be raised when primer file cannot be read or contains invalid primers.
+    """
+    pass
+# end class PrimerError
+
+
+class MergingError(Preprocess16SError):
+    """
+    An exception meant to be raised when read merging fails (e.g. NGmerge or BLAST+ utilities fail).
+    """
+    pass
+# end class MergingError
+
+
+class SampleSheetError(Preprocess16SError):
+    """
+    An exception meant to be raised when sample sheet of batch mode cannot be read or is invalid.
+    """
+    pass
+# end class SampleSheetError
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+# Module provides shared pool of worker processes.
+# The pool is created once per process and is reused by all parallel stages
+#   (cross-talk detection, gap-filling merging, quality calculation) and by all samples
+#   processed in the same run. It is enlarged if a stage requests more workers.
+# Workers keep "warm" state between tasks (see 'warm_state' function),
+#   e.g. primer matchers and caches of reference sequences.
+# Shared objects (counters of processed reads) are created together with the pool
+#   and are inherited by workers, so that they can be used by any stage.
+# Results that must be written in input order are returned to the calling process,
+#   which writes them as the single writer (see 'imap' function).
+# Reader, workers and writer are connected with bounded queues: the calling process reads next packet
+#   of reads only when there is room for it, so memory usage does not depend on size of input files.
+#   The room is derived from memory budget (see 'set_max_memory' and 'packet_plan').
+# Every task is timed in the worker (see '_run_timed'): CPU time, idle time before the task, time spent
+#   waiting for child processes; the calling process adds time the result has waited for the writer
+#   and passes the breakdown to 'src.run_report'.
+
+import os
+import atexit
+import queue
+import multiprocessing as mp
+from time import monotonic, process_time
+
+from src import profiling
+from src import run_report
+
+
+# Pool of worker processes, number of it's workers and PID of the process that owns it.
+_pool = None
+_n_workers = 0
+_pool_pid = None
+
+# Objects shared by the parent process and workers:
+#   "progress" -- array of counters of processed reads, one per process (see 'add_progress').
+#     Each counter is incremented only by it's owner, so no lock is needed;
+#   "next_slot" -- index of the counter that will be given to the next started worker.
+_shared = None
+
+# Index of counter of processed reads of the current process ("progress" array).
+#   The parent process owns counter 0.
+_progress_slot = 0
+
+# Warm state of the current process: dict<hashable: object>.
+_warm_state = dict()
+
+# Time at which the current worker has finished it's last task ('time.monotonic'; None before the first task).
+_last_task_end = None
+
+# Memory budget for reads in flight between the reader, workers and the writer (bytes, None -- no budget).
+_max_memory = None
+
+# Estimated memory taken by one read pair in flight (bytes): parsed records kept by the calling process,
+#   their pickled and unpickled copies and the result of processing.
+PAIR_FOOTPRINT = 8 * 2**10
+
+# Suffixes of memory sizes accepted by 'parse_memory_size'
+_SIZE_SUFFIXES = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def _create_shared(n_workers=0):
+    return {
+        "progress": mp.Array('q', n_workers + 1, lock=False),
+        "next_slot": mp.Value('i', 1)
+    }
+# end def _create_shared
+
+
+def _worker_init(shared_buff):
+    """
+    Function initializes global variables of a worker process.
+    This function is meant to be passed as 'initializer' argument to 'multiprocessing.Pool' function.
+
+    :param shared_buff: shared objects (see '_shared');
+    :type shared_buff: dict<str: object>;
+    """
+    global _shared, _warm_state, _progress_slot, _last_task_end
+    _shared = shared_buff
+    _warm_state = dict() # do not inherit state of the parent process
+    _last_task_end = None
+    with _shared["next_slot"].get_lock():
+        # A worker that replaces a dead one reuses a counter
+        _progress_slot = 1 + (_shared["next_slot"].value - 1) % (len(_shared["progress"]) - 1)
+        _shared["next_slot"].value += 1
+    # end with
+# end def _worker_init
+
+
+def shared(name):
+    """
+    Function returns shared object 'name' (see '_shared').
+    It can be called both in the parent process and in workers.
+    """
+    global _shared
+    if _shared is None:
+        _shared = _create_shared()
+    # end if
+    return _shared[name]
+# end def shared
+
+
+def reset_shared():
+    """
+    Function resets counters of processed reads before a stage.
+    """
+    progress = shared("progress")
+    for i in range(len(progress)):
+        progress[i] = 0
+    # end for
+# end def reset_shared
+
+
+def add_progress(n_reads=1):
+    """
+    Function adds 'n_reads' to the counter of processed reads of the current process.
+    Every process has it's own counter, so there is no lock and no contention between workers.
+    It can be called both in the parent process and in workers.
+    """
+    shared("progress")[_progress_slot] += n_reads
+# end def add_progress
+
+
+def get_progress():
+    """
+    Function returns number of reads processed by all processes since the last 'reset_shared' call.
+    """
+    return sum(shared("progress"))
+# end def get_progress
+
+
+def warm_state(key, factory):
+    """
+    Function returns object stored in warm state of the current process under 'key'.
+    If there is no such object, it is created by calling 'factory()' and stored.
+    Warm state lives as long as the process (a worker or the parent process), so objects
+      that are expensive to create are created once per process, not once per task.
+
+    :param key: key of the object;
+    :type key: hashable;
+    :param factory: function without arguments that creates the object;
+    """
+    try:
+        return _warm_state[key]
+    except KeyError:
+        obj = _warm_state[key] = factory()
+        return obj
+    # end try
+# end def warm_state
+
+
+def parse_memory_size(text):
+    """
+    Function parses memory size: number of bytes optionally followed by suffix K, M, G or T
+      (powers of 1024), e.g. "512M" or "4G".
+
+    Returns number of bytes (int).
+    Raises ValueError if 'text' is not a valid positive memory size.
+    """
+    text = text.strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    # end if
+    suffix = text[-1:] if text[-1:] in _SIZE_SUFFIXES else ""
+    try:
+        n_bytes = int(float(text[: len(text) - len(suffix)]) * _SIZE_SUFFIXES[suffix])
+    except ValueError:
+        raise ValueError("invalid memory size: '{}'".format(text))
+    # end try
+    if n_bytes <= 0:
+        raise ValueError("memory size must be positive: '{}'".format(text))
+    # end if
+    return n_bytes
+# end def parse_memory_size
+
+
+def set_max_memory(n_bytes):
+    """
+    Function sets memory budget for reads in flight in all parallel stages (see 'packet_plan').
+
+    :param n_bytes: budget in bytes (None -- no budget);
+    :type n_bytes: int;
+    """
+    global _max_memory
+    _max_memory = n_bytes
+# end def set_max_memory
+
+
+def packet_plan(packet_size, n_workers):
+    """
+    Function adjusts size of packets of reads and number of packets in flight to the memory budget.
+    Without budget, each worker gets two packets: one being processed and one waiting.
+    With budget, packets are shrunk first (down to one read pair), so that all workers still have work,
+      and then number of packets in flight is limited.
+
+    :param packet_size: desired number of read pairs in a packet;
+    :type packet_size: int;
+    :param n_workers: number of workers;
+    :type n_workers: int;
+
+    Returns tuple (<number of read pairs in a packet>, <maximum number of packets in flight>).
+    The latter is meant to be passed to 'imap' as 'max_pending'.
+    """
+    max_pending = 2 * n_workers
+    if _max_memory is None:
+        return (packet_size, max_pending)
+    # end if
+
+    pairs_budget = max(1, _max_memory // PAIR_FOOTPRINT)
+    packet_size = max(1, min(packet_size, pairs_budget // max_pending))
+    max_pending = max(1, min(max_pending, pairs_budget // packet_size))
+    return (packet_size, max_pending)
+# end def packet_plan
+
+
+def get_pool(n_workers):
+    """
+    Function returns shared pool of at least 'n_workers' worker processes.
+    The pool is created on the first call and is recreated only if more workers are requested.
+
+    :param n_workers: required number of workers;
+    :type n_workers: int;
+    """
+    global _pool, _n_workers, _pool_pid, _shared
+
+    if not _pool is None and _pool_pid == os.getpid() and _n_workers >= n_workers:
+        return _pool
+    # end if
+
+    shutdown()
+    # Shared objects must exist before workers are forked. Counters of the parent process are kept.
+    parent_progress = 0 if _shared is None else _shared["progress"][0]
+    _shared = _create_shared(n_workers)
+    _shared["progress"][0] = parent_progress
+    _pool = mp.Pool(n_workers, initializer=_worker_init, initargs=(_shared,))
+    _n_workers = n_workers
+    _pool_pid = os.getpid()
+
+    return _pool
+# end def get_pool
+
+
+def _run_timed(stage_start, task):
+    """
+    Function runs a task in a worker process (see 'src.profiling.run_task') and times it.
+    Time, during which the worker has been idle before the task, is counted from the end of
+      the previous task or from 'stage_start' (if it is later).
+
+    :param stage_start: time at which the stage has started submitting tasks ('time.monotonic');
+    :type stage_start: float;
+    :param task: arguments of 'src.profiling.run_task';
+    :type task: tuple;
+
+    Returns tuple (<name of the worker>, <time at which the task has finished>,
+      <time of the task per category (see 'src.run_report.WORKER_TIME_CATEGORIES')>, <result of the task>).
+    """
+    global _last_task_end
+    task_start = monotonic()
+    cpu_start = process_time()
+    child_start = run_report.get_wait_time("child_wait")
+
+    result = profiling.run_task(*task)
+
+    task_end = monotonic()
+    compute = process_time() - cpu_start
+    child_wait = run_report.get_wait_time("child_wait") - child_start
+    idle_since = stage_start if _last_task_end is None else max(stage_start, _last_task_end)
+    _last_task_end = task_end
+
+    times = {
+        "compute": compute,
+        "input_wait": max(0.0, task_start - idle_since),
+        "child_wait": child_wait,
+        "other": max(0.0, task_end - task_start - compute - child_wait)
+    }
+    return ("worker_{}".format(_progress_slot), task_end, times, result)
+# end def _run_timed
+
+
+def _unwrap(timed_result):
+    # Function passes time of a task (see '_run_timed') to 'src.run_report' and returns result of the task.
+    # It is called when the writer takes the result, so time the result has waited for the writer is known.
+    worker, task_end, times, result = timed_result
+    times["writer_wait"] = max(0.0, monotonic() - task_end)
+    run_report.add_worker_times(worker, times)
+    return result
+# end def _unwrap
+
+
+def starmap(stage, func, args_list, n_workers):
+    """
+    Function runs 'func(*args)' for each 'args' of 'args_list' in the shared pool
+      (with profiling, see 'src.profiling.run_task').
+
+    :param stage: name of the stage;
+    :type stage: str;
+    :param func: function that will be called in worker processes;
+    :param args_list: iterable of tuples of arguments of 'func';
+    :param n_workers: number of workers the stage requires;
+    :type n_workers: int;
+
+    Returns list of values returned by 'func' (in order of 'args_list').
+    """
+    pool = get_pool(n_workers)
+    stage_start = monotonic()
+    timed_results = pool.starmap(_run_timed,
+        ((stage_start, task) for task in profiling.task_args(stage, func, args_list)))
+    run_report.add_wait_time("result_wait", monotonic() - stage_start)
+    return [_unwrap(timed_result) for timed_result in timed_results]
+# end def starmap
+
+
+class ReorderBuffer:
+    """
+    Class ReorderBuffer is dedicated to restore order of results that are tagged with sequence numbers
+      (0, 1, 2, ...) and arrive in arbitrary order.
+
+    :method put: stores item with sequence number;
+    :method pop_ready: yields items in order of sequence numbers as long as there is no gap;
+    """
+
+    def __init__(self):
+        self._items = dict()
+        self._next_num = 0
+    # end def __init__
+
+    def __len__(self):
+        return len(self._items)
+    # end def __len__
+
+    def put(self, seq_num, item):
+        self._items[seq_num] = item
+    # end def put
+
+    def pop_ready(self):
+        while self._next_num in self._items:
+            yield self._items.pop(self._next_num)
+            self._next_num += 1
+        # end while
+    # end def pop_ready
+# end class ReorderBuffer
+
+
+def imap(stage, func, args_iter, n_workers, max_pending=None):
+    """
+    Generator is a lazy version of 'starmap': tasks are submitted as 'args_iter' is consumed,
+      and results are yielded in order of 'args_iter'.
+    Tasks are tagged with sequence numbers; results arrive as workers finish them
+      and are put to a reorder buffer (see 'ReorderBuffer'), from which they are yielded in order.
+    At most 'max_pending' tasks (2*n_workers by default, see 'packet_plan') are running or waiting
+      in the buffer. When this limit is reached, the calling process blocks until a result is consumed,
+      so 'args_iter' is not read far ahead of the consumer and memory usage is bounded.
+    """
+    pool = get_pool(n_workers)
+    if max_pending is None:
+        max_pending = 2 * n_workers
+    # end if
+
+    done = queue.Queue() # (<sequence number>, <is_error>, <result or exception>)
+    reorder_buffer = ReorderBuffer()
+    stage_start = monotonic()
+    tasks = enumerate(profiling.task_args(stage, func, args_iter))
+    n_running = 0
+    tasks_left = True
+
+    while tasks_left or n_running != 0:
+
+        while tasks_left and n_running + len(reorder_buffer) < max_pending:
+            try:
+                seq_num, task = next(tasks)
+            except StopIteration:
+                tasks_left = False
+                break
+            # end try
+            pool.apply_async(_run_timed, (stage_start, task),
+                callback=lambda result, seq_num=seq_num: done.put((seq_num, False, result)),
+                error_callback=lambda err, seq_num=seq_num: done.put((seq_num, True, err)))
+            n_running += 1
+        # end while
+
+        if n_running == 0:
+            break
+        # end if
+
+        wait_start = monotonic()
+        seq_num, is_error, result = done.get()
+        run_report.add_wait_time("result_wait", monotonic() - wait_start)
+        n_running -= 1
+        if is_error:
+            raise result
+        # end if
+        reorder_buffer.put(seq_num, result)
+        for timed_result in reorder_buffer.pop_ready():
+            yield _unwrap(timed_result)
+        # end for
+    # end while
+# end def imap
+
+
+def shutdown():
+    """
+    Function closes the shared pool and waits for workers to exit.
+    It is called automatically at exit of the interpreter.
+    """
+    global _pool, _n_workers, _pool_pid
+    if not _pool is None and _pool_pid == os.getpid():
+        _pool.close()
+        _pool.join()
+    # end if
+    _pool = None
+    _n_workers = 0
+    _pool_pid = None
+# end def shutdown
+
+
+atexit.register(shutdown)
@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 # Module for reading and writing fastq files.
 
-import sys
 from src.printing import *
 from src.filesystem import *
+from src.errors import FastqError
 
 
 def read_fastq_pair(read_files, fmt_func):
@@ -32,12 +32,11 @@ def read_fastq_pair(read_files, fmt_func):
         "qual_str": quality line
     }
     I.e. type of returned value is 'dict< dict<str, str> >'
+    Raises FastqError if number of files is neither 1 nor 2.
     """
 
     if len(read_files) != 2 and len(read_files) != 1:
-        print_error("You can only pass 1 or 2 files to the function 'read_fastq_pair'!\a")
-        print("Contact the developer")
-        sys.exit(1)
+        raise FastqError("You can only pass 1 or 2 files to the function 'read_fastq_pair'!")
     # end if
 
     fastq_recs = dict()           # this dict should consist of two fastq-records: R1 and R2
@@ -73,6 +72,8 @@ def write_fastq_record(outfile, fastq_record):
         "qual_str": quality line
     }
     :type fastq_record: dict<str: str>
+
+    Raises FastqError if record cannot be written.
     """
 
     try:
@@ -82,58 +83,50 @@ def write_fastq_record(outfile, fastq_record):
         outfile.write(fastq_record["qual_str"] + '\n')
         outfile.flush()
     except Exception as exc:
-        print_error("\n error while writing to output file")
-        print( str(exc) )
-        sys.exit(1)
+        raise FastqError("error while writing to output file: {}".format(exc)) from exc
     # end try
 # end def write_fastq_record
 
 
-def fastq_read_packets(read_paths, reads_at_all, n_thr):
+def fastq_read_packets(read_paths, packet_size):
     """
-    Function-generator for retrieving FASTQ records from PE files
-        and distributing them evenly between 'n_thr' processes
-        for further parallel processing.
-        # end for
+    Function-generator for retrieving FASTQ records from PE files in packets of limited size
+        for further parallel processing. Files are read lazily: next packet is read
+        only when it is requested, so the whole input is never kept in memory
+        (see 'src.executor.imap' for bounding number of packets in flight).
+
     :param read_paths: dictionary (dict<str: str> of the following structure:
     {
         "R1": path_to_file_with_forward_reads,
         "R2": path_to_file_with_reverse_reads
     }
-    :param reads_at_all: number of read pairs in these files;
-    :type reads_at_all: int;
+    :param packet_size: maximum number of read pairs in a packet;
+    :type packet_size: int;
+
     Yields lists of FASTQ-records (structure of these records is described in 'write_fastq_record' function).
-    Returns None when end of file(s) is reached.
     """
 
     how_to_open = OPEN_FUNCS[ get_archv_fmt_indx(read_paths["R1"]) ]
     fmt_func = FORMATTING_FUNCS[ get_archv_fmt_indx(read_paths["R1"]) ]
-    read_files = dict() # dictionary for file objects
-
-    # Open files that contain reads meant to be processed.
-    for key, path in read_paths.items():
-        read_files[key] = how_to_open(path)
-    # end for
-
-    # Compute packet size (one packet -- one thread).
-    pack_size = reads_at_all // n_thr
-    if reads_at_all % n_thr != 0:
-        pack_size += 1
-    # end if
+    read_files = open_files(read_paths, how_to_open)
 
-    for i in range(n_thr):
+    try:
         packet = list()
-        for j in range(pack_size):
-            tmp = read_fastq_pair(read_files, fmt_func)
-            # if the end of the line is reached
-            if tmp is None:
-                # Yield partial packet and return 'None' on next call
+        while True:
+            fastq_recs = read_fastq_pair(read_files, fmt_func)
+            # if the end of file is reached
+            if fastq_recs is None:
+                break
+            # end if
+            packet.append(fastq_recs)
+            if len(packet) == packet_size:
                 yield packet
-                return
-            else:
-                packet.append(tmp)
+                packet = list()
             # end if
-        # end for
-        yield packet # yield full packet
-    # end for
-# end def fastq_read_packets
\ No newline at end of file
+        # end while
+        if len(packet) != 0:
+            yield packet # yield partial packet
+        # end if
+    finally:
+        close_files(read_files)
+    # end try
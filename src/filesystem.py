@@ -2,7 +2,9 @@
 # Module for dealing with filesystem: close/open files, detect and handlt files in different formats.
 # __last_update_date__ = "2020-08-07"
 
+import os
 import sys
+from subprocess import Popen as sp_Popen
 from gzip import open as open_as_gzip
 from gzip import GzipFile
 from bz2 import open as open_as_bz2
@@ -82,6 +84,7 @@ def open_files(fpaths, how_to_open, mode=None):
     :type mode: str;
 
     Returns dictionary <key: file_object>
+    Raises OSError if a file cannot be opened (files opened before are closed).
     """
 
     files = dict()
@@ -94,11 +97,94 @@ def open_files(fpaths, how_to_open, mode=None):
                 files[key] = how_to_open(fpaths[key], mode)
             # end if
         # end for
-    except OSError as oserror:
-        print("Error while opening file", str(oserror))
+    except OSError:
         close_files(files)
-        sys.exit(1)
+        raise
     # end try
 
     return files
-# end def open_files
\ No newline at end of file
+# end def open_files
+
+
+def _gz_path(fpath, src_dir, dest_dir):
+    # Returns path of gzipped file: next to 'fpath' or at the same relative path in 'dest_dir'
+    if dest_dir is None:
+        return fpath + ".gz"
+    # end if
+    gz_path = os.path.join(dest_dir, os.path.relpath(fpath, src_dir)) + ".gz"
+    os.makedirs(os.path.dirname(gz_path), exist_ok=True)
+    return gz_path
+# end def _gz_path
+
+
+def _wait_gzip(gzip_proc):
+    pipe, fpath, gz_file = gzip_proc
+    exit_code = pipe.wait()
+    gz_file.close()
+    if exit_code != 0:
+        raise OSError("gzip exited with code {} while compressing '{}'".format(exit_code, fpath))
+    # end if
+    os.unlink(fpath)
+    print("\'{}\' is gzipped".format(fpath))
+# end def _wait_gzip
+
+
+def gzip_files(fpaths, n_thr=1, src_dir=None, dest_dir=None):
+    """
+    Function gzips files with 'gzip' utility or with Python 'gzip' module if the utility is not installed.
+    Up to 'n_thr' files are compressed simultaneously by 'gzip' utility. Plain files are removed.
+
+    :param fpaths: paths to files;
+    :type fpaths: list<str>;
+    :param n_thr: number of simultaneously running 'gzip' processes;
+    :type n_thr: int;
+    :param src_dir: directory, in which files are located (used only with 'dest_dir');
+    :type src_dir: str;
+    :param dest_dir: directory, to which gzipped files are written keeping their paths relative to 'src_dir'.
+        Gzipped files are written next to plain files if it is None;
+    :type dest_dir: str;
+
+    Returns list of paths to gzipped files (nonexistent files are skipped).
+    Raises OSError if a file cannot be compressed.
+    """
+    gzip_util = "gzip"
+    util_found = False
+    for directory in os.environ["PATH"].split(os.pathsep):
+        if os.path.isdir(directory) and gzip_util in os.listdir(directory):
+            util_found = True
+            break
+        # end if
+    # end for
+
+    gz_paths = list()
+    running = list()
+    try:
+        for fpath in fpaths:
+            if os.path.exists(fpath):
+                gz_path = _gz_path(fpath, src_dir, dest_dir)
+                gz_paths.append(gz_path)
+                if util_found:
+                    if len(running) == n_thr:
+                        _wait_gzip(running.pop(0))
+                    # end if
+                    gz_file = open(gz_path, 'wb')
+                    running.append((sp_Popen([gzip_util, "-c", fpath], stdout=gz_file), fpath, gz_file))
+                else:
+                    with open(fpath, 'r') as plain_file, open_as_gzip(gz_path, 'wb') as gz_file:
+                        for line in plain_file:
+                            gz_file.write(bytes(line, "utf-8"))
+                        # end for
+                    # end with
+                    os.unlink(fpath)
+                    print("\'{}\' is gzipped".format(fpath))
+                # end if
+            # end if
+        # end for
+    finally:
+        while len(running) != 0:
+            _wait_gzip(running.pop(0))
+        # end while
+    # end try
+
+    return gz_paths
+# end def gzip_files
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Module provides persistent cache of hits of reads for gap-filling read merging.
+# The same samples are reprocessed and the same mock communities are re-sequenced again and again,
+#   so the same unmerged reads are aligned against the same database run after run. With the cache,
+#   best hits of a read (see 'read_merging_16S._align_reads') are stored in an SQLite file, and
+#   the read is not aligned again by any later run until it's entry is evicted.
+#
+# Key of an entry is SHA-1 of the fingerprint of the aligner and of the sequence of the read.
+#   The fingerprint covers files of the database (names, sizes and modification times) and parameters
+#   of the aligner (see 'read_merging_16S._hit_cache_fingerprint'): after the database is rebuilt or
+#   parameters are changed, old entries are not hit anymore and they are evicted in time.
+# The cache is bounded: when it holds more than 'max_entries' entries, the least recently used ones are
+#   removed (down to EVICT_TO of 'max_entries', so that eviction does not run after each chunk of reads).
+# Any number of processes may use the same file: each process opens it's own connection
+#   (see 'src.executor.warm_state'), and SQLite serializes writes. Connection of a process is used
+#   by one thread at a time: by the thread of the orchestrator if reads are aligned by it (see 'src.orchestrator').
+
+import json
+import sqlite3
+from time import time
+from hashlib import sha1
+from collections import Counter
+
+from src.smith_waterman import AlignResult
+
+
+# Default maximum number of entries of the cache. Hits of a read take about 100 bytes per hit
+DEFAULT_MAX_ENTRIES = 1000000
+# Share of 'max_entries' that is left after eviction
+EVICT_TO = 0.9
+# Seconds to wait for a lock of the database held by another process
+_LOCK_TIMEOUT = 600
+# Maximum number of parameters of one SQL statement (SQLite's limit is 999 in old versions)
+_MAX_SQL_VARS = 900
+
+
+def hit_fields(hits):
+    """
+    Function returns fields of best hits of a read as a list of lists, which can be dumped to JSON.
+    Hits are stored in the cache in this form and are sent by the alignment server (see 'src.alignment_server').
+
+    :param hits: best hits of a read (None if the read has no significant hit);
+    :type hits: list<AlignResult>;
+    """
+    if hits is None:
+        return None
+    # end if
+    return [[hit.q_start, hit.q_end, hit.s_start, hit.s_end, hit.qlen, hit.sacc, hit.sstrand,
+        hit.score, hit.length, hit.gaps, hit.evalue] for hit in hits]
+# end def hit_fields
+
+
+def hits_from_fields(fields):
+    """
+    Function returns best hits of a read from their fields returned by 'hit_fields'.
+    """
+    if fields is None:
+        return None
+    # end if
+    return [AlignResult(None, None, *hit) for hit in fields]
+# end def hits_from_fields
+
+
+def _encode_hits(hits):
+    # Returns JSON representation of best hits of a read (None if the read has no significant hit)
+    return json.dumps(hit_fields(hits))
+# end def _encode_hits
+
+
+def _decode_hits(text):
+    # Returns best hits encoded by '_encode_hits'
+    return hits_from_fields(json.loads(text))
+# end def _decode_hits
+
+
+class HitCache:
+    """
+    Class HitCache is dedicated to keep best hits of reads between runs (see the header of this module).
+
+    :field path: path to SQLite file of the cache;
+    :type path: str;
+    :field max_entries: maximum number of entries;
+    :type max_entries: int;
+    :field counts: numbers of "lookups" of reads, of "hits", of "stored" and of "evicted" entries;
+    :type counts: collections.Counter;
+
+    :method get_many: returns cached hits of reads;
+    :method put_many: stores hits of reads;
+    :method pop_counts: returns counts and resets them;
+    :method close: closes the database;
+    """
+
+    def __init__(self, path, fingerprint, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param path: path to SQLite file of the cache (it is created if it does not exist);
+        :type path: str;
+        :param fingerprint: fingerprint of the database and of parameters of the aligner;
+        :type fingerprint: str;
+        :param max_entries: maximum number of entries;
+        :type max_entries: int;
+
+        Raises sqlite3.Error if the file is not a valid cache.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.counts = Counter()
+        self._fingerprint = fingerprint.encode("utf-8") + b'\n'
+        self._db = sqlite3.connect(path, timeout=_LOCK_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS hits (key BLOB PRIMARY KEY, hits TEXT NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS hits_used ON hits (used)")
+    # end def __init__
+
+    def _key(self, seq):
+        return sha1(self._fingerprint + seq.encode("ascii")).digest()
+    # end def _key
+
+    def get_many(self, seqs):
+        """
+        Function returns cached hits of reads and marks them as recently used.
+
+        :param seqs: sequences of reads (unique ones);
+        :type seqs: list<str>;
+
+        Returns dict<str: list<AlignResult>> -- best hits of cached sequences
+          (sequences without significant similarity are mapped to None).
+        """
+        keys = {self._key(seq): seq for seq in seqs}
+        found = dict()
+        key_list = list(keys)
+        for i in range(0, len(key_list), _MAX_SQL_VARS):
+            batch = key_list[i : i + _MAX_SQL_VARS]
+            rows = self._db.execute("SELECT key, hits FROM hits WHERE key IN ({})"
+                .format(", ".join('?' * len(batch))), batch)
+            for key, text in rows:
+                found[keys[key]] = _decode_hits(text)
+            # end for
+        # end for
+        if len(found) != 0:
+            now = time()
+            # Marks are written in one transaction, otherwise each row is committed (and synced) separately
+            with self._db:
+                self._db.execute("BEGIN IMMEDIATE")
+                self._db.executemany("UPDATE hits SET used = ? WHERE key = ?",
+                    ((now, self._key(seq)) for seq in found))
+            # end with
+        # end if
+        self.counts["lookups"] += len(keys)
+        self.counts["hits"] += len(found)
+        return found
+    # end def get_many
+
+    def put_many(self, align_reports):
+        """
+        Function stores hits of reads and evicts the least recently used entries if the cache is full.
+
+        :param align_reports: best hits of reads (see 'get_many');
+        :type align_reports: dict<str: list<AlignResult>>;
+        """
+        if len(align_reports) == 0:
+            return
+        # end if
+        now = time()
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany("INSERT OR REPLACE INTO hits (key, hits, used) VALUES (?, ?, ?)",
+                ((self._key(seq), _encode_hits(hits), now) for seq, hits in align_reports.items()))
+            n_entries = self._db.execute("SELECT COUNT(*) FROM hits").fetchone()[0]
+            if n_entries > self.max_entries:
+                n_evicted = n_entries - int(self.max_entries * EVICT_TO)
+                self._db.execute("DELETE FROM hits WHERE key IN (SELECT key FROM hits ORDER BY used LIMIT ?)",
+                    (n_evicted,))
+                self.counts["evicted"] += n_evicted
+            # end if
+        # end with
+        self.counts["stored"] += len(align_reports)
+    # end def put_many
+
+    def pop_counts(self):
+        counts = Counter(self.counts)
+        self.counts.clear()
+        return counts
+    # end def pop_counts
+
+    def close(self):
+        self._db.close()
+    # end def close
+# end class HitCache
+
+
+def hit_rate(counts):
+    """
+    Function returns share of lookups of reads that have been found in the cache.
+
+    :param counts: counts of a cache (see 'HitCache.pop_counts');
+    :type counts: dict<str: int>;
+    """
+    lookups = counts.get("lookups", 0)
+    if lookups == 0:
+        return None
+    # end if
+    return round(counts.get("hits", 0) / lookups, 4)
+# end def hit_rate
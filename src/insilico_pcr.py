@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# Module performs in-silico PCR on reference sequences: it extracts amplicons (primer sites included)
+#   of a primer pair from every sequence and dereplicates them. 'configure_Silva_db.sh -a' uses it
+#   to make reference database for gap-filling merging that consists of amplicon regions of Silva sequences
+#   only -- unmerged reads align nowhere else, and the database is several times smaller.
+#
+# Primer sites are matched according to MATCH_DICT (see 'src.crosstalks.compile_primer').
+#   3'-terminal ANCHOR_LEN nucleotides of a primer must match (they are found with a regular expression),
+#   the rest of the primer may have up to MAX_MISMATCHES mismatches. Forward primer is searched
+#   in sequences as they are (Silva sequences are oriented as 16S rRNA), reverse primer -- as it's
+#   reverse complement downstream of the forward one.
+#
+# Identical amplicons are written once, under the lexicographically least ID of sequences they come from,
+#   as gap-filling merging breaks ties between equally good references in the same way.
+#   IDs of all the sequences are written to file '<amplicon_fasta>.members'
+#   (<ID of written sequence>\t<comma-separated IDs of the sequences>).
+#
+# Usage (from the root directory of the repository):
+#   python3 -m src.insilico_pcr <fasta> <amplicon_fasta> [<primer_fasta>]
+# If <fasta> is removed (as 'configure_Silva_db.sh' does after making BLAST database), sequences
+#   are read from it's packed store (see 'src.packed_references'). Default primers are Illumina V3-V4 ones.
+
+import os
+import re
+import sys
+
+from src.crosstalks import get_primers, compile_primer
+from src.packed_references import PackedReferences, store_paths
+from src.errors import PrimerError
+
+
+# Number of 3'-terminal nucleotides of a primer that must match
+ANCHOR_LEN = 8
+# Maximum number of mismatches in the rest of a primer
+MAX_MISMATCHES = 2
+# Amplicons (primer sites included) that are shorter or longer are discarded
+MIN_AMPLICON_LEN = 100
+MAX_AMPLICON_LEN = 1000
+
+MEMBERS_EXT = ".members"
+
+# Complements of nucleotides and degenerate symbols of primers
+_COMPLEMENT = str.maketrans("ACGTURYSWKMBDHVN", "TGCAAYRSWMKVHDBN")
+
+
+def _rc_primer(primer):
+    return primer.translate(_COMPLEMENT)[::-1]
+# end def _rc_primer
+
+
+class PrimerSiteFinder:
+    """
+    Class PrimerSiteFinder is dedicated to find sites of a primer in reference sequences.
+
+    :field primer: sequence of the primer as it is searched (reverse primer is reverse-complemented);
+    :type primer: str;
+    :field anchor_at_end: the anchor (3'-end of the primer) is at the end of 'primer' (at the start otherwise);
+    :type anchor_at_end: bool;
+
+    :method find: returns positions of sites in a sequence;
+    """
+
+    def __init__(self, primer, anchor_at_end):
+        self.primer = primer
+        self.anchor_at_end = anchor_at_end
+        self._matcher = compile_primer(primer)
+        anchor_len = min(ANCHOR_LEN, len(primer))
+        anchor = self._matcher[-anchor_len:] if anchor_at_end else self._matcher[:anchor_len]
+        # Lookahead finds overlapping anchors too
+        self._anchor_regex = re.compile("(?=({}))".format("".join("[{}]".format("".join(sorted(nucls)))
+            for nucls in anchor)))
+        self._anchor_offset = len(primer) - anchor_len if anchor_at_end else 0
+        self._rest = range(0, len(primer) - anchor_len) if anchor_at_end else range(anchor_len, len(primer))
+    # end def __init__
+
+    def find(self, seq, start=0):
+        """
+        Function-generator yields 0-based positions of sites of the primer in a sequence
+          (in ascending order, starting from 'start').
+
+        :param seq: sequence (upper case);
+        :type seq: str;
+        """
+        matcher, primer_len = self._matcher, len(self.primer)
+        for match in self._anchor_regex.finditer(seq, start + self._anchor_offset):
+            site = match.start() - self._anchor_offset
+            if site + primer_len > len(seq):
+                break
+            # end if
+            mismatches = sum(1 for i in self._rest if not seq[site + i] in matcher[i])
+            if mismatches <= MAX_MISMATCHES:
+                yield site
+            # end if
+        # end for
+    # end def find
+# end class PrimerSiteFinder
+
+
+def amplify(seq, forward_finder, reverse_finder):
+    """
+    Function extracts amplicon from a sequence: from the first site of the forward primer to the first
+      site of reverse-complement reverse primer downstream of it (primer sites are included).
+
+    :param seq: sequence (upper case);
+    :type seq: str;
+    :param forward_finder: finder of sites of the forward primer;
+    :type forward_finder: PrimerSiteFinder;
+    :param reverse_finder: finder of sites of reverse-complement reverse primer;
+    :type reverse_finder: PrimerSiteFinder;
+
+    Returns amplicon (str) or None if the sequence is not amplified.
+    """
+    for forward_site in forward_finder.find(seq):
+        for reverse_site in reverse_finder.find(seq, forward_site + len(forward_finder.primer)):
+            amplicon_len = reverse_site + len(reverse_finder.primer) - forward_site
+            if amplicon_len > MAX_AMPLICON_LEN:
+                break
+            # end if
+            if amplicon_len >= MIN_AMPLICON_LEN:
+                return seq[forward_site : forward_site + amplicon_len]
+            # end if
+        # end for
+        return None # primers bind once: the first forward site is the one
+    # end for
+    return None
+# end def amplify
+
+
+def _read_references(fasta_path):
+    # Generator yields tuples (<sequence ID>, <sequence>) from FASTA file
+    #   or from it's packed store if the file does not exist
+    if not os.path.exists(fasta_path) and all(map(os.path.exists, store_paths(fasta_path))):
+        references = PackedReferences(fasta_path)
+        try:
+            for i in range(references.n_records):
+                yield references.entry(i)
+            # end for
+        finally:
+            references.close()
+        # end try
+        return
+    # end if
+
+    with open(fasta_path, 'r') as fasta_file:
+        seq_id, seq_lines = None, list()
+        for line in fasta_file:
+            line = line.strip()
+            if line.startswith('>'):
+                if not seq_id is None:
+                    yield (seq_id, "".join(seq_lines))
+                # end if
+                seq_id, seq_lines = line[1:].partition(' ')[0], list()
+            elif line != "":
+                seq_lines.append(line)
+            # end if
+        # end for
+        if not seq_id is None:
+            yield (seq_id, "".join(seq_lines))
+        # end if
+    # end with
+# end def _read_references
+
+
+def extract_amplicons(fasta_path, amplicon_path, primers):
+    """
+    Function performs in-silico PCR on sequences of FASTA file and writes dereplicated amplicons
+      (see the header of this module).
+
+    :param fasta_path: path to FASTA file of reference sequences;
+    :type fasta_path: str;
+    :param amplicon_path: path to output FASTA file;
+    :type amplicon_path: str;
+    :param primers: sequences of forward and reverse primers;
+    :type primers: list<str>;
+
+    Returns dict<str: int>: numbers of "sequences", of "amplified" ones and of "unique" amplicons.
+    Raises PrimerError if there are not two primers.
+    """
+    if len(primers) != 2:
+        raise PrimerError("in-silico PCR requires two primers, but {} are specified".format(len(primers)))
+    # end if
+    forward_finder = PrimerSiteFinder(primers[0].upper(), anchor_at_end=True)
+    reverse_finder = PrimerSiteFinder(_rc_primer(primers[1].upper()), anchor_at_end=False)
+
+    members = dict() # <amplicon>: list of IDs of sequences
+    n_seqs, n_amplified = 0, 0
+    for seq_id, seq in _read_references(fasta_path):
+        n_seqs += 1
+        amplicon = amplify(seq.upper().replace('U', 'T'), forward_finder, reverse_finder)
+        if not amplicon is None:
+            n_amplified += 1
+            members.setdefault(amplicon, list()).append(seq_id)
+        # end if
+    # end for
+
+    with open(amplicon_path, 'w') as amplicon_file, open(amplicon_path + MEMBERS_EXT, 'w') as members_file:
+        for amplicon, seq_ids in members.items():
+            seq_ids.sort()
+            amplicon_file.write(">{} amplicon of {} sequences\n{}\n".format(seq_ids[0], len(seq_ids), amplicon))
+            members_file.write("{}\t{}\n".format(seq_ids[0], ",".join(seq_ids)))
+        # end for
+    # end with
+
+    return {"sequences": n_seqs, "amplified": n_amplified, "unique": len(members)}
+# end def extract_amplicons
+
+
+if __name__ == "__main__":
+    if not len(sys.argv) in (3, 4):
+        print("Usage: python3 -m src.insilico_pcr <fasta> <amplicon_fasta> [<primer_fasta>]")
+        sys.exit(1)
+    # end if
+    try:
+        primers, primer_ids = get_primers(None, sys.argv[3] if len(sys.argv) == 4 else None)
+        counts = extract_amplicons(sys.argv[1], sys.argv[2], primers)
+    except (OSError, PrimerError) as err:
+        print("Error: {}".format(str(err)))
+        sys.exit(1)
+    # end try
+    print("{} of {} sequences are amplified; {} unique amplicons are written to '{}'".format(
+        counts["amplified"], counts["sequences"], counts["unique"], sys.argv[2]))
+# end if
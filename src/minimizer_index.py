@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+# Module provides in-process alternative to blastn for gap-filling read merging:
+#   index of minimizers of reference sequences and query engine that places reads on references
+#   (see 'read_merging_16S._align_reads'). Gap-filling merging needs only the best placement of each read,
+#   so that the engine performs ungapped alignment seeded by minimizers -- as blastn is run with '-ungapped'.
+#
+# Minimizer of a window of W consecutive k-mers is the k-mer with the least hash (see '_minimizers').
+#   Sequences that share a window share it's minimizer, so that minimizers of a read are found
+#   in the index at positions of similar references, and each hit gives a diagonal
+#   (<position in reference> - <position in read>). Read is aligned (without gaps) along the diagonals
+#   supported by the most seeds, and hits are scored as by blastn with reward 2 and penalty -1.
+#
+# Index is built by 'configure_Silva_db.sh' next to packed store of reference sequences
+#   (see 'src.packed_references'), which provides sequences and their IDs. File '<fasta>.midx' consists of:
+#   header (magic, K, W, numbers of bits of fields of entries, number of entries, total length of references)
+#   followed by entries -- 64-bit integers (<k-mer code>, <number of reference in packed store>, <position>)
+#   sorted in ascending order. Entries of a minimizer are found with binary search over the memory-mapped file,
+#   so forked workers share the index through the page cache.
+#
+# Usage (from the root directory of the repository):
+#   python3 -m src.minimizer_index <fasta>
+
+import os
+import sys
+import re
+import mmap
+import struct
+from math import log
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from src.packed_references import PackedReferences, build_store, store_paths
+
+
+# Length of k-mers
+K = 15
+# Number of consecutive k-mers in a window
+W = 10
+
+INDEX_EXT = ".midx"
+
+_INDEX_MAGIC = b"P16SMIN1"
+# Header of index: magic, K, W, bits of reference numbers, bits of positions,
+#   number of entries, total length of references
+_INDEX_HEADER = struct.Struct("<8sIIIIQQ")
+
+# Minimizers that occur in more entries than this are not used as seeds:
+#   they come from conserved regions and do not discriminate references
+MAX_OCCURRENCES = 1000
+# Maximum number of diagonals (the ones supported by the most seeds) a read is aligned along
+MAX_CANDIDATES = 50
+
+# Parameters of bit score calculation for ungapped alignment with reward 2 and penalty -1
+#   (Karlin-Altschul statistics)
+_REWARD, _PENALTY = 2, -1
+_LAMBDA = 0.549
+_K_PARAM = 0.334
+
+# Minimizers are selected by hash, so that poly-A and other low-complexity k-mers are not preferred
+_HASH_MULT = 0x9E3779B97F4A7C15
+
+# Nucleotides are written as base-4 digits, so that k-mer code is 'int(<digits>, 4)'
+_DIGITS = str.maketrans("ACGTacgt", "01230123")
+_UNAMBIGUOUS = re.compile(r"[ACGTacgt]+")
+
+_RC_TABLE = str.maketrans("ACGTURYSWKMBDHVNacgturyswkmbdhvn", "TGCAAYRSWMKVHDBNtgcaayrswmkvhdbn")
+
+
+def index_path(fasta_path):
+    return fasta_path + INDEX_EXT
+# end def index_path
+
+
+def _rc(seq):
+    return seq.translate(_RC_TABLE)[::-1]
+# end def _rc
+
+
+def _minimizers(seq, k=K, w=W):
+    """
+    Function finds minimizers of a sequence. K-mers containing characters other than A, C, G and T are skipped.
+
+    :param seq: sequence;
+    :type seq: str;
+
+    Returns list of tuples (<0-based position>, <k-mer code>) in ascending order of positions.
+    """
+    mask = (1 << 2*k) - 1
+    minimizers = list()
+
+    for run in _UNAMBIGUOUS.finditer(seq):
+        digits = run.group().translate(_DIGITS)
+        n_kmers = len(digits) - k + 1
+        if n_kmers <= 0:
+            continue
+        # end if
+        codes = [int(digits[i : i+k], 4) for i in range(n_kmers)]
+        hashes = [(code * _HASH_MULT) & mask for code in codes]
+
+        last = -1
+        for i in range(max(1, n_kmers - w + 1)):
+            window_end = min(i + w, n_kmers)
+            pos = hashes.index(min(hashes[i : window_end]), i, window_end)
+            if pos != last:
+                minimizers.append((run.start() + pos, codes[pos]))
+                last = pos
+            # end if
+        # end for
+    # end for
+
+    return minimizers
+# end def _minimizers
+
+
+def build_index(fasta_path, k=K, w=W):
+    """
+    Function builds index of minimizers of sequences of FASTA file (see the header of this module).
+    Packed store of the sequences is built first if it does not exist.
+    Entries are collected in memory (8 bytes per minimizer) in buckets, which are sorted one by one.
+
+    :param fasta_path: path to FASTA file;
+    :type fasta_path: str;
+
+    Returns number of entries.
+    Raises ValueError if entries do not fit 64 bits.
+    """
+    if not all(map(os.path.exists, store_paths(fasta_path))):
+        build_store(fasta_path)
+    # end if
+    references = PackedReferences(fasta_path)
+    try:
+        lengths = [references.record(i)[2] for i in range(references.n_records)]
+        ref_bits = max(1, (references.n_records - 1).bit_length())
+        # Positions have a spare bit, so that diagonals can be counted as integers (see 'MinimizerIndex._seeds')
+        pos_bits = max(1, max(lengths, default=1).bit_length()) + 1
+        if 2*k + ref_bits + pos_bits > 64:
+            raise ValueError("{} sequences of up to {} nt cannot be indexed with k-mers of length {}"
+                .format(references.n_records, max(lengths), k))
+        # end if
+
+        code_shift = ref_bits + pos_bits
+        bucket_shift = max(0, 2*k - 8)
+        buckets = [array('Q') for i in range(1 << min(8, 2*k))]
+        for ref_i in range(references.n_records):
+            ref_bits_i = ref_i << pos_bits
+            for pos, code in _minimizers(references.entry(ref_i)[1], k, w):
+                buckets[code >> bucket_shift].append((code << code_shift) | ref_bits_i | pos)
+            # end for
+        # end for
+    finally:
+        references.close()
+    # end try
+
+    n_entries = sum(map(len, buckets))
+    with open(index_path(fasta_path), 'wb') as index_file:
+        index_file.write(_INDEX_HEADER.pack(_INDEX_MAGIC, k, w, ref_bits, pos_bits, n_entries, sum(lengths)))
+        for i in range(len(buckets)):
+            array('Q', sorted(buckets[i])).tofile(index_file)
+            buckets[i] = None # memory of the bucket is not needed anymore
+        # end for
+    # end with
+
+    return n_entries
+# end def build_index
+
+
+def _format_bitscore(bitscore):
+    # Bit scores are compared as blastn prints them (see 'read_merging_16S._best_hits')
+    return "{:.0f}".format(bitscore) if bitscore >= 100 else "{:.1f}".format(bitscore)
+# end def _format_bitscore
+
+
+def _ungapped_extend(query, sseq, diag):
+    """
+    Function finds maximal scoring segment of ungapped alignment of 'query' and 'sseq' along diagonal 'diag'.
+
+    Returns tuple (<score>, <qstart>, <qend>) (0-based, end exclusive).
+    """
+    qfrom = max(0, -diag)
+    qto = min(len(query), len(sseq) - diag)
+
+    best_score, best_start, best_end = 0, 0, 0
+    score, seg_start = 0, qfrom
+    for qpos, matched in enumerate(map(str.__eq__, query[qfrom:qto], sseq[qfrom+diag : qto+diag]), qfrom):
+        score += _REWARD if matched else _PENALTY
+        if score <= 0:
+            score, seg_start = 0, qpos + 1
+        elif score > best_score:
+            best_score, best_start, best_end = score, seg_start, qpos + 1
+        # end if
+    # end for
+
+    return (best_score, best_start, best_end)
+# end def _ungapped_extend
+
+
+class MinimizerIndex:
+    """
+    Class MinimizerIndex is dedicated to place reads on reference sequences (see the header of this module).
+
+    :field k: length of k-mers;
+    :type k: int;
+    :field w: number of consecutive k-mers in a window;
+    :type w: int;
+    :field n_entries: number of entries in the index;
+    :type n_entries: int;
+
+    :method align: returns hits of a read in the format of tabular output of blastn;
+    :method close: unmaps files;
+    """
+
+    def __init__(self, fasta_path, max_occurrences=MAX_OCCURRENCES, max_candidates=MAX_CANDIDATES):
+        """
+        :param fasta_path: path to FASTA file the index has been built from (it is not needed anymore);
+        :type fasta_path: str;
+        :param max_occurrences: minimizers that occur in more entries are not used as seeds;
+        :type max_occurrences: int;
+        :param max_candidates: maximum number of diagonals a read is aligned along;
+        :type max_candidates: int;
+
+        Raises OSError if files of the index or of packed store cannot be opened, ValueError if index is invalid.
+        """
+        path = index_path(fasta_path)
+        with open(path, 'rb') as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # end with
+
+        magic, self.k, self.w, ref_bits, self._pos_bits, self.n_entries, self._db_len \
+            = _INDEX_HEADER.unpack_from(self._mmap, 0)
+        if magic != _INDEX_MAGIC:
+            self._mmap.close()
+            raise ValueError("'{}' is not an index of minimizers".format(path))
+        # end if
+        self._code_shift = ref_bits + self._pos_bits
+        self._location_mask = (1 << self._code_shift) - 1
+        self._diag_bias = 1 << (self._pos_bits - 1)
+        self._entries = memoryview(self._mmap)[_INDEX_HEADER.size:].cast('Q')
+
+        self._references = PackedReferences(fasta_path)
+        self.max_occurrences = max_occurrences
+        self.max_candidates = max_candidates
+    # end def __init__
+
+    def _seeds(self, seq):
+        # Returns Counter of seed hits of 'seq' on diagonals. Diagonal of a seed is counted as integer
+        #   <reference number> * 2^<bits of positions> + <diagonal> + <bias> (see '_diagonal'):
+        #   bias is greater than any position in references, so that diagonals do not overlap.
+        entries = self._entries
+        diagonals = Counter()
+        for qpos, code in _minimizers(seq, self.k, self.w):
+            first = bisect_left(entries, code << self._code_shift)
+            last = bisect_left(entries, (code + 1) << self._code_shift, first)
+            if last - first > self.max_occurrences or qpos > self._diag_bias:
+                continue
+            # end if
+            diagonals.update(map((self._diag_bias - qpos).__add__, map(self._location_mask.__and__, entries[first:last])))
+        # end for
+        return diagonals
+    # end def _seeds
+
+    def _diagonal(self, key):
+        # Returns tuple (<reference number>, <diagonal>) of a key of Counter returned by '_seeds'
+        return (key >> self._pos_bits, (key & ((1 << self._pos_bits) - 1)) - self._diag_bias)
+    # end def _diagonal
+
+    def align(self, qseqid, seq, max_target_seqs=10, max_evalue=10.0):
+        """
+        Function aligns a read against reference sequences on both strands.
+
+        :param qseqid: ID of the query;
+        :param seq: sequence of the read;
+        :type seq: str;
+        :param max_target_seqs: maximum number of references in result;
+        :type max_target_seqs: int;
+        :param max_evalue: hits with greater e-value are discarded;
+        :type max_evalue: float;
+
+        Returns list of tuples of fields of blastn output
+          "qseqid qstart qend sstart send sacc qlen length gaps sstrand bitscore evalue"
+          sorted by bitscore (descending), one hit per reference.
+        """
+        qlen = len(seq)
+        candidates = list() # (<number of seeds>, <reference number>, <strand>, <diagonal>)
+        for strand, strand_seq in (("plus", seq), ("minus", _rc(seq))):
+            for key, n_seeds in self._seeds(strand_seq).most_common(self.max_candidates):
+                ref_i, diag = self._diagonal(key)
+                candidates.append((n_seeds, ref_i, strand, diag))
+            # end for
+        # end for
+        candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+        # Diagonals supported by less than a half of seeds of the best one are not worth aligning along
+        min_seeds = (candidates[0][0] + 1) // 2 if len(candidates) != 0 else 0
+
+        best_hits = dict() # <reference number>: (<score>, <hit>)
+        for n_seeds, ref_i, strand, diag in candidates[: self.max_candidates]:
+            if n_seeds < min_seeds:
+                break
+            # end if
+            sacc, sseq = self._references.entry(ref_i)
+            strand_seq = seq if strand == "plus" else _rc(seq)
+            score, qstart, qend = _ungapped_extend(strand_seq, sseq.upper(), diag)
+            if score == 0 or score <= best_hits.get(ref_i, (0,))[0]:
+                continue
+            # end if
+
+            bitscore = (_LAMBDA * score - log(_K_PARAM)) / log(2)
+            evalue = qlen * self._db_len * 2 ** (-bitscore)
+            if evalue > max_evalue:
+                continue
+            # end if
+
+            # 1-based coordinates
+            sstart, send = qstart + diag + 1, qend + diag
+            if strand == "plus":
+                qstart += 1
+            else:
+                # Coordinates of reverse-complement read are converted to coordinates of the read itself,
+                #   subject coordinates go in descending order
+                qstart, qend = qlen - qend + 1, qlen - qstart
+                sstart, send = send, sstart
+            # end if
+            best_hits[ref_i] = (score, (qseqid, qstart, qend, sstart, send, sacc, qlen, qend - qstart + 1,
+                0, strand, _format_bitscore(bitscore), evalue))
+        # end for
+
+        ranked = sorted(best_hits.items(), key=lambda item: (-item[1][0], item[0]))
+        return [hit for ref_i, (score, hit) in ranked[: max_target_seqs]]
+    # end def align
+
+    def close(self):
+        self._entries.release()
+        self._mmap.close()
+        self._references.close()
+    # end def close
+# end class MinimizerIndex
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 -m src.minimizer_index <fasta>")
+        sys.exit(1)
+    # end if
+    try:
+        n_entries = build_index(sys.argv[1])
+    except (OSError, ValueError) as err:
+        print("Error: {}".format(str(err)))
+        sys.exit(1)
+    # end try
+    print("{} minimizers are indexed to '{}'".format(n_entries, index_path(sys.argv[1])))
+# end if
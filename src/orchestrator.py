@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Module provides orchestrator of external processes (blastn calls of gap-filling merging).
+# Without it, each worker of the shared pool (see 'src/executor.py') blocks on it's own blastn call,
+#   so no more than one blastn process per worker runs, and each worker holds a whole Python interpreter
+#   and a packet of reads while blastn is running.
+# The orchestrator runs an asyncio event loop in a thread of the calling process and keeps up to
+#   'max_in_flight' processes running at once. Coroutines that run commands ('SubprocessOrchestrator.run')
+#   are submitted from the calling thread ('SubprocessOrchestrator.submit'), and their results are
+#   collected as they are finished, while the calling thread keeps doing it's own work.
+# asyncio starts child processes from a thread other than the main one since Python 3.8.
+
+import os
+import signal
+import asyncio
+import threading
+from time import perf_counter
+from collections import Counter
+from subprocess import PIPE
+
+
+class SubprocessOrchestrator:
+    """
+    Class SubprocessOrchestrator is dedicated to run external processes concurrently
+      from one Python process (see the header of this module).
+
+    :field max_in_flight: maximum number of processes running at once;
+    :type max_in_flight: int;
+    :field counts: numbers of "commands" run, "peak_in_flight" processes and "wall_time"
+      of processes (sum of their run times, seconds);
+    :type counts: collections.Counter;
+
+    :method run: coroutine that runs a command;
+    :method submit: schedules a coroutine in the event loop;
+    :method close: cancels unfinished coroutines and stops the event loop;
+    """
+
+    def __init__(self, max_in_flight):
+        """
+        :param max_in_flight: maximum number of processes running at once;
+        :type max_in_flight: int;
+        """
+        if max_in_flight < 1:
+            raise ValueError("number of processes in flight must be positive: {}".format(max_in_flight))
+        # end if
+        self.max_in_flight = max_in_flight
+        self.counts = Counter()
+        self._in_flight = 0
+        self._loop = asyncio.new_event_loop()
+        self._slots = None # semaphore is created in the event loop (see '_create_slots')
+        self._thread = threading.Thread(target=self._loop.run_forever, name="subprocess-orchestrator",
+            daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._create_slots(), self._loop).result()
+    # end def __init__
+
+    async def _create_slots(self):
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+    # end def _create_slots
+
+    async def run(self, cmd, stdin=None):
+        """
+        Coroutine runs shell command and waits for it's completion. It must be run in the event loop
+          of the orchestrator (see 'submit'). Process is started when there are less than 'max_in_flight'
+          running processes. The process is started in a session of it's own, and the whole session
+          is killed if the coroutine is cancelled (so that children of the shell do not hold pipes open).
+
+        :param cmd: shell command;
+        :type cmd: str;
+        :param stdin: data passed to stdin of the process;
+        :type stdin: bytes;
+
+        Returns tuple (<exit code>, <stdout>, <stderr>, <run time of the process, seconds>).
+        """
+        async with self._slots:
+            start = perf_counter()
+            proc = await asyncio.create_subprocess_shell(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                start_new_session=True)
+            self._in_flight += 1
+            self.counts["peak_in_flight"] = max(self.counts["peak_in_flight"], self._in_flight)
+            try:
+                stdout, stderr = await proc.communicate(stdin)
+            except asyncio.CancelledError:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                # end try
+                await proc.wait()
+                raise
+            finally:
+                self._in_flight -= 1
+            # end try
+            run_time = perf_counter() - start
+            self.counts["commands"] += 1
+            self.counts["wall_time"] += run_time
+            return (proc.returncode, stdout, stderr, run_time)
+        # end with
+    # end def run
+
+    def submit(self, coro):
+        """
+        Function schedules a coroutine in the event loop of the orchestrator.
+        Coroutine may await 'run' any number of times.
+
+        Returns concurrent.futures.Future of the result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+    # end def submit
+
+    async def _cancel_all(self):
+        tasks = [task for task in asyncio.all_tasks() if not task is asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        # end for
+        await asyncio.gather(*tasks, return_exceptions=True)
+    # end def _cancel_all
+
+    def close(self):
+        """
+        Function cancels unfinished coroutines (their processes are killed) and stops the event loop.
+        """
+        if self._loop.is_closed():
+            return
+        # end if
+        asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+    # end def close
+# end class SubprocessOrchestrator
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# Module provides packed store of reference sequences, which is built by 'configure_Silva_db.sh'
+#   next to BLAST database, so that gap-filling merging retrieves reference sequences
+#   without calling blastdbcmd (see 'read_merging_16S._fetch_references').
+#
+# The store consists of two files:
+#   '<fasta>.pack' -- sequences packed 4 bits per nucleotide (IUPAC codes are kept, U is stored as T).
+#     Each sequence starts at a byte boundary;
+#   '<fasta>.pidx' -- index: header (magic, width of keys, number of records) followed by records
+#     (<sequence ID padded with zero bytes>, <offset in '.pack' file>, <length of sequence>)
+#     sorted by sequence ID.
+# Both files are memory-mapped and are searched in place (binary search over the index),
+#   so forked workers share them through the page cache and nothing is loaded into memory of a process.
+#
+# Usage (from the root directory of the repository):
+#   python3 -m src.packed_references <fasta>
+
+import os
+import sys
+import mmap
+import struct
+from bisect import bisect_left
+
+
+# Alphabet of 4-bit codes: code of a nucleotide is it's index
+_ALPHABET = b"-ACGTRYSWKMBDHVN"
+
+# Code of unknown characters
+_N_CODE = _ALPHABET.index(b'N')
+
+_INDEX_MAGIC = b"P16SIDX1"
+# Header of index: magic, width of keys, number of records
+_INDEX_HEADER = struct.Struct("<8sIQ")
+
+PACK_EXT = ".pack"
+INDEX_EXT = ".pidx"
+
+# Translation tables: characters to codes, and packed bytes to high and low nucleotides
+_ENCODE = bytearray([_N_CODE]) * 256
+for _code, _nucl in enumerate(_ALPHABET):
+    _ENCODE[_nucl] = _code
+    _ENCODE[ord(chr(_nucl).lower())] = _code
+# end for
+_ENCODE[ord('U')] = _ENCODE[ord('u')] = _ALPHABET.index(b'T')
+_ENCODE = bytes(_ENCODE)
+_HIGH_SHIFT = bytes((code << 4) & 0xFF for code in range(256))
+_DECODE_HIGH = bytes(_ALPHABET[byte >> 4] for byte in range(256))
+_DECODE_LOW = bytes(_ALPHABET[byte & 0x0F] for byte in range(256))
+
+
+def store_paths(fasta_path):
+    """
+    Function returns paths to files of packed store built from 'fasta_path': tuple (<pack>, <index>).
+    """
+    return (fasta_path + PACK_EXT, fasta_path + INDEX_EXT)
+# end def store_paths
+
+
+def pack_seq(seq):
+    """
+    Function packs nucleotide sequence 4 bits per nucleotide.
+
+    :param seq: sequence;
+    :type seq: bytes;
+
+    Returns bytes of length ceil(len(seq) / 2).
+    """
+    codes = seq.translate(_ENCODE)
+    if len(codes) % 2 != 0:
+        codes += b'\x00'
+    # end if
+    return bytes(map(int.__or__, codes[0::2].translate(_HIGH_SHIFT), codes[1::2]))
+# end def pack_seq
+
+
+def unpack_seq(packed, length):
+    """
+    Function unpacks sequence packed by 'pack_seq'.
+
+    :param packed: packed sequence;
+    :type packed: bytes;
+    :param length: number of nucleotides;
+    :type length: int;
+
+    Returns str.
+    """
+    seq = bytearray(2 * len(packed))
+    seq[0::2] = packed.translate(_DECODE_HIGH)
+    seq[1::2] = packed.translate(_DECODE_LOW)
+    return seq[:length].decode("ascii")
+# end def unpack_seq
+
+
+def _read_fasta(fasta_file):
+    # Generator yields tuples (<sequence ID>, <sequence>) from FASTA file opened in binary mode
+    seq_id, seq_lines = None, list()
+    for line in fasta_file:
+        line = line.strip()
+        if line.startswith(b'>'):
+            if not seq_id is None:
+                yield (seq_id, b"".join(seq_lines))
+            # end if
+            seq_id, seq_lines = line[1:].split(maxsplit=1)[0], list()
+        elif line != b"":
+            seq_lines.append(line)
+        # end if
+    # end for
+    if not seq_id is None:
+        yield (seq_id, b"".join(seq_lines))
+    # end if
+# end def _read_fasta
+
+
+def build_store(fasta_path):
+    """
+    Function builds packed store of sequences of FASTA file (see the header of this module).
+
+    :param fasta_path: path to FASTA file;
+    :type fasta_path: str;
+
+    Returns number of sequences.
+    Raises ValueError if sequence IDs are not unique.
+    """
+    pack_path, index_path = store_paths(fasta_path)
+    records = list() # (<sequence ID>, <offset>, <length>)
+
+    with open(fasta_path, 'rb') as fasta_file, open(pack_path, 'wb') as pack_file:
+        offset = 0
+        for seq_id, seq in _read_fasta(fasta_file):
+            packed = pack_seq(seq)
+            pack_file.write(packed)
+            records.append((seq_id, offset, len(seq)))
+            offset += len(packed)
+        # end for
+    # end with
+
+    records.sort()
+    for i in range(1, len(records)):
+        if records[i][0] == records[i-1][0]:
+            raise ValueError("sequence ID '{}' is not unique in '{}'".format(records[i][0].decode(), fasta_path))
+        # end if
+    # end for
+
+    key_width = max((len(seq_id) for seq_id, offset, length in records), default=1)
+    record_struct = struct.Struct("<{}sQI".format(key_width))
+    with open(index_path, 'wb') as index_file:
+        index_file.write(_INDEX_HEADER.pack(_INDEX_MAGIC, key_width, len(records)))
+        for record in records:
+            index_file.write(record_struct.pack(*record))
+        # end for
+    # end with
+
+    return len(records)
+# end def build_store
+
+
+class _IndexKeys:
+    # Sequence of keys of the index for 'bisect': keys are read from the memory-mapped file on demand
+
+    def __init__(self, index):
+        self._index = index
+    # end def __init__
+
+    def __len__(self):
+        return self._index.n_records
+    # end def __len__
+
+    def __getitem__(self, i):
+        return self._index.record(i)[0].rstrip(b'\x00')
+    # end def __getitem__
+# end class _IndexKeys
+
+
+class PackedReferences:
+    """
+    Class PackedReferences is dedicated to retrieve sequences from packed store (see the header of this module).
+
+    :field n_records: number of sequences in the store;
+    :type n_records: int;
+
+    :method get: returns sequence by it's ID;
+    :method entry: returns ID and sequence by number of the sequence;
+    :method close: unmaps files;
+    """
+
+    def __init__(self, fasta_path):
+        """
+        :param fasta_path: path to FASTA file the store has been built from (it is not needed anymore);
+        :type fasta_path: str;
+
+        Raises OSError if files of the store cannot be opened, ValueError if index is invalid.
+        """
+        pack_path, index_path = store_paths(fasta_path)
+        with open(pack_path, 'rb') as pack_file, open(index_path, 'rb') as index_file:
+            # mmap cannot map empty files
+            self._pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ) \
+                if os.path.getsize(pack_path) != 0 else b""
+            self._index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # end with
+
+        magic, key_width, self.n_records = _INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != _INDEX_MAGIC:
+            raise ValueError("'{}' is not an index of packed store".format(index_path))
+        # end if
+        self._record_struct = struct.Struct("<{}sQI".format(key_width))
+        self._keys = _IndexKeys(self)
+    # end def __init__
+
+    def record(self, i):
+        return self._record_struct.unpack_from(self._index, _INDEX_HEADER.size + i * self._record_struct.size)
+    # end def record
+
+    def get(self, seq_id):
+        """
+        Function returns sequence by it's ID (None if there is no such sequence).
+
+        :param seq_id: ID of the sequence (the first word of FASTA header);
+        :type seq_id: str;
+        """
+        key = seq_id.encode("ascii")
+        i = bisect_left(self._keys, key)
+        if i == self.n_records or self._keys[i] != key:
+            return None
+        # end if
+        return self.entry(i)[1]
+    # end def get
+
+    def entry(self, i):
+        """
+        Function returns i-th sequence of the store (sequences are sorted by ID):
+          tuple (<sequence ID>, <sequence>).
+        """
+        key, offset, length = self.record(i)
+        return (key.rstrip(b'\x00').decode("ascii"), unpack_seq(self._pack[offset : offset + (length + 1) // 2], length))
+    # end def entry
+
+    def close(self):
+        for mapped in (self._pack, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+            # end if
+        # end for
+    # end def close
+# end class PackedReferences
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 -m src.packed_references <fasta>")
+        sys.exit(1)
+    # end if
+    try:
+        n_seqs = build_store(sys.argv[1])
+    except (OSError, ValueError) as err:
+        print("Error: {}".format(str(err)))
+        sys.exit(1)
+    # end try
+    print("{} sequences are packed to '{}'".format(n_seqs, store_paths(sys.argv[1])[0]))
+# end if
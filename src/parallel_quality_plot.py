@@ -3,13 +3,13 @@
 
 import os
 
-import multiprocessing as mp
-from functools import reduce
 from math import log # for log scale in plot
 
 from src.filesystem import *
 from src.fastq import *
 from src.printing import *
+from src import executor
+from src import progress
 
 
 try:
@@ -18,7 +18,7 @@ except ImportError as imperr:
     print_error("'numpy' package is not installed!")
     print( str(imperr) )
     print("Please install numpy (e.g. pip3 install numpy)")
-    exit(1)
+    raise
 # end try
 
 try:
@@ -27,7 +27,7 @@ except ImportError as imperr:
     print_error("'matplotlib' package is not installed!")
     print( str(imperr) )
     print("Please install matplotlib (e.g. pip3 install matplotlib)")
-    exit(1)
+    raise
 # end try
 
 
@@ -44,59 +44,24 @@ top_x_scale, step = 40.0, 0.5
 # average read quality
 X = np.arange(0, top_x_scale + step, step)
 
+# Number of read pairs in a task of a worker
+QUAL_PACKET_SIZE = 5000
 
-def fastq_read_packets(read_paths, reads_at_all, n_thr):
-    """
-    Function-generator for retrieving FASTQ records from PE files
-        and distributing them evenly between 'n_thr' processes
-        for further parallel processing.
-        # end for
 
-    :param read_paths: dictionary (dict<str: str> of the following structure:
-    {
-        "R1": path_to_file_with_forward_reads,
-        "R2": path_to_file_with_reverse_reads
-    }
-    :param reads_at_all: number of read pairs in these files;
-    :type reads_at_all: int;
-
-    Yields lists of FASTQ-records (structure of these records is described in 'write_fastq_record' function).
-    Returns None when end of file(s) is reached.
+def quality_table(phred_offset):
     """
-    how_to_open = OPEN_FUNCS[ get_archv_fmt_indx(read_paths["R1"]) ]
-    fmt_func = FORMATTING_FUNCS[ get_archv_fmt_indx(read_paths["R1"]) ]
-    read_files = dict() # dictionary for file objects
-
-    # Open files that contain reads meant to be processed.
-    for key, path in read_paths.items():
-        read_files[key] = how_to_open(path)
-    # end for
-
-    # Compute packet size (one packet -- one thread).
-    pack_size = reads_at_all // n_thr
-    if reads_at_all % n_thr != 0:
-        pack_size += 1
-    # end if
+    Function returns dict<str: float> that maps Phred-encoded quality characters
+      to propabilities of error. Worker processes keep these tables in their warm state
+      (see 'src.executor.warm_state').
 
-    for i in range(n_thr):
-        packet = list()
-        for j in range(pack_size):
-            tmp = read_fastq_pair(read_files, fmt_func)
-            # if the end of the line is reached
-            if tmp is None:
-                # Yield partial packet and return 'None' on next call
-                yield packet
-                return
-            else:
-                packet.append(tmp)
-            # end if
-        # end for
-        yield packet # yield full packet
-    # end for
-# end def fastq_read_packets
+    :param phred_offset: Phred quality offset;
+    :type phred_offset: int;
+    """
+    return {chr(code): qual2prop(code - phred_offset) for code in range(len(q2p_map))}
+# end def quality_table
 
 
-def single_qual_calcer(data, reads_at_all, substr_phred_offs):
+def single_qual_calcer(data, reads_at_all, phred_offset):
     """
     Function that performs task meant to be done by one process while parallel quality calculation.
 
@@ -105,24 +70,24 @@ def single_qual_calcer(data, reads_at_all, substr_phred_offs):
     :type data: list< dict<str: str> >;
     :param reads_at_all: total number of read pairs in input files;
     :type reads_at_all: int;
+    :param phred_offset: Phred quality offset;
+    :type phred_offset: int;
 
     Returns numpy.ndarray<int> performing quality distribution of reads.
     """
 
+    char2prop = executor.warm_state(("quality_table", phred_offset), lambda: quality_table(phred_offset))
+
     # amount of reads with sertain average quality
     Y = np.zeros(int(top_x_scale / step), dtype=int)
 
-    # Processes will print number of processed reads every 'delay' reads.
-    delay, i = 1000, 0
-
     for fastq_recs in data:
 
         for rec in fastq_recs.values():
 
             qual_str = rec["qual_str"]
 
-            qual_array = map(substr_phred_offs, qual_str)
-            qual_array = tuple( map(qual2prop, qual_array) )
+            qual_array = tuple( map(char2prop.__getitem__, qual_str) )
 
             avg_qual = prop2qual( np.mean(qual_array) )
             min_indx = ( np.abs(X - avg_qual) ).argmin()
@@ -130,91 +95,42 @@ def single_qual_calcer(data, reads_at_all, substr_phred_offs):
             Y[min_indx] += 1
         # end for
 
-        # if next 'delay' reads are processed
-        if i == delay:
-
-            # synchronized incrementing
-            with count_lock:
-                counter.value += delay
-            # end with
-
-            bar_len = 50 # length of status bar
-            eqs = int( bar_len*(counter.value / reads_at_all) ) # number of '=' characters
-            spaces = bar_len - eqs # number of ' ' characters
-
-            with print_lock:
-                printn("\r[" + "="*eqs + '>' + ' '*spaces +"] {}% ({}/{})".format(int(counter.value/reads_at_all*100),
-                    counter.value, reads_at_all))
-            # end with
-
-            i = 0 # reset i
-        # end if
-
-        i += 1
+        executor.add_progress()
     # end for
     return Y
 # end def single_qual_calcer
 
 
-def proc_init(print_lock_buff, counter_buff, count_lock_buff):
-    """
-    Function that initializes global variables that all processes shoud have access to.
-    This function is meant to be passed as 'initializer' argument to 'multiprocessing.Pool' function.
-
-    :param print_lock_buff: lock that synchronizes printing to the console;
-    :type print_lock_buff: multiprocessing.Lock;
-    :param counter_buff: integer number representing number of processed reads;
-    :type counter_buff: multiprocessing.Value;
-    :param count_lock_buff: lock that synchronizes incrementing 'counter' variable;
-    :type count_lock_buff: multiprocessing.Lock;
-    """
-
-    global print_lock
-    print_lock = print_lock_buff
-
-    global counter
-    counter = counter_buff
-
-    global count_lock
-    count_lock = count_lock_buff
-# end def proc_init
-
-
-
-def parallel_qual(read_paths, n_thr, substr_phred_offs):
+def parallel_qual(read_paths, n_thr, phred_offset):
     """
-    Function launches parallel quality calculations.
+    Function launches parallel quality calculations in the shared pool of processes (see 'src/executor.py').
+    Reads are sent to workers in packets of 'QUAL_PACKET_SIZE' read pairs.
 
-    :param read_paths: dict of paths to read files. it's structure is described in 'fastq_read_packets' function;
+    :param read_paths: dict of paths to read files. it's structure is described in 'src.fastq.fastq_read_packets' function;
     :type read_paths: dict<str: str>;
     :param n_thr: int;
     :type n_thr: int:
+    :param phred_offset: Phred quality offset;
+    :type phred_offset: int;
     """
-    
-    print_lock = mp.Lock()     # lock that synchronizes printing to console;
-    count_lock = mp.Lock()     # lock that synchronizes incrementing 'counter';
-    counter = mp.Value('i', 0) # integer number representing number of processed reads;
 
     how_to_open = OPEN_FUNCS[ get_archv_fmt_indx(read_paths["R1"]) ]
 
     # Count number of read pairs
     reads_at_all = int(sum(1 for line in how_to_open(read_paths["R1"])) / 4)
 
-    # Create pool of processes
-    pool = mp.Pool(n_thr, initializer=proc_init, initargs=(print_lock, counter, count_lock))
-    # Run parallel calculations
-    Y = pool.starmap(single_qual_calcer, [(data, reads_at_all, substr_phred_offs) for data in fastq_read_packets(read_paths, reads_at_all, n_thr)])
-    print("\r["+"="*50+"] 100% ({}/{})\n".format(reads_at_all, reads_at_all))
-
-    # Reaping zombies
-    pool.close()
-    pool.join()
-
-    def arr_sum(Y1, Y2): # function to perform 'functools.reduce' sum
-        return Y1 + Y2
-    # end def arr_sum
+    # Run parallel calculations. Distributions of packets are summed as they come,
+    #   so that only packets in flight are kept in memory.
+    packet_size, max_pending = executor.packet_plan(QUAL_PACKET_SIZE, n_thr)
+    tasks = ((data, reads_at_all, phred_offset) for data in fastq_read_packets(read_paths, packet_size))
+    Y = np.zeros(int(top_x_scale / step), dtype=int)
+    with progress.ProgressReporter(reads_at_all):
+        for packet_Y in executor.imap("quality_plot", single_qual_calcer, tasks, n_thr, max_pending):
+            Y += packet_Y
+        # end for
+    # end with
 
-    return reduce(arr_sum, Y) # element-wise sum of all processes' results
+    return Y
 # end def parallel_qual
 
 
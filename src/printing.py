@@ -3,10 +3,11 @@
 # __last_update_date__ = "2020-08-07"
 
 import sys
+import shutil
 
 # |===== Stuff for dealing with time =====|
 
-from time import time, strftime, localtime, gmtime
+from time import time, perf_counter, strftime, localtime, gmtime
 start_time = time()
 
 
@@ -26,6 +27,16 @@ def printn(text=""):
 # end def printn
 
 
+def terminal_width():
+    """
+    Function returns width of the terminal (number of columns).
+    It returns 80 if standard output is not a terminal (e.g. it is redirected to a file),
+      whereas 'os.get_terminal_size' raises OSError in this case.
+    """
+    return shutil.get_terminal_size((80, 24)).columns
+# end def terminal_width
+
+
 def print_error(text):
     """Function for printing pretty error messages"""
     print("\n   \a!! - ERROR: " + text + '\n')
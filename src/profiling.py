@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+# Module for built-in profiling.
+# 1) Deterministic profiling with cProfile ('--profile' option).
+#   Parent process is profiled stage by stage, tasks of pool workers are profiled separately,
+#   and then all profiles of a stage are combined into single pstats file.
+# 2) Low-overhead sampling profiling ('--sample-profile' option).
+#   A thread samples stack of the main thread of each process every 'SAMPLE_INTERVAL' seconds.
+#   Collapsed stack counts (flame graph format) are written per process.
+
+import os
+import io
+import sys
+import glob
+import pstats
+import cProfile
+import threading
+from itertools import count
+
+
+# Directory, in which profiles are stored. None if profiling is disabled.
+_profile_dir = None
+
+# True if cProfile profiling is enabled.
+_cprofile = False
+
+# Sampling interval (seconds). None if sampling profiling is disabled.
+_sample_interval = None
+
+# Default sampling interval (seconds).
+SAMPLE_INTERVAL = 0.01
+
+# Number of functions to list in summary of a stage.
+TOP_N = 15
+
+# Profiler of the parent process for the current stage.
+_parent_profiler = None
+
+# Summaries of profiled stages: list of tuples (<stage_name>, <path_to_pstats>, <summary_text>).
+_summaries = list()
+
+# Counter for naming profiles of worker tasks.
+_task_counter = count()
+
+# Sampler of the main thread of the current process and PID of the process, in which it was created.
+_sampler = None
+_sampler_pid = None
+
+
+class StackSampler:
+    """
+    Class StackSampler is dedicated to perform sampling profiling of one thread.
+    A daemon thread takes stack of the target thread from 'sys._current_frames()'
+      every 'interval' seconds and counts identical collapsed stacks.
+
+    :field interval: sampling interval (seconds);
+    :type interval: float;
+    :field stage: name of the current stage. It becomes the root frame of sampled stacks;
+    :type stage: str;
+    :field counts: numbers of samples of collapsed stacks;
+    :type counts: dict<str: int>;
+
+    :method start: starts sampling;
+    :method stop: stops sampling;
+    :method write: writes collapsed stack counts to a file;
+    """
+
+    def __init__(self, interval, thread_id=None):
+        """
+        :param interval: sampling interval (seconds);
+        :type interval: float;
+        :param thread_id: identifier of the thread to sample. Current thread is sampled by default;
+        :type thread_id: int;
+        """
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stage = "main"
+        self.counts = dict()
+        self._stop_event = threading.Event()
+        self._thread = None
+    # end def __init__
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+    # end def start
+
+    def stop(self):
+        if not self._thread is None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        # end if
+    # end def stop
+
+    def _sample(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            # end if
+
+            stack = list()
+            while not frame is None:
+                code = frame.f_code
+                stack.append("{} ({}:{})".format(code.co_name,
+                    os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            # end while
+            stack.append(self.stage)
+
+            collapsed = ";".join(reversed(stack))
+            self.counts[collapsed] = self.counts.get(collapsed, 0) + 1
+        # end while
+    # end def _sample
+
+    def write(self, path):
+        """
+        Function writes collapsed stack counts in the format accepted by 'flamegraph.pl',
+          'speedscope' and 'inferno': one '<frame>;<frame>;...;<frame> <count>' line per stack.
+        """
+        with open(path, 'w') as outfile:
+            for stack, n_samples in sorted(self.counts.items()):
+                outfile.write("{} {}\n".format(stack, n_samples))
+            # end for
+        # end with
+    # end def write
+# end class StackSampler
+
+
+def enable(profile_dir, cprofile=True, sample_interval=None):
+    """
+    Function enables profiling.
+
+    :param profile_dir: directory, in which pstats files will be placed;
+    :type profile_dir: str;
+    :param cprofile: enable profiling with cProfile;
+    :type cprofile: bool;
+    :param sample_interval: sampling interval (seconds). Sampling profiling is disabled if it is None;
+    :type sample_interval: float;
+    """
+    global _profile_dir, _cprofile, _sample_interval, _sampler, _sampler_pid
+    if not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
+    # end if
+    _profile_dir = profile_dir
+    _cprofile = cprofile
+    _sample_interval = sample_interval
+
+    if not sample_interval is None:
+        _sampler = StackSampler(sample_interval)
+        _sampler_pid = os.getpid()
+        _sampler.start()
+    # end if
+# end def enable
+
+
+def finish():
+    """
+    Function stops sampling profiling of the current process and writes collapsed stacks
+      to file 'sampled.main.<pid>.folded'. Does nothing if sampling profiling is disabled.
+
+    Returns path to the file or None.
+    """
+    global _sampler
+    if _sampler is None:
+        return None
+    # end if
+
+    _sampler.stop()
+    folded_path = os.path.join(_profile_dir, "sampled.main.{}.folded".format(os.getpid()))
+    _sampler.write(folded_path)
+    _sampler = None
+
+    return folded_path
+# end def finish
+
+
+def is_enabled():
+    return not _profile_dir is None
+# end def is_enabled
+
+
+def get_profile_dir():
+    return _profile_dir
+# end def get_profile_dir
+
+
+def stage_started(stage):
+    """
+    Function starts profiling parent process during a stage.
+    Does nothing if profiling is disabled.
+
+    :param stage: name of the stage;
+    :type stage: str;
+    """
+    global _parent_profiler
+    if not _sampler is None:
+        _sampler.stage = stage
+    # end if
+    if not _cprofile:
+        return
+    # end if
+    _parent_profiler = cProfile.Profile()
+    _parent_profiler.enable()
+# end def stage_started
+
+
+def stage_finished(stage):
+    """
+    Function stops profiling parent process and combines it's profile with profiles
+      of worker tasks of this stage. Result is written to file '<stage>.pstats'.
+    Does nothing if profiling is disabled.
+
+    :param stage: name of the stage;
+    :type stage: str;
+    """
+    global _parent_profiler
+    if not _sampler is None:
+        _sampler.stage = "main"
+    # end if
+    if not _cprofile:
+        return
+    # end if
+
+    part_paths = list()
+    if not _parent_profiler is None:
+        _parent_profiler.disable()
+        parent_path = os.path.join(_profile_dir, "{}.parent.prof".format(stage))
+        _parent_profiler.dump_stats(parent_path)
+        part_paths.append(parent_path)
+        _parent_profiler = None
+    # end if
+
+    part_paths.extend(sorted(glob.glob(os.path.join(_profile_dir, "{}.worker.*.prof".format(stage)))))
+
+    stats = pstats.Stats(*part_paths)
+    stage_path = os.path.join(_profile_dir, "{}.pstats".format(stage))
+    stats.dump_stats(stage_path)
+
+    for path in part_paths:
+        os.unlink(path)
+    # end for
+
+    _summaries.append( (stage, stage_path, _summarize(stats)) )
+# end def stage_finished
+
+
+def _summarize(stats):
+    """
+    Function returns text summary of 'TOP_N' functions with the largest internal time.
+
+    :param stats: combined profiling statistics;
+    :type stats: pstats.Stats;
+    """
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.strip_dirs().sort_stats("tottime").print_stats(TOP_N)
+    # Omit header with names of profile files
+    lines = stream.getvalue().splitlines()
+    for i, line in enumerate(lines):
+        if "function calls" in line:
+            lines = lines[i:]
+            break
+        # end if
+    # end for
+    return "\n".join(lines).strip() + '\n'
+# end def _summarize
+
+
+def get_summaries():
+    """
+    Function returns list of tuples (<stage_name>, <path_to_pstats>, <summary_text>)
+      for all profiled stages.
+    """
+    return _summaries
+# end def get_summaries
+
+
+def task_args(stage, func, args_list):
+    """
+    Function prepares arguments of 'run_task' for 'multiprocessing.Pool.starmap' call.
+    Instead of
+        pool.starmap(func, args_list)
+    one should call
+        pool.starmap(run_task, task_args(stage, func, args_list))
+
+    :param stage: name of the stage;
+    :type stage: str;
+    :param func: function that will be called in worker process;
+    :param args_list: iterable of tuples of arguments of 'func';
+    """
+    settings = (_profile_dir, _cprofile, _sample_interval)
+    return ((settings, stage, func, args) for args in args_list)
+# end def task_args
+
+
+def run_task(settings, stage, func, args):
+    """
+    Function calls 'func(*args)' in a worker process and profiles this call
+      according to 'settings' -- tuple (<profile_dir>, <cprofile>, <sample_interval>).
+    cProfile profile is written to file '<stage>.worker.<pid>.<n>.prof' and is combined
+      with other profiles of this stage in 'stage_finished' function.
+    Sampled stacks of all tasks of a worker are written to file 'sampled.worker.<pid>.folded'.
+
+    Returns the value 'func' returns.
+    """
+    global _sampler, _sampler_pid
+    profile_dir, cprofile, sample_interval = settings
+
+    if profile_dir is None:
+        return func(*args)
+    # end if
+
+    if not sample_interval is None:
+        # Sampler could be inherited from the parent process while forking
+        if _sampler is None or _sampler_pid != os.getpid():
+            _sampler = StackSampler(sample_interval)
+            _sampler_pid = os.getpid()
+        # end if
+        _sampler.stage = stage
+        _sampler.start()
+    # end if
+
+    profiler = cProfile.Profile() if cprofile else None
+    try:
+        if profiler is None:
+            return func(*args)
+        else:
+            return profiler.runcall(func, *args)
+        # end if
+    finally:
+        if not profiler is None:
+            profiler.dump_stats(os.path.join(profile_dir, "{}.worker.{}.{}.prof".format(stage,
+                os.getpid(), next(_task_counter))))
+        # end if
+        if not sample_interval is None:
+            _sampler.stop()
+            _sampler.write(os.path.join(profile_dir, "sampled.worker.{}.folded".format(os.getpid())))
+        # end if
+    # end try
+# end def run_task
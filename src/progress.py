@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Module displays progress of stages that process reads.
+# Processes count reads with their own counters in shared memory (see 'src.executor.add_progress'),
+#   so workers neither lock nor print anything. One reporter thread of the parent process
+#   sums the counters and renders progress at a fixed rate (see 'ProgressReporter').
+# If standard output is a terminal, progress bar is redrawn. Otherwise (e.g. output of a job of
+#   a batch scheduler is redirected to a file) a log line is written periodically.
+
+import sys
+import math
+import threading
+
+from src.printing import *
+from src import executor
+from src import run_report
+
+
+# Progress bar is redrawn every BAR_INTERVAL seconds
+BAR_INTERVAL = 0.2
+# Log line is written every LOG_INTERVAL seconds if standard output is not a terminal
+LOG_INTERVAL = 30.0
+
+
+class ProgressReporter:
+    """
+    Class ProgressReporter is dedicated to display progress of a stage.
+    It is meant to be used as a context manager:
+
+        with ProgressReporter(reads_at_all):
+            for ...:
+                ...
+                executor.add_progress(1)
+
+    :field total: number of reads the stage will process;
+    :type total: int;
+    :field label: name of the stage for log lines (name of the current stage of 'src.run_report' by default);
+    :type label: str;
+    :field interval: time between two renderings (seconds);
+    :type interval: float;
+
+    :method start: resets counters and starts the reporter thread;
+    :method finish: stops the reporter thread and renders final state;
+    """
+
+    def __init__(self, total, label=None, interval=None):
+        self.total = total
+        self.label = label if not label is None else run_report.current_stage()
+        self._tty = sys.stdout.isatty()
+        if interval is None:
+            interval = BAR_INTERVAL if self._tty else LOG_INTERVAL
+        # end if
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._digits = math.ceil(math.log(max(total, 2), 10)) # number of digits in number of reads
+    # end def __init__
+
+    def __enter__(self):
+        self.start()
+        return self
+    # end def __enter__
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish(completed=exc_type is None)
+        return False
+    # end def __exit__
+
+    def start(self):
+        executor.reset_shared()
+        self._start_time = perf_counter()
+        if self._tty:
+            self._render(0)
+        # end if
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+    # end def start
+
+    def finish(self, completed=True):
+        self._stop_event.set()
+        self._thread.join()
+        if completed:
+            self._render(self.total, final=True)
+        elif self._tty:
+            print()
+        # end if
+    # end def finish
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._render(executor.get_progress())
+        # end while
+    # end def _run
+
+    def _render(self, done, final=False):
+        done = min(done, self.total)
+        percent = int(100 * done / self.total) if self.total != 0 else 100
+
+        if self._tty:
+            # Progress bar shoud not be larger than terminal.
+            # 11 is number of some 'technical' characters in progress bar, such as '['.
+            width = max(10, min(50, terminal_width() - (11 + 2*self._digits)))
+            eqs = width if self.total == 0 else int(width * done / self.total) # number of '=' characters
+            if final:
+                print("\r[" + "="*width + "] 100% ({}/{})\n".format(done, self.total))
+            else:
+                printn("\r[" + "="*eqs + '>' + ' '*(width - eqs) + "] {}% ({}/{})".format(percent,
+                    done, self.total))
+                sys.stdout.flush()
+            # end if
+        else:
+            elapsed = perf_counter() - self._start_time
+            speed = "; {} reads/s".format(int(done / elapsed)) if elapsed > 0 else ""
+            print("{} - {}: {}% ({}/{}){}".format(get_work_time(),
+                "processed" if self.label is None else self.label, percent, done, self.total, speed))
+            sys.stdout.flush()
+        # end if
+    # end def _render
+# end class ProgressReporter
@@ -13,7 +13,7 @@ except ImportError as imperr:
     print_error("'numpy' package is not installed!")
     print( str(imperr) )
     print("Please install numpy (e.g. pip3 install numpy)")
-    exit(1)
+    raise
 # end try
 
 try:
@@ -22,7 +22,7 @@ except ImportError as imperr:
     print_error("'matplotlib' package is not installed!")
     print( str(imperr) )
     print("Please install matplotlib (e.g. pip3 install matplotlib)")
-    exit(1)
+    raise
 # end try
 
 
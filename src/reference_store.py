@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Module provides store of reference sequences for gap-filling read merging.
+# Reference sequences are retrieved in batches for all accessions hit by a chunk of reads
+#   (see 'ReferenceStore.prefetch'): from packed store (see 'src.packed_references') or with one
+#   'blastdbcmd -entry_batch' call. They are kept in bounded LRU cache of (<accession>, <strand>)
+#   to sequence, so that sequences are neither retrieved nor turned around again while they are in use.
+# A store lives in warm state of a process (see 'src.executor.warm_state'), so each worker
+#   of the shared pool has it's own store for the whole run.
+
+from collections import OrderedDict, Counter
+
+
+class ReferenceStore:
+    """
+    Class ReferenceStore is dedicated to keep reference sequences retrieved from BLAST database.
+
+    :field capacity: maximum number of (<accession>, <strand>) entries in cache;
+    :type capacity: int;
+    :field counts: numbers of "lookups" of sequences, of "fetched" accessions and of database calls ("batches");
+    :type counts: collections.Counter;
+
+    :method get: returns sequence of a reference;
+    :method prefetch: retrieves all missing accessions with one database call;
+    :method pop_counts: returns counts and resets them;
+    """
+
+    def __init__(self, capacity, fetch_batch, revcomp):
+        """
+        :param capacity: maximum number of (<accession>, <strand>) entries in cache;
+        :type capacity: int;
+        :param fetch_batch: function that retrieves sequences from the database. It takes list of accessions
+            and returns dict<str: tuple<str, str>> -- accession to (<sequence ID>, <sequence>);
+        :param revcomp: function that returns reverse-complement sequence;
+        """
+        self.capacity = capacity
+        self.counts = Counter()
+        self._fetch_batch = fetch_batch
+        self._revcomp = revcomp
+        self._cache = OrderedDict() # (<accession>, <strand>): (<sequence ID>, <sequence>)
+    # end def __init__
+
+    def __len__(self):
+        return len(self._cache)
+    # end def __len__
+
+    def _put(self, key, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False) # forget the least recently used entry
+        # end if
+    # end def _put
+
+    def _fetch(self, accs):
+        fetched = self._fetch_batch(accs)
+        self.counts["fetched"] += len(accs)
+        self.counts["batches"] += 1
+        for acc, value in fetched.items():
+            self._put((acc, True), value)
+        # end for
+        return fetched
+    # end def _fetch
+
+    def prefetch(self, accs):
+        """
+        Function retrieves accessions that are not cached (on any strand) with one database call.
+
+        :param accs: accessions;
+        :type accs: iterable<str>;
+        """
+        missing = [acc for acc in dict.fromkeys(accs)
+            if not (acc, True) in self._cache and not (acc, False) in self._cache]
+        if len(missing) != 0:
+            self._fetch(missing)
+        # end if
+    # end def prefetch
+
+    def get(self, acc, sstrand=True):
+        """
+        Function returns reference sequence as it is (plus strand, 'sstrand' is True)
+          or reverse-complement one ('sstrand' is False).
+
+        Returns tuple (<sequence ID>, <sequence>).
+        """
+        self.counts["lookups"] += 1
+        key = (acc, sstrand)
+        try:
+            value = self._cache[key]
+        except KeyError:
+            try:
+                seq_id, seq = self._cache[(acc, not sstrand)]
+            except KeyError:
+                seq_id, seq = self._fetch([acc])[acc]
+                if sstrand:
+                    return (seq_id, seq)
+                # end if
+            # end try
+            value = (seq_id, self._revcomp(seq))
+            self._put(key, value)
+            return value
+        # end try
+        self._cache.move_to_end(key)
+        return value
+    # end def get
+
+    def pop_counts(self):
+        counts = Counter(self.counts)
+        self.counts.clear()
+        return counts
+    # end def pop_counts
+# end class ReferenceStore
+
+
+def hit_rate(counts):
+    """
+    Function returns share of lookups that have not required retrieval from the database.
+
+    :param counts: counts of a store (see 'ReferenceStore.pop_counts');
+    :type counts: dict<str: int>;
+    """
+    lookups = counts.get("lookups", 0)
+    if lookups == 0:
+        return None
+    # end if
+    return round(max(0.0, 1 - counts.get("fetched", 0) / lookups), 4)
+# end def hit_rate
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+# Module for collecting per-stage timing and throughput statistics
+#   and writing them to machine-readable JSON run report.
+# Time of each process taking part in a stage is broken down into categories
+#   (see 'WORKER_TIME_CATEGORIES' and 'end_stage'), so that one can tell whether workers
+#   are busy, starved by the reader, held up by the writer or waiting for external programs.
+
+import os
+import sys
+import json
+import resource
+from time import time, perf_counter, strftime, localtime
+
+from src.printing import start_time
+from src import profiling
+
+
+# List of finished stages (dictionaries of the structure described in 'end_stage' function).
+_stages = list()
+
+# Stages that are started but not finished yet: dict<str: dict>.
+_running_stages = dict()
+
+# Accumulators of time spent in sub-stages (e.g. BLAST, Smith-Waterman aligning)
+#   of the current process. Structure: dict<str: [wall_time, number_of_calls]>.
+_substage_timers = dict()
+
+# Start time of the current run (seconds since the epoch).
+_run_start = start_time
+
+# Time the current process has spent waiting (seconds, from the start of the process):
+#   "child_wait" -- waiting for child processes (blastn, blastdbcmd, NGmerge);
+#   "result_wait" -- waiting for results of pool workers (see 'src.executor.imap').
+_wait_times = {"child_wait": 0.0, "result_wait": 0.0}
+
+# Categories of time of a pool worker (see 'src.executor'):
+#   "compute" -- CPU time of the worker spent on tasks;
+#   "input_wait" -- time the worker has been idle waiting for the next task (starved by the reader);
+#   "writer_wait" -- time results of the worker have waited for the writer (after the task is finished);
+#   "child_wait" -- time spent waiting for child processes;
+#   "other" -- rest of time of tasks (e.g. I/O or waiting for a CPU).
+WORKER_TIME_CATEGORIES = ("compute", "input_wait", "writer_wait", "child_wait", "other")
+
+# Time of pool workers during the current stage: dict<str: dict<str: float>>.
+#   Keys are names of workers, values are times per category and number of tasks ("tasks").
+_worker_times = dict()
+
+
+def reset():
+    """
+    Function discards statistics of previous runs. It is meant to be called
+      when a program runs the pipeline multiple times in one process (see 'src/api.py').
+    """
+    global _run_start
+    _stages.clear()
+    _running_stages.clear()
+    _substage_timers.clear()
+    _worker_times.clear()
+    _run_start = time()
+# end def reset
+
+
+def _cpu_times():
+    """
+    Function returns tuple of two floats: (CPU time of this process, CPU time of it's reaped children).
+    CPU time of children includes time of pool workers (after they are joined) and external programs
+      such as NGmerge and blastn.
+    """
+    times = os.times()
+    return (times.user + times.system, times.children_user + times.children_system)
+# end def _cpu_times
+
+
+def _peak_rss_kb():
+    """
+    Function returns tuple of two ints: (peak RSS of this process, peak RSS of the largest reaped child),
+      both in kilobytes.
+    """
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        self_rss //= 1024
+        children_rss //= 1024
+    # end if
+    return (self_rss, children_rss)
+# end def _peak_rss_kb
+
+
+def files_size(fpaths):
+    """
+    Function returns summary size of existing files (in bytes).
+
+    :param fpaths: collection of paths to files;
+    :type fpaths: list<str> or dict<str: str>;
+    """
+    if isinstance(fpaths, dict):
+        fpaths = fpaths.values()
+    # end if
+    return sum(os.path.getsize(path) for path in fpaths if os.path.exists(path))
+# end def files_size
+
+
+def start_stage(name, n_workers=1, bytes_in=0):
+    """
+    Function starts measuring a stage.
+
+    :param name: name of the stage;
+    :type name: str;
+    :param n_workers: number of processes (threads) the stage runs in;
+    :type n_workers: int;
+    :param bytes_in: number of bytes stage reads;
+    :type bytes_in: int;
+    """
+    _running_stages[name] = {
+        "wall_start": perf_counter(),
+        "cpu_start": _cpu_times(),
+        "n_workers": n_workers,
+        "bytes_in": bytes_in,
+        "wait_start": dict(_wait_times)
+    }
+    _substage_timers.clear()
+    _worker_times.clear()
+    profiling.stage_started(name)
+# end def start_stage
+
+
+def end_stage(name, reads=0, bytes_out=0, substages=None):
+    """
+    Function finishes measuring a stage and saves it's statistics.
+
+    :param name: name of the stage;
+    :type name: str;
+    :param reads: number of read pairs processed during the stage;
+    :type reads: int;
+    :param bytes_out: number of bytes stage has written;
+    :type bytes_out: int;
+    :param substages: timers of sub-stages collected in worker processes
+        (values returned by 'pop_substage_timers' function). Timers of the current process
+        are added to them;
+    :type substages: list< dict<str: list> >;
+
+    Returns dictionary of the following structure:
+    {
+        "name": name of the stage,
+        "wall_time": wall-clock time (seconds),
+        "cpu_time": CPU time of this process (seconds),
+        "children_cpu_time": CPU time of child processes (seconds),
+        "reads": number of processed read pairs,
+        "reads_per_sec": throughput,
+        "bytes_in": number of input bytes,
+        "bytes_out": number of output bytes,
+        "peak_rss_kb": peak RSS of this process so far (kilobytes),
+        "children_peak_rss_kb": peak RSS of the largest child process so far (kilobytes),
+        "n_workers": number of workers,
+        "substages": dict<str: dict> -- wall time and number of calls of sub-stages,
+        "workers": dict<str: dict> -- breakdown of time of processes:
+            "main" -- the calling process (reader and writer): "compute" (CPU time),
+              "result_wait" (waiting for results of workers) and "child_wait" (waiting for child processes);
+            "worker_<N>" -- pool workers: number of "tasks" and time per category (see 'WORKER_TIME_CATEGORIES')
+    }
+    """
+    stage = _running_stages.pop(name)
+
+    wall_time = perf_counter() - stage["wall_start"]
+    cpu_end = _cpu_times()
+    self_rss, children_rss = _peak_rss_kb()
+    profiling.stage_finished(name)
+
+    all_timers = [pop_substage_timers()]
+    if substages is not None:
+        all_timers.extend(substages)
+    # end if
+
+    workers = {"main": {
+        "compute": round(cpu_end[0] - stage["cpu_start"][0], 3),
+        "result_wait": round(_wait_times["result_wait"] - stage["wait_start"]["result_wait"], 3),
+        "child_wait": round(_wait_times["child_wait"] - stage["wait_start"]["child_wait"], 3)
+    }}
+    for worker in sorted(_worker_times, key=lambda worker: int(worker.rpartition('_')[2])):
+        workers[worker] = {key: round(value, 3) for key, value in _worker_times[worker].items()}
+    # end for
+    _worker_times.clear()
+
+    record = {
+        "name": name,
+        "wall_time": round(wall_time, 3),
+        "cpu_time": round(cpu_end[0] - stage["cpu_start"][0], 3),
+        "children_cpu_time": round(cpu_end[1] - stage["cpu_start"][1], 3),
+        "reads": reads,
+        "reads_per_sec": round(reads / wall_time, 2) if reads != 0 and wall_time > 0 else None,
+        "bytes_in": stage["bytes_in"],
+        "bytes_out": bytes_out,
+        "peak_rss_kb": self_rss,
+        "children_peak_rss_kb": children_rss,
+        "n_workers": stage["n_workers"],
+        "substages": merge_substage_timers(all_timers),
+        "workers": workers
+    }
+    _stages.append(record)
+
+    if len(workers) > 1:
+        print(format_worker_times(record))
+    # end if
+
+    return record
+# end def end_stage
+
+
+def add_substage_time(name, seconds, calls=1, child=False):
+    """
+    Function adds time spent in a sub-stage to the accumulator of current process.
+
+    :param name: name of the sub-stage;
+    :type name: str;
+    :param seconds: wall-clock time spent;
+    :type seconds: float;
+    :param child: True if the sub-stage is waiting for a child process (e.g. blastn).
+        Then time is added to waiting time of the process as well (see 'add_wait_time');
+    :type child: bool;
+    """
+    try:
+        timer = _substage_timers[name]
+    except KeyError:
+        timer = _substage_timers[name] = [0.0, 0]
+    # end try
+    timer[0] += seconds
+    timer[1] += calls
+    if child:
+        _wait_times["child_wait"] += seconds
+    # end if
+# end def add_substage_time
+
+
+def add_wait_time(category, seconds):
+    """
+    Function adds time the current process has spent waiting.
+
+    :param category: "child_wait" or "result_wait" (see '_wait_times');
+    :type category: str;
+    :param seconds: wall-clock time spent;
+    :type seconds: float;
+    """
+    _wait_times[category] += seconds
+# end def add_wait_time
+
+
+def get_wait_time(category):
+    """
+    Function returns time the current process has spent waiting since it's start (see '_wait_times').
+    """
+    return _wait_times[category]
+# end def get_wait_time
+
+
+def add_worker_times(worker, times):
+    """
+    Function adds time of a task of a pool worker to statistics of the current stage.
+    It is called in the calling process for each result received from workers (see 'src.executor').
+
+    :param worker: name of the worker;
+    :type worker: str;
+    :param times: time of the task per category (see 'WORKER_TIME_CATEGORIES');
+    :type times: dict<str: float>;
+    """
+    try:
+        worker_times = _worker_times[worker]
+    except KeyError:
+        worker_times = _worker_times[worker] = dict.fromkeys(WORKER_TIME_CATEGORIES, 0.0)
+        worker_times["tasks"] = 0
+    # end try
+    for category, seconds in times.items():
+        worker_times[category] += seconds
+    # end for
+    worker_times["tasks"] += 1
+# end def add_worker_times
+
+
+def format_worker_times(record):
+    """
+    Function formats breakdown of time of processes of a stage (see 'end_stage') as a short table.
+
+    :param record: statistics of a stage returned by 'end_stage';
+    :type record: dict<str: object>;
+    """
+    lines = ["Time of workers of stage '{}' (seconds):".format(record["name"]),
+        "  {:<10} {:>6} {:>9} {:>11} {:>12} {:>11} {:>9}".format("worker", "tasks", "compute",
+            "input wait", "writer wait", "child wait", "other")]
+    for worker, times in record["workers"].items():
+        if worker != "main":
+            lines.append("  {:<10} {:>6} {:>9.2f} {:>11.2f} {:>12.2f} {:>11.2f} {:>9.2f}".format(worker,
+                times["tasks"], *(times[category] for category in WORKER_TIME_CATEGORIES)))
+        # end if
+    # end for
+    main = record["workers"]["main"]
+    lines.append("  main process: compute {:.2f}, waiting for workers {:.2f}, waiting for child processes {:.2f}\n"
+        .format(main["compute"], main["result_wait"], main["child_wait"]))
+    return "\n".join(lines)
+# end def format_worker_times
+
+
+def pop_substage_timers():
+    """
+    Function returns sub-stage timers of the current process and resets them.
+    It is meant to be called at the end of a task of a pool worker:
+      the result should be passed to parent process and then to 'end_stage' function.
+    """
+    timers = dict(_substage_timers)
+    _substage_timers.clear()
+    return timers
+# end def pop_substage_timers
+
+
+def merge_substage_timers(timers_list):
+    """
+    Function sums sub-stage timers collected in different processes.
+
+    :param timers_list: list of values returned by 'pop_substage_timers' function;
+    :type timers_list: list< dict<str: list> >;
+
+    Returns dict<str: dict> of the following structure:
+    {
+        "<substage_name>": {"wall_time": <float>, "calls": <int>}
+    }
+    """
+    merged = dict()
+    for timers in timers_list:
+        for name, (seconds, calls) in timers.items():
+            if not name in merged:
+                merged[name] = {"wall_time": 0.0, "calls": 0}
+            # end if
+            merged[name]["wall_time"] += seconds
+            merged[name]["calls"] += calls
+        # end for
+    # end for
+
+    for substage in merged.values():
+        substage["wall_time"] = round(substage["wall_time"], 3)
+    # end for
+
+    return merged
+# end def merge_substage_timers
+
+
+def current_stage():
+    """
+    Function returns name of the most recently started stage that is not finished yet (None if there is no such stage).
+    """
+    return next(reversed(_running_stages), None)
+# end def current_stage
+
+
+def get_stages():
+    """
+    Function returns list of statistics of finished stages (see 'end_stage' function).
+    """
+    return _stages
+# end def get_stages
+
+
+def write_report(report_path, **run_info):
+    """
+    Function writes JSON run report.
+
+    :param report_path: path to report file;
+    :type report_path: str;
+    :param run_info: any additional information about the run (version, input files, etc.).
+        It must be JSON-serializable;
+
+    Returns path to the report file.
+    """
+    self_rss, children_rss = _peak_rss_kb()
+
+    report = {
+        "start_time": strftime("%Y-%m-%dT%H:%M:%S", localtime(_run_start)),
+        "end_time": strftime("%Y-%m-%dT%H:%M:%S", localtime(time())),
+        "wall_time": round(time() - _run_start, 3),
+        "peak_rss_kb": self_rss,
+        "children_peak_rss_kb": children_rss
+    }
+    report.update(run_info)
+    report["stages"] = list(_stages)
+
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+        report_file.write('\n')
+    # end with
+
+    return report_path
+# end def write_report
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# Module for subsampled QC runs: a random subset of read pairs is taken in one streaming pass
+#   and the pipeline is run on this subset only (see 'src.api.preprocess').
+# Stage timings of such a run are extrapolated to the full input (see 'extrapolate_stages'),
+#   so that cost of the full run is known after a few seconds.
+#
+# Records are copied as raw lines (they are not parsed), sampled read pairs are written
+#   in the same order as they appear in input files.
+
+import os
+import random
+
+from src.filesystem import OPEN_FUNCS, get_archv_fmt_indx
+
+
+def _raw_pairs(read_paths):
+    """
+    Generator yields read pairs as raw FASTQ records: tuples (<4 lines of R1>, <4 lines of R2>)
+      of bytes objects. Files can be plain, gzipped or bzipped.
+
+    :param read_paths: paths to files with forward ("R1") and reverse ("R2") reads;
+    :type read_paths: dict<str: str>;
+    """
+    R1_file = OPEN_FUNCS[get_archv_fmt_indx(read_paths["R1"])](read_paths["R1"], "rb")
+    R2_file = OPEN_FUNCS[get_archv_fmt_indx(read_paths["R2"])](read_paths["R2"], "rb")
+    try:
+        while True:
+            R1_rec = b"".join(R1_file.readline() for i in range(4))
+            R2_rec = b"".join(R2_file.readline() for i in range(4))
+            if R1_rec == b"" or R2_rec == b"":
+                return
+            # end if
+            yield (R1_rec, R2_rec)
+        # end while
+    finally:
+        R1_file.close()
+        R2_file.close()
+    # end try
+# end def _raw_pairs
+
+
+def reservoir_sample(pairs, n_pairs, rng):
+    """
+    Function takes uniform random sample of 'n_pairs' items from iterable of unknown length
+      in one pass (reservoir sampling, "algorithm R"). Memory usage is proportional to 'n_pairs'.
+
+    :param pairs: items to sample from;
+    :param n_pairs: size of the sample;
+    :type n_pairs: int;
+    :param rng: random number generator;
+    :type rng: random.Random;
+
+    Returns tuple (<list of sampled items in order of 'pairs'>, <number of items in 'pairs'>).
+    """
+    reservoir = list() # (<index>, <item>)
+    n_total = 0
+    for i, pair in enumerate(pairs):
+        if i < n_pairs:
+            reservoir.append((i, pair))
+        else:
+            j = rng.randrange(i + 1)
+            if j < n_pairs:
+                reservoir[j] = (i, pair)
+            # end if
+        # end if
+        n_total += 1
+    # end for
+    reservoir.sort(key=lambda indexed: indexed[0])
+    return ([pair for i, pair in reservoir], n_total)
+# end def reservoir_sample
+
+
+def subsample_reads(read_paths, outdir_path, n_pairs=None, fraction=None, seed=None):
+    """
+    Function writes random subset of read pairs to plain FASTQ files in 'outdir_path'.
+    Files are named after input files (without '.gz' and '.bz2' extentions).
+    If 'n_pairs' is specified, exactly 'n_pairs' pairs are sampled (or all pairs if there are fewer of them).
+    If 'fraction' is specified, each pair is taken with probability 'fraction', so memory usage is constant.
+
+    :param read_paths: paths to files with forward ("R1") and reverse ("R2") reads;
+    :type read_paths: dict<str: str>;
+    :param outdir_path: directory for subsampled files;
+    :type outdir_path: str;
+    :param n_pairs: number of read pairs to sample;
+    :type n_pairs: int;
+    :param fraction: fraction of read pairs to sample (from 0 to 1);
+    :type fraction: float;
+    :param seed: seed of random number generator (random seed if None);
+    :type seed: int;
+
+    Returns tuple (<dict of paths to subsampled files>, <number of sampled pairs>, <number of pairs at all>).
+    Raises ValueError if neither or both of 'n_pairs' and 'fraction' are specified.
+    """
+    if (n_pairs is None) == (fraction is None):
+        raise ValueError("Either number or fraction of read pairs to sample must be specified")
+    # end if
+
+    rng = random.Random(seed)
+
+    sample_paths = dict()
+    for key, path in read_paths.items():
+        name = os.path.basename(path)
+        if get_archv_fmt_indx(path) != 0:
+            name = name[: name.rfind('.')]
+        # end if
+        sample_paths[key] = os.path.join(outdir_path, name)
+    # end for
+
+    if not os.path.exists(outdir_path):
+        os.makedirs(outdir_path)
+    # end if
+
+    if n_pairs is not None:
+        sample, n_total = reservoir_sample(_raw_pairs(read_paths), n_pairs, rng)
+    else:
+        sample = list()
+        n_total = 0
+    # end if
+
+    n_sampled = 0
+    with open(sample_paths["R1"], "wb") as R1_file, open(sample_paths["R2"], "wb") as R2_file:
+        if n_pairs is not None:
+            for R1_rec, R2_rec in sample:
+                R1_file.write(R1_rec)
+                R2_file.write(R2_rec)
+            # end for
+            n_sampled = len(sample)
+        else:
+            # Bernoulli sampling: the streaming counterpart of the reservoir for unknown number of pairs
+            for R1_rec, R2_rec in _raw_pairs(read_paths):
+                n_total += 1
+                if rng.random() < fraction:
+                    R1_file.write(R1_rec)
+                    R2_file.write(R2_rec)
+                    n_sampled += 1
+                # end if
+            # end for
+        # end if
+    # end with
+
+    return (sample_paths, n_sampled, n_total)
+# end def subsample_reads
+
+
+def extrapolate_stages(stages, n_sampled, n_total):
+    """
+    Function estimates wall-clock and CPU time of stages of the full run from a subsampled run.
+    All stages of the pipeline process reads one by one, so their time is scaled
+      linearly by ratio of numbers of read pairs.
+
+    :param stages: statistics of stages of the subsampled run (see 'src.run_report.end_stage');
+    :type stages: list< dict<str: object> >;
+    :param n_sampled: number of sampled read pairs;
+    :type n_sampled: int;
+    :param n_total: number of read pairs in input files;
+    :type n_total: int;
+
+    Returns dict of the following structure:
+    {
+        "scale": ratio n_total / n_sampled,
+        "stages": dict<str: dict> -- estimated "wall_time", "cpu_time" and "children_cpu_time" of stages,
+        "wall_time": estimated wall-clock time of all these stages
+    }
+    """
+    scale = n_total / n_sampled if n_sampled != 0 else 0.0
+    estimates = dict()
+    for stage in stages:
+        estimates[stage["name"]] = {
+            key: round(stage[key] * scale, 3) for key in ("wall_time", "cpu_time", "children_cpu_time")
+        }
+    # end for
+    return {
+        "scale": round(scale, 3),
+        "stages": estimates,
+        "wall_time": round(sum(stage["wall_time"] for stage in estimates.values()), 3)
+    }
+# end def extrapolate_stages